@@ -0,0 +1,239 @@
+# benchmarks/fake_gemini.py
+"""
+Локальная заглушка Gemini API для нагрузочных тестов
+
+Отвечает на POST /v1beta/models/<model>:generateContent так же, как REST API
+Gemini, с настраиваемым распределением задержки и долей ошибок. Приложение
+направляется на заглушку переменной GEMINI_API_ENDPOINT.
+
+Запуск отдельно:
+    python benchmarks/fake_gemini.py --port 9100 --latency-ms 1500 --distribution lognormal --error-rate 0.02
+
+Распределения задержки (--distribution):
+    fixed      - всегда latency-ms;
+    uniform    - равномерно в [latency-ms * (1 - jitter), latency-ms * (1 + jitter)];
+    lognormal  - медиана latency-ms, sigma = jitter (длинный хвост, как у реального API).
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PARTS = ['bumper_front', 'bumper_rear', 'fender_left', 'door_left_front', 'hood', 'trunk', 'roof']
+DAMAGE_TYPES = ['scratch', 'dent', 'crack', 'paint_peel', 'rust']
+
+
+class FakeGeminiConfig:
+    """Параметры ответов заглушки"""
+
+    def __init__(self, latency_ms: float = 1000.0, distribution: str = 'lognormal', jitter: float = 0.4,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, malformed_rate: float = 0.0,
+                 seed: int = None):
+        self.latency_ms = latency_ms
+        self.distribution = distribution
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def sample_latency(self) -> float:
+        """Задержка ответа в секундах"""
+        with self._random_lock:
+            if self.distribution == 'fixed':
+                value = self.latency_ms
+            elif self.distribution == 'uniform':
+                value = self.latency_ms * self.random.uniform(1 - self.jitter, 1 + self.jitter)
+            else:
+                value = self.latency_ms * math.exp(self.random.gauss(0, self.jitter))
+        return max(value, 0.0) / 1000
+
+    def sample_outcome(self) -> str:
+        """'ok', 'error' (HTTP 500), 'rate_limited' (HTTP 429) или 'malformed' (не JSON в ответе)"""
+        with self._random_lock:
+            roll = self.random.random()
+        for outcome, rate in (('error', self.error_rate), ('rate_limited', self.rate_limit_rate),
+                              ('malformed', self.malformed_rate)):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return 'ok'
+
+    def analysis_text(self) -> str:
+        """Ответ модели в формате промпта GeminiAnalyzer"""
+        with self._random_lock:
+            parts = []
+            for _ in range(self.random.randint(0, 3)):
+                x1, y1 = self.random.uniform(0, 0.6), self.random.uniform(0, 0.6)
+                parts.append({
+                    'part': self.random.choice(PARTS),
+                    'type': self.random.choice(DAMAGE_TYPES),
+                    'confidence': round(self.random.uniform(0.5, 0.99), 3),
+                    'bbox': [round(x1, 3), round(y1, 3), round(x1 + 0.3, 3), round(y1 + 0.3, 3)],
+                })
+            confidence = round(self.random.uniform(0.6, 0.99), 3)
+        return '```json\n' + json.dumps({
+            'integrity': {'label': 'damaged' if parts else 'undamaged', 'confidence': confidence},
+            'cleanliness': {'label': 'clean', 'confidence': confidence},
+            'damage_details': {'overall_confidence': confidence, 'parts': parts},
+            'environment': {
+                'weather': 'sunny', 'lighting': 'normal', 'glare_coverage_pct': 0.05,
+                'wet_surface': False, 'wetness_pct': 0.0, 'raindrops_visible': False,
+                'reflections_strong': False, 'confidence': confidence,
+            },
+            'uncertain': False,
+            'notes': 'fake_gemini',
+        }, ensure_ascii=False) + '\n```'
+
+
+class FakeGeminiStats:
+    """Счетчики ответов заглушки"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'ok': 0, 'error': 0, 'rate_limited': 0, 'malformed': 0}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self, outcome: str):
+        with self._lock:
+            self.in_flight -= 1
+            self.counts[outcome] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {'requests': sum(self.counts.values()), **self.counts, 'max_in_flight': self.max_in_flight}
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """Обработчик generateContent"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if ':generateContent' not in self.path:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+            return
+
+        config, stats = self.server.config, self.server.stats
+        stats.begin()
+        outcome = config.sample_outcome()
+        try:
+            time.sleep(config.sample_latency())
+            if outcome == 'error':
+                self._send_json(500, {'error': {'code': 500, 'message': 'Internal error', 'status': 'INTERNAL'}})
+            elif outcome == 'rate_limited':
+                self._send_json(429, {'error': {'code': 429, 'message': 'Resource exhausted',
+                                                'status': 'RESOURCE_EXHAUSTED'}})
+            else:
+                text = 'not a json answer' if outcome == 'malformed' else config.analysis_text()
+                self._send_json(200, {
+                    'candidates': [{
+                        'content': {'parts': [{'text': text}], 'role': 'model'},
+                        'finishReason': 'STOP',
+                        'index': 0,
+                    }],
+                    'usageMetadata': {'promptTokenCount': 1290, 'candidatesTokenCount': 180,
+                                      'totalTokenCount': 1470},
+                })
+        finally:
+            stats.end(outcome)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.stats.as_dict())
+        else:
+            self._send_json(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    """Многопоточный сервер заглушки"""
+
+    daemon_threads = True
+    # Очередь соединений под высокую конкурентность нагрузочного теста
+    request_queue_size = 1024
+
+    def __init__(self, address, config: FakeGeminiConfig):
+        super().__init__(address, FakeGeminiHandler)
+        self.config = config
+        self.stats = FakeGeminiStats()
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_in_thread(host: str = '127.0.0.1', port: int = 0, **config) -> FakeGeminiServer:
+    """Запускает заглушку в фоновом потоке (port=0 - свободный порт)"""
+    server = FakeGeminiServer((host, port), FakeGeminiConfig(**config))
+    threading.Thread(target=server.serve_forever, name='fake-gemini', daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Параметры заглушки (общие для этого скрипта и load_test.py)"""
+    parser.add_argument('--latency-ms', type=float, default=1000.0, help='Медиана задержки Gemini, мс')
+    parser.add_argument('--distribution', choices=['fixed', 'uniform', 'lognormal'], default='lognormal')
+    parser.add_argument('--jitter', type=float, default=0.4,
+                        help='Разброс задержки (доля для uniform, sigma для lognormal)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов HTTP 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Доля ответов HTTP 429')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='Доля ответов с нераспознаваемым текстом')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def config_from_args(args) -> dict:
+    return {
+        'latency_ms': args.latency_ms,
+        'distribution': args.distribution,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'rate_limit_rate': args.rate_limit_rate,
+        'malformed_rate': args.malformed_rate,
+        'seed': args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная заглушка Gemini API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeGeminiServer((args.host, args.port), FakeGeminiConfig(**config_from_args(args)))
+    print(f"Fake Gemini listening on {server.endpoint} (GEMINI_API_ENDPOINT={server.endpoint})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
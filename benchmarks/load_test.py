@@ -0,0 +1,471 @@
+# benchmarks/load_test.py
+"""
+Сквозной нагрузочный тест API анализа
+
+Поднимает заглушку Gemini (fake_gemini.py) и приложение на временной базе и
+каталоге media, нагружает /api/analyze/, /api/gemini-analyze/ и
+/api/simple-status/ изображениями dent_1.jpg…dent_3.jpg с заданной
+конкурентностью и сохраняет результат в JSON для сравнения между коммитами:
+p50/p95/p99, пропускная способность, коды ответов, CPU и RSS процессов
+приложения, счетчики заглушки.
+
+Примеры:
+    # gunicorn из gunicorn.conf.py, 32 параллельных клиента, Gemini ~1.5 с
+    python benchmarks/load_test.py --concurrency 32 --requests 300 --latency-ms 1500
+
+    # без gunicorn: встроенный сервер Django
+    python benchmarks/load_test.py --server-cmd "python manage.py runserver --noreload 127.0.0.1:{port}"
+
+    # уже запущенное приложение (заглушку Gemini нужно настроить самостоятельно)
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --api-key cak_...
+
+    # сравнение двух прогонов
+    python benchmarks/load_test.py compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+import argparse
+import json
+import os
+import platform
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import psutil
+import requests
+
+import fake_gemini
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DEFAULT_IMAGES = [os.path.join(BASE_DIR, f'dent_{index}.jpg') for index in (1, 2, 3)]
+
+ENDPOINTS = {
+    'analyze': '/app2/api/analyze/',
+    'gemini-analyze': '/app2/api/gemini-analyze/',
+    'simple-status': '/app2/api/simple-status/',
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """Перцентиль с линейной интерполяцией"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99, среднее и максимум задержек, мс"""
+    return {
+        'p50': _round(percentile(values, 50)),
+        'p95': _round(percentile(values, 95)),
+        'p99': _round(percentile(values, 99)),
+        'mean': _round(statistics.mean(values)) if values else None,
+        'max': _round(max(values)) if values else None,
+    }
+
+
+class AppServer:
+    """Приложение в отдельном процессе на временной базе"""
+
+    def __init__(self, command: str, port: int, env: Dict[str, str], startup_timeout: float):
+        self.command = command.format(port=port)
+        self.port = port
+        self.env = env
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.log_file = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        subprocess.run(
+            [sys.executable, 'manage.py', 'migrate', '--noinput', '-v', '0'],
+            cwd=BASE_DIR, env=self.env, check=True,
+        )
+        self.log_file = tempfile.NamedTemporaryFile(prefix='load_test_server_', suffix='.log', delete=False)
+        self.process = subprocess.Popen(
+            shlex.split(self.command), cwd=BASE_DIR, env=self.env,
+            stdout=self.log_file, stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, log: {self.log_file.name}")
+            try:
+                if requests.get(self.url + '/app2/health/live/', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"Server did not start in {self.startup_timeout}s, log: {self.log_file.name}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.log_file:
+            self.log_file.close()
+
+
+class ResourceSampler:
+    """CPU и RSS процесса приложения и его дочерних процессов (воркеры gunicorn, пул инференса)"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self.rss_samples: List[float] = []
+        self._cpu_start = None
+        self._wall_start = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='resource-sampler', daemon=True)
+
+    def _processes(self) -> List[psutil.Process]:
+        try:
+            return [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _cpu_total(self) -> float:
+        total = 0.0
+        for process in self._processes():
+            try:
+                times = process.cpu_times()
+                total += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def _rss_mb(self) -> float:
+        rss = 0
+        for process in self._processes():
+            try:
+                rss += process.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return rss / (1024 * 1024)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.rss_samples.append(self._rss_mb())
+
+    def start(self):
+        self._cpu_start = self._cpu_total()
+        self._wall_start = time.perf_counter()
+        self.rss_samples.append(self._rss_mb())
+        self._thread.start()
+
+    def stop(self) -> Dict[str, Any]:
+        self._stop.set()
+        self._thread.join()
+        self.rss_samples.append(self._rss_mb())
+        cpu_seconds = self._cpu_total() - self._cpu_start
+        wall = time.perf_counter() - self._wall_start
+        return {
+            'processes': len(self._processes()),
+            'cpu_seconds': round(cpu_seconds, 3),
+            # 100% = одно полностью занятое ядро
+            'cpu_percent': round(cpu_seconds / wall * 100, 1) if wall else None,
+            'rss_mb_max': round(max(self.rss_samples), 1),
+            'rss_mb_mean': round(statistics.mean(self.rss_samples), 1),
+        }
+
+
+class LoadRunner:
+    """Нагрузка на один endpoint с фиксированным числом параллельных клиентов"""
+
+    def __init__(self, base_url: str, images: List[str], api_key: Optional[str], timeout: float,
+                 unique_images: bool = True):
+        self.base_url = base_url
+        self.images = [(os.path.basename(path), _read_bytes(path)) for path in images]
+        self.api_key = api_key
+        self.timeout = timeout
+        self.unique_images = unique_images
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _one(self, path: str, index: int) -> Dict[str, Any]:
+        name, content = self.images[index % len(self.images)]
+        if self.unique_images:
+            # Байты после конца JPEG не влияют на декодирование, но меняют хеш загрузки:
+            # одинаковые изображения иначе объединяются single-flight и не доходят до моделей
+            content += f'load-test-{time.time_ns()}-{index}'.encode()
+        headers = {'X-API-Key': self.api_key} if self.api_key else {}
+        start = time.perf_counter()
+        try:
+            response = self._session().post(
+                self.base_url + path, files={'image': (name, content, 'image/jpeg')},
+                headers=headers, timeout=self.timeout,
+            )
+            status = response.status_code
+            coalesced = response.headers.get('Idempotent-Replayed') == 'true'
+            partial = False
+            if status == 200:
+                try:
+                    partial = bool(response.json().get('partial'))
+                except ValueError:
+                    pass
+        except requests.RequestException as e:
+            status, partial, coalesced = type(e).__name__, False, False
+        return {'latency': time.perf_counter() - start, 'status': status, 'partial': partial, 'coalesced': coalesced}
+
+    def run(self, endpoint: str, concurrency: int, total: int, warmup: int) -> Dict[str, Any]:
+        path = ENDPOINTS[endpoint]
+        for index in range(warmup):
+            self._one(path, index)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(lambda index: self._one(path, index), range(total)))
+        wall = time.perf_counter() - start
+
+        status_counts: Dict[str, int] = {}
+        for sample in samples:
+            status_counts[str(sample['status'])] = status_counts.get(str(sample['status']), 0) + 1
+        ok_latencies = [sample['latency'] * 1000 for sample in samples if sample['status'] == 200]
+        all_latencies = [sample['latency'] * 1000 for sample in samples]
+
+        return {
+            'requests': total,
+            'concurrency': concurrency,
+            'duration_s': round(wall, 3),
+            'throughput_rps': round(total / wall, 2) if wall else None,
+            'ok_throughput_rps': round(len(ok_latencies) / wall, 2) if wall else None,
+            'errors': total - len(ok_latencies),
+            'partial': sum(1 for sample in samples if sample['partial']),
+            'coalesced': sum(1 for sample in samples if sample['coalesced']),
+            'status_counts': status_counts,
+            'latency_ms': latency_summary(ok_latencies),
+            'latency_ms_all': latency_summary(all_latencies),
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 1)
+
+
+def _parse_env(pairs: List[str]) -> Dict[str, str]:
+    env = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        env[key] = value
+    return env
+
+
+@contextmanager
+def test_instance(args):
+    """
+    Приложение для прогона: запущенное по --url или локальное с заглушкой Gemini
+
+    Возвращает (адрес, AppServer или None, сервер заглушки или None)
+    """
+    if args.url:
+        yield args.url, None, None
+        return
+
+    gemini = fake_gemini.start_in_thread(**fake_gemini.config_from_args(args))
+    workdir = tempfile.TemporaryDirectory(prefix='load_test_')
+    server = None
+    try:
+        port = args.port or _free_port()
+        env = {
+            **os.environ,
+            'SQLITE_PATH': os.path.join(workdir.name, 'db.sqlite3'),
+            'MEDIA_ROOT': os.path.join(workdir.name, 'media'),
+            'GEMINI_API_ENDPOINT': gemini.endpoint,
+            'API_KEYS_REQUIRED': 'False',
+            'GUNICORN_BIND': f'127.0.0.1:{port}',
+            'LOG_LEVEL': 'WARNING',
+            'WEBHOOK_IN_PROCESS': 'False',
+            **_parse_env(args.env),
+        }
+        env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+        server = AppServer(args.server_cmd, port, env, args.startup_timeout)
+        server.start()
+        yield server.url, server, gemini
+    finally:
+        if server:
+            server.stop()
+        gemini.shutdown()
+        gemini.server_close()
+        workdir.cleanup()
+
+
+def add_instance_arguments(parser: argparse.ArgumentParser):
+    """Параметры приложения и заглушки (общие для этого скрипта и replay_traffic.py)"""
+    parser.add_argument('--url', help='Адрес запущенного приложения (приложение и заглушка не запускаются)')
+    parser.add_argument('--api-key', help='Ключ X-API-Key (для --url с API_KEYS_REQUIRED)')
+    parser.add_argument('--server-cmd', default='gunicorn -c gunicorn.conf.py',
+                        help='Команда запуска приложения; {port} заменяется на порт')
+    parser.add_argument('--port', type=int, default=0, help='Порт приложения (0 - свободный)')
+    parser.add_argument('--startup-timeout', type=float, default=180.0)
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Дополнительные переменные окружения приложения (можно несколько раз)')
+    parser.add_argument('--label', default='', help='Метка прогона в имени файла и результатах')
+    parser.add_argument('--output', help='Файл результатов (по умолчанию benchmarks/results/<время>_<коммит>.json)')
+    fake_gemini.add_arguments(parser)
+
+
+def run_meta(args) -> Dict[str, Any]:
+    """Описание прогона: коммит, машина, приложение, заглушка"""
+    return {
+        'label': args.label,
+        'commit': _git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'server_cmd': None if args.url else args.server_cmd,
+        'url': args.url,
+        'env': _parse_env(args.env),
+        'fake_gemini': None if args.url else fake_gemini.config_from_args(args),
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    for name in endpoints:
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint {name!r}, expected one of: {', '.join(ENDPOINTS)}")
+
+    with test_instance(args) as (base_url, server, gemini):
+        runner = LoadRunner(base_url, args.images, args.api_key, args.timeout, not args.same_images)
+        sampler = ResourceSampler(server.process.pid) if server else None
+        if sampler:
+            sampler.start()
+
+        results = {}
+        for endpoint in endpoints:
+            print(f"{endpoint}: {args.requests} requests, concurrency {args.concurrency}...", flush=True)
+            results[endpoint] = runner.run(endpoint, args.concurrency, args.requests, args.warmup)
+            latency = results[endpoint]['latency_ms']
+            print(f"  {results[endpoint]['throughput_rps']} req/s, p50 {latency['p50']} ms, "
+                  f"p95 {latency['p95']} ms, p99 {latency['p99']} ms, errors {results[endpoint]['errors']}",
+                  flush=True)
+
+        return {
+            'meta': {
+                **run_meta(args),
+                'images': [os.path.basename(path) for path in args.images],
+                'same_images': args.same_images,
+            },
+            'endpoints': results,
+            'server': sampler.stop() if sampler else None,
+            'gemini': gemini.stats.as_dict() if gemini else None,
+        }
+
+
+def save(result: Dict[str, Any], output: Optional[str]) -> str:
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        name = '_'.join(filter(None, [stamp, result['meta']['commit'], result['meta']['label']]))
+        output = os.path.join(RESULTS_DIR, f'{name}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    return output
+
+
+def compare(baseline_path: str, candidate_path: str):
+    """Печатает изменение метрик второго прогона относительно первого"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(candidate_path, encoding='utf-8') as f:
+        candidate = json.load(f)
+
+    def change(old, new):
+        if old in (None, 0) or new is None:
+            return ''
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"baseline:  {baseline['meta'].get('commit')} {baseline['meta'].get('label') or ''}")
+    print(f"candidate: {candidate['meta'].get('commit')} {candidate['meta'].get('label') or ''}")
+    row = '{:<16} {:<16} {:>12} {:>12} {:>9}'
+    print(row.format('endpoint', 'metric', 'baseline', 'candidate', 'change'))
+    for endpoint, new in candidate['endpoints'].items():
+        old = baseline['endpoints'].get(endpoint)
+        if not old:
+            continue
+        metrics = [('throughput_rps', old['throughput_rps'], new['throughput_rps']),
+                   ('errors', old['errors'], new['errors'])]
+        metrics += [(f'{name}_ms', old['latency_ms'][name], new['latency_ms'][name]) for name in ('p50', 'p95', 'p99')]
+        for name, old_value, new_value in metrics:
+            print(row.format(endpoint, name, str(old_value), str(new_value), change(old_value, new_value)))
+    if baseline.get('server') and candidate.get('server'):
+        for name in ('cpu_seconds', 'rss_mb_max'):
+            old_value, new_value = baseline['server'][name], candidate['server'][name]
+            print(row.format('server', name, str(old_value), str(new_value), change(old_value, new_value)))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(description='Сравнение двух прогонов load_test.py')
+        parser.add_argument('command')
+        parser.add_argument('baseline')
+        parser.add_argument('candidate')
+        args = parser.parse_args()
+        compare(args.baseline, args.candidate)
+        return
+
+    parser = argparse.ArgumentParser(description='Сквозной нагрузочный тест API анализа')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help='Через запятую: analyze, gemini-analyze, simple-status')
+    parser.add_argument('--concurrency', type=int, default=16, help='Параллельных клиентов')
+    parser.add_argument('--requests', type=int, default=200, help='Запросов на каждый endpoint')
+    parser.add_argument('--warmup', type=int, default=3, help='Последовательных запросов до замера')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Таймаут запроса, с')
+    parser.add_argument('--images', nargs='+', default=DEFAULT_IMAGES)
+    parser.add_argument('--same-images', action='store_true',
+                        help='Отправлять файлы без изменений (одинаковые запросы объединяются single-flight)')
+    add_instance_arguments(parser)
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"Results saved to {save(result, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
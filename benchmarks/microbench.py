@@ -0,0 +1,398 @@
+# benchmarks/microbench.py
+"""
+Микробенчмарки горячих функций анализа
+
+Функции замеряются на типичных размерах изображений и числе детекций:
+YOLODetector.detect, GeminiAnalyzer.load_as_jpeg_bytes, GeminiAnalyzer._parse_response,
+CarAnalysisService.format_results_for_django, CarAnalysisService.fuse_results,
+image_utils.create_comparison_image, оценка кадра и трекинг повреждений видео-обхода (video_inspection).
+
+Время каждого случая делится на время эталонной нагрузки, замеренной поочередно
+с ним, поэтому
+базовые значения в baselines.json сравнимы между машинами. Тесты
+PerformanceRegressionTests (car_detector/tests.py) падают, если случай стал
+медленнее базового значения больше чем на допуск.
+
+    python benchmarks/microbench.py                    # замер и сравнение с baselines.json
+    python benchmarks/microbench.py --filter jpeg      # только случаи с 'jpeg' в имени
+    python benchmarks/microbench.py --update-baseline  # записать новые базовые значения
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# Допустимое замедление относительно базового значения (0.5 = на 50%)
+DEFAULT_TOLERANCE = float(os.environ.get('PERF_TOLERANCE', '0.5'))
+# Минимальная длительность одного повтора замера, секунды
+MIN_REPEAT_TIME = 0.05
+REPEATS = 5
+# Число поочередных замеров эталона и функции
+ROUNDS = 3
+
+IMAGE_SIZES = {
+    'vga': (640, 480),
+    'fullhd': (1920, 1080),
+    'phone': (4032, 3024),
+}
+DETECTION_COUNTS = (0, 10, 50)
+
+
+class Case:
+    """
+    Случай бенчмарка
+
+    Args:
+        name: Имя случая (ключ в baselines.json)
+        setup: Подготовка данных; возвращает вызываемый объект без аргументов
+            или None, если случай недоступен (например, нет весов YOLO)
+    """
+
+    def __init__(self, name: str, setup: Callable[[str], Optional[Callable[[], object]]]):
+        self.name = name
+        self.setup = setup
+
+
+def _setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'car_analysis_project.settings')
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def _write_image(workdir: str, size: Tuple[int, int]) -> str:
+    """Фото-подобное изображение (шум поверх градиента), чтобы JPEG сжимался как реальный снимок"""
+    from PIL import Image
+
+    path = os.path.join(workdir, f'image_{size[0]}x{size[1]}.jpg')
+    if not os.path.exists(path):
+        width, height = size
+        rng = np.random.default_rng(0)
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        pixels = gradient + rng.normal(0, 25, (height, width, 3)).astype(np.float32)
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(path, quality=90)
+    return path
+
+
+def _damage_parts(count: int) -> List[Dict]:
+    rng = random.Random(count)
+    parts = []
+    for _ in range(count):
+        x1, y1 = rng.uniform(0, 0.7), rng.uniform(0, 0.7)
+        parts.append({
+            'part': rng.choice(['hood', 'bumper_front', 'door_left_front', 'roof']),
+            'type': rng.choice(['scratch', 'dent', 'crack']),
+            'confidence': round(rng.uniform(0.5, 0.99), 3),
+            'bbox': [x1, y1, x1 + 0.2, y1 + 0.2],
+        })
+    return parts
+
+
+def _yolo_detections(count: int) -> List[Dict]:
+    rng = random.Random(count + 1)
+    detections = []
+    for _ in range(count):
+        x1, y1 = rng.uniform(0, 0.7), rng.uniform(0, 0.7)
+        detections.append({
+            'class': 'Bodypanel-Dent',
+            'confidence': rng.uniform(0.3, 0.99),
+            'bbox': [x1, y1, x1 + 0.2, y1 + 0.2],
+            'bbox_pixels': [int(x1 * 1920), int(y1 * 1080), int((x1 + 0.2) * 1920), int((y1 + 0.2) * 1080)],
+            'area': 384 * 216,
+        })
+    return detections
+
+
+def _gemini_response(parts: int) -> str:
+    return '```json\n' + json.dumps({
+        'integrity': {'label': 'damaged' if parts else 'undamaged', 'confidence': 0.91},
+        'cleanliness': {'label': 'clean', 'confidence': 0.87},
+        'damage_details': {'overall_confidence': 0.9, 'parts': _damage_parts(parts)},
+        'environment': {'weather': 'sunny', 'lighting': 'normal', 'glare_coverage_pct': 0.1,
+                        'wet_surface': False, 'wetness_pct': 0.0, 'confidence': 0.8},
+        'uncertain': False,
+        'notes': '',
+    }, ensure_ascii=False) + '\n```'
+
+
+def _yolo_detect_case(size_name: str):
+    def setup(workdir):
+        from PIL import Image
+        from car_detector.services import car_analysis_service
+
+        detector = car_analysis_service.yolo_detector
+        if detector is None or not detector.model:
+            return None
+        with Image.open(_write_image(workdir, IMAGE_SIZES[size_name])) as image:
+            image = image.convert('RGB')
+        return lambda: detector.detect(image)
+    return Case(f'yolo_detect[{size_name}]', setup)
+
+
+def _jpeg_case(size_name: str):
+    def setup(workdir):
+        from car_detector.models_ai import GeminiAnalyzer
+
+        analyzer = GeminiAnalyzer.__new__(GeminiAnalyzer)
+        path = _write_image(workdir, IMAGE_SIZES[size_name])
+        return lambda: analyzer.load_as_jpeg_bytes(path)
+    return Case(f'load_as_jpeg_bytes[{size_name}]', setup)
+
+
+def _parse_case(parts: int):
+    def setup(workdir):
+        from car_detector.models_ai import GeminiAnalyzer
+
+        analyzer = GeminiAnalyzer.__new__(GeminiAnalyzer)
+        raw_text = _gemini_response(parts)
+        return lambda: analyzer._parse_response(raw_text)
+    return Case(f'parse_response[{parts}_parts]', setup)
+
+
+def _format_case(count: int):
+    def setup(workdir):
+        from car_detector.services import car_analysis_service
+
+        results = {
+            'gemini': json.loads(_gemini_response(count)[8:-4]),
+            'yolo': {'detections': _yolo_detections(count), 'average_confidence': 0.7},
+            'processing_time': 1.5,
+        }
+        # Как в результатах analyze_image: сопоставление уже посчитано
+        results['fusion'] = car_analysis_service.fuse_results(results['gemini'], results['yolo'])
+        return lambda: car_analysis_service.format_results_for_django(results)
+    return Case(f'format_results_for_django[{count}_detections]', setup)
+
+
+def _fusion_case(count: int):
+    def setup(workdir):
+        from car_detector.services import car_analysis_service
+
+        gemini = {'damage_details': {'parts': _damage_parts(count)}}
+        yolo = {'detections': _yolo_detections(count)}
+        return lambda: car_analysis_service.fuse_results(gemini, yolo)
+    return Case(f'fuse_results[{count}_boxes]', setup)
+
+
+def _overlay_case(size_name: str, count: int):
+    def setup(workdir):
+        from car_detector.image_utils import create_comparison_image
+
+        path = _write_image(workdir, IMAGE_SIZES[size_name])
+        output = os.path.join(workdir, f'overlay_{size_name}_{count}.jpg')
+        parts, detections = _damage_parts(count), _yolo_detections(count)
+        return lambda: create_comparison_image(path, parts, detections, output)
+    return Case(f'create_comparison_image[{size_name},{count}_detections]', setup)
+
+
+def _video_frame_case(size_name: str):
+    def setup(workdir):
+        import cv2
+        from car_detector.video_inspection import _analysis_images
+
+        frame = cv2.imread(_write_image(workdir, IMAGE_SIZES[size_name]))
+        return lambda: _analysis_images(frame)
+    return Case(f'video_frame_scoring[{size_name}]', setup)
+
+
+def _tracker_case(count: int):
+    def setup(workdir):
+        from car_detector.video_inspection import DamageTracker
+
+        # 30 ключевых кадров с одними и теми же повреждениями, слегка смещенными
+        frames = []
+        for number in range(30):
+            detections = _yolo_detections(count)
+            for detection in detections:
+                detection['bbox'] = [value + 0.002 * number for value in detection['bbox']]
+            frames.append(detections)
+
+        def track():
+            tracker = DamageTracker()
+            for number, detections in enumerate(frames):
+                tracker.update(number, float(number), detections, (0.002, 0.002))
+            return tracker.damages()
+        return track
+    return Case(f'damage_tracker[{count}_detections]', setup)
+
+
+def get_cases() -> List[Case]:
+    cases = [_yolo_detect_case(name) for name in ('vga', 'fullhd')]
+    cases += [_jpeg_case(name) for name in IMAGE_SIZES]
+    cases += [_parse_case(parts) for parts in (0, 5, 30)]
+    cases += [_format_case(count) for count in DETECTION_COUNTS]
+    cases += [_fusion_case(count) for count in DETECTION_COUNTS[1:] + (300,)]
+    cases += [_overlay_case('fullhd', count) for count in DETECTION_COUNTS]
+    cases += [_overlay_case('phone', count) for count in (0, DETECTION_COUNTS[-1])]
+    cases += [_video_frame_case(name) for name in ('fullhd', 'phone')]
+    cases += [_tracker_case(count) for count in DETECTION_COUNTS[1:]]
+    return cases
+
+
+def _reference_workload():
+    """Эталонная нагрузка: Python-код, JSON и numpy в пропорциях, похожих на горячие функции"""
+    rng = random.Random(42)
+    values = [rng.random() for _ in range(20000)]
+    sorted(values)
+    json.loads(json.dumps({'values': values[:2000]}))
+    array = np.arange(1_000_000, dtype=np.float32)
+    float((array * 0.5 + 1.0).sum())
+
+
+def measure(func: Callable[[], object], repeats: int = REPEATS) -> float:
+    """Минимальное время одного вызова, секунды"""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= MIN_REPEAT_TIME or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < MIN_REPEAT_TIME / 10 else 2
+    return min([elapsed] + timer.repeat(repeat=repeats - 1, number=number)) / number
+
+
+def measure_relative(func: Callable[[], object], rounds: int = ROUNDS) -> Dict[str, float]:
+    """
+    Время вызова относительно эталонной нагрузки
+
+    Эталон и функция замеряются поочередно, отношение берется медианой по раундам:
+    частота процессора и соседняя нагрузка меняются во времени и одинаково
+    влияют на оба замера одного раунда.
+    """
+    seconds, ratios = [], []
+    for _ in range(rounds):
+        reference = measure(_reference_workload, repeats=2)
+        elapsed = measure(func, repeats=2)
+        seconds.append(elapsed)
+        ratios.append(elapsed / reference)
+    return {'seconds': min(seconds), 'relative': statistics.median(ratios)}
+
+
+def run_cases(name_filter: str = '', workdir: Optional[str] = None) -> Dict[str, Optional[Dict[str, float]]]:
+    """
+    Замеряет случаи
+
+    Returns:
+        По имени случая: seconds (время вызова) и relative (доля эталонной нагрузки);
+        None - случай недоступен
+    """
+    _setup_django()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='microbench_') as tmp:
+        for case in get_cases():
+            if name_filter and name_filter not in case.name:
+                continue
+            func = case.setup(workdir or tmp)
+            results[case.name] = measure_relative(func) if func is not None else None
+    return results
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(results: Dict[str, Optional[Dict[str, float]]], baseline: Optional[Dict],
+            tolerance: float = DEFAULT_TOLERANCE) -> List[Dict]:
+    """
+    Сравнивает замеры с базовыми значениями
+
+    Returns:
+        Строки сравнения: name, seconds, relative, baseline_relative, ratio, regressed
+    """
+    rows = []
+    for name, measured in results.items():
+        row = {'name': name, 'seconds': None, 'relative': None,
+               'baseline_relative': None, 'ratio': None, 'regressed': False}
+        if measured is not None:
+            row.update(measured)
+            stored = baseline.get('cases', {}).get(name) if baseline else None
+            if stored:
+                row['baseline_relative'] = stored['relative']
+                row['ratio'] = row['relative'] / stored['relative']
+                row['regressed'] = row['ratio'] > 1 + tolerance
+        rows.append(row)
+    return rows
+
+
+def save_baseline(results: Dict[str, Optional[Dict[str, float]]], path: str = BASELINE_PATH):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    previous = load_baseline(path) or {}
+    cases = dict(previous.get('cases', {}))
+    for name, measured in results.items():
+        if measured is not None:
+            cases[name] = {'seconds': round(measured['seconds'], 9), 'relative': round(measured['relative'], 6)}
+    data = {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'machine': f"{platform.machine()} {platform.processor() or ''}".strip(),
+        'python': platform.python_version(),
+        'cases': dict(sorted(cases.items())),
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки горячих функций анализа')
+    parser.add_argument('--filter', default='', help='Только случаи, содержащие подстроку')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='Записать замеры как базовые значения')
+    parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_cases(args.filter)
+    rows = compare(results, load_baseline(args.baseline), args.tolerance)
+
+    if args.json:
+        print(json.dumps({'cases': rows}, indent=2))
+    else:
+        print(f"total {time.perf_counter() - start:.1f} s")
+        line = '{:<48} {:>12} {:>10} {:>10} {:>8}'
+        print(line.format('case', 'time', 'relative', 'baseline', 'ratio'))
+        for row in rows:
+            if row['seconds'] is None:
+                print(line.format(row['name'], 'skipped', '', '', ''))
+                continue
+            print(line.format(
+                row['name'], f"{row['seconds'] * 1000:.3f} ms", f"{row['relative']:.4g}",
+                f"{row['baseline_relative']:.4g}" if row['baseline_relative'] else '-',
+                (f"{row['ratio']:.2f}" + (' !' if row['regressed'] else '')) if row['ratio'] else '-',
+            ))
+
+    if args.update_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Baseline saved to {args.baseline}")
+    elif any(row['regressed'] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+# benchmarks/replay_traffic.py
+"""
+Воспроизведение записанного production-трафика (car_detector/traffic_capture.py)
+
+Запросы из архива TRAFFIC_CAPTURE_DIR отправляются на тестовое приложение с
+исходными интервалами между поступлениями (--speed N - в N раз быстрее),
+без ограничения числа одновременных запросов сверху, кроме --max-concurrency:
+нагрузка не подстраивается под скорость приложения, как и реальный трафик.
+Так видно, как изменение конфигурации или кода ведет себя на реальной смеси
+endpoint'ов, размеров изображений и повторов.
+
+Результат сохраняется в формате load_test.py и сравнивается его командой compare.
+Запись ведется с долей TRAFFIC_CAPTURE_RATE, поэтому для исходной интенсивности
+задайте --speed 1/доля (например, 10 при TRAFFIC_CAPTURE_RATE=0.1).
+
+Примеры:
+    # локальное приложение (gunicorn) с заглушкой Gemini, исходная скорость
+    python benchmarks/replay_traffic.py traffic/
+
+    # вдвое быстрее, только анализ, с измененной конфигурацией
+    python benchmarks/replay_traffic.py traffic/ --speed 2 --endpoints api_analyze \\
+        --env YOLO_INFERENCE_WORKERS=4 --label workers4
+
+    # уже запущенный тестовый стенд
+    python benchmarks/replay_traffic.py traffic/20250101-120000.000000-4242 --url http://staging:8000 --api-key cak_...
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from load_test import ResourceSampler, add_instance_arguments, latency_summary, run_meta, save, test_instance
+
+
+INDEX_NAME = 'requests.jsonl'
+PAYLOADS_DIR = 'payloads'
+
+
+def _segments(path: str) -> List[str]:
+    """Сегменты архива: сам path, если это сегмент, иначе его подкаталоги-сегменты"""
+    if os.path.exists(os.path.join(path, INDEX_NAME)):
+        return [path]
+    return sorted(
+        entry.path for entry in os.scandir(path)
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, INDEX_NAME))
+    )
+
+
+def load_archive(paths: List[str], endpoints: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Записи сегментов, упорядоченные по времени поступления; у каждой - '_segment'"""
+    records = []
+    for path in paths:
+        for segment in _segments(path):
+            with open(os.path.join(segment, INDEX_NAME), encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Строка, которую процесс не успел дописать
+                        continue
+                    if endpoints and record['endpoint'] not in endpoints:
+                        continue
+                    record['_segment'] = segment
+                    records.append(record)
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+class TrafficReplayer:
+    """
+    Отправка записанных запросов по исходному расписанию
+
+    Args:
+        base_url: Адрес приложения
+        api_key: Ключ X-API-Key для всех запросов
+        speed: Множитель скорости (2 - интервалы вдвое короче)
+        timeout: Таймаут запроса, с
+        max_concurrency: Предел одновременных запросов
+        fallback_image: Файл для запросов, записанных без содержимого изображения
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str], speed: float, timeout: float,
+                 max_concurrency: int, fallback_image: Optional[str] = None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.speed = speed
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.fallback = None
+        if fallback_image:
+            with open(fallback_image, 'rb') as f:
+                self.fallback = f.read()
+        # Повторы с одним Idempotency-Key остаются повторами, но не совпадают с прошлыми прогонами
+        self.run_id = uuid.uuid4().hex[:8]
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _files(self, record: Dict[str, Any]) -> Optional[List[Tuple[str, Tuple[str, bytes, str]]]]:
+        # Список пар, а не словарь: повторяющееся поле (несколько image) отправляется всеми файлами
+        files = []
+        for item in record['files']:
+            path = os.path.join(record['_segment'], PAYLOADS_DIR, item['sha256'])
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    content = f.read()
+            elif self.fallback is not None:
+                content = self.fallback
+            else:
+                return None
+            files.append((item['field'], (item['name'], content, item['content_type'] or 'application/octet-stream')))
+        return files
+
+    def _one(self, record: Dict[str, Any], due: float, start: float) -> Dict[str, Any]:
+        sent = time.perf_counter()
+        sample = {
+            'endpoint': record['endpoint'],
+            'lag': sent - start - due,
+            'captured_status': record['status'],
+            'captured_latency': record['duration_ms'] / 1000,
+            'partial': False,
+            'coalesced': False,
+        }
+        files = self._files(record)
+        if files is None:
+            return {**sample, 'status': 'skipped', 'latency': 0.0}
+
+        headers = dict(record['headers'])
+        if self.api_key:
+            headers['X-API-Key'] = self.api_key
+        if record.get('idempotency_key'):
+            headers['Idempotency-Key'] = f"replay-{self.run_id}-{record['idempotency_key']}"
+        url = self.base_url + record['path'] + (f"?{record['query']}" if record['query'] else '')
+        try:
+            response = self._session().request(
+                record['method'], url, files=files or None, data=record['form'] or None,
+                headers=headers, timeout=self.timeout,
+            )
+            status = response.status_code
+            sample['coalesced'] = response.headers.get('Idempotent-Replayed') == 'true'
+            if status == 200 and record['method'] == 'POST':
+                try:
+                    sample['partial'] = bool(response.json().get('partial'))
+                except ValueError:
+                    pass
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return {**sample, 'status': status, 'latency': time.perf_counter() - sent}
+
+    def run(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not records:
+            return []
+        first_ts = records[0]['ts']
+        futures = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for record in records:
+                due = (record['ts'] - first_ts) / self.speed
+                delay = start + due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(self._one, record, due, start))
+        return [future.result() for future in futures]
+
+
+def summarize(samples: List[Dict[str, Any]], wall: float) -> Dict[str, Any]:
+    """Итоги по endpoint'ам в формате load_test.py и сравнение с записанными ответами"""
+    results = {}
+    for endpoint in sorted({sample['endpoint'] for sample in samples}):
+        rows = [sample for sample in samples if sample['endpoint'] == endpoint and sample['status'] != 'skipped']
+        status_counts: Dict[str, int] = {}
+        captured_counts: Dict[str, int] = {}
+        for row in rows:
+            status_counts[str(row['status'])] = status_counts.get(str(row['status']), 0) + 1
+            captured_counts[str(row['captured_status'])] = captured_counts.get(str(row['captured_status']), 0) + 1
+        ok = [row['latency'] * 1000 for row in rows if row['status'] == 200]
+        results[endpoint] = {
+            'requests': len(rows),
+            'skipped': sum(1 for sample in samples if sample['endpoint'] == endpoint and sample['status'] == 'skipped'),
+            'duration_s': round(wall, 3),
+            'throughput_rps': round(len(rows) / wall, 2) if wall else None,
+            'ok_throughput_rps': round(len(ok) / wall, 2) if wall else None,
+            'errors': len(rows) - len(ok),
+            'partial': sum(1 for row in rows if row['partial']),
+            'coalesced': sum(1 for row in rows if row['coalesced']),
+            'status_counts': status_counts,
+            'latency_ms': latency_summary(ok),
+            'latency_ms_all': latency_summary([row['latency'] * 1000 for row in rows]),
+            'captured_status_counts': captured_counts,
+            'captured_latency_ms': latency_summary(
+                [row['captured_latency'] * 1000 for row in rows if row['captured_status'] == 200]
+            ),
+        }
+    return results
+
+
+def run(args) -> Dict[str, Any]:
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    records = load_archive(args.archive, endpoints)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit(f"No captured requests in {', '.join(args.archive)}")
+    span = records[-1]['ts'] - records[0]['ts']
+    print(f"{len(records)} requests over {span:.1f}s captured, replaying at {args.speed}x "
+          f"(~{span / args.speed:.1f}s)...", flush=True)
+
+    with test_instance(args) as (base_url, server, gemini):
+        replayer = TrafficReplayer(base_url, args.api_key, args.speed, args.timeout,
+                                   args.max_concurrency, args.fallback_image)
+        sampler = ResourceSampler(server.process.pid) if server else None
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        samples = replayer.run(records)
+        wall = time.perf_counter() - start
+
+        results = summarize(samples, wall)
+        for endpoint, result in results.items():
+            latency = result['latency_ms']
+            print(f"  {endpoint}: {result['requests']} requests, p50 {latency['p50']} ms, "
+                  f"p95 {latency['p95']} ms, p99 {latency['p99']} ms, errors {result['errors']}, "
+                  f"skipped {result['skipped']}", flush=True)
+
+        lags = [max(sample['lag'], 0.0) * 1000 for sample in samples]
+        return {
+            'meta': {
+                **run_meta(args),
+                'archive': args.archive,
+                'speed': args.speed,
+                'captured_requests': len(records),
+                'captured_span_s': round(span, 3),
+            },
+            'endpoints': results,
+            # Отставание отправки от расписания: большое значение - упор в --max-concurrency
+            'schedule_lag_ms': latency_summary(lags),
+            'server': sampler.stop() if sampler else None,
+            'gemini': gemini.stats.as_dict() if gemini else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воспроизведение записанного трафика API')
+    parser.add_argument('archive', nargs='+', help='Каталог архива TRAFFIC_CAPTURE_DIR или его сегменты')
+    parser.add_argument('--speed', type=float, default=1.0, help='Множитель скорости воспроизведения')
+    parser.add_argument('--endpoints', default='',
+                        help='Через запятую: имена представлений (api_analyze, ...); по умолчанию все')
+    parser.add_argument('--limit', type=int, default=0, help='Не больше N первых запросов')
+    parser.add_argument('--max-concurrency', type=int, default=256, help='Предел одновременных запросов')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Таймаут запроса, с')
+    parser.add_argument('--fallback-image', help='Изображение для запросов, записанных без содержимого')
+    add_instance_arguments(parser)
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"Results saved to {save(result, args.output)}")
+
+
+if __name__ == '__main__':
+    main()
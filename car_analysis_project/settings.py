@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -76,10 +77,26 @@ WSGI_APPLICATION = 'car_analysis_project.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# Кеш (результаты идемпотентных запросов). Без REDIS_URL - локальная память процесса
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'car-analysis',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,9 +139,193 @@ STATICFILES_DIRS = [
 
 # Media files
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', BASE_DIR / 'media')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# AI models
+# Адрес Gemini API вместо Google (локальная заглушка для нагрузочных тестов, см. benchmarks/)
+GEMINI_API_ENDPOINT = os.environ.get('GEMINI_API_ENDPOINT', '')
+
+# Кассета ответов Gemini: record - записывать ответы, replay - отвечать из записей
+# без обращения к API, пусто - выключено. GEMINI_CASSETTE_LATENCY - множитель
+# записанной задержки при воспроизведении (0 - отвечать сразу)
+GEMINI_CASSETTE_MODE = os.environ.get('GEMINI_CASSETTE_MODE', '')
+GEMINI_CASSETTE_DIR = os.environ.get('GEMINI_CASSETTE_DIR', str(BASE_DIR / 'cassettes' / 'gemini'))
+GEMINI_CASSETTE_LATENCY = float(os.environ.get('GEMINI_CASSETTE_LATENCY', '1.0'))
+
+# Размер изображения для холостого прогона YOLO при старте
+YOLO_WARMUP_IMAGE_SIZE = int(os.environ.get('YOLO_WARMUP_IMAGE_SIZE', '640'))
+
+# Если True, readiness-проба не проходит без загруженных весов YOLO
+YOLO_REQUIRED = os.environ.get('YOLO_REQUIRED', 'False').lower() in ('1', 'true', 'yes')
+
+# Версия модели YOLO в записях CarAnalysis (пусто - по хешу best.pt); задается явно,
+# когда инференс идет на выделенных серверах с другими весами
+YOLO_MODEL_VERSION = os.environ.get('YOLO_MODEL_VERSION', '')
+
+# Пул процессов для инференса YOLO (0 - инференс в веб-процессе)
+YOLO_INFERENCE_WORKERS = int(os.environ.get('YOLO_INFERENCE_WORKERS', '0'))
+YOLO_INFERENCE_TORCH_THREADS = int(os.environ.get('YOLO_INFERENCE_TORCH_THREADS', '1'))
+YOLO_INFERENCE_TIMEOUT = float(os.environ.get('YOLO_INFERENCE_TIMEOUT', '60'))
+
+# Удаленные серверы инференса YOLO (через запятую: http://host:8100,http://host2:8100)
+YOLO_INFERENCE_ENDPOINTS = [
+    url.strip() for url in os.environ.get('YOLO_INFERENCE_ENDPOINTS', '').split(',') if url.strip()
+]
+# Максимальный размер тела запроса к серверу инференса (run_inference_server), МБ
+YOLO_INFERENCE_MAX_BODY_MB = int(os.environ.get('YOLO_INFERENCE_MAX_BODY_MB', '64'))
+# Локальный инференс, если ни один сервер не ответил
+YOLO_INFERENCE_FALLBACK = os.environ.get('YOLO_INFERENCE_FALLBACK', 'True').lower() in ('1', 'true', 'yes')
+
+# Потоков для блокирующей работы (YOLO, файлы) в async-представлениях
+ASYNC_EXECUTOR_WORKERS = int(os.environ.get('ASYNC_EXECUTOR_WORKERS', '8'))
+
+# Admission control (лимиты на процесс)
+# Суммарный размер изображений в обработке, мегапиксели
+ADMISSION_MAX_MEGAPIXELS = float(os.environ.get('ADMISSION_MAX_MEGAPIXELS', '200'))
+# Одновременных вызовов Gemini и инференсов YOLO
+ADMISSION_GEMINI_CONCURRENCY = int(os.environ.get('ADMISSION_GEMINI_CONCURRENCY', '64'))
+ADMISSION_YOLO_CONCURRENCY = int(os.environ.get('ADMISSION_YOLO_CONCURRENCY', '4'))
+# Длина очереди ожидания и максимальное время ожидания, секунды
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '100'))
+ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', '15'))
+
+# Приоритетные полосы для стадий Gemini и YOLO: вес WFQ, длина очереди, ожидание (с)
+SCHEDULER_LANES = {
+    'interactive': {'weight': 8, 'max_queue': 50, 'max_wait': 10},
+    'standard': {'weight': 4, 'max_queue': 100, 'max_wait': 30},
+    'batch': {'weight': 1, 'max_queue': 1000, 'max_wait': 600},
+}
+# Слоты, доступные только интерактивной полосе
+SCHEDULER_GEMINI_RESERVED_INTERACTIVE = int(os.environ.get('SCHEDULER_GEMINI_RESERVED_INTERACTIVE', '8'))
+SCHEDULER_YOLO_RESERVED_INTERACTIVE = int(os.environ.get('SCHEDULER_YOLO_RESERVED_INTERACTIVE', '1'))
+# Ожидание, после которого запрос любой полосы обслуживается вне очереди, секунды
+SCHEDULER_STARVATION_TIMEOUT = float(os.environ.get('SCHEDULER_STARVATION_TIMEOUT', '20'))
+
+# Бюджет задержки /api/analyze/, миллисекунды (0 - ждать Gemini без ограничения).
+# Если Gemini не успел, ответ отдается с результатом YOLO, а Gemini дописывается в фоне
+ANALYSIS_LATENCY_BUDGET_MS = float(os.environ.get('ANALYSIS_LATENCY_BUDGET_MS', '8000'))
+
+# Повторный анализ из админки: записей в секунду и одновременно (команда reanalyze - свои параметры)
+REANALYSIS_RATE = float(os.environ.get('REANALYSIS_RATE', '1'))
+REANALYSIS_CONCURRENCY = int(os.environ.get('REANALYSIS_CONCURRENCY', '2'))
+
+# Согласие Gemini и YOLO (0..1), начиная с которого результат помечается trusted
+FUSION_TRUST_AGREEMENT = float(os.environ.get('FUSION_TRUST_AGREEMENT', '0.7'))
+
+# Карточек на странице списка анализов (/analyses/)
+ANALYSIS_LIST_PAGE_SIZE = int(os.environ.get('ANALYSIS_LIST_PAGE_SIZE', '24'))
+
+# Осмотр по нескольким фотографиям (/api/inspections/): максимум снимков в одной сессии
+INSPECTION_MAX_PHOTOS = int(os.environ.get('INSPECTION_MAX_PHOTOS', '12'))
+
+# Видео-обход автомобиля (/api/video-inspect/, команда analyze_video):
+# кадров в секунду для оценки, окно выбора ключевого кадра (с), минимальная резкость
+# (дисперсия лапласиана), предел ключевых кадров и кадров для Gemini, максимальная длительность (с)
+# (дальше видео не читается) и размер загрузки (МБ)
+VIDEO_SAMPLE_FPS = float(os.environ.get('VIDEO_SAMPLE_FPS', '4'))
+VIDEO_KEYFRAME_INTERVAL = float(os.environ.get('VIDEO_KEYFRAME_INTERVAL', '1.0'))
+VIDEO_MIN_SHARPNESS = float(os.environ.get('VIDEO_MIN_SHARPNESS', '40'))
+VIDEO_MAX_KEYFRAMES = int(os.environ.get('VIDEO_MAX_KEYFRAMES', '180'))
+VIDEO_GEMINI_KEYFRAMES = int(os.environ.get('VIDEO_GEMINI_KEYFRAMES', '4'))
+VIDEO_MAX_DURATION = float(os.environ.get('VIDEO_MAX_DURATION', '180'))
+VIDEO_MAX_UPLOAD_MB = int(os.environ.get('VIDEO_MAX_UPLOAD_MB', '200'))
+
+# Время хранения ответа по Idempotency-Key, секунды
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '86400'))
+
+# Webhook-уведомления о завершенных анализах
+# Секрет подписи для запросов без API-ключа (у клиентов с ключом - ApiKey.webhook_secret);
+# пусто - такие запросы не могут задать callback_url
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+# Разрешить адреса webhook во внутренней сети (только для локальной разработки)
+WEBHOOK_ALLOW_PRIVATE_HOSTS = os.environ.get('WEBHOOK_ALLOW_PRIVATE_HOSTS', 'False').lower() in ('1', 'true', 'yes')
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', '5'))
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '50'))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+# Задержка перед повтором: WEBHOOK_RETRY_BASE * 2^(попытка-1), не более WEBHOOK_RETRY_MAX, секунды
+WEBHOOK_RETRY_BASE = float(os.environ.get('WEBHOOK_RETRY_BASE', '2'))
+WEBHOOK_RETRY_MAX = float(os.environ.get('WEBHOOK_RETRY_MAX', '3600'))
+# Доставка в фоновом потоке веб-процесса (False - только через run_webhook_worker)
+WEBHOOK_IN_PROCESS = os.environ.get('WEBHOOK_IN_PROCESS', 'True').lower() in ('1', 'true', 'yes')
+
+# API-ключи для /api/* (False - запросы без ключа допускаются без лимитов)
+API_KEYS_REQUIRED = os.environ.get('API_KEYS_REQUIRED', 'True').lower() in ('1', 'true', 'yes')
+# Хранилище счетчиков лимитов (redis://...); без него счетчики в памяти процесса
+COUNTER_STORE_URL = os.environ.get('COUNTER_STORE_URL', os.environ.get('REDIS_URL', ''))
+
+# Профилирование cProfile каждого N-го запроса анализа (0 - выключено)
+PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+
+# Запись доли запросов API в архив для воспроизведения (benchmarks/replay_traffic.py).
+# TRAFFIC_CAPTURE_RATE - доля записываемых запросов (0 - выключено, 1 - все);
+# TRAFFIC_CAPTURE_PAYLOADS=False - только метаданные, без изображений клиентов
+TRAFFIC_CAPTURE_RATE = float(os.environ.get('TRAFFIC_CAPTURE_RATE', '0'))
+TRAFFIC_CAPTURE_PAYLOADS = os.environ.get('TRAFFIC_CAPTURE_PAYLOADS', 'True').lower() == 'true'
+TRAFFIC_CAPTURE_DIR = os.environ.get('TRAFFIC_CAPTURE_DIR', str(BASE_DIR / 'traffic'))
+TRAFFIC_CAPTURE_SEGMENT_MB = int(os.environ.get('TRAFFIC_CAPTURE_SEGMENT_MB', '256'))
+TRAFFIC_CAPTURE_SEGMENT_SECONDS = int(os.environ.get('TRAFFIC_CAPTURE_SEGMENT_SECONDS', '3600'))
+TRAFFIC_CAPTURE_MAX_SEGMENTS = int(os.environ.get('TRAFFIC_CAPTURE_MAX_SEGMENTS', '48'))
+TRAFFIC_CAPTURE_QUEUE_SIZE = int(os.environ.get('TRAFFIC_CAPTURE_QUEUE_SIZE', '100'))
+
+# Логирование: JSON-события через очередь (вывод в stdout в фоновом потоке).
+# LOG_FORMAT=console - читаемый текст для разработки.
+# LOG_LEVELS - уровни по модулям: "car_detector.image_utils=DEBUG,car_detector.webhooks=WARNING".
+# LOG_SAMPLE_RATES - доля сохраняемых записей по событию: "overlay.box=0.01,analysis.detection=0.1".
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+
+
+def _parse_pairs(value):
+    pairs = {}
+    for item in value.split(','):
+        if '=' in item:
+            key, item_value = item.split('=', 1)
+            pairs[key.strip()] = item_value.strip()
+    return pairs
+
+
+LOG_SAMPLE_RATES = {
+    'overlay.box': 0.01,
+    'analysis.detection': 0.01,
+    **{event: float(rate) for event, rate in _parse_pairs(os.environ.get('LOG_SAMPLE_RATES', '')).items()},
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'car_detector.logging_utils.EventSampler',
+            'rates': LOG_SAMPLE_RATES,
+        },
+        'trace': {
+            '()': 'car_detector.tracing.TraceContextFilter',
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'car_detector.logging_utils.QueueingHandler',
+            'output_format': LOG_FORMAT,
+            'maxsize': int(os.environ.get('LOG_QUEUE_SIZE', '10000')),
+            'filters': ['sampling', 'trace'],
+        },
+    },
+    'loggers': {
+        'car_detector': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+        **{
+            name: {'level': level.upper()}
+            for name, level in _parse_pairs(os.environ.get('LOG_LEVELS', '')).items()
+        },
+    },
+}
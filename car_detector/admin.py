@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import CarAnalysis
+from django.utils import timezone
+from .models import ApiKey, CarAnalysis, DamageItem, InspectionSession, WebhookDelivery, WebhookDeadLetter
 
 
 @admin.register(CarAnalysis)
@@ -7,11 +9,11 @@ class CarAnalysisAdmin(admin.ModelAdmin):
     list_display = [
         'id', 'created_at', 'gemini_integrity_label', 
         'gemini_cleanliness_label', 'gemini_damage_count', 
-        'yolo_detection_count', 'processing_time'
+        'yolo_detection_count', 'agreement_score', 'processing_time'
     ]
     list_filter = [
         'gemini_integrity_label', 'gemini_cleanliness_label', 
-        'gemini_uncertain', 'created_at'
+        'gemini_uncertain', 'created_at', 'gemini_model_version', 'yolo_model_version'
     ]
     search_fields = ['gemini_notes']
     readonly_fields = [
@@ -19,10 +21,14 @@ class CarAnalysisAdmin(admin.ModelAdmin):
         'yolo_detection_count'
     ]
     date_hierarchy = 'created_at'
+    raw_id_fields = ['session']
+    # Точный COUNT(*) всей таблицы на миллионах строк дороже самой страницы
+    show_full_result_count = False
+    actions = ['reanalyze_stale']
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('image', 'created_at', 'processing_time')
+            'fields': ('image', 'created_at', 'processing_time', 'session')
         }),
         ('Gemini анализ', {
             'fields': (
@@ -35,8 +41,132 @@ class CarAnalysisAdmin(admin.ModelAdmin):
         ('YOLO анализ', {
             'fields': ('yolo_detections', 'yolo_confidence')
         }),
+        ('Сопоставление Gemini и YOLO', {
+            'fields': ('agreement_score', 'fused_damages'),
+            'classes': ('collapse',)
+        }),
+        ('Версии моделей', {
+            'fields': ('gemini_model_version', 'yolo_model_version'),
+            'classes': ('collapse',)
+        }),
         ('Статистика', {
             'fields': ('gemini_damage_count', 'yolo_detection_count'),
             'classes': ('collapse',)
         })
     )
+    
+    @admin.action(description='Переанализировать устаревшие стадии (в фоне)')
+    def reanalyze_stale(self, request, queryset):
+        from .async_utils import submit_detached
+        from .reanalysis import reanalyze
+        
+        ids = list(queryset.values_list('id', flat=True))
+        # Выполняется на фоновом цикле процесса с ограничением скорости, итог - событие reanalysis.finished
+        submit_detached(reanalyze(
+            CarAnalysis.objects.filter(id__in=ids),
+            rate=settings.REANALYSIS_RATE,
+            concurrency=settings.REANALYSIS_CONCURRENCY,
+        ))
+        self.message_user(request, f'Повторный анализ запущен для {len(ids)} записей '
+                                   f'(обновляются только устаревшие стадии)')
+
+
+@admin.register(DamageItem)
+class DamageItemAdmin(admin.ModelAdmin):
+    list_display = ['id', 'analysis', 'created_at', 'source', 'part', 'damage_type', 'label', 'confidence']
+    list_filter = ['source', 'part_group', 'damage_type', 'created_at']
+    raw_id_fields = ['analysis']
+    date_hierarchy = 'created_at'
+    
+    def has_add_permission(self, request):
+        # Строки пишутся при сохранении анализа (damage_items.py)
+        return False
+
+
+class InspectionPhotoInline(admin.TabularInline):
+    model = CarAnalysis
+    fields = ['image', 'status', 'gemini_integrity_label', 'gemini_cleanliness_label', 'processing_time']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+    show_change_link = True
+
+
+@admin.register(InspectionSession)
+class InspectionSessionAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'vehicle_id', 'created_at', 'status', 'photo_count',
+        'integrity_label', 'cleanliness_label', 'damage_count'
+    ]
+    list_filter = ['status', 'integrity_label', 'cleanliness_label', 'created_at']
+    search_fields = ['vehicle_id']
+    readonly_fields = [
+        'created_at', 'completed_at', 'processing_time', 'photo_count', 'failed_photos',
+        'integrity_label', 'integrity_confidence', 'cleanliness_label', 'cleanliness_confidence',
+        'damage_count', 'damages'
+    ]
+    date_hierarchy = 'created_at'
+    inlines = [InspectionPhotoInline]
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event', 'url', 'status', 'attempts', 'next_attempt_at', 'delivered_at']
+    list_filter = ['status', 'event']
+    search_fields = ['url', 'last_error']
+    readonly_fields = ['created_at', 'delivered_at']
+
+
+@admin.register(WebhookDeadLetter)
+class WebhookDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ['id', 'event', 'url', 'attempts', 'last_error', 'failed_at']
+    list_filter = ['event']
+    search_fields = ['url', 'last_error']
+    actions = ['requeue']
+    
+    @admin.action(description='Повторить доставку')
+    def requeue(self, request, queryset):
+        from .webhooks import webhook_dispatcher
+        
+        count = 0
+        for dead_letter in queryset:
+            WebhookDelivery.objects.create(
+                analysis_id=dead_letter.analysis_id,
+                api_key_id=dead_letter.api_key_id,
+                url=dead_letter.url,
+                event=dead_letter.event,
+                payload=dead_letter.payload,
+                next_attempt_at=timezone.now(),
+            )
+            dead_letter.delete()
+            count += 1
+        webhook_dispatcher.wake()
+        self.message_user(request, f'Поставлено в очередь: {count}')
+
+
+@admin.register(ApiKey)
+class ApiKeyAdmin(admin.ModelAdmin):
+    list_display = [
+        'name', 'prefix', 'is_active', 'lane', 'rate_per_minute',
+        'burst', 'max_concurrent', 'daily_quota', 'created_at'
+    ]
+    list_filter = ['is_active', 'lane']
+    search_fields = ['name', 'prefix']
+    readonly_fields = ['prefix', 'created_at']
+    actions = ['rotate_webhook_secret']
+    
+    def save_model(self, request, obj, form, change):
+        if not obj.key_hash:
+            raw_key = obj.set_new_key()
+            self.message_user(request, f'Ключ для «{obj.name}» (показывается один раз): {raw_key}')
+        if not obj.webhook_secret:
+            secret = obj.set_new_webhook_secret()
+            self.message_user(request, f'Секрет webhook для «{obj.name}» (показывается один раз): {secret}')
+        super().save_model(request, obj, form, change)
+    
+    @admin.action(description='Новый секрет webhook')
+    def rotate_webhook_secret(self, request, queryset):
+        for api_key in queryset:
+            secret = api_key.set_new_webhook_secret()
+            api_key.save(update_fields=['webhook_secret'])
+            self.message_user(request, f'Секрет webhook для «{api_key.name}» (показывается один раз): {secret}')
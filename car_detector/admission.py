@@ -0,0 +1,553 @@
+# car_detector/admission.py
+"""
+Контроль допуска (admission control) и приоритетное планирование перед CarAnalysisService
+
+- Бюджет мегапикселей на процесс: каждый запрос занимает долю, равную
+  размеру изображения, поэтому несколько 20 Мп фото не исчерпают память.
+- Лимиты параллелизма по стадиям (вызовы Gemini, инференс YOLO) с
+  приоритетными полосами: interactive (водитель ждет у машины),
+  standard и batch (массовая и административная обработка). Слоты
+  распределяются взвешенной справедливой очередью (WFQ), а запросы,
+  ждущие дольше порога, обслуживаются вне очереди (защита от голодания).
+- Ограниченные очереди ожидания: при переполнении или истечении времени
+  ожидания запрос отклоняется с Retry-After вместо бесконечного роста.
+
+Ограничители работают и из потоков (sync-представления), и из любых event
+loop (async-представления): ожидающие будятся через call_soon_threadsafe.
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from PIL import Image
+
+from . import metrics
+
+
+LANE_INTERACTIVE = 'interactive'
+LANE_STANDARD = 'standard'
+LANE_BATCH = 'batch'
+
+# Полосы в порядке убывания приоритета
+LANES = (LANE_INTERACTIVE, LANE_STANDARD, LANE_BATCH)
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: система перегружена"""
+
+    def __init__(self, message: str, retry_after: int, status: int = 503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+
+class _Waiter:
+    """Ожидающий в очереди ограничителя"""
+
+    def __init__(self, weight: float, lane: str, wake):
+        self.weight = weight
+        self.lane = lane
+        self.wake = wake
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class _Limiter:
+    """
+    Базовый ограничитель: ожидание из потоков и event loop, учет удержания
+
+    Подклассы определяют, можно ли выдать разрешение сразу, как хранить
+    очередь и кого будить при освобождении емкости.
+    """
+
+    def __init__(self, name: str, capacity: float):
+        self.name = name
+        self.capacity = capacity
+        self.in_use = 0.0
+        self.holders = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_hold_time = 1.0
+        self._lock = threading.Lock()
+
+    # Методы ниже вызываются под блокировкой и реализуются подклассами
+    def _try_admit(self, waiter: _Waiter) -> bool:
+        raise NotImplementedError
+
+    def _push(self, waiter: _Waiter):
+        raise NotImplementedError
+
+    def _remove(self, waiter: _Waiter):
+        raise NotImplementedError
+
+    def _dispatch(self):
+        raise NotImplementedError
+
+    def _max_wait(self, lane: str) -> float:
+        raise NotImplementedError
+
+    def _retry_after(self, waiter: _Waiter) -> int:
+        raise NotImplementedError
+
+    def _waiting(self) -> int:
+        raise NotImplementedError
+
+    def _report(self):
+        """Обновляет метрики очереди и занятой емкости (вызывается под блокировкой)"""
+        metrics.queue_depth.labels(self.name).set(self._waiting())
+        metrics.limiter_in_use.labels(self.name).set(self.in_use)
+
+    def _grant(self, waiter: _Waiter):
+        waiter.granted = True
+        self.in_use += waiter.weight
+        self.holders += 1
+        self.admitted += 1
+
+    def _enqueue(self, weight: float, lane: str, wake) -> _Waiter:
+        """Берет разрешение сразу или ставит в очередь"""
+        waiter = _Waiter(weight, lane, wake)
+        with self._lock:
+            try:
+                if not self._try_admit(waiter):
+                    self._push(waiter)
+            finally:
+                self._report()
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Убирает ожидающего из очереди; True, если разрешение уже было выдано"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._remove(waiter)
+            self.rejected += 1
+            self._dispatch()
+            self._report()
+            return False
+
+    def _timed_out(self, waiter: _Waiter) -> AdmissionRejected:
+        with self._lock:
+            retry_after = self._retry_after(waiter)
+        return AdmissionRejected(f"{self.name}: wait timed out", retry_after, status=503)
+
+    def _clamp(self, weight: float) -> float:
+        # Запрос тяжелее всей емкости допускается, когда система свободна
+        return min(max(weight, 0.0), self.capacity)
+
+    def acquire(self, weight: float = 1.0, lane: str = LANE_STANDARD,
+                timeout: Optional[float] = None) -> float:
+        """Блокирующее получение разрешения (для потоков)"""
+        weight = self._clamp(weight)
+        event = threading.Event()
+        waiter = self._enqueue(weight, lane, event.set)
+        if waiter.granted:
+            return weight
+
+        if not event.wait(self._max_wait(lane) if timeout is None else timeout):
+            if not self._abandon(waiter):
+                raise self._timed_out(waiter)
+        return weight
+
+    async def acquire_async(self, weight: float = 1.0, lane: str = LANE_STANDARD,
+                            timeout: Optional[float] = None) -> float:
+        """Асинхронное получение разрешения (для любого event loop)"""
+        weight = self._clamp(weight)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        waiter = self._enqueue(weight, lane, wake)
+        if waiter.granted:
+            return weight
+
+        try:
+            await asyncio.wait_for(future, self._max_wait(lane) if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                raise self._timed_out(waiter)
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release(weight, lane=lane)
+            raise
+        return weight
+
+    def _on_release(self, lane: str):
+        """Учет освобождения в подклассе (вызывается под блокировкой)"""
+
+    def release(self, weight: float, hold_time: Optional[float] = None,
+                lane: str = LANE_STANDARD):
+        """Возвращает разрешение и будит следующих в очереди"""
+        with self._lock:
+            self._on_release(lane)
+            self.in_use = max(self.in_use - weight, 0.0)
+            self.holders -= 1
+            if hold_time is not None:
+                # Скользящее среднее времени удержания для оценки Retry-After
+                self.avg_hold_time = 0.8 * self.avg_hold_time + 0.2 * hold_time
+            self._dispatch()
+            self._report()
+
+    def permit(self, weight: float = 1.0, lane: str = LANE_STANDARD) -> '_Permit':
+        """Контекстный менеджер (with / async with) для удержания разрешения"""
+        return _Permit(self, weight, lane)
+
+
+class WeightedSemaphore(_Limiter):
+    """Взвешенный семафор с ограниченной FIFO-очередью ожидания"""
+
+    def __init__(self, name: str, capacity: float, max_waiters: int, max_wait: float):
+        super().__init__(name, capacity)
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self._waiters = deque()
+
+    def _fits(self, weight: float) -> bool:
+        return self.in_use + weight <= self.capacity
+
+    def _try_admit(self, waiter: _Waiter) -> bool:
+        if not self._waiters and self._fits(waiter.weight):
+            self._grant(waiter)
+            return True
+        return False
+
+    def _push(self, waiter: _Waiter):
+        if len(self._waiters) >= self.max_waiters:
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"{self.name}: queue is full", self._retry_after(waiter), status=429
+            )
+        self._waiters.append(waiter)
+
+    def _remove(self, waiter: _Waiter):
+        self._waiters.remove(waiter)
+
+    def _waiting(self) -> int:
+        return len(self._waiters)
+
+    def _dispatch(self):
+        while self._waiters and self._fits(self._waiters[0].weight):
+            waiter = self._waiters.popleft()
+            self._grant(waiter)
+            waiter.wake()
+
+    def _max_wait(self, lane: str) -> float:
+        return self.max_wait
+
+    def _retry_after(self, waiter: _Waiter) -> int:
+        """Оценка времени до освобождения емкости для клиента (секунды)"""
+        queued = sum(w.weight for w in self._waiters if w is not waiter) + waiter.weight
+        estimate = self.avg_hold_time * max(queued / self.capacity, 1.0)
+        return max(1, math.ceil(estimate))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            queued = sum(waiter.weight for waiter in self._waiters)
+            return {
+                'capacity': self.capacity,
+                'in_use': round(self.in_use, 2),
+                'holders': self.holders,
+                'waiting': len(self._waiters),
+                'max_waiters': self.max_waiters,
+                'utilization': round(self.in_use / self.capacity, 3),
+                # > 1.0 означает, что очередь больше свободной емкости
+                'pressure': round((self.in_use + queued) / self.capacity, 3),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avg_hold_time': round(self.avg_hold_time, 3),
+            }
+
+
+class _Lane:
+    """Полоса приоритетного планировщика"""
+
+    def __init__(self, name: str, weight: float, max_waiters: int, max_wait: float):
+        self.name = name
+        self.weight = weight
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self.waiters = deque()
+        self.virtual_time = 0.0
+        self.in_use = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.promoted = 0
+        self.avg_wait_time = 0.0
+
+
+class PriorityScheduler(_Limiter):
+    """
+    Слоты параллелизма стадии с приоритетными полосами
+
+    - WFQ: каждая полоса получает долю освобождающихся слотов пропорционально
+      весу (виртуальное время полосы растет на 1/вес за каждый выданный слот).
+    - Резерв: последние reserved слотов доступны только полосе interactive,
+      чтобы проверка водителя не ждала завершения пакетной работы.
+    - Защита от голодания: ожидающий дольше starvation_timeout обслуживается
+      первым среди допустимых полос независимо от веса. Продвижения чередуются
+      с обычным выбором WFQ, чтобы накопившийся batch не вытеснял остальных.
+    """
+
+    def __init__(self, name: str, capacity: int, lanes: Dict[str, Dict[str, float]],
+                 reserved_interactive: int = 0, starvation_timeout: float = 30.0):
+        super().__init__(name, capacity)
+        self.lanes = {
+            lane: _Lane(lane, config['weight'], int(config['max_queue']), config['max_wait'])
+            for lane, config in lanes.items()
+        }
+        self.reserved_interactive = min(reserved_interactive, max(capacity - 1, 0))
+        self.starvation_timeout = starvation_timeout
+        self.virtual_time = 0.0
+        self._promoted_last = False
+
+    def _lane(self, name: str) -> _Lane:
+        return self.lanes.get(name) or self.lanes[LANE_STANDARD]
+
+    def _free_for(self, lane: str) -> bool:
+        free = self.capacity - self.in_use
+        if lane == LANE_INTERACTIVE:
+            return free >= 1
+        return free - self.reserved_interactive >= 1
+
+    def _activate(self, lane: _Lane):
+        """Полоса начинает ждать: пока она простаивала, кредит не накапливается"""
+        lane.virtual_time = max(lane.virtual_time, self.virtual_time)
+
+    def _grant_lane(self, waiter: _Waiter):
+        lane = self._lane(waiter.lane)
+        # Виртуальное время полосы сдвигается с момента, когда она начала ждать,
+        # а не с текущего общего: иначе полоса с малым весом никогда не догонит остальные
+        start = lane.virtual_time
+        lane.virtual_time = start + 1.0 / lane.weight
+        self.virtual_time = max(self.virtual_time, start)
+        lane.in_use += 1
+        lane.admitted += 1
+        lane.avg_wait_time = 0.8 * lane.avg_wait_time + 0.2 * (time.monotonic() - waiter.enqueued_at)
+        self._grant(waiter)
+
+    def _try_admit(self, waiter: _Waiter) -> bool:
+        waiting = any(lane.waiters for lane in self.lanes.values())
+        if not waiting and self._free_for(waiter.lane):
+            self._activate(self._lane(waiter.lane))
+            self._grant_lane(waiter)
+            return True
+        return False
+
+    def _push(self, waiter: _Waiter):
+        lane = self._lane(waiter.lane)
+        if len(lane.waiters) >= lane.max_waiters:
+            lane.rejected += 1
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"{self.name}/{lane.name}: queue is full", self._retry_after(waiter), status=429
+            )
+        if not lane.waiters:
+            self._activate(lane)
+        lane.waiters.append(waiter)
+        # Возможно, слот свободен, но недоступен из-за очереди других полос
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter):
+        lane = self._lane(waiter.lane)
+        lane.waiters.remove(waiter)
+        lane.rejected += 1
+
+    def _waiting(self) -> int:
+        return sum(len(lane.waiters) for lane in self.lanes.values())
+
+    def _pick_lane(self) -> Optional[_Lane]:
+        """Выбирает полосу для следующего свободного слота"""
+        eligible = [
+            lane for lane in self.lanes.values()
+            if lane.waiters and self._free_for(lane.name)
+        ]
+        if not eligible:
+            return None
+
+        now = time.monotonic()
+        starving = [
+            lane for lane in eligible
+            if now - lane.waiters[0].enqueued_at >= self.starvation_timeout
+        ]
+        if starving and not self._promoted_last:
+            lane = min(starving, key=lambda l: l.waiters[0].enqueued_at)
+            lane.promoted += 1
+            self._promoted_last = True
+            return lane
+
+        self._promoted_last = False
+        return min(eligible, key=lambda l: l.virtual_time + 1.0 / l.weight)
+
+    def _dispatch(self):
+        while True:
+            lane = self._pick_lane()
+            if lane is None:
+                return
+            waiter = lane.waiters.popleft()
+            self._grant_lane(waiter)
+            waiter.wake()
+
+    def _on_release(self, lane: str):
+        self._lane(lane).in_use -= 1
+
+    def _max_wait(self, lane: str) -> float:
+        return self._lane(lane).max_wait
+
+    def _retry_after(self, waiter: _Waiter) -> int:
+        """Оценка по числу ожидающих в полосе и полосах с более высоким приоритетом"""
+        ahead = 0
+        for name in LANES:
+            if name in self.lanes:
+                ahead += len(self.lanes[name].waiters)
+            if name == waiter.lane:
+                break
+        estimate = self.avg_hold_time * max((ahead + 1) / self.capacity, 1.0)
+        return max(1, math.ceil(estimate))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            waiting = sum(len(lane.waiters) for lane in self.lanes.values())
+            return {
+                'capacity': self.capacity,
+                'in_use': round(self.in_use, 2),
+                'holders': self.holders,
+                'waiting': waiting,
+                'max_waiters': sum(lane.max_waiters for lane in self.lanes.values()),
+                'utilization': round(self.in_use / self.capacity, 3),
+                'pressure': round((self.in_use + waiting) / self.capacity, 3),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avg_hold_time': round(self.avg_hold_time, 3),
+                'reserved_interactive': self.reserved_interactive,
+                'lanes': {
+                    lane.name: {
+                        'weight': lane.weight,
+                        'in_use': lane.in_use,
+                        'waiting': len(lane.waiters),
+                        'max_waiters': lane.max_waiters,
+                        'admitted': lane.admitted,
+                        'rejected': lane.rejected,
+                        'promoted': lane.promoted,
+                        'avg_wait_time': round(lane.avg_wait_time, 3),
+                    }
+                    for lane in self.lanes.values()
+                },
+            }
+
+
+class _Permit:
+    """Разрешение ограничителя на время блока with / async with"""
+
+    def __init__(self, limiter: _Limiter, weight: float, lane: str):
+        self.limiter = limiter
+        self.weight = weight
+        self.lane = lane
+        self._acquired = 0.0
+        self._start = 0.0
+
+    def _release(self):
+        self.limiter.release(self._acquired, time.monotonic() - self._start, lane=self.lane)
+
+    def __enter__(self):
+        self._acquired = self.limiter.acquire(self.weight, self.lane)
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+    async def __aenter__(self):
+        self._acquired = await self.limiter.acquire_async(self.weight, self.lane)
+        self._start = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._release()
+
+
+def normalize_lane(lane: Optional[str], default: str = LANE_STANDARD) -> str:
+    """
+    Приводит запрошенную клиентом полосу к допустимой
+
+    Клиент может только понизить приоритет относительно default
+    (например, отправить фоновую работу в batch), но не повысить его.
+    """
+    if lane not in LANES:
+        return default
+    return lane if LANES.index(lane) >= LANES.index(default) else default
+
+
+class AdmissionController:
+    """Бюджет мегапикселей на запрос и приоритетные лимиты параллелизма по стадиям"""
+
+    def __init__(self):
+        self.megapixels = WeightedSemaphore(
+            'megapixels',
+            capacity=settings.ADMISSION_MAX_MEGAPIXELS,
+            max_waiters=settings.ADMISSION_MAX_QUEUE,
+            max_wait=settings.ADMISSION_MAX_WAIT,
+        )
+        self.stages = {
+            'gemini': PriorityScheduler(
+                'gemini',
+                capacity=settings.ADMISSION_GEMINI_CONCURRENCY,
+                lanes=settings.SCHEDULER_LANES,
+                reserved_interactive=settings.SCHEDULER_GEMINI_RESERVED_INTERACTIVE,
+                starvation_timeout=settings.SCHEDULER_STARVATION_TIMEOUT,
+            ),
+            'yolo': PriorityScheduler(
+                'yolo',
+                capacity=settings.ADMISSION_YOLO_CONCURRENCY,
+                lanes=settings.SCHEDULER_LANES,
+                reserved_interactive=settings.SCHEDULER_YOLO_RESERVED_INTERACTIVE,
+                starvation_timeout=settings.SCHEDULER_STARVATION_TIMEOUT,
+            ),
+        }
+
+    @staticmethod
+    def image_megapixels(image_file) -> float:
+        """
+        Размер изображения в мегапикселях по заголовку файла (без декодирования)
+
+        Args:
+            image_file: Путь или файловый объект (в т.ч. UploadedFile)
+
+        Returns:
+            Мегапиксели (не меньше 0.1); 1.0, если заголовок не читается
+        """
+        try:
+            with Image.open(image_file) as image:
+                width, height = image.size
+            return max(width * height / 1_000_000, 0.1)
+        except Exception:
+            return 1.0
+        finally:
+            if hasattr(image_file, 'seek'):
+                image_file.seek(0)
+
+    def admit(self, megapixels: float) -> _Permit:
+        """Допуск запроса с изображением заданного размера"""
+        return self.megapixels.permit(megapixels)
+
+    def stage(self, name: str, lane: str = LANE_STANDARD) -> _Permit:
+        """Слот параллелизма для стадии ('gemini' или 'yolo') в заданной полосе"""
+        return self.stages[name].permit(1, lane)
+
+    def get_load(self) -> Dict[str, Any]:
+        """Текущая нагрузка для автомасштабирования"""
+        semaphores = {'megapixels': self.megapixels.snapshot()}
+        semaphores.update({name: sem.snapshot() for name, sem in self.stages.items()})
+        return {
+            'load_factor': max(sem['pressure'] for sem in semaphores.values()),
+            'saturated': any(sem['waiting'] >= sem['max_waiters'] for sem in semaphores.values()),
+            'semaphores': semaphores,
+        }
+
+
+# Глобальный контроллер допуска (на процесс)
+admission_controller = AdmissionController()
@@ -0,0 +1,251 @@
+# car_detector/api_keys.py
+"""
+Аутентификация /api/* по ключу клиента, лимиты и учет использования
+
+Ключ передается заголовком X-API-Key или Authorization: Bearer <ключ>.
+Для каждого ключа действуют (счетчики в counter_store, общем при Redis):
+
+- token bucket: rate_per_minute в среднем, не более burst подряд
+  (rate_per_minute = 0 - без ограничения скорости);
+- ограничение одновременных запросов (max_concurrent);
+- суточная квота анализов (daily_quota, сутки по UTC); запросы,
+  отклоненные перегрузкой или завершившиеся ошибкой сервера, квоту
+  не расходуют, как и повторы с тем же Idempotency-Key и объединенные
+  дубликаты (ответ с Idempotent-Replayed: анализ уже учтен).
+
+Превышение любого лимита - 429 с Retry-After.
+"""
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .async_utils import run_blocking
+from .counters import counter_store
+from .models import ApiKey
+
+
+# Сколько хранятся суточные счетчики использования, дни
+USAGE_RETENTION_DAYS = 31
+# Срок жизни счетчика одновременных запросов (защита от утечки при падении процесса), секунды
+CONCURRENCY_TTL = 600
+# Сколько секунд ключ кешируется в процессе после чтения из базы
+KEY_CACHE_TTL = 30
+# Сколько ключей кешируется в процессе (давно не использованные вытесняются)
+KEY_CACHE_SIZE = 1024
+
+USAGE_FIELDS = ('requests', 'analyses', 'rejected_rate', 'rejected_concurrency', 'rejected_quota')
+
+
+class _LimitExceeded(Exception):
+    def __init__(self, reason: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+_key_cache: 'OrderedDict[str, tuple]' = OrderedDict()
+_key_cache_lock = threading.Lock()
+
+
+def _utc_day(offset: int = 0) -> str:
+    return (datetime.now(dt_timezone.utc).date() - timedelta(days=offset)).isoformat()
+
+
+def _seconds_until_utc_midnight() -> int:
+    now = datetime.now(dt_timezone.utc)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=dt_timezone.utc)
+    return max(int(math.ceil((midnight - now).total_seconds())), 1)
+
+
+def _usage_key(api_key_id: int, day: str, field: str) -> str:
+    return f"apikey:{api_key_id}:usage:{day}:{field}"
+
+
+def _record_usage(api_key_id: int, field: str):
+    counter_store.incr(_usage_key(api_key_id, _utc_day(), field), 1, ttl=USAGE_RETENTION_DAYS * 86400)
+
+
+def _extract_key(request) -> Optional[str]:
+    raw_key = request.headers.get('X-API-Key')
+    if not raw_key:
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            raw_key = authorization[len('Bearer '):].strip()
+    return raw_key or None
+
+
+def _lookup_key(raw_key: str) -> Optional[ApiKey]:
+    """
+    Активный ключ по значению (с кешем в процессе, чтобы не ходить в базу на каждый запрос)
+
+    Кешируются только найденные ключи: иначе запросы со случайными X-API-Key
+    заполняли бы кеш без ограничения. Кеш - LRU на KEY_CACHE_SIZE записей.
+    """
+    key_hash = ApiKey.hash_key(raw_key)
+    now = time.monotonic()
+    with _key_cache_lock:
+        cached = _key_cache.get(key_hash)
+        if cached is not None:
+            if cached[1] > now:
+                _key_cache.move_to_end(key_hash)
+                return cached[0]
+            del _key_cache[key_hash]
+
+    api_key = ApiKey.objects.filter(key_hash=key_hash, is_active=True).first()
+    if api_key is not None:
+        with _key_cache_lock:
+            _key_cache[key_hash] = (api_key, now + KEY_CACHE_TTL)
+            _key_cache.move_to_end(key_hash)
+            while len(_key_cache) > KEY_CACHE_SIZE:
+                _key_cache.popitem(last=False)
+    return api_key
+
+
+def _acquire(api_key: ApiKey, counts_as_analysis: bool) -> bool:
+    """
+    Проверяет лимиты ключа и занимает слот параллелизма
+
+    Returns:
+        Признак того, что запрос зарезервировал единицу суточной квоты
+    """
+    _record_usage(api_key.id, 'requests')
+
+    wait = 0.0
+    if api_key.rate_per_minute:
+        wait = counter_store.take_token(
+            f"apikey:{api_key.id}:bucket", api_key.rate_per_minute / 60, max(api_key.burst, 1)
+        )
+    if wait > 0:
+        _record_usage(api_key.id, 'rejected_rate')
+        raise _LimitExceeded('rate', 'Rate limit exceeded', max(int(math.ceil(wait)), 1))
+
+    quota_reserved = False
+    if counts_as_analysis and api_key.daily_quota:
+        quota_key = f"apikey:{api_key.id}:quota:{_utc_day()}"
+        used = counter_store.incr(quota_key, 1, ttl=2 * 86400)
+        if used > api_key.daily_quota:
+            counter_store.incr(quota_key, -1)
+            _record_usage(api_key.id, 'rejected_quota')
+            raise _LimitExceeded('quota', 'Daily quota exceeded', _seconds_until_utc_midnight())
+        quota_reserved = True
+
+    concurrency_key = f"apikey:{api_key.id}:in_flight"
+    if counter_store.incr(concurrency_key, 1, ttl=CONCURRENCY_TTL) > api_key.max_concurrent:
+        counter_store.incr(concurrency_key, -1)
+        if quota_reserved:
+            counter_store.incr(f"apikey:{api_key.id}:quota:{_utc_day()}", -1)
+        _record_usage(api_key.id, 'rejected_concurrency')
+        raise _LimitExceeded('concurrency', 'Too many concurrent requests', 1)
+
+    return quota_reserved
+
+
+def _release(api_key: ApiKey, quota_reserved: bool, status_code: Optional[int], replayed: bool = False):
+    """
+    Освобождает слот параллелизма и возвращает квоту, если анализ не состоялся
+
+    replayed - ответ повторен из кеша идемпотентности или взят у объединенного
+    запроса: анализ уже учтен у исходного запроса
+    """
+    counter_store.incr(f"apikey:{api_key.id}:in_flight", -1)
+    if not quota_reserved:
+        return
+    if replayed or status_code is None or status_code >= 500 or status_code == 429:
+        counter_store.incr(f"apikey:{api_key.id}:quota:{_utc_day()}", -1)
+    else:
+        _record_usage(api_key.id, 'analyses')
+
+
+def _error_response(message: str, status: int, retry_after: Optional[int] = None, **extra) -> JsonResponse:
+    body = {'status': 'error', 'error': message, **extra}
+    if retry_after is not None:
+        body['retry_after'] = retry_after
+    response = JsonResponse(body, status=status)
+    if retry_after is not None:
+        response['Retry-After'] = str(retry_after)
+    return response
+
+
+def api_key_required(counts_as_analysis: bool = True):
+    """
+    Декоратор async-представления /api/*: ключ клиента и его лимиты
+
+    Args:
+        counts_as_analysis: Запрос расходует суточную квоту анализов
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            request.api_key = None
+            raw_key = _extract_key(request)
+            if raw_key is None:
+                if settings.API_KEYS_REQUIRED:
+                    response = _error_response('API key required', 401)
+                    response['WWW-Authenticate'] = 'Bearer'
+                    return response
+                return await view(request, *args, **kwargs)
+
+            api_key = await run_blocking(_lookup_key, raw_key)
+            if api_key is None:
+                return _error_response('Invalid API key', 401)
+
+            try:
+                quota_reserved = await run_blocking(_acquire, api_key, counts_as_analysis)
+            except _LimitExceeded as e:
+                return _error_response(str(e), 429, retry_after=e.retry_after, limit=e.reason)
+
+            request.api_key = api_key
+            status_code = None
+            replayed = False
+            try:
+                response = await view(request, *args, **kwargs)
+                status_code = response.status_code
+                replayed = response.get('Idempotent-Replayed') == 'true'
+                return response
+            finally:
+                await run_blocking(_release, api_key, quota_reserved, status_code, replayed)
+
+        return wrapper
+    return decorator
+
+
+def get_usage(api_key: ApiKey, days: int = 1) -> Dict[str, Any]:
+    """Лимиты ключа и суточные счетчики использования за последние days дней"""
+    days = max(1, min(days, USAGE_RETENTION_DAYS))
+    day_list = [_utc_day(offset) for offset in range(days)]
+    keys = [_usage_key(api_key.id, day, field) for day in day_list for field in USAGE_FIELDS]
+    keys.append(f"apikey:{api_key.id}:quota:{day_list[0]}")
+    keys.append(f"apikey:{api_key.id}:in_flight")
+    values = counter_store.get_many(keys)
+
+    history: List[Dict[str, Any]] = []
+    for index, day in enumerate(day_list):
+        row = values[index * len(USAGE_FIELDS):(index + 1) * len(USAGE_FIELDS)]
+        history.append({'date': day, **dict(zip(USAGE_FIELDS, row))})
+
+    quota_used = values[-2]
+    return {
+        'key': {
+            'name': api_key.name,
+            'prefix': api_key.prefix,
+            'lane': api_key.lane,
+        },
+        'limits': {
+            'rate_per_minute': api_key.rate_per_minute,
+            'burst': api_key.burst,
+            'max_concurrent': api_key.max_concurrent,
+            'daily_quota': api_key.daily_quota,
+        },
+        'in_flight': max(values[-1], 0),
+        'quota_remaining': (
+            max(api_key.daily_quota - quota_used, 0) if api_key.daily_quota else None
+        ),
+        'history': history,
+    }
@@ -0,0 +1,87 @@
+# car_detector/async_utils.py
+"""
+Вспомогательные функции для асинхронных представлений
+
+- run_blocking: выполняет блокирующую функцию (YOLO, работа с файлами)
+  в общем пуле потоков, сохраняя contextvars вызывающего кода.
+- run_on_background_loop: выполняет корутину на отдельном долгоживущем
+  event loop. Асинхронный клиент Gemini (grpc.aio) привязывается к циклу,
+  в котором создан, а под WSGI/runserver каждый async-запрос получает
+  новый цикл, поэтому все вызовы Gemini идут через один фоновый цикл.
+- submit_detached: фоновая работа, которая переживает запрос (например,
+  запись результата в базу после ответа клиенту).
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Coroutine
+
+from django.conf import settings
+
+from .tracing import profiled_call
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_background_loop = None
+_background_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Общий пул потоков для блокирующей работы из async-кода"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ASYNC_EXECUTOR_WORKERS,
+                thread_name_prefix='car-analysis',
+            )
+        return _executor
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполняет блокирующую функцию в пуле потоков и ожидает результат"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    # profiled_call профилирует участок, если запрос выбран для профилирования (tracing.py)
+    call = functools.partial(context.run, profiled_call, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Возвращает (и при необходимости запускает) фоновый event loop"""
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None or _background_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever, name='car-analysis-background-loop', daemon=True
+            )
+            thread.start()
+            _background_loop = loop
+        return _background_loop
+
+
+def submit_background(coro: Coroutine) -> Future:
+    """Запускает корутину на фоновом цикле, не дожидаясь результата"""
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+
+
+def run_on_background_loop(coro: Coroutine) -> Awaitable:
+    """Запускает корутину на фоновом цикле и возвращает awaitable для текущего цикла"""
+    return asyncio.wrap_future(submit_background(coro))
+
+
+def submit_detached(coro: Coroutine) -> Future:
+    """
+    Запускает корутину на фоновом цикле в чистом контексте
+
+    Задача наследует contextvars вызывающего кода, в том числе исполнитель
+    asgiref текущего запроса; после завершения запроса async ORM в такой
+    задаче падает ("CurrentThreadExecutor already quit"). Работа, которая
+    переживает запрос, должна запускаться без этого контекста.
+    """
+    return contextvars.Context().run(submit_background, coro)
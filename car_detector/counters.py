@@ -0,0 +1,145 @@
+# car_detector/counters.py
+"""
+Хранилище счетчиков для лимитов API-ключей
+
+- MemoryCounterStore: счетчики в памяти процесса (разработка, один процесс).
+- RedisCounterStore: общие счетчики для всех процессов и узлов; операции
+  атомарны (INCRBY, Lua-скрипт для token bucket), одна операция - один
+  round-trip к Redis.
+
+Выбирается по REDIS_URL; без пакета redis используется хранилище в памяти.
+"""
+import math
+import threading
+import time
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class MemoryCounterStore:
+    """Счетчики и token bucket в памяти процесса"""
+
+    # Как часто удалять истекшие ключи (число операций)
+    PURGE_EVERY = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, List[float]] = {}
+        self._buckets: Dict[str, List[float]] = {}
+        self._operations = 0
+
+    def _purge(self, now: float):
+        self._values = {key: item for key, item in self._values.items() if item[1] > now}
+        self._buckets = {key: item for key, item in self._buckets.items() if item[2] > now}
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Увеличивает счетчик и возвращает новое значение; ttl продлевает срок жизни"""
+        now = time.monotonic()
+        with self._lock:
+            self._operations += 1
+            if self._operations % self.PURGE_EVERY == 0:
+                self._purge(now)
+            item = self._values.get(key)
+            if item is None or item[1] <= now:
+                item = [0, math.inf]
+                self._values[key] = item
+            item[0] += amount
+            if ttl:
+                item[1] = now + ttl
+            return int(item[0])
+
+    def get_many(self, keys: List[str]) -> List[int]:
+        """Значения счетчиков (0 для отсутствующих)"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                int(self._values[key][0]) if key in self._values and self._values[key][1] > now else 0
+                for key in keys
+            ]
+
+    def take_token(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """
+        Token bucket: списывает cost токенов (rate <= 0 - без ограничения)
+
+        Returns:
+            0, если токены списаны; иначе секунды до появления нужного числа токенов
+        """
+        if rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, 0))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = [tokens, now, now + burst / rate + 1]
+            return wait
+
+
+class RedisCounterStore:
+    """Общие счетчики в Redis"""
+
+    # Время берется из Redis (TIME), чтобы часы узлов не влияли на пополнение
+    TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst / rate + 1) * 1000))
+return tostring(wait)
+"""
+
+    def __init__(self, url: str):
+        self._client = redis.Redis.from_url(url)
+        self._token_bucket = self._client.register_script(self.TOKEN_BUCKET_SCRIPT)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        pipeline = self._client.pipeline()
+        pipeline.incrby(key, amount)
+        if ttl:
+            pipeline.expire(key, int(math.ceil(ttl)))
+        return int(pipeline.execute()[0])
+
+    def get_many(self, keys: List[str]) -> List[int]:
+        if not keys:
+            return []
+        return [int(value) if value is not None else 0 for value in self._client.mget(keys)]
+
+    def take_token(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        if rate <= 0:
+            return 0.0
+        return float(self._token_bucket(keys=[key], args=[rate, burst, cost]))
+
+
+def _create_store():
+    url = settings.COUNTER_STORE_URL
+    if url:
+        if redis is not None:
+            return RedisCounterStore(url)
+        print("Warning: redis not available. API key limits will be per-process.")
+    return MemoryCounterStore()
+
+
+# Глобальное хранилище счетчиков (на процесс; с Redis - общее)
+counter_store = _create_store()
@@ -0,0 +1,112 @@
+# car_detector/damage_items.py
+"""
+Запись повреждений анализа в таблицу DamageItem
+
+Результаты моделей по-прежнему хранятся в JSON-полях CarAnalysis; при каждом
+сохранении анализа (API, веб-форма, analyze_dir, сессии осмотра, фоновое
+завершение Gemini, reanalyze) его повреждения переписываются строками
+DamageItem одним bulk_create. Классы YOLO приводятся к элементу и типу Gemini
+(damage_taxonomy), поэтому выборка по part_group и damage_type находит
+повреждения обеих моделей.
+"""
+
+from typing import Any, Dict, Iterable, List
+
+from django.db import transaction
+
+from .damage_taxonomy import part_group, yolo_part_type
+from .models import CarAnalysis, DamageItem
+
+# Поля анализа, нужные для построения строк (для .only() при пересчете)
+SOURCE_FIELDS = ('id', 'created_at', 'status', 'gemini_damage_details', 'yolo_detections')
+
+
+def _bbox_columns(bbox) -> Dict[str, Any]:
+    """Колонки x1..y2 из рамки [x1, y1, x2, y2] (None, если рамки нет или она некорректна)"""
+    columns = dict.fromkeys(('x1', 'y1', 'x2', 'y2'))
+    if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+        try:
+            columns.update(zip(('x1', 'y1', 'x2', 'y2'), (float(value) for value in bbox)))
+        except (TypeError, ValueError):
+            pass
+    return columns
+
+
+def damage_item_rows(analysis) -> List[Dict[str, Any]]:
+    """
+    Поля строк DamageItem для анализа (без analysis)
+
+    Принимает любой объект с полями SOURCE_FIELDS, в том числе историческую
+    модель в миграции. Повреждения Gemini берутся только у завершенного анализа:
+    у partial и failed поле gemini_damage_details не содержит ответа модели.
+    """
+    rows = []
+    if analysis.status == 'complete':
+        for part in (analysis.gemini_damage_details or {}).get('parts') or []:
+            if not isinstance(part, dict) or not part.get('part'):
+                continue
+            rows.append({
+                'created_at': analysis.created_at,
+                'source': 'gemini',
+                'part': part['part'][:50],
+                'part_group': (part_group(part['part']) or '')[:50],
+                'damage_type': (part.get('type') or 'other')[:30],
+                'label': '',
+                'confidence': float(part.get('confidence') or 0.0),
+                **_bbox_columns(part.get('bbox')),
+            })
+    for detection in analysis.yolo_detections or []:
+        if not isinstance(detection, dict):
+            continue
+        class_name = detection.get('class') or 'unknown'
+        group, damage_type = yolo_part_type(class_name)
+        rows.append({
+            'created_at': analysis.created_at,
+            'source': 'yolo',
+            'part': group[:50],
+            'part_group': group[:50],
+            'damage_type': damage_type,
+            'label': class_name[:50],
+            'confidence': float(detection.get('confidence') or 0.0),
+            **_bbox_columns(detection.get('bbox')),
+        })
+    return rows
+
+
+def build_damage_items(analyses: Iterable[CarAnalysis]) -> List[DamageItem]:
+    """Несохраненные строки DamageItem для сохраненных анализов"""
+    return [
+        DamageItem(analysis_id=analysis.id, **row)
+        for analysis in analyses
+        for row in damage_item_rows(analysis)
+    ]
+
+
+def save_damage_items(analyses: Iterable[CarAnalysis], replace: bool = False) -> int:
+    """
+    Записывает повреждения анализов одним bulk_create
+
+    Args:
+        analyses: Сохраненные анализы
+        replace: Сначала удалить прежние строки этих анализов (после обновления результата)
+
+    Returns:
+        Число записанных строк
+    """
+    analyses = list(analyses)
+    items = build_damage_items(analyses)
+    with transaction.atomic():
+        if replace:
+            DamageItem.objects.filter(analysis_id__in=[analysis.id for analysis in analyses]).delete()
+        DamageItem.objects.bulk_create(items)
+    return len(items)
+
+
+async def asave_damage_items(analyses: Iterable[CarAnalysis], replace: bool = False) -> int:
+    """Асинхронная версия save_damage_items"""
+    analyses = list(analyses)
+    items = build_damage_items(analyses)
+    if replace:
+        await DamageItem.objects.filter(analysis_id__in=[analysis.id for analysis in analyses]).adelete()
+    await DamageItem.objects.abulk_create(items)
+    return len(items)
@@ -0,0 +1,67 @@
+# car_detector/damage_taxonomy.py
+"""
+Общая таксономия повреждений Gemini и YOLO
+
+Gemini называет элемент кузова с указанием стороны (door_left_front) и тип
+повреждения из своего перечня, YOLO - один из 17 классов модели повреждений
+(doorouter-dent), где сторона не указана. Для сопоставления оба приводятся к
+группе элемента (door) и типу повреждения Gemini (dent).
+"""
+
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# Порядок оценок чистоты от чистой к грязной (при равенстве голосов выбирается более грязная)
+CLEANLINESS_ORDER = ('clean', 'slightly_dirty', 'dirty')
+
+# Класс YOLO -> (группа элемента, тип повреждения Gemini)
+YOLO_CLASS_MAP = {
+    'Bodypanel-Dent': ('body', 'dent'),
+    'Front-Windscreen-Damage': ('windshield', 'crack'),
+    'Headlight-Damage': ('headlight', 'broken_glass'),
+    'Rear-windscreen-Damage': ('rear_window', 'crack'),
+    'RunningBoard-Dent': ('sill', 'dent'),
+    'Sidemirror-Damage': ('mirror', 'other'),
+    'Signlight-Damage': ('signlight', 'broken_glass'),
+    'Taillight-Damage': ('taillight', 'broken_glass'),
+    'bonnet-dent': ('hood', 'dent'),
+    'boot-dent': ('trunk', 'dent'),
+    'doorouter-dent': ('door', 'dent'),
+    'fender-dent': ('fender', 'dent'),
+    'front-bumper-dent': ('bumper_front', 'dent'),
+    'pillar-dent': ('pillar', 'dent'),
+    'quaterpanel-dent': ('quarter_panel', 'dent'),
+    'rear-bumper-dent': ('bumper_rear', 'dent'),
+    'roof-dent': ('roof', 'dent'),
+}
+
+# Группы YOLO, в которые попадает любой элемент кузова Gemini
+# (Bodypanel-Dent не указывает конкретную панель)
+BODY_GROUPS = frozenset({'door', 'fender', 'hood', 'trunk', 'roof', 'sill', 'quarter_panel', 'pillar'})
+
+_SIDED_PREFIXES = (
+    'door', 'fender', 'headlight', 'taillight', 'mirror', 'side_window', 'wheel', 'sill',
+)
+
+
+@lru_cache(maxsize=256)
+def part_group(part: Optional[str]) -> Optional[str]:
+    """Группа элемента Gemini без стороны и положения: door_left_front -> door"""
+    if not part:
+        return part
+    for prefix in _SIDED_PREFIXES:
+        if part == prefix or part.startswith(prefix + '_'):
+            return prefix
+    return part
+
+
+def yolo_part_type(class_name: str) -> Tuple[str, str]:
+    """Группа элемента и тип повреждения Gemini для класса YOLO (неизвестный класс - сам класс и other)"""
+    return YOLO_CLASS_MAP.get(class_name, (class_name, 'other'))
+
+
+def groups_match(gemini_group: Optional[str], yolo_group: str) -> bool:
+    """Совпадают ли группа элемента Gemini и группа класса YOLO"""
+    if gemini_group == yolo_group:
+        return True
+    return yolo_group == 'body' and gemini_group in BODY_GROUPS
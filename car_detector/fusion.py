@@ -0,0 +1,206 @@
+# car_detector/fusion.py
+"""
+Сопоставление результатов Gemini и YOLO для одного снимка
+
+Повреждение Gemini (part, type, bbox) и детекция YOLO (class, bbox) считаются
+одним повреждением, если класс YOLO относится к той же группе элемента
+(damage_taxonomy.YOLO_CLASS_MAP) и рамки пересекаются (IoU не ниже
+FUSION_MIN_IOU; повреждение Gemini без рамки сопоставляется только по смыслу).
+Все пары оцениваются матрицами NumPy сразу, пары выбираются венгерским
+алгоритмом (scipy) или жадно по убыванию оценки.
+
+Согласие пары - взвешенная сумма геометрии (IoU, насыщается на
+FUSION_FULL_IOU) и смысла (1 - совпал тип повреждения, 0.5 - только группа).
+Согласие снимка - сумма согласий пар, деленная на число объединенных
+повреждений: 1.0 - обе модели нашли одно и то же (или обе ничего),
+0.0 - ни одного общего повреждения.
+"""
+
+import logging
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .damage_taxonomy import BODY_GROUPS, part_group, yolo_part_type
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    print("Warning: scipy not available. Gemini-YOLO fusion will use greedy matching.")
+    linear_sum_assignment = None
+
+logger = logging.getLogger(__name__)
+
+# Минимальный IoU пары с рамками; рамки Gemini приблизительные, поэтому порог низкий
+FUSION_MIN_IOU = 0.05
+# IoU, начиная с которого геометрия считается полностью совпавшей
+FUSION_FULL_IOU = 0.5
+# Вес геометрии в согласии пары (остальное - совпадение типа повреждения)
+FUSION_IOU_WEIGHT = 0.5
+# Смысловое согласие, если совпала только группа элемента
+GROUP_ONLY_SCORE = 0.5
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """IoU каждой пары рамок [x1, y1, x2, y2] из boxes_a (N, 4) и boxes_b (M, 4)"""
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+
+def _boxes(items: Sequence[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Рамки (N, 4) и маска элементов с корректной рамкой"""
+    try:
+        boxes = np.array([item.get('bbox') for item in items], dtype=np.float64).reshape(len(items), 4)
+    except (TypeError, ValueError):
+        # Есть элементы без рамки или с рамкой не из 4 чисел
+        boxes = np.zeros((len(items), 4), dtype=np.float64)
+        for i, item in enumerate(items):
+            bbox = item.get('bbox')
+            if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+                try:
+                    boxes[i] = [float(value) for value in bbox]
+                except (TypeError, ValueError):
+                    boxes[i] = 0.0
+    valid = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+    return boxes, valid
+
+
+def _match(rows: np.ndarray, cols: np.ndarray, scores: np.ndarray, shape: Tuple[int, int]) -> List[int]:
+    """Индексы выбранных пар (rows[k], cols[k]) с наибольшей суммарной оценкой, по одной на строку и столбец"""
+    if not len(scores):
+        return []
+    if linear_sum_assignment is not None:
+        dense = np.zeros(shape)
+        index = np.full(shape, -1)
+        dense[rows, cols] = scores
+        index[rows, cols] = np.arange(len(scores))
+        chosen_rows, chosen_cols = linear_sum_assignment(dense, maximize=True)
+        chosen = index[chosen_rows, chosen_cols]
+        return [int(k) for k in chosen if k >= 0]
+
+    order = np.argsort(-scores, kind='stable')
+    used_rows = np.zeros(shape[0], dtype=bool)
+    used_cols = np.zeros(shape[1], dtype=bool)
+    limit = min(len(np.unique(rows)), len(np.unique(cols)))
+    chosen = []
+    for k in order:
+        row, col = rows[k], cols[k]
+        if used_rows[row] or used_cols[col]:
+            continue
+        used_rows[row] = used_cols[col] = True
+        chosen.append(int(k))
+        if len(chosen) == limit:
+            break
+    return chosen
+
+
+def fuse_damages(gemini_parts: Sequence[Dict[str, Any]],
+                 yolo_detections: Sequence[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Объединенный список повреждений снимка и согласие моделей
+
+    Args:
+        gemini_parts: damage_details.parts ответа Gemini
+        yolo_detections: Детекции YOLO (class, confidence, bbox)
+
+    Returns:
+        Повреждения (part, type, sources, confidence, gemini_confidence,
+        yolo_confidence, yolo_class, iou, agreement, bbox) по убыванию
+        уверенности и согласие снимка от 0 до 1
+    """
+    gemini_parts = [part for part in gemini_parts if isinstance(part, dict)]
+    yolo_detections = [detection for detection in yolo_detections if isinstance(detection, dict)]
+    n, m = len(gemini_parts), len(yolo_detections)
+    if not n and not m:
+        return [], 1.0
+
+    # Группы и типы - целочисленные коды, чтобы сравнивать матрицами
+    group_names = [part_group(part.get('part')) or '' for part in gemini_parts]
+    mapped = [yolo_part_type(detection.get('class')) for detection in yolo_detections]
+    codes: Dict[str, int] = {'body': 0, 'dent': 1}
+    gemini_groups = np.array([codes.setdefault(name, len(codes)) for name in group_names], dtype=np.int32)
+    gemini_types = np.array([codes.setdefault(part.get('type') or '', len(codes)) for part in gemini_parts],
+                            dtype=np.int32)
+    yolo_groups = np.array([codes.setdefault(group, len(codes)) for group, _ in mapped], dtype=np.int32)
+    yolo_types = np.array([codes.setdefault(damage_type, len(codes)) for _, damage_type in mapped], dtype=np.int32)
+
+    # Смысл: группа совпала (Bodypanel-Dent - любая панель кузова); вмятина YOLO - только с вмятиной Gemini
+    in_body = np.array([name in BODY_GROUPS for name in group_names], dtype=bool)
+    same_group = (gemini_groups[:, None] == yolo_groups[None, :]) | (
+        in_body[:, None] & (yolo_groups == codes['body'])[None, :]
+    )
+    same_type = gemini_types[:, None] == yolo_types[None, :]
+    compatible = same_group & (same_type | (yolo_types != codes['dent'])[None, :])
+
+    # Геометрия: float32 достаточно для IoU, матрица вдвое меньше
+    gemini_boxes, gemini_valid = _boxes(gemini_parts)
+    yolo_boxes, yolo_valid = _boxes(yolo_detections)
+    iou = iou_matrix(gemini_boxes.astype(np.float32), yolo_boxes.astype(np.float32))
+    allowed = compatible & ((iou >= FUSION_MIN_IOU) & yolo_valid[None, :] | ~gemini_valid[:, None])
+    rows, cols = np.nonzero(allowed)
+    iou = np.where(gemini_valid[rows] & yolo_valid[cols], iou[rows, cols], 0.0).astype(np.float64)
+    semantic = np.where(same_type[rows, cols], 1.0, GROUP_ONLY_SCORE)
+    affinity = FUSION_IOU_WEIGHT * np.minimum(iou / FUSION_FULL_IOU, 1.0) + (1 - FUSION_IOU_WEIGHT) * semantic
+
+    matched_gemini = {}
+    for k in _match(rows, cols, affinity, (n, m)):
+        matched_gemini[int(rows[k])] = (int(cols[k]), float(iou[k]), float(affinity[k]))
+    matched_yolo = {col for col, _, _ in matched_gemini.values()}
+
+    fused = []
+    for row, part in enumerate(gemini_parts):
+        gemini_confidence = float(part.get('confidence') or 0.0)
+        item = {
+            'part': part.get('part'),
+            'type': part.get('type'),
+            'sources': ['gemini'],
+            'confidence': round(gemini_confidence, 3),
+            'gemini_confidence': round(gemini_confidence, 3),
+            'yolo_confidence': None,
+            'yolo_class': None,
+            'iou': None,
+            'agreement': 0.0,
+            'bbox': part.get('bbox'),
+        }
+        if row in matched_gemini:
+            col, pair_overlap, pair_agreement = matched_gemini[row]
+            detection = yolo_detections[col]
+            yolo_confidence = float(detection.get('confidence') or 0.0)
+            item.update({
+                'sources': ['gemini', 'yolo'],
+                # Обе модели независимо нашли повреждение: noisy-OR уверенностей
+                'confidence': round(1 - (1 - gemini_confidence) * (1 - yolo_confidence), 3),
+                'yolo_confidence': round(yolo_confidence, 3),
+                'yolo_class': detection.get('class'),
+                'iou': round(pair_overlap, 3),
+                'agreement': round(pair_agreement, 3),
+                'bbox': part.get('bbox') if gemini_valid[row] else detection.get('bbox'),
+            })
+        fused.append(item)
+
+    for col, detection in enumerate(yolo_detections):
+        if col in matched_yolo:
+            continue
+        yolo_confidence = round(float(detection.get('confidence') or 0.0), 3)
+        fused.append({
+            'part': mapped[col][0],
+            'type': mapped[col][1],
+            'sources': ['yolo'],
+            'confidence': yolo_confidence,
+            'gemini_confidence': None,
+            'yolo_confidence': yolo_confidence,
+            'yolo_class': detection.get('class'),
+            'iou': None,
+            'agreement': 0.0,
+            'bbox': detection.get('bbox'),
+        })
+
+    agreement = sum(item['agreement'] for item in fused) / len(fused)
+    fused.sort(key=lambda item: item['confidence'], reverse=True)
+    return fused, round(agreement, 3)
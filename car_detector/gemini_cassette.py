@@ -0,0 +1,210 @@
+# car_detector/gemini_cassette.py
+"""
+Запись и воспроизведение ответов Gemini (кассета)
+
+- record: запрос уходит в Gemini, ответ (текст или ошибка) и задержка
+  сохраняются на диск;
+- replay: ответ берется с диска без обращения к API, задержка
+  воспроизводится с множителем latency_scale (0 - без задержки);
+  отсутствующая запись - ошибка CassetteMiss.
+
+Ключ записи - sha256 от модели, версии промпта (хеш текста промпта) и хеша
+отправленного изображения. Само изображение не хранится: запись - сжатый
+gzip JSON размером в несколько килобайт, <dir>/<ключ[:2]>/<ключ>.json.gz.
+
+Модуль не зависит от Django и используется как GeminiAnalyzer (настройки
+GEMINI_CASSETTE_*), так и скриптом gemini_car_state.py. Исключение - acall:
+пул потоков run_blocking импортируется при вызове, так как тянет за собой
+django.conf.settings.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+MODES = (MODE_RECORD, MODE_REPLAY)
+
+
+class CassetteMiss(Exception):
+    """В режиме replay нет записи для запроса"""
+
+
+class CassetteRecordedError(Exception):
+    """Воспроизведенная ошибка, записанная при обращении к Gemini"""
+
+
+def prompt_version(prompt: str) -> str:
+    """Версия промпта: изменение текста промпта дает новые ключи записей"""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+
+
+class GeminiCassette:
+    """
+    Хранилище записанных ответов Gemini
+
+    Args:
+        directory: Каталог записей
+        mode: record или replay
+        latency_scale: Множитель записанной задержки при воспроизведении
+    """
+
+    def __init__(self, directory: str, mode: str, latency_scale: float = 1.0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode {mode!r}, expected one of: {', '.join(MODES)}")
+        self.directory = str(directory)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == MODE_REPLAY
+
+    @staticmethod
+    def make_key(model: str, prompt: str, payload: bytes) -> str:
+        material = '\n'.join([model, prompt_version(prompt), hashlib.sha256(payload).hexdigest()])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f'{key}.json.gz')
+
+    def _load_cached(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._cache.get(key)
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is not None:
+            return entry
+        try:
+            with gzip.open(self._path(key), 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._cache[key] = entry
+        return entry
+
+    def _save(self, key: str, entry: Dict[str, Any]):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл: параллельные процессы не увидят оборванную запись
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+                f.write(json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._cache[key] = entry
+            self.recorded += 1
+
+    def _entry(self, key: str, model: str, prompt: str, payload: bytes, latency: float,
+               text: Optional[str] = None, error: Optional[BaseException] = None) -> Dict[str, Any]:
+        return {
+            'key': key,
+            'model': model,
+            'prompt_version': prompt_version(prompt),
+            'payload_sha256': hashlib.sha256(payload).hexdigest(),
+            'payload_size': len(payload),
+            'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'latency_ms': round(latency * 1000, 1),
+            'text': text,
+            'error': None if error is None else {'type': type(error).__name__, 'message': str(error)},
+        }
+
+    def _replay_entry(self, key: str) -> Dict[str, Any]:
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            raise CassetteMiss(f"No cassette entry {key} in {self.directory}")
+        return entry
+
+    def _replay_result(self, entry: Dict[str, Any]) -> str:
+        if entry['error']:
+            raise CassetteRecordedError(f"{entry['error']['type']}: {entry['error']['message']}")
+        return entry['text']
+
+    def call(self, model: str, prompt: str, payload: bytes, generate: Callable[[], str]) -> str:
+        """
+        Текст ответа Gemini: из кассеты (replay) или от generate с записью (record)
+
+        Args:
+            model: Имя модели
+            prompt: Текст промпта
+            payload: Байты изображения, отправляемые в Gemini
+            generate: Вызов Gemini, возвращающий текст ответа
+        """
+        key = self.make_key(model, prompt, payload)
+        if self.replaying:
+            entry = self._replay_entry(key)
+            if self.latency_scale > 0:
+                time.sleep(entry['latency_ms'] / 1000 * self.latency_scale)
+            return self._replay_result(entry)
+
+        start = time.perf_counter()
+        try:
+            text = generate()
+        except Exception as e:
+            self._save(key, self._entry(key, model, prompt, payload, time.perf_counter() - start, error=e))
+            raise
+        self._save(key, self._entry(key, model, prompt, payload, time.perf_counter() - start, text=text))
+        return text
+
+    async def acall(self, model: str, prompt: str, payload: bytes, generate: Callable[[], Awaitable[str]]) -> str:
+        """Асинхронная версия call; запись на диск выполняется в пуле потоков"""
+        from .async_utils import run_blocking
+
+        key = self.make_key(model, prompt, payload)
+        if self.replaying:
+            if self._load_cached(key) is not None:
+                # Запись уже в памяти - читаем без пула потоков
+                entry = self._replay_entry(key)
+            else:
+                entry = await run_blocking(self._replay_entry, key)
+            if self.latency_scale > 0:
+                await asyncio.sleep(entry['latency_ms'] / 1000 * self.latency_scale)
+            return self._replay_result(entry)
+
+        start = time.perf_counter()
+        try:
+            text = await generate()
+        except Exception as e:
+            entry = self._entry(key, model, prompt, payload, time.perf_counter() - start, error=e)
+            await run_blocking(self._save, key, entry)
+            raise
+        entry = self._entry(key, model, prompt, payload, time.perf_counter() - start, text=text)
+        await run_blocking(self._save, key, entry)
+        return text
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'directory': self.directory,
+                'hits': self.hits,
+                'misses': self.misses,
+                'recorded': self.recorded,
+            }
@@ -0,0 +1,225 @@
+# car_detector/idempotency.py
+"""
+Идемпотентность и объединение одинаковых запросов (single-flight)
+
+- Idempotency-Key: результат запроса с ключом сохраняется в кеше Django
+  на IDEMPOTENCY_TTL секунд, повтор с тем же ключом получает сохраненный
+  ответ без повторного анализа. Повтор ключа с другим запросом - 422.
+- Single-flight: одновременные запросы с тем же ключом (или без ключа,
+  но с тем же отпечатком) присоединяются к уже выполняющемуся анализу
+  и получают его ответ.
+
+Отпечаток запроса - хеш всех загруженных файлов по порядку (сессия осмотра
+присылает несколько снимков в одном поле), полей формы (callback_url,
+vehicle_id, gemini) и заголовков, меняющих ответ (FINGERPRINT_HEADERS):
+одинаковые снимки с другим адресом webhook или бюджетом задержки - это
+разные запросы.
+
+Мобильные клиенты повторяют запрос при обрыве связи, пока первый еще
+выполняется; без объединения каждый повтор запускает Gemini и YOLO заново.
+"""
+import asyncio
+import functools
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from .async_utils import run_blocking
+from .metrics import record_cache
+
+
+# Заголовки, которые переносятся в повторно отданный ответ
+REPLAY_HEADERS = ('Content-Type', 'Retry-After')
+
+# Заголовки запроса, от которых зависит ответ или побочные действия анализа
+FINGERPRINT_HEADERS = ('X-Callback-Url', 'X-Priority', 'X-Latency-Budget')
+
+
+class IdempotencyConflict(Exception):
+    """Ключ идемпотентности повторно использован с другим запросом"""
+
+
+class SingleFlight:
+    """Не более одного выполнения на ключ; остальные вызовы ждут его результат"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Tuple[Future, str]] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fingerprint: str,
+                 func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Выполняет func или присоединяется к уже выполняющемуся вызову
+
+        Args:
+            key: Ключ объединения
+            fingerprint: Отпечаток входных данных (см. _request_fingerprint)
+            func: Фабрика корутины, выполняющей работу
+
+        Returns:
+            Результат и признак того, что он получен от другого вызова
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                future = Future()
+                self._calls[key] = (future, fingerprint)
+                self.executed += 1
+            else:
+                future, call_fingerprint = call
+                if call_fingerprint != fingerprint:
+                    raise IdempotencyConflict(key)
+                self.coalesced += 1
+
+        if call is not None:
+            # shield: отмена ожидающего запроса не должна отменять чужое выполнение
+            return await asyncio.shield(asyncio.wrap_future(future)), True
+
+        try:
+            result = await func()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            future.set_exception(RuntimeError("Original request was cancelled"))
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Число выполнений, объединенных запросов и текущих вызовов"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+            }
+
+
+single_flight = SingleFlight()
+
+
+def _hash_upload(image_file) -> str:
+    """SHA-256 загруженного файла (указатель возвращается в начало)"""
+    digest = hashlib.sha256()
+    image_file.seek(0)
+    for chunk in image_file.chunks():
+        digest.update(chunk)
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+def _request_fingerprint(request) -> str:
+    """
+    SHA-256 запроса: файлы (поля по имени, файлы поля - в порядке загрузки),
+    поля формы и заголовки FINGERPRINT_HEADERS
+    """
+    digest = hashlib.sha256()
+    for field in sorted(request.FILES):
+        for upload in request.FILES.getlist(field):
+            digest.update(f"file:{field}:{_hash_upload(upload)}\n".encode())
+    for field in sorted(request.POST):
+        for value in request.POST.getlist(field):
+            digest.update(f"form:{field}={value}\n".encode())
+    for name in FINGERPRINT_HEADERS:
+        digest.update(f"header:{name}={request.headers.get(name, '')}\n".encode())
+    return digest.hexdigest()
+
+
+def _snapshot(response: HttpResponse) -> Dict[str, Any]:
+    """Сериализуемое представление ответа для кеша и других ожидающих запросов"""
+    return {
+        'status': response.status_code,
+        'content': response.content,
+        'headers': {name: response[name] for name in REPLAY_HEADERS if response.has_header(name)},
+    }
+
+
+def _restore(snapshot: Dict[str, Any], replayed: bool) -> HttpResponse:
+    """Собирает новый HttpResponse из сохраненного представления"""
+    response = HttpResponse(snapshot['content'], status=snapshot['status'])
+    for name, value in snapshot['headers'].items():
+        response[name] = value
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _cacheable(snapshot: Dict[str, Any]) -> bool:
+    """Перегрузку и ошибки сервера не сохраняем: клиент должен иметь возможность повторить"""
+    return snapshot['status'] < 500 and snapshot['status'] != 429
+
+
+def _conflict_response() -> JsonResponse:
+    return JsonResponse({
+        'success': False,
+        'error': 'Idempotency-Key was already used with a different request',
+    }, status=422)
+
+
+def idempotent(view):
+    """
+    Декоратор async-представления анализа: Idempotency-Key и single-flight
+
+    Ключи и объединение действуют в пределах одного представления и API-ключа.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not request.FILES:
+            return await view(request, *args, **kwargs)
+
+        # Разные клиенты не получают ответы друг друга
+        api_key = getattr(request, 'api_key', None)
+        scope = f"{view.__name__}:{api_key.id if api_key is not None else 'anonymous'}"
+
+        fingerprint = await run_blocking(_request_fingerprint, request)
+        idempotency_key = request.headers.get('Idempotency-Key')
+
+        if idempotency_key:
+            cache_key = f"idempotency:{scope}:{hashlib.sha256(idempotency_key.encode()).hexdigest()}"
+            stored = await cache.aget(cache_key)
+            record_cache('idempotency', stored is not None)
+            if stored is not None:
+                if stored['fingerprint'] != fingerprint:
+                    return _conflict_response()
+                return _restore(stored['response'], replayed=True)
+            flight_key = f"{scope}:key:{idempotency_key}"
+        else:
+            cache_key = None
+            flight_key = f"{scope}:request:{fingerprint}"
+
+        original = {}
+
+        async def execute():
+            original['response'] = await view(request, *args, **kwargs)
+            snapshot = _snapshot(original['response'])
+            if cache_key and _cacheable(snapshot):
+                # Сохраняем до завершения single-flight, чтобы повтор не проскочил между ними
+                await cache.aset(
+                    cache_key,
+                    {'fingerprint': fingerprint, 'response': snapshot},
+                    settings.IDEMPOTENCY_TTL,
+                )
+            return snapshot
+
+        try:
+            snapshot, shared = await single_flight.do(flight_key, fingerprint, execute)
+        except IdempotencyConflict:
+            return _conflict_response()
+        record_cache('single_flight', shared)
+        if not shared:
+            return original['response']
+        return _restore(snapshot, replayed=True)
+
+    return wrapper
@@ -1,9 +1,16 @@
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
+import logging
 import os
+import time
 from typing import List, Dict, Tuple, Optional
 
+from .logging_utils import log_event
+from .tracing import record_span, span
+
+logger = logging.getLogger(__name__)
+
 def draw_damage_boxes(image_path: str, damage_parts: List[Dict], output_path: str) -> str:
     """
     Рисует прямоугольники повреждений на изображении
@@ -60,7 +67,8 @@ def draw_damage_boxes(image_path: str, damage_parts: List[Dict], output_path: st
                     font_scale = 0.8
                     thickness = 2
                     
-                    print(f"Рисуем повреждение: {damage_type} в координатах ({x1},{y1})-({x2},{y2}) цветом {color}")
+                    log_event(logger, 'overlay.box', level=logging.DEBUG,
+                              source='gemini', label=damage_type, box=(x1, y1, x2, y2))
                     
                     # Получаем размер текста
                     (text_width, text_height), baseline = cv2.getTextSize(
@@ -92,7 +100,7 @@ def draw_damage_boxes(image_path: str, damage_parts: List[Dict], output_path: st
         return output_path
         
     except Exception as e:
-        print(f"Ошибка при рисовании повреждений: {e}")
+        logger.exception("Ошибка при рисовании повреждений: %s", e)
         # Возвращаем исходное изображение в случае ошибки
         return image_path
 
@@ -168,7 +176,7 @@ def draw_yolo_detections(image_path: str, detections: List[Dict], output_path: s
         return output_path
         
     except Exception as e:
-        print(f"Ошибка при рисовании YOLO детекций: {e}")
+        logger.exception("Ошибка при рисовании YOLO детекций: %s", e)
         # Возвращаем исходное изображение в случае ошибки
         return image_path
 
@@ -188,14 +196,15 @@ def create_comparison_image(original_path: str, gemini_damages: List[Dict],
     """
     try:
         # Загружаем изображение
-        image = cv2.imread(original_path)
+        with span('overlay_read'):
+            image = cv2.imread(original_path)
         if image is None:
             raise ValueError(f"Не удалось загрузить изображение: {original_path}")
         
+        draw_start = time.perf_counter()
         height, width = image.shape[:2]
-        print(f"Создаем сравнение изображения размером {width}x{height}")
-        print(f"Gemini повреждений: {len(gemini_damages)}")
-        print(f"YOLO детекций: {len(yolo_detections)}")
+        log_event(logger, 'overlay.start', level=logging.DEBUG, width=width, height=height,
+                  gemini_damages=len(gemini_damages), yolo_detections=len(yolo_detections))
         
         # Цвета для разных моделей
         gemini_color = (0, 0, 255)  # Красный для Gemini
@@ -222,7 +231,8 @@ def create_comparison_image(original_path: str, gemini_damages: List[Dict],
                         cv2.FONT_HERSHEY_SIMPLEX, 0.8, gemini_color, 3
                     )
                     
-                    print(f"Рисуем Gemini повреждение: {part.get('type', 'damage')} в координатах ({x1},{y1})-({x2},{y2})")
+                    log_event(logger, 'overlay.box', level=logging.DEBUG,
+                              source='gemini', label=damage_type, box=(x1, y1, x2, y2))
         
         # Рисуем детекции YOLO
         for detection in yolo_detections:
@@ -245,7 +255,8 @@ def create_comparison_image(original_path: str, gemini_damages: List[Dict],
                         cv2.FONT_HERSHEY_SIMPLEX, 0.8, yolo_color, 3
                     )
                     
-                    print(f"Рисуем YOLO детекцию: {detection.get('class', 'detection')} в координатах ({x1},{y1})-({x2},{y2})")
+                    log_event(logger, 'overlay.box', level=logging.DEBUG,
+                              source='yolo', label=class_name, box=(x1, y1, x2, y2))
         
         # Добавляем легенду (на английском для совместимости с OpenCV)
         legend_y = 30
@@ -253,13 +264,15 @@ def create_comparison_image(original_path: str, gemini_damages: List[Dict],
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, gemini_color, 2)
         cv2.putText(image, "YOLO (green solid)", (10, legend_y + 30), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, yolo_color, 2)
+        record_span('overlay_draw', draw_start)
         
         # Сохраняем результат
-        cv2.imwrite(output_path, image)
+        with span('overlay_write'):
+            cv2.imwrite(output_path, image)
         return output_path
         
     except Exception as e:
-        print(f"Ошибка при создании сравнения: {e}")
+        logger.exception("Ошибка при создании сравнения: %s", e)
         return original_path
 
 def draw_dashed_rectangle(image, pt1, pt2, color, thickness):
@@ -0,0 +1,158 @@
+# car_detector/inference_client.py
+"""
+Клиент удаленных серверов инференса YOLO (см. inference_server.py)
+
+Балансирует запросы между несколькими эндпоинтами по числу
+незавершенных запросов и временно исключает недоступные узлы. Недоступным
+узел считается при ошибке соединения, таймауте или ответе 5xx; ответ 4xx
+означает ошибку в самом запросе (например, поврежденное изображение) и
+возвращается сразу, без перехода на другой узел.
+"""
+import threading
+import time
+from typing import Any, Dict, List
+
+import requests
+
+from .inference_server import pack_frames
+
+
+class InferenceUnavailable(Exception):
+    """Ни один из серверов инференса не ответил"""
+
+
+class InferenceRequestError(Exception):
+    """Сервер инференса отклонил запрос (4xx): повтор на другом узле не поможет"""
+
+
+class _Endpoint:
+    """Состояние одного сервера инференса на стороне клиента"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.in_flight = 0
+        self.processed = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.total_time = 0.0
+
+
+class RemoteInferenceClient:
+    """Клиент с балансировкой по наименьшему числу незавершенных запросов"""
+
+    def __init__(self, endpoints: List[str], timeout: float = 30.0, retry_after: float = 10.0):
+        self.endpoints = [_Endpoint(url) for url in endpoints]
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def _candidates(self) -> List[_Endpoint]:
+        """Эндпоинты в порядке предпочтения: сначала доступные и наименее загруженные"""
+        now = time.time()
+        with self._lock:
+            return sorted(
+                self.endpoints,
+                key=lambda e: (e.down_until > now, e.in_flight, e.consecutive_failures)
+            )
+
+    def _mark_down(self, endpoint: _Endpoint):
+        """Исключает эндпоинт из ротации на retry_after секунд"""
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            endpoint.down_until = time.time() + self.retry_after
+
+    def _post(self, path: str, body: bytes, confidence_threshold: float) -> Dict[str, Any]:
+        """
+        Отправляет запрос на первый ответивший эндпоинт
+
+        Raises:
+            InferenceRequestError: Сервер ответил 4xx (узел не исключается, другие не пробуются)
+            InferenceUnavailable: Ни один узел не ответил
+        """
+        errors = []
+        for endpoint in self._candidates():
+            with self._lock:
+                endpoint.in_flight += 1
+            start_time = time.perf_counter()
+            try:
+                response = self._session.post(
+                    f"{endpoint.url}{path}",
+                    params={'conf': confidence_threshold},
+                    data=body,
+                    headers={'Content-Type': 'application/octet-stream'},
+                    timeout=self.timeout,
+                )
+                if 400 <= response.status_code < 500:
+                    raise InferenceRequestError(f"{endpoint.url}: HTTP {response.status_code}: {response.text[:200]}")
+                response.raise_for_status()
+                data = response.json()
+            except InferenceRequestError:
+                raise
+            except (requests.RequestException, ValueError) as e:
+                # Соединение, таймаут, 5xx или нечитаемый ответ - узел неисправен
+                errors.append(f"{endpoint.url}: {e}")
+                self._mark_down(endpoint)
+                continue
+            finally:
+                with self._lock:
+                    endpoint.in_flight -= 1
+
+            with self._lock:
+                endpoint.processed += 1
+                endpoint.consecutive_failures = 0
+                endpoint.down_until = 0.0
+                endpoint.total_time += time.perf_counter() - start_time
+            return data
+
+        raise InferenceUnavailable("; ".join(errors) or "No inference endpoints configured")
+
+    def detect_bytes(self, data: bytes, confidence_threshold: float = 0.3) -> List[Dict[str, Any]]:
+        """
+        Детекция на удаленном сервере
+
+        Args:
+            data: Закодированное изображение (JPEG/PNG/WebP)
+            confidence_threshold: Минимальный порог уверенности
+
+        Returns:
+            Список детекций в формате YOLODetector.detect
+        """
+        return self._post('/detect', data, confidence_threshold)['detections']
+
+    def detect_batch_bytes(self, payloads: List[bytes],
+                           confidence_threshold: float = 0.3) -> List[List[Dict[str, Any]]]:
+        """Пакетная детекция: один запрос на несколько изображений"""
+        return self._post('/detect-batch', pack_frames(payloads), confidence_threshold)['results']
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Статистика клиента по каждому эндпоинту"""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    'url': endpoint.url,
+                    'available': endpoint.down_until <= now,
+                    'in_flight': endpoint.in_flight,
+                    'processed': endpoint.processed,
+                    'failures': endpoint.failures,
+                    'avg_latency': (
+                        round(endpoint.total_time / endpoint.processed, 4) if endpoint.processed else None
+                    ),
+                }
+                for endpoint in self.endpoints
+            ]
+
+    def fetch_health(self) -> List[Dict[str, Any]]:
+        """Запрашивает /health у всех эндпоинтов (нагрузка, состояние модели)"""
+        health = []
+        for endpoint in self.endpoints:
+            try:
+                response = self._session.get(f"{endpoint.url}/health", timeout=min(self.timeout, 5.0))
+                response.raise_for_status()
+                health.append({'url': endpoint.url, **response.json()})
+            except Exception as e:
+                health.append({'url': endpoint.url, 'status': 'unreachable', 'error': str(e)})
+        return health
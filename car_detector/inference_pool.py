@@ -0,0 +1,325 @@
+# car_detector/inference_pool.py
+"""
+Пул процессов для локального инференса YOLO
+
+Каждый процесс пула владеет своим экземпляром YOLODetector. Веб-процесс
+не загружает модель: декодированное изображение копируется в сегмент
+multiprocessing.shared_memory, а через очередь передается только имя
+сегмента, форма и тип массива. Это избавляет от pickle больших массивов
+и выносит инференс из-под GIL веб-процесса.
+"""
+import atexit
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Подключается к сегменту, созданному клиентом пула"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # До Python 3.13 нет track=False. Воркеры запускаются через spawn и
+        # используют resource_tracker родителя, поэтому повторная регистрация
+        # сегмента ничего не меняет, а удаляет его клиент через unlink()
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker_main(worker_id: int, weights_path: str, torch_threads: int,
+                 request_queue, response_queue):
+    """Цикл процесса пула: загружает модель и обрабатывает задачи из своей очереди"""
+    if torch_threads:
+        try:
+            import torch
+            torch.set_num_threads(torch_threads)
+        except ImportError:
+            pass
+
+    from .models_ai.yolo_detector import YOLODetector
+
+    detector = YOLODetector(weights_path)
+    detector.warmup()
+    response_queue.put(('ready', worker_id, None, detector.model is not None, detector.warmup_time, 0.0))
+
+    while True:
+        task = request_queue.get()
+        if task is None:
+            break
+
+        request_id, shm_name, shape, dtype, confidence_threshold = task
+        start_time = time.perf_counter()
+        try:
+            shm = _attach_shared_memory(shm_name)
+            try:
+                # Копируем кадр из сегмента: предиктор ultralytics хранит ссылку
+                # на последний батч, и без копии сегмент нельзя было бы закрыть
+                image = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+            finally:
+                shm.close()
+            result, error = detector.detect(image, confidence_threshold), None
+        except Exception as e:
+            result, error = None, str(e)
+
+        response_queue.put(('result', worker_id, request_id, result, error,
+                            time.perf_counter() - start_time))
+
+
+class _WorkerState:
+    """Состояние процесса пула на стороне клиента"""
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id
+        self.process = None
+        self.request_queue = None
+        self.in_flight = 0
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.started_at = time.time()
+        self.ready = False
+        self.model_loaded = False
+        self.warmup_time = None
+
+
+class InferencePool:
+    """Пул процессов с экземплярами YOLODetector и передачей изображений через shared memory"""
+
+    def __init__(self, weights_path: str, workers: int = 2, torch_threads: int = 1,
+                 timeout: float = 60.0):
+        self.weights_path = weights_path
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.timeout = timeout
+
+        # spawn: дочерние процессы не наследуют потоки PyTorch и состояние Django
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._pending = {}
+        self._workers: List[_WorkerState] = []
+        self._response_queue = None
+        self._collector = None
+        self._owner_pid = None
+
+    @property
+    def started(self) -> bool:
+        return self._owner_pid == os.getpid()
+
+    def start(self):
+        """Запускает процессы пула (идемпотентно, отдельно в каждом процессе-владельце)"""
+        with self._lock:
+            if self.started:
+                return
+
+            self._owner_pid = os.getpid()
+            self._pending = {}
+            self._response_queue = self._context.Queue()
+            self._workers = [_WorkerState(i) for i in range(self.workers)]
+            for state in self._workers:
+                self._spawn(state)
+
+            self._collector = threading.Thread(
+                target=self._collect_responses, name='inference-pool-collector', daemon=True
+            )
+            self._collector.start()
+            atexit.register(self.shutdown)
+
+    def _spawn(self, state: _WorkerState):
+        """Запускает (или перезапускает) процесс воркера"""
+        state.request_queue = self._context.Queue()
+        state.process = self._context.Process(
+            target=_worker_main,
+            args=(state.worker_id, self.weights_path, self.torch_threads,
+                  state.request_queue, self._response_queue),
+            name=f'yolo-inference-{state.worker_id}',
+            daemon=True,
+        )
+        state.process.start()
+        state.ready = False
+        state.started_at = time.time()
+        state.busy_time = 0.0
+
+    def _collect_responses(self):
+        """Фоновый поток: разбирает ответы воркеров и завершает Future"""
+        while True:
+            try:
+                message = self._response_queue.get()
+            except (EOFError, OSError):
+                break
+            if message is None:
+                break
+
+            kind, worker_id, request_id, payload, extra, elapsed = message
+            with self._lock:
+                if worker_id >= len(self._workers):
+                    continue
+                state = self._workers[worker_id]
+                if kind == 'ready':
+                    state.ready = True
+                    state.model_loaded = payload
+                    state.warmup_time = extra
+                    continue
+
+                pending = self._pending.pop(request_id, None)
+                if pending is None:
+                    # Задача уже завершена ошибкой при перезапуске воркера
+                    continue
+                state.in_flight -= 1
+                state.processed += 1
+                state.busy_time += elapsed
+
+            future, shm, _ = pending
+            shm.close()
+            shm.unlink()
+            if extra is not None:
+                with self._lock:
+                    state.errors += 1
+                future.set_exception(RuntimeError(f"Inference worker {worker_id} failed: {extra}"))
+            else:
+                future.set_result(payload)
+
+    def _pick_worker(self) -> _WorkerState:
+        """Выбирает живой воркер с наименьшей очередью"""
+        for state in self._workers:
+            if not state.process.is_alive():
+                self._fail_pending(state)
+                self._spawn(state)
+        return min(self._workers, key=lambda s: s.in_flight)
+
+    def _fail_pending(self, state: _WorkerState):
+        """Завершает ошибкой задачи упавшего воркера"""
+        lost = [request_id for request_id, (_, _, worker_id) in self._pending.items()
+                if worker_id == state.worker_id]
+        for request_id in lost:
+            future, shm, _ = self._pending.pop(request_id)
+            shm.close()
+            shm.unlink()
+            future.set_exception(RuntimeError(f"Inference worker {state.worker_id} died"))
+        state.in_flight = 0
+
+    def submit(self, image: Union[Image.Image, np.ndarray],
+               confidence_threshold: float = 0.3) -> Future:
+        """
+        Отправляет изображение на инференс
+
+        Args:
+            image: PIL Image объект или numpy массив
+            confidence_threshold: Минимальный порог уверенности
+
+        Returns:
+            Future со списком детекций в формате YOLODetector.detect
+        """
+        self.start()
+
+        array = np.ascontiguousarray(np.asarray(image))
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+
+        future = Future()
+        with self._lock:
+            state = self._pick_worker()
+            request_id = next(self._request_ids)
+            self._pending[request_id] = (future, shm, state.worker_id)
+            state.in_flight += 1
+            state.request_queue.put(
+                (request_id, shm.name, array.shape, array.dtype.str, confidence_threshold)
+            )
+        return future
+
+    def detect(self, image: Union[Image.Image, np.ndarray],
+               confidence_threshold: float = 0.3,
+               timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Синхронный инференс через пул (интерфейс совпадает с YOLODetector.detect)"""
+        future = self.submit(image, confidence_threshold)
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except FutureTimeoutError:
+            self.abandon(future)
+            raise
+
+    def abandon(self, future: Future):
+        """
+        Снимает задачу, ответа на которую больше не ждут (таймаут)
+
+        Запись и сегмент shared memory освобождаются сразу, а не после ответа
+        воркера: зависший воркер может не ответить никогда. Поздний ответ
+        коллектор пропускает, а воркер, не успевший открыть сегмент, получает ошибку.
+        """
+        with self._lock:
+            request_id = next(
+                (request_id for request_id, (pending, _, _) in self._pending.items() if pending is future),
+                None,
+            )
+            if request_id is None:
+                # Ответ уже получен (или задача снята при перезапуске воркера)
+                return
+            _, shm, worker_id = self._pending.pop(request_id)
+            if worker_id < len(self._workers):
+                state = self._workers[worker_id]
+                state.in_flight = max(state.in_flight - 1, 0)
+                state.errors += 1
+
+        shm.close()
+        shm.unlink()
+        if not future.done():
+            future.set_exception(FutureTimeoutError(f"Inference request {request_id} timed out"))
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """
+        Возвращает состояние воркеров пула
+
+        Returns:
+            Список со статистикой по каждому воркеру: глубина очереди,
+            загрузка (доля времени в инференсе), число обработанных задач
+        """
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    'worker_id': state.worker_id,
+                    'pid': state.process.pid if state.process else None,
+                    'alive': bool(state.process and state.process.is_alive()),
+                    'ready': state.ready,
+                    'model_loaded': state.model_loaded,
+                    'warmup_time': state.warmup_time,
+                    'queue_depth': state.in_flight,
+                    'processed': state.processed,
+                    'errors': state.errors,
+                    'utilization': round(state.busy_time / max(now - state.started_at, 1e-6), 4),
+                    'avg_inference_time': (
+                        round(state.busy_time / state.processed, 4) if state.processed else None
+                    ),
+                }
+                for state in self._workers
+            ]
+
+    def shutdown(self):
+        """Останавливает воркеры и освобождает сегменты shared memory"""
+        with self._lock:
+            if not self.started:
+                return
+            self._owner_pid = None
+            workers, self._workers = self._workers, []
+            pending, self._pending = self._pending, {}
+
+        for state in workers:
+            state.request_queue.put(None)
+        for state in workers:
+            state.process.join(timeout=5)
+            if state.process.is_alive():
+                state.process.terminate()
+
+        for future, shm, _ in pending.values():
+            shm.close()
+            shm.unlink()
+            future.set_exception(RuntimeError("Inference pool shut down"))
+
+        self._response_queue.put(None)
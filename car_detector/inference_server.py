@@ -0,0 +1,255 @@
+# car_detector/inference_server.py
+"""
+Сетевой сервер инференса YOLO
+
+Позволяет нескольким веб-узлам использовать несколько выделенных узлов
+инференса вместо загрузки модели в каждый Django-процесс.
+
+Протокол (HTTP/1.1, keep-alive):
+    POST /detect?conf=0.3        тело - закодированное изображение (JPEG/PNG/WebP)
+    POST /detect-batch?conf=0.3  тело - кадры [4 байта длины big-endian][изображение]...
+    GET  /health                 состояние модели и текущая нагрузка
+
+Тело больше max_body отклоняется с 413 без чтения; если пул не ответил за
+timeout, задачи снимаются с пула и сервер отвечает 503 (клиент переключается
+на другой узел).
+
+Запуск:
+    python manage.py run_inference_server --port 8100
+"""
+import io
+import json
+import struct
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+from .inference_pool import InferencePool
+from .models_ai.yolo_detector import YOLODetector
+
+
+FRAME_HEADER = struct.Struct('>I')
+
+
+def pack_frames(payloads: List[bytes]) -> bytes:
+    """Упаковывает несколько изображений в одно тело запроса"""
+    return b''.join(FRAME_HEADER.pack(len(payload)) + payload for payload in payloads)
+
+
+def unpack_frames(body: bytes) -> List[bytes]:
+    """Разбирает тело запроса /detect-batch на отдельные изображения"""
+    payloads = []
+    offset = 0
+    while offset < len(body):
+        if offset + FRAME_HEADER.size > len(body):
+            raise ValueError("Truncated frame header")
+        (length,) = FRAME_HEADER.unpack_from(body, offset)
+        offset += FRAME_HEADER.size
+        if offset + length > len(body):
+            raise ValueError("Truncated frame payload")
+        payloads.append(body[offset:offset + length])
+        offset += length
+    return payloads
+
+
+class InferenceBackend:
+    """Модель сервера: пул процессов или один детектор под блокировкой"""
+
+    def __init__(self, weights_path: str, workers: int = 0, torch_threads: int = 1,
+                 capacity: Optional[int] = None, timeout: float = 60.0):
+        self.pool = None
+        self.detector = None
+        self._detector_lock = threading.Lock()
+
+        if workers > 0:
+            self.pool = InferencePool(weights_path, workers=workers, torch_threads=torch_threads,
+                                      timeout=timeout)
+            self.pool.start()
+        else:
+            if torch_threads:
+                try:
+                    import torch
+                    torch.set_num_threads(torch_threads)
+                except ImportError:
+                    pass
+            self.detector = YOLODetector(weights_path)
+            self.detector.warmup()
+
+        # Емкость - число изображений, обрабатываемых одновременно без очереди
+        self.capacity = capacity or max(workers, 1)
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.started_at = time.time()
+
+    def detect_many(self, images: List[np.ndarray], confidence_threshold: float) -> List[List[Dict[str, Any]]]:
+        """
+        Запускает детекцию для списка изображений
+
+        Raises:
+            concurrent.futures.TimeoutError: Пул не ответил за timeout (задачи сняты с пула)
+        """
+        with self._stats_lock:
+            self.in_flight += len(images)
+        start_time = time.perf_counter()
+        try:
+            if self.pool:
+                futures = [self.pool.submit(image, confidence_threshold) for image in images]
+                deadline = time.monotonic() + self.pool.timeout
+                try:
+                    return [future.result(timeout=max(deadline - time.monotonic(), 0)) for future in futures]
+                except FutureTimeoutError:
+                    # Зависший воркер не должен держать поток обработчика и сегменты shared memory
+                    for future in futures:
+                        self.pool.abandon(future)
+                    raise
+
+            with self._detector_lock:
+                if len(images) == 1:
+                    return [self.detector.detect(images[0], confidence_threshold)]
+                return self.detector.detect_batch(images, confidence_threshold)
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.in_flight -= len(images)
+                self.processed += len(images)
+                self.busy_time += time.perf_counter() - start_time
+
+    def get_health(self) -> Dict[str, Any]:
+        """Состояние модели и нагрузка для балансировщика"""
+        if self.pool:
+            workers = self.pool.get_stats()
+            model_loaded = any(worker['model_loaded'] for worker in workers)
+            ready = all(worker['ready'] for worker in workers)
+        else:
+            workers = None
+            model_loaded = self.detector.model is not None
+            ready = True
+
+        with self._stats_lock:
+            return {
+                'status': 'ok' if ready else 'starting',
+                'model_loaded': model_loaded,
+                'capacity': self.capacity,
+                'in_flight': self.in_flight,
+                'load': round(self.in_flight / self.capacity, 3),
+                'processed': self.processed,
+                'errors': self.errors,
+                'avg_inference_time': (
+                    round(self.busy_time / self.processed, 4) if self.processed else None
+                ),
+                'uptime': round(time.time() - self.started_at, 1),
+                'workers': workers,
+            }
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP-запросов сервера инференса"""
+
+    server_version = 'CarInference/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/health':
+            self._send_json(self.server.backend.get_health())
+        else:
+            self._send_json({'error': 'Not found'}, status=404)
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        if parsed.path not in ('/detect', '/detect-batch'):
+            self._send_json({'error': 'Not found'}, status=404)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError('negative Content-Length')
+        except ValueError as e:
+            self.close_connection = True
+            self._send_json({'error': f'Bad request: {str(e)}'}, status=400)
+            return
+        if length > self.server.max_body:
+            # Тело не читается, поэтому соединение нельзя использовать для следующего запроса
+            self.close_connection = True
+            self._send_json({'error': f'Request body exceeds {self.server.max_body} bytes'}, status=413)
+            return
+
+        try:
+            params = parse_qs(parsed.query)
+            confidence_threshold = float(params.get('conf', ['0.3'])[0])
+            body = self.rfile.read(length)
+
+            if parsed.path == '/detect':
+                payloads = [body]
+            else:
+                payloads = unpack_frames(body)
+
+            images = [np.asarray(Image.open(io.BytesIO(payload))) for payload in payloads]
+        except Exception as e:
+            self._send_json({'error': f'Bad request: {str(e)}'}, status=400)
+            return
+
+        start_time = time.perf_counter()
+        try:
+            results = self.server.backend.detect_many(images, confidence_threshold)
+        except FutureTimeoutError:
+            self._send_json({'error': 'Inference timed out'}, status=503)
+            return
+        except Exception as e:
+            self._send_json({'error': f'Inference failed: {str(e)}'}, status=500)
+            return
+        inference_time = round(time.perf_counter() - start_time, 4)
+
+        if parsed.path == '/detect':
+            self._send_json({'detections': results[0], 'inference_time': inference_time})
+        else:
+            self._send_json({'results': results, 'inference_time': inference_time})
+
+    def _send_json(self, data: Dict[str, Any], status: int = 200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class InferenceHTTPServer(ThreadingHTTPServer):
+    """Многопоточный HTTP-сервер с общей моделью"""
+
+    daemon_threads = True
+
+    def __init__(self, address, backend: InferenceBackend, max_body: int = 64 * 1024 * 1024):
+        super().__init__(address, InferenceRequestHandler)
+        self.backend = backend
+        self.max_body = max_body
+
+
+def serve(host: str, port: int, weights_path: str, workers: int = 0, torch_threads: int = 1,
+          timeout: float = 60.0, max_body: int = 64 * 1024 * 1024):
+    """Запускает сервер инференса и блокируется до остановки"""
+    backend = InferenceBackend(weights_path, workers=workers, torch_threads=torch_threads, timeout=timeout)
+    server = InferenceHTTPServer((host, port), backend, max_body=max_body)
+    print(f"Inference server listening on http://{host}:{port} (workers: {workers or 'in-process'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if backend.pool:
+            backend.pool.shutdown()
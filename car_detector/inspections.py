@@ -0,0 +1,199 @@
+# car_detector/inspections.py
+"""
+Осмотр автомобиля по нескольким фотографиям
+
+Сессия (InspectionSession) объединяет снимки одного автомобиля с разных
+ракурсов; каждый снимок - обычная запись CarAnalysis, снимки анализируются
+параллельно. Повреждения сводятся по элементам кузова:
+    - Gemini: по паре (part, type), одна вмятина на двери, видимая на трех
+      фото, - одно повреждение с тремя ракурсами;
+    - YOLO: класс приводится к группе элемента и типу Gemini
+      (damage_taxonomy.YOLO_CLASS_MAP) и подтверждает найденное Gemini
+      повреждение той же группы (сначала на том же снимке); если Gemini его
+      не нашел - отдельное повреждение группы, тоже объединенное по ракурсам.
+Сводка сохраняется в сессии, поэтому ее чтение - один запрос.
+"""
+
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.utils import timezone
+
+from .damage_taxonomy import CLEANLINESS_ORDER, groups_match, part_group, yolo_part_type
+from .logging_utils import log_event
+from .models import CarAnalysis, InspectionSession
+
+logger = logging.getLogger(__name__)
+
+# Поля снимка, нужные для сводки (остальное при пересчете не загружается)
+SUMMARY_FIELDS = (
+    'id', 'status', 'gemini_integrity_label', 'gemini_integrity_confidence',
+    'gemini_cleanliness_label', 'gemini_cleanliness_confidence',
+    'gemini_damage_details', 'yolo_detections',
+)
+
+
+def _add_view(item: Dict[str, Any], photo_id: int, confidence: float, bbox=None):
+    """Добавляет ракурс к повреждению; лучший ракурс - с наибольшей уверенностью"""
+    if photo_id not in item['photos']:
+        item['photos'].append(photo_id)
+    if confidence > item['confidence']:
+        item['confidence'] = confidence
+        item['best_photo'] = photo_id
+        item['bbox'] = bbox
+
+
+def merge_damages(photos: Iterable[CarAnalysis]) -> List[Dict[str, Any]]:
+    """
+    Повреждения нескольких снимков одного автомобиля, объединенные по элементам кузова
+
+    Args:
+        photos: Снимки сессии (нужны поля SUMMARY_FIELDS)
+
+    Returns:
+        Список повреждений по убыванию числа ракурсов и уверенности: part, part_group, type,
+        confidence, sources, photos, best_photo, bbox, yolo_classes
+    """
+    photos = list(photos)
+    items: Dict[tuple, Dict[str, Any]] = {}
+
+    for photo in photos:
+        if photo.status == 'failed':
+            continue
+        for part in (photo.gemini_damage_details or {}).get('parts') or []:
+            key = ('gemini', part.get('part'), part.get('type'))
+            item = items.get(key)
+            if item is None:
+                item = items[key] = {
+                    'part': part.get('part'),
+                    'part_group': part_group(part.get('part')),
+                    'type': part.get('type'),
+                    'confidence': -1.0,
+                    'sources': ['gemini'],
+                    'photos': [],
+                    'best_photo': None,
+                    'bbox': None,
+                    'yolo_classes': [],
+                }
+            _add_view(item, photo.id, part.get('confidence') or 0.0, part.get('bbox'))
+    gemini_items = list(items.values())
+
+    for photo in photos:
+        for detection in photo.yolo_detections or []:
+            class_name = detection.get('class')
+            group, damage_type = yolo_part_type(class_name)
+            confidence = detection.get('confidence') or 0.0
+            # Классы "*-Damage" не различают тип повреждения, вмятина должна совпасть по типу
+            candidates = [
+                item for item in gemini_items
+                if groups_match(item['part_group'], group)
+                and (damage_type != 'dent' or item['type'] == 'dent')
+            ]
+            if candidates:
+                same_view = [item for item in candidates if photo.id in item['photos']]
+                target = max(same_view or candidates, key=lambda item: item['confidence'])
+                if 'yolo' not in target['sources']:
+                    target['sources'].append('yolo')
+                if photo.id not in target['photos']:
+                    target['photos'].append(photo.id)
+            else:
+                key = ('yolo', group, damage_type)
+                target = items.get(key)
+                if target is None:
+                    target = items[key] = {
+                        'part': group,
+                        'part_group': group,
+                        'type': damage_type,
+                        'confidence': -1.0,
+                        'sources': ['yolo'],
+                        'photos': [],
+                        'best_photo': None,
+                        'bbox': None,
+                        'yolo_classes': [],
+                    }
+                _add_view(target, photo.id, confidence, detection.get('bbox'))
+            if class_name not in target['yolo_classes']:
+                target['yolo_classes'].append(class_name)
+
+    for item in items.values():
+        item['confidence'] = round(max(item['confidence'], 0.0), 3)
+        item['views'] = len(item['photos'])
+    return sorted(items.values(), key=lambda item: (item['views'], item['confidence']), reverse=True)
+
+
+def summarize_photos(photos: Iterable[CarAnalysis]) -> Dict[str, Any]:
+    """
+    Сводка сессии по ее снимкам: поля InspectionSession
+
+    Поврежден, если Gemini нашел повреждение хотя бы на одном снимке (без ответов
+    Gemini - если YOLO что-то нашел); чистота - самая частая оценка среди
+    снимков (при равенстве - более грязная).
+    """
+    photos = list(photos)
+    analyzed = [photo for photo in photos if photo.status != 'failed']
+    damages = merge_damages(photos)
+
+    damaged = [photo.gemini_integrity_confidence for photo in analyzed
+               if photo.gemini_integrity_label == 'damaged']
+    if damaged:
+        integrity_label, integrity_confidence = 'damaged', max(damaged)
+    elif analyzed:
+        integrity_label = 'undamaged'
+        integrity_confidence = min(photo.gemini_integrity_confidence for photo in analyzed)
+    elif damages:
+        integrity_label, integrity_confidence = 'damaged', max(item['confidence'] for item in damages)
+    else:
+        integrity_label, integrity_confidence = '', 0.0
+
+    cleanliness_label, cleanliness_confidence = '', 0.0
+    votes = Counter(photo.gemini_cleanliness_label for photo in analyzed if photo.gemini_cleanliness_label)
+    if votes:
+        cleanliness_label = max(votes, key=lambda name: (
+            votes[name], CLEANLINESS_ORDER.index(name) if name in CLEANLINESS_ORDER else -1
+        ))
+        scores = [photo.gemini_cleanliness_confidence for photo in analyzed
+                  if photo.gemini_cleanliness_label == cleanliness_label]
+        cleanliness_confidence = sum(scores) / len(scores)
+
+    return {
+        'status': 'complete' if analyzed else 'failed',
+        'photo_count': len(photos),
+        'failed_photos': len(photos) - len(analyzed),
+        'integrity_label': integrity_label,
+        'integrity_confidence': round(integrity_confidence, 3),
+        'cleanliness_label': cleanliness_label,
+        'cleanliness_confidence': round(cleanliness_confidence, 3),
+        'damage_count': len(damages),
+        'damages': damages,
+    }
+
+
+async def acomplete_session(session: InspectionSession, photos: List[CarAnalysis],
+                            processing_time: Optional[float] = None) -> InspectionSession:
+    """Сохраняет сводку по снимкам в сессию и завершает ее"""
+    for field, value in summarize_photos(photos).items():
+        setattr(session, field, value)
+    session.completed_at = timezone.now()
+    if processing_time is not None:
+        session.processing_time = round(processing_time, 3)
+    await session.asave()
+    log_event(logger, 'inspection.completed', session_id=session.id,
+              photos=session.photo_count, failed_photos=session.failed_photos,
+              damages=session.damage_count, processing_time=session.processing_time)
+    return session
+
+
+async def arefresh_sessions(session_ids: Iterable[int]):
+    """Пересчитывает сводку сессий после изменения их снимков (например, повторного анализа)"""
+    session_ids = {session_id for session_id in session_ids if session_id}
+    if not session_ids:
+        return
+    photos_by_session: Dict[int, List[CarAnalysis]] = {}
+    async for photo in CarAnalysis.objects.filter(session_id__in=session_ids).only(
+        'session_id', *SUMMARY_FIELDS
+    ).order_by('id'):
+        photos_by_session.setdefault(photo.session_id, []).append(photo)
+    for session_id in session_ids:
+        summary = summarize_photos(photos_by_session.get(session_id, []))
+        await InspectionSession.objects.filter(id=session_id).aupdate(**summary)
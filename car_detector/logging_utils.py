@@ -0,0 +1,144 @@
+# car_detector/logging_utils.py
+"""
+Структурированное неблокирующее логирование
+
+- QueueingHandler: запись лога только кладется в ограниченную очередь,
+  вывод в stdout выполняет фоновый поток (QueueListener); при переполнении
+  очереди записи отбрасываются, запрос никогда не ждет вывода.
+- JsonFormatter: одна JSON-строка на событие с полями event, analysis_id,
+  stage, duration_ms, trace_id и любыми другими полями из extra.
+- EventSampler: доля сохраняемых записей по имени события
+  (LOG_SAMPLE_RATES), например, для событий на каждую детекцию.
+
+Уровни по модулям и частоты выборки задаются в settings.LOGGING.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Dict, Optional
+
+
+# Стандартные атрибуты LogRecord; остальные пришли из extra и попадают в событие
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def log_event(logger: logging.Logger, event: str, message: str = '', level: int = logging.INFO, **fields):
+    """
+    Записывает структурированное событие
+
+    Args:
+        logger: Логгер модуля
+        event: Имя события (например, 'overlay.box'), по нему работает выборка
+        message: Текст для человека (по умолчанию - имя события)
+        level: Уровень записи
+        **fields: Поля события (analysis_id, stage, duration_ms, ...)
+    """
+    # Проверяем уровень до сборки записи: отключенные события почти ничего не стоят
+    if logger.isEnabledFor(level):
+        logger.log(level, message or event, extra={'event': event, **fields})
+
+
+def _event_fields(record: logging.LogRecord) -> Dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update(_event_fields(record))
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Текст для разработки: сообщение и поля события в виде key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = _event_fields(record)
+        if fields:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return text
+
+
+class EventSampler(logging.Filter):
+    """
+    Пропускает долю записей события
+
+    Args:
+        rates: Доля сохраняемых записей по имени события (0..1);
+            записи без события и с уровнем WARNING и выше проходят всегда
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.rates = rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, 'event', None))
+        return rate is None or random.random() < rate
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """
+    Неблокирующий обработчик: очередь и поток вывода в stdout
+
+    Args:
+        output_format: 'json' или 'console'
+        maxsize: Размер очереди; записи сверх него отбрасываются
+    """
+
+    def __init__(self, output_format: str = 'json', maxsize: int = 10000):
+        super().__init__(queue.Queue(maxsize))
+        self._target = logging.StreamHandler(sys.stdout)
+        self._target.setFormatter(JsonFormatter() if output_format == 'json' else ConsoleFormatter())
+        self._listener = None
+        self._owner_pid = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+        atexit.register(self.stop)
+
+    def _ensure_listener(self):
+        # Поток вывода не переживает fork (gunicorn preload_app): в новом процессе запускаем свой
+        if self._owner_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._owner_pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, self._target)
+            self._listener.start()
+            self._owner_pid = os.getpid()
+
+    def enqueue(self, record: logging.LogRecord):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """Выводит оставшиеся записи и останавливает поток (при завершении процесса)"""
+        if self._listener is not None and self._owner_pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._owner_pid = None
@@ -0,0 +1,325 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from car_detector.admission import LANE_BATCH
+from car_detector.async_utils import run_blocking
+from car_detector.damage_items import asave_damage_items
+from car_detector.inference_pool import InferencePool
+from car_detector.models import CarAnalysis
+from car_detector.services import car_analysis_service
+from car_detector.tracing import Trace, use_trace
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Строка контрольной точки для пачки, которая записывается в базу:
+# pending<TAB>путь<TAB>trace_id записи<TAB>имя файла в хранилище
+PENDING_PREFIX = 'pending\t'
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Command(BaseCommand):
+    help = (
+        'Массовый анализ фотографий из каталога или списка файлов: YOLO в пуле процессов, '
+        'Gemini с ограниченной параллельностью, запись CarAnalysis пачками и продолжение '
+        'после сбоя по файлу контрольной точки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', help='Каталог с фотографиями (обходится рекурсивно)')
+        parser.add_argument('--manifest', help='Файл со списком фотографий: путь на строку, # - комментарий')
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки (по умолчанию analyze_dir-<хеш источника>.checkpoint)'
+        )
+        parser.add_argument('--restart', action='store_true', help='Начать заново, игнорируя контрольную точку')
+        parser.add_argument('--jsonl', help='Дописывать результаты в JSONL-файл (строка на фотографию)')
+        parser.add_argument('--concurrency', type=int, default=16, help='Фотографий в обработке одновременно')
+        parser.add_argument('--gemini-concurrency', type=int, default=8, help='Одновременных вызовов Gemini')
+        parser.add_argument(
+            '--yolo-workers', type=int, default=max((os.cpu_count() or 2) // 2, 1),
+            help='Процессов пула YOLO, если пул не настроен (YOLO_INFERENCE_WORKERS/ENDPOINTS); 0 - в процессе'
+        )
+        parser.add_argument('--batch-size', type=int, default=50, help='Записей CarAnalysis в одном bulk_create')
+        parser.add_argument('--limit', type=int, default=0, help='Обработать не больше N фотографий')
+        parser.add_argument('--progress-interval', type=float, default=10.0, help='Период вывода прогресса, с')
+
+    def handle(self, *args, **options):
+        paths = self._collect(options)
+        checkpoint_path = options['checkpoint'] or self._default_checkpoint(options)
+        done = set()
+        if options['restart'] and os.path.exists(checkpoint_path):
+            os.unlink(checkpoint_path)
+        elif os.path.exists(checkpoint_path):
+            done, in_flight = self._read_checkpoint(checkpoint_path)
+            if in_flight:
+                done |= self._recover(in_flight, checkpoint_path)
+
+        pending = [path for path in paths if path not in done]
+        already_done = len(paths) - len(pending)
+        if options['limit']:
+            pending = pending[:options['limit']]
+        self.stdout.write(
+            f"{len(paths)} images, {already_done} already done (checkpoint {checkpoint_path}), "
+            f"{len(pending)} to analyze"
+        )
+        if not pending:
+            return
+
+        pool = self._start_yolo_pool(options['yolo_workers'])
+        try:
+            stats = asyncio.run(self._run(pending, checkpoint_path, options))
+        except KeyboardInterrupt:
+            raise CommandError(f"Interrupted; rerun the same command to resume from {checkpoint_path}")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+                car_analysis_service.inference_pool = None
+
+        elapsed = time.monotonic() - stats['started']
+        self.stdout.write(self.style.SUCCESS(
+            f"Analyzed {stats['done']} images in {_format_duration(elapsed)} "
+            f"({stats['done'] / max(elapsed, 1e-6):.2f} img/s), failed {stats['failed']}, "
+            f"skipped {stats['skipped']}, errors {stats['errors']} (retried on the next run)"
+        ))
+
+    def _collect(self, options):
+        """Абсолютные пути фотографий в детерминированном порядке"""
+        if bool(options['source']) == bool(options['manifest']):
+            raise CommandError('Specify either a source directory or --manifest')
+        if options['manifest']:
+            base = os.path.dirname(os.path.abspath(options['manifest']))
+            with open(options['manifest'], encoding='utf-8') as f:
+                lines = [line.strip() for line in f]
+            return [os.path.abspath(os.path.join(base, line)) for line in lines if line and not line.startswith('#')]
+
+        source = os.path.abspath(options['source'])
+        if not os.path.isdir(source):
+            raise CommandError(f"{source} is not a directory")
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            paths.extend(
+                os.path.join(root, name) for name in sorted(files)
+                if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        return paths
+
+    @staticmethod
+    def _read_checkpoint(checkpoint_path):
+        """Обработанные пути и {путь: (trace_id, имя файла)} пачек, прерванных во время записи"""
+        done, in_flight = set(), {}
+        with open(checkpoint_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith(PENDING_PREFIX):
+                    path, trace_id, image_name = line[len(PENDING_PREFIX):].split('\t', 2)
+                    in_flight[path] = (trace_id, image_name)
+                elif line.strip():
+                    done.add(line)
+        return done, {path: entry for path, entry in in_flight.items() if path not in done}
+
+    def _recover(self, in_flight, checkpoint_path):
+        """
+        Разбирает пачки, прерванные между записью в базу и контрольной точкой
+
+        Записи, которые успели сохраниться (находятся по trace_id), отмечаются
+        обработанными и повторно не вставляются; копии файлов несохраненных
+        записей удаляются, чтобы повторный анализ не оставил их в хранилище.
+        """
+        trace_ids = [trace_id for trace_id, _ in in_flight.values()]
+        saved = set(CarAnalysis.objects.filter(trace_id__in=trace_ids).values_list('trace_id', flat=True))
+        recovered = []
+        for path, (trace_id, image_name) in in_flight.items():
+            if trace_id in saved:
+                recovered.append(path)
+            elif not self._inside_media_root(path) and default_storage.exists(image_name):
+                default_storage.delete(image_name)
+        with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+            checkpoint.write(''.join(path + '\n' for path in recovered))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        self.stdout.write(
+            f"Recovered an interrupted batch: {len(recovered)} saved, {len(in_flight) - len(recovered)} to redo"
+        )
+        return set(recovered)
+
+    @staticmethod
+    def _default_checkpoint(options) -> str:
+        source = os.path.abspath(options['manifest'] or options['source'])
+        return f"analyze_dir-{hashlib.sha256(source.encode('utf-8')).hexdigest()[:10]}.checkpoint"
+
+    def _start_yolo_pool(self, workers: int):
+        """Пул процессов YOLO на время команды, если сервис не использует пул или серверы инференса"""
+        service = car_analysis_service
+        if workers <= 0 or service.inference_pool or service.remote_inference:
+            return None
+        if not (service.weights_path and os.path.exists(service.weights_path)):
+            return None
+        pool = InferencePool(
+            service.weights_path,
+            workers=workers,
+            torch_threads=settings.YOLO_INFERENCE_TORCH_THREADS,
+            timeout=settings.YOLO_INFERENCE_TIMEOUT,
+        )
+        pool.start()
+        service.inference_pool = pool
+        self.stdout.write(f"YOLO inference pool: {workers} workers")
+        return pool
+
+    async def _run(self, paths, checkpoint_path, options):
+        stats = {'total': len(paths), 'done': 0, 'failed': 0, 'skipped': 0, 'errors': 0,
+                 'started': time.monotonic()}
+        slots = asyncio.Semaphore(options['concurrency'])
+        gemini_slots = asyncio.Semaphore(options['gemini_concurrency'])
+        flush_lock = asyncio.Lock()
+        buffer = []
+
+        checkpoint = open(checkpoint_path, 'a', encoding='utf-8')
+        jsonl = open(options['jsonl'], 'a', encoding='utf-8') if options['jsonl'] else None
+
+        async def flush():
+            async with flush_lock:
+                if not buffer:
+                    return
+                batch = buffer[:]
+                del buffer[:]
+                rows = [item['row'] for item in batch if item['row'] is not None]
+                if rows:
+                    # Пачка отмечается до вставки: после сбоя между вставкой и контрольной точкой
+                    # повторный запуск найдет записи по trace_id и не вставит их второй раз
+                    await run_blocking(self._write_pending, batch, checkpoint)
+                    await CarAnalysis.objects.abulk_create(rows)
+                    await asave_damage_items(rows)
+                # Контрольная точка - только после записи в базу: при сбое пачка будет повторена
+                await run_blocking(self._write_batch, batch, checkpoint, jsonl)
+
+        async def process(path):
+            try:
+                try:
+                    item = await self._analyze(path, gemini_slots)
+                    if item['row'] is None:
+                        stats['skipped'] += 1
+                    elif item['row'].status == 'failed':
+                        stats['failed'] += 1
+                except Exception as e:
+                    # Фотография не попадает в контрольную точку и обрабатывается при следующем запуске
+                    item = {'path': path, 'row': None, 'retry': True, 'result': {'path': path, 'error': str(e)}}
+                    stats['errors'] += 1
+                buffer.append(item)
+                stats['done'] += 1
+                if len(buffer) >= options['batch_size']:
+                    await flush()
+            finally:
+                slots.release()
+
+        reporter = asyncio.create_task(self._report_progress(stats, options['progress_interval']))
+        tasks = set()
+        try:
+            for path in paths:
+                await slots.acquire()
+                task = asyncio.create_task(process(path))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+            await flush()
+        finally:
+            reporter.cancel()
+            checkpoint.close()
+            if jsonl:
+                jsonl.close()
+        return stats
+
+    async def _analyze(self, path, gemini_slots):
+        """Результат одной фотографии: несохраненная запись CarAnalysis и строка JSONL"""
+        trace = Trace()
+        start_time = time.time()
+        with use_trace(trace):
+            if not os.path.exists(path):
+                return {'path': path, 'row': None, 'result': {'path': path, 'error': 'File not found'}}
+
+            async def gemini():
+                async with gemini_slots:
+                    return await car_analysis_service.analyze_gemini_async(path, LANE_BATCH)
+
+            gemini_results, yolo_results = await asyncio.gather(
+                gemini(), car_analysis_service.analyze_yolo_async(path, LANE_BATCH), return_exceptions=True
+            )
+            results = {'gemini': None, 'yolo': None, 'errors': []}
+            if isinstance(gemini_results, Exception):
+                results['errors'].append(f"Gemini analysis failed: {gemini_results}")
+            else:
+                results['gemini'] = gemini_results
+            if isinstance(yolo_results, Exception):
+                results['errors'].append(f"YOLO analysis failed: {yolo_results}")
+            else:
+                results['yolo'] = yolo_results
+            results['processing_time'] = time.time() - start_time
+
+            row = CarAnalysis(
+                status=car_analysis_service.analysis_status(results['gemini']),
+                trace_id=trace.trace_id,
+                **car_analysis_service.format_results_for_django(results)
+            )
+            row.image.name = await run_blocking(self._store_image, path)
+            row.trace = trace.as_dict()
+        return {'path': path, 'row': row, 'result': {'path': path, 'status': row.status, **results}}
+
+    @staticmethod
+    def _inside_media_root(path: str) -> bool:
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        return os.path.commonpath([media_root, path]) == media_root
+
+    @classmethod
+    def _store_image(cls, path: str) -> str:
+        """Имя файла в хранилище: файлы внутри MEDIA_ROOT не копируются"""
+        if cls._inside_media_root(path):
+            return os.path.relpath(path, os.path.abspath(settings.MEDIA_ROOT))
+        with open(path, 'rb') as f:
+            return default_storage.save(f"car_images/{os.path.basename(path)}", File(f))
+
+    @staticmethod
+    def _write_pending(batch, checkpoint):
+        checkpoint.write(''.join(
+            f"{PENDING_PREFIX}{item['path']}\t{item['row'].trace_id}\t{item['row'].image.name}\n"
+            for item in batch if item['row'] is not None
+        ))
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+    @staticmethod
+    def _write_batch(batch, checkpoint, jsonl):
+        if jsonl:
+            for item in batch:
+                row = item['row']
+                line = {**item['result'], 'analysis_id': row.id if row is not None else None}
+                jsonl.write(json.dumps(line, ensure_ascii=False, default=str) + '\n')
+            jsonl.flush()
+        checkpoint.write(''.join(item['path'] + '\n' for item in batch if not item.get('retry')))
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+    async def _report_progress(self, stats, interval):
+        while True:
+            await asyncio.sleep(interval)
+            elapsed = time.monotonic() - stats['started']
+            rate = stats['done'] / elapsed if elapsed else 0.0
+            remaining = stats['total'] - stats['done']
+            eta = _format_duration(remaining / rate) if rate else '--:--:--'
+            self.stdout.write(
+                f"[{stats['done']}/{stats['total']}] {rate:.2f} img/s, ETA {eta}, "
+                f"failed {stats['failed']}, skipped {stats['skipped']}, errors {stats['errors']}"
+            )
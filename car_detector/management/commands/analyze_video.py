@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from car_detector.admission import LANE_BATCH
+from car_detector.video_inspection import VideoError, VideoInspector
+
+
+class Command(BaseCommand):
+    help = (
+        'Анализ видео-обхода автомобиля: ключевые кадры, YOLO с трекингом повреждений '
+        'и Gemini на нескольких кадрах; выводит сводку повреждений'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('video', help='Путь к видео')
+        parser.add_argument('--json', help='Сохранить полную сводку в JSON-файл')
+        parser.add_argument('--keyframes-dir', help='Сохранить ключевые кадры (JPEG) в каталог')
+        parser.add_argument('--no-gemini', action='store_true', help='Только YOLO, без Gemini')
+        parser.add_argument('--sample-fps', type=float, help='Кадров в секунду для оценки (VIDEO_SAMPLE_FPS)')
+        parser.add_argument('--keyframe-interval', type=float,
+                            help='Окно выбора ключевого кадра, с (VIDEO_KEYFRAME_INTERVAL)')
+        parser.add_argument('--min-sharpness', type=float, help='Минимальная резкость (VIDEO_MIN_SHARPNESS)')
+        parser.add_argument('--gemini-keyframes', type=int,
+                            help='Ключевых кадров для Gemini (VIDEO_GEMINI_KEYFRAMES)')
+        parser.add_argument('--min-hits', type=int, default=1,
+                            help='Повреждение учитывается, если найдено на N ключевых кадрах')
+
+    def handle(self, *args, **options):
+        inspector = VideoInspector(
+            sample_fps=options['sample_fps'],
+            keyframe_interval=options['keyframe_interval'],
+            min_sharpness=options['min_sharpness'],
+            gemini_keyframes=options['gemini_keyframes'],
+            min_hits=options['min_hits'],
+        )
+        try:
+            summary = asyncio.run(inspector.inspect(
+                options['video'], LANE_BATCH,
+                use_gemini=not options['no_gemini'],
+                keyframes_dir=options['keyframes_dir'],
+            ))
+        except VideoError as e:
+            raise CommandError(str(e))
+
+        video = summary['video']
+        self.stdout.write(
+            f"{video['duration_s']}s video {video['width']}x{video['height']} @ {video['fps']} fps: "
+            f"{video['frames']} frames, {video['sampled_frames']} scored, {len(summary['keyframes'])} keyframes"
+            + (' (truncated)' if video['truncated'] else '')
+        )
+        for damage in summary['damages']:
+            self.stdout.write(
+                f"  #{damage['track_id']} {damage['class']} {damage['confidence']:.2f}, "
+                f"{damage['first_seen_s']:.1f}-{damage['last_seen_s']:.1f}s, {damage['hits']} keyframes"
+            )
+        gemini = summary['gemini']
+        if gemini:
+            self.stdout.write(
+                f"Gemini: {gemini['integrity']['label']}, {gemini['cleanliness']['label']}, "
+                f"{len(gemini['damage_details']['parts'])} damaged parts"
+            )
+        for error in summary['errors']:
+            self.stdout.write(self.style.WARNING(error))
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{summary['car_status']}: {summary['damage_count']} damages, "
+            f"processed in {summary['processing_time']}s ({summary['realtime_factor']}x real time)"
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from car_detector.models import ApiKey
+
+
+class Command(BaseCommand):
+    help = 'Создает API-ключ клиента и выводит его и секрет подписи webhook (показываются один раз)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Название клиента (driver-app, back-office, partner-x)')
+        parser.add_argument(
+            '--lane', default='standard', choices=['interactive', 'standard', 'batch'],
+            help='Максимальный приоритет запросов'
+        )
+        parser.add_argument('--rate', type=int, default=60, help='Запросов в минуту (0 - без ограничения)')
+        parser.add_argument('--burst', type=int, default=20, help='Допустимый всплеск запросов')
+        parser.add_argument('--concurrency', type=int, default=4, help='Одновременных запросов')
+        parser.add_argument('--daily-quota', type=int, default=1000, help='Анализов в сутки (0 - без ограничения)')
+        parser.add_argument('--webhook-url', default='', help='Адрес webhook по умолчанию')
+
+    def handle(self, *args, **options):
+        api_key = ApiKey(
+            name=options['name'],
+            lane=options['lane'],
+            rate_per_minute=options['rate'],
+            burst=options['burst'],
+            max_concurrent=options['concurrency'],
+            daily_quota=options['daily_quota'],
+            webhook_url=options['webhook_url'],
+        )
+        raw_key = api_key.set_new_key()
+        secret = api_key.set_new_webhook_secret()
+        api_key.save()
+        self.stdout.write(self.style.SUCCESS(f"API key for {api_key.name}: {raw_key}"))
+        self.stdout.write(self.style.SUCCESS(f"Webhook signing secret: {secret}"))
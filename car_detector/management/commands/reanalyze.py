@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from car_detector.models import CarAnalysis
+from car_detector.reanalysis import STAGES, reanalyze, stale_queryset
+from car_detector.services import car_analysis_service
+
+
+class Command(BaseCommand):
+    help = (
+        'Повторный анализ сохраненных записей после обновления best.pt или промпта Gemini: '
+        'перезапускаются только стадии, посчитанные не текущей версией модели'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stages', default=','.join(STAGES),
+            help='Стадии через запятую: gemini, yolo (по умолчанию обе)'
+        )
+        parser.add_argument('--force', action='store_true', help='Перезапускать и записи с текущей версией')
+        parser.add_argument('--rate', type=float, default=2.0, help='Записей в секунду (0 - без ограничения)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Записей в обработке одновременно')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Записей в порции курсора и bulk_update')
+        parser.add_argument('--after-id', type=int, default=0, help='Начать с записей с id больше указанного')
+        parser.add_argument('--limit', type=int, default=0, help='Обработать не больше N записей')
+        parser.add_argument('--since', help='Только записи, созданные не раньше даты (YYYY-MM-DD)')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать устаревшие записи')
+
+    def handle(self, *args, **options):
+        stages = [stage.strip() for stage in options['stages'].split(',') if stage.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown or not stages:
+            raise CommandError(f"Unknown stages {', '.join(sorted(unknown))}; expected: {', '.join(STAGES)}")
+
+        queryset = CarAnalysis.objects.all()
+        if options['since']:
+            queryset = queryset.filter(created_at__date__gte=options['since'])
+        versions = car_analysis_service.get_model_versions()
+        self.stdout.write(f"Current model versions: gemini {versions['gemini']}, yolo {versions['yolo'] or '-'}")
+
+        if options['dry_run']:
+            for stage in stages:
+                count = stale_queryset(queryset.filter(id__gt=options['after_id']), [stage], versions).count()
+                self.stdout.write(f"{stage}: {count} stale records")
+            return
+
+        def progress(stats):
+            elapsed = time.monotonic() - stats['started']
+            self.stdout.write(
+                f"processed {stats['processed']}, updated {stats['updated']}, skipped {stats['skipped']}, "
+                f"{stats['processed'] / max(elapsed, 1e-6):.2f} rec/s, last id {stats['last_id']}"
+            )
+
+        try:
+            stats = asyncio.run(reanalyze(
+                queryset, stages,
+                force=options['force'],
+                rate=options['rate'],
+                concurrency=options['concurrency'],
+                chunk_size=options['chunk_size'],
+                after_id=options['after_id'],
+                limit=options['limit'],
+                progress=progress,
+            ))
+        except KeyboardInterrupt:
+            raise CommandError(
+                'Interrupted; rerun the command to continue (updated records are skipped, '
+                'with --force pass --after-id from the last progress line)'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: processed {stats['processed']}, updated {stats['updated']}, skipped {stats['skipped']}"
+        ))
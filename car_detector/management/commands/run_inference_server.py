@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from car_detector.inference_server import serve
+
+
+class Command(BaseCommand):
+    help = 'Запускает сетевой сервер инференса YOLO для нескольких веб-узлов'
+
+    def add_arguments(self, parser):
+        default_weights = os.path.join(settings.BASE_DIR, 'CarDentDetector', 'Weights', 'best.pt')
+        parser.add_argument('--host', default='0.0.0.0', help='Адрес для прослушивания')
+        parser.add_argument('--port', type=int, default=8100, help='Порт сервера')
+        parser.add_argument('--weights', default=default_weights, help='Путь к весам YOLO')
+        parser.add_argument(
+            '--workers', type=int, default=settings.YOLO_INFERENCE_WORKERS,
+            help='Процессов инференса (0 - одна модель в процессе сервера)'
+        )
+        parser.add_argument(
+            '--torch-threads', type=int, default=settings.YOLO_INFERENCE_TORCH_THREADS,
+            help='Потоков PyTorch на процесс'
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=settings.YOLO_INFERENCE_TIMEOUT,
+            help='Таймаут ответа пула, секунд (после него сервер отвечает 503)'
+        )
+        parser.add_argument(
+            '--max-body-mb', type=int, default=settings.YOLO_INFERENCE_MAX_BODY_MB,
+            help='Максимальный размер тела запроса, МБ (больше - 413)'
+        )
+
+    def handle(self, *args, **options):
+        serve(
+            options['host'],
+            options['port'],
+            options['weights'],
+            workers=options['workers'],
+            torch_threads=options['torch_threads'],
+            timeout=options['timeout'],
+            max_body=options['max_body_mb'] * 1024 * 1024,
+        )
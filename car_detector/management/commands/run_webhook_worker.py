@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from car_detector.webhooks import webhook_dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Запускает отдельный процесс доставки webhook-уведомлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Доставить готовые записи и завершиться'
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            webhook_dispatcher.process_due()
+            self.stdout.write(str(webhook_dispatcher.get_stats()))
+            return
+
+        self.stdout.write('Webhook worker started')
+        try:
+            webhook_dispatcher.run_forever()
+        except KeyboardInterrupt:
+            pass
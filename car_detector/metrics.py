@@ -0,0 +1,179 @@
+# car_detector/metrics.py
+"""
+Метрики Prometheus для анализа изображений
+
+- car_analysis_stage_seconds{stage}: гистограмма времени стадий
+  (upload_read, decode, gemini_call, gemini_parse, yolo_inference,
+  overlay_render, storage_write, db_save);
+- car_analysis_stage_errors_total{stage}: ошибки стадий;
+- car_analysis_requests_total{endpoint,status} и
+  car_analysis_request_seconds{endpoint}: запросы API;
+- car_analysis_cache_requests_total{cache,result}: попадания и промахи
+  (idempotency, single_flight);
+- car_analysis_gemini_parse_failures_total: нераспознанные ответы Gemini;
+- car_analysis_traffic_captured_total{result}: записи архива трафика
+  (queued, dropped);
+- car_analysis_in_flight{endpoint}, car_analysis_queue_depth{limiter},
+  car_analysis_limiter_in_use{limiter}: текущая нагрузка.
+
+Под gunicorn с несколькими воркерами задайте PROMETHEUS_MULTIPROC_DIR:
+значения всех воркеров сводятся в один ответ /metrics/.
+"""
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Tuple
+
+from .logging_utils import log_event
+from .tracing import record_span
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+        REGISTRY, multiprocess,
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    print("Warning: prometheus_client not available. Metrics will be disabled.")
+
+
+logger = logging.getLogger(__name__)
+
+STAGES = (
+    'upload_read', 'decode', 'gemini_call', 'gemini_parse',
+    'yolo_inference', 'overlay_render', 'storage_write', 'db_save',
+)
+
+# Границы корзин: от быстрых стадий (декодирование, запись в базу) до вызовов Gemini
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0,
+)
+
+
+class _NoopMetric:
+    """Заглушка метрики, когда prometheus_client не установлен"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+if PROMETHEUS_AVAILABLE:
+    stage_seconds = Histogram(
+        'car_analysis_stage_seconds', 'Duration of analysis stages',
+        ['stage'], buckets=LATENCY_BUCKETS,
+    )
+    stage_errors = Counter(
+        'car_analysis_stage_errors_total', 'Failed analysis stages', ['stage'],
+    )
+    requests_total = Counter(
+        'car_analysis_requests_total', 'API requests by response status', ['endpoint', 'status'],
+    )
+    request_seconds = Histogram(
+        'car_analysis_request_seconds', 'API request duration',
+        ['endpoint'], buckets=LATENCY_BUCKETS,
+    )
+    cache_requests = Counter(
+        'car_analysis_cache_requests_total', 'Cache lookups by result', ['cache', 'result'],
+    )
+    gemini_parse_failures = Counter(
+        'car_analysis_gemini_parse_failures_total', 'Gemini responses that could not be parsed',
+    )
+    traffic_captured = Counter(
+        'car_analysis_traffic_captured_total', 'Sampled API requests for the traffic archive', ['result'],
+    )
+    in_flight = Gauge(
+        'car_analysis_in_flight', 'Requests being processed',
+        ['endpoint'], multiprocess_mode='livesum',
+    )
+    queue_depth = Gauge(
+        'car_analysis_queue_depth', 'Requests waiting in admission queues',
+        ['limiter'], multiprocess_mode='livesum',
+    )
+    limiter_in_use = Gauge(
+        'car_analysis_limiter_in_use', 'Capacity held in admission limiters',
+        ['limiter'], multiprocess_mode='livesum',
+    )
+else:
+    stage_seconds = stage_errors = requests_total = request_seconds = _NoopMetric()
+    cache_requests = gemini_parse_failures = traffic_captured = _NoopMetric()
+    in_flight = queue_depth = limiter_in_use = _NoopMetric()
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Замеряет длительность стадии (метрика, участок трассы, событие лога); исключение учитывается как ошибка стадии"""
+    start_time = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        stage_errors.labels(stage).inc()
+        raise
+    finally:
+        duration = time.perf_counter() - start_time
+        stage_seconds.labels(stage).observe(duration)
+        record_span(stage, start_time)
+        log_event(logger, 'stage.finished', level=logging.DEBUG, stage=stage,
+                  duration_ms=round(duration * 1000, 2), failed=failed)
+
+
+def track_request(view):
+    """Декоратор async-представления API: число запросов, статусы, длительность, запросы в обработке"""
+    endpoint = view.__name__
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        in_flight.labels(endpoint).inc()
+        start_time = time.perf_counter()
+        status = '500'
+        try:
+            response = await view(request, *args, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            in_flight.labels(endpoint).dec()
+            requests_total.labels(endpoint, status).inc()
+            request_seconds.labels(endpoint).observe(time.perf_counter() - start_time)
+
+    return wrapper
+
+
+def record_cache(cache: str, hit: bool):
+    """Учитывает попадание или промах кеша"""
+    cache_requests.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Текст метрик в формате Prometheus и его Content-Type"""
+    if not PROMETHEUS_AVAILABLE:
+        return b'# prometheus_client is not installed\n', 'text/plain; charset=utf-8'
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Удаляет live-значения завершившегося воркера (хук gunicorn child_exit)"""
+    if PROMETHEUS_AVAILABLE and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
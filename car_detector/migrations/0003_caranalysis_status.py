@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0002_caranalysis_processed_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caranalysis',
+            name='status',
+            field=models.CharField(choices=[('complete', 'Complete'), ('partial', 'Partial'), ('failed', 'Failed')], default='complete', max_length=20),
+        ),
+    ]
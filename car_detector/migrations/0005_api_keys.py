@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0004_webhooks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApiKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('prefix', models.CharField(editable=False, max_length=12)),
+                ('key_hash', models.CharField(editable=False, max_length=64, unique=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('lane', models.CharField(choices=[('interactive', 'Interactive'), ('standard', 'Standard'), ('batch', 'Batch')], default='standard', max_length=20)),
+                ('rate_per_minute', models.PositiveIntegerField(default=60)),
+                ('burst', models.PositiveIntegerField(default=20)),
+                ('max_concurrent', models.PositiveIntegerField(default=4)),
+                ('daily_quota', models.PositiveIntegerField(default=1000)),
+                ('webhook_url', models.URLField(blank=True, max_length=500)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'API Key',
+                'verbose_name_plural': 'API Keys',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='caranalysis',
+            name='api_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='analyses', to='car_detector.apikey'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0005_api_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caranalysis',
+            name='trace',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='caranalysis',
+            name='trace_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0006_caranalysis_trace'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caranalysis',
+            name='gemini_model_version',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='caranalysis',
+            name='yolo_model_version',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
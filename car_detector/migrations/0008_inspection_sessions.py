@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0007_caranalysis_model_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InspectionSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vehicle_id', models.CharField(blank=True, db_index=True, max_length=100)),
+                ('status', models.CharField(choices=[('processing', 'Processing'), ('complete', 'Complete'), ('failed', 'Failed')], default='processing', max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('photo_count', models.PositiveIntegerField(default=0)),
+                ('failed_photos', models.PositiveIntegerField(default=0)),
+                ('integrity_label', models.CharField(blank=True, max_length=20)),
+                ('integrity_confidence', models.FloatField(default=0.0)),
+                ('cleanliness_label', models.CharField(blank=True, max_length=20)),
+                ('cleanliness_confidence', models.FloatField(default=0.0)),
+                ('damage_count', models.PositiveIntegerField(default=0)),
+                ('damages', models.JSONField(blank=True, default=list)),
+                ('processing_time', models.FloatField(blank=True, null=True)),
+                ('api_key', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='inspection_sessions', to='car_detector.apikey')),
+            ],
+            options={
+                'verbose_name': 'Inspection Session',
+                'verbose_name_plural': 'Inspection Sessions',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='caranalysis',
+            name='session',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='photos', to='car_detector.inspectionsession'),
+        ),
+    ]
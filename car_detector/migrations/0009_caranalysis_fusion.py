@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0008_inspection_sessions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caranalysis',
+            name='agreement_score',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='caranalysis',
+            name='fused_damages',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0009_caranalysis_fusion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DamageItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('source', models.CharField(choices=[('gemini', 'Gemini'), ('yolo', 'YOLO')], max_length=10)),
+                ('part', models.CharField(max_length=50)),
+                ('part_group', models.CharField(max_length=50)),
+                ('damage_type', models.CharField(max_length=30)),
+                ('label', models.CharField(blank=True, max_length=50)),
+                ('confidence', models.FloatField()),
+                ('x1', models.FloatField(blank=True, null=True)),
+                ('y1', models.FloatField(blank=True, null=True)),
+                ('x2', models.FloatField(blank=True, null=True)),
+                ('y2', models.FloatField(blank=True, null=True)),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='damage_items', to='car_detector.caranalysis')),
+            ],
+            options={
+                'ordering': ['-created_at', 'id'],
+                'indexes': [models.Index(fields=['part_group', 'damage_type', 'created_at'], name='car_detecto_part_gr_1b4674_idx'), models.Index(fields=['part', 'damage_type', 'created_at'], name='car_detecto_part_2ae257_idx'), models.Index(fields=['source', 'created_at'], name='car_detecto_source_37ca66_idx')],
+            },
+        ),
+    ]
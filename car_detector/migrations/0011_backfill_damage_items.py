@@ -0,0 +1,113 @@
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+# Копия таксономии и построения строк на момент миграции (damage_taxonomy.py, damage_items.py):
+# миграция не должна зависеть от кода приложения, который будет меняться
+
+YOLO_CLASS_MAP = {
+    'Bodypanel-Dent': ('body', 'dent'),
+    'Front-Windscreen-Damage': ('windshield', 'crack'),
+    'Headlight-Damage': ('headlight', 'broken_glass'),
+    'Rear-windscreen-Damage': ('rear_window', 'crack'),
+    'RunningBoard-Dent': ('sill', 'dent'),
+    'Sidemirror-Damage': ('mirror', 'other'),
+    'Signlight-Damage': ('signlight', 'broken_glass'),
+    'Taillight-Damage': ('taillight', 'broken_glass'),
+    'bonnet-dent': ('hood', 'dent'),
+    'boot-dent': ('trunk', 'dent'),
+    'doorouter-dent': ('door', 'dent'),
+    'fender-dent': ('fender', 'dent'),
+    'front-bumper-dent': ('bumper_front', 'dent'),
+    'pillar-dent': ('pillar', 'dent'),
+    'quaterpanel-dent': ('quarter_panel', 'dent'),
+    'rear-bumper-dent': ('bumper_rear', 'dent'),
+    'roof-dent': ('roof', 'dent'),
+}
+
+SIDED_PREFIXES = ('door', 'fender', 'headlight', 'taillight', 'mirror', 'side_window', 'wheel', 'sill')
+
+SOURCE_FIELDS = ('id', 'created_at', 'status', 'gemini_damage_details', 'yolo_detections')
+
+
+def part_group(part):
+    for prefix in SIDED_PREFIXES:
+        if part == prefix or part.startswith(prefix + '_'):
+            return prefix
+    return part
+
+
+def bbox_columns(bbox):
+    columns = dict.fromkeys(('x1', 'y1', 'x2', 'y2'))
+    if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+        try:
+            columns.update(zip(('x1', 'y1', 'x2', 'y2'), (float(value) for value in bbox)))
+        except (TypeError, ValueError):
+            pass
+    return columns
+
+
+def damage_item_rows(analysis):
+    rows = []
+    if analysis.status == 'complete':
+        for part in (analysis.gemini_damage_details or {}).get('parts') or []:
+            if not isinstance(part, dict) or not part.get('part'):
+                continue
+            rows.append({
+                'created_at': analysis.created_at,
+                'source': 'gemini',
+                'part': part['part'][:50],
+                'part_group': part_group(part['part'])[:50],
+                'damage_type': (part.get('type') or 'other')[:30],
+                'label': '',
+                'confidence': float(part.get('confidence') or 0.0),
+                **bbox_columns(part.get('bbox')),
+            })
+    for detection in analysis.yolo_detections or []:
+        if not isinstance(detection, dict):
+            continue
+        class_name = detection.get('class') or 'unknown'
+        group, damage_type = YOLO_CLASS_MAP.get(class_name, (class_name, 'other'))
+        rows.append({
+            'created_at': analysis.created_at,
+            'source': 'yolo',
+            'part': group[:50],
+            'part_group': group[:50],
+            'damage_type': damage_type,
+            'label': class_name[:50],
+            'confidence': float(detection.get('confidence') or 0.0),
+            **bbox_columns(detection.get('bbox')),
+        })
+    return rows
+
+
+def backfill_damage_items(apps, schema_editor):
+    """Строки DamageItem для анализов, сохраненных до появления таблицы"""
+    CarAnalysis = apps.get_model('car_detector', 'CarAnalysis')
+    DamageItem = apps.get_model('car_detector', 'DamageItem')
+    done = DamageItem.objects.values_list('analysis_id', flat=True)
+    analyses = CarAnalysis.objects.exclude(id__in=done).only(*SOURCE_FIELDS).order_by('id')
+
+    items = []
+    for analysis in analyses.iterator(chunk_size=BATCH_SIZE):
+        items.extend(DamageItem(analysis_id=analysis.id, **row) for row in damage_item_rows(analysis))
+        if len(items) >= BATCH_SIZE:
+            DamageItem.objects.bulk_create(items)
+            items = []
+    if items:
+        DamageItem.objects.bulk_create(items)
+
+
+def clear_damage_items(apps, schema_editor):
+    apps.get_model('car_detector', 'DamageItem').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0010_damage_items'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_damage_items, clear_damage_items),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0011_backfill_damage_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caranalysis',
+            name='gemini_damage_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='caranalysis',
+            name='yolo_detection_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddIndex(
+            model_name='caranalysis',
+            index=models.Index(fields=['created_at', 'id'], name='car_detecto_created_c67d9c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='caranalysis',
+            index=models.Index(fields=['gemini_integrity_label', 'created_at'], name='car_detecto_gemini__6fed98_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='caranalysis',
+            index=models.Index(fields=['gemini_cleanliness_label', 'created_at'], name='car_detecto_gemini__8f2bb3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='caranalysis',
+            index=models.Index(fields=['gemini_uncertain', 'created_at'], name='car_detecto_gemini__fc2f99_idx'),
+        ),
+    ]
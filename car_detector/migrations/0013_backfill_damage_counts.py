@@ -0,0 +1,40 @@
+from django.db import migrations
+
+BATCH_SIZE = 500
+
+
+def damage_counts(gemini_damage_details, yolo_detections):
+    """Копия CarAnalysis.damage_counts на момент миграции"""
+    gemini_count = 0
+    if isinstance(gemini_damage_details, dict):
+        gemini_count = len(gemini_damage_details.get('parts') or [])
+    return gemini_count, len(yolo_detections or [])
+
+
+def backfill_damage_counts(apps, schema_editor):
+    """Счетчики повреждений для анализов, сохраненных до появления колонок"""
+    CarAnalysis = apps.get_model('car_detector', 'CarAnalysis')
+    analyses = CarAnalysis.objects.only('id', 'gemini_damage_details', 'yolo_detections').order_by('id')
+
+    batch = []
+    for analysis in analyses.iterator(chunk_size=BATCH_SIZE):
+        analysis.gemini_damage_count, analysis.yolo_detection_count = damage_counts(
+            analysis.gemini_damage_details, analysis.yolo_detections
+        )
+        batch.append(analysis)
+        if len(batch) >= BATCH_SIZE:
+            CarAnalysis.objects.bulk_update(batch, ['gemini_damage_count', 'yolo_detection_count'])
+            batch = []
+    if batch:
+        CarAnalysis.objects.bulk_update(batch, ['gemini_damage_count', 'yolo_detection_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0012_caranalysis_counts_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_damage_counts, migrations.RunPython.noop),
+    ]
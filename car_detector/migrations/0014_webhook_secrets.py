@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:24
+
+import secrets
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def generate_webhook_secrets(apps, schema_editor):
+    """Секреты подписи для существующих ключей (клиентам выдаются действием «Новый секрет webhook»)"""
+    ApiKey = apps.get_model('car_detector', 'ApiKey')
+    for api_key in ApiKey.objects.filter(webhook_secret=''):
+        api_key.webhook_secret = f"whsec_{secrets.token_urlsafe(32)}"
+        api_key.save(update_fields=['webhook_secret'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('car_detector', '0013_backfill_damage_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='webhook_secret',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='webhookdeadletter',
+            name='api_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='webhook_dead_letters', to='car_detector.apikey'),
+        ),
+        migrations.AddField(
+            model_name='webhookdelivery',
+            name='api_key',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='webhook_deliveries', to='car_detector.apikey'),
+        ),
+        migrations.RunPython(generate_webhook_secrets, migrations.RunPython.noop),
+    ]
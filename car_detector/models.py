@@ -1,6 +1,134 @@
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
+import hashlib
 import json
+import secrets
+
+
+class ApiKey(models.Model):
+    """Ключ доступа клиента к /api/* с лимитами и квотой"""
+    
+    name = models.CharField(max_length=100)
+    prefix = models.CharField(max_length=12, editable=False)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    is_active = models.BooleanField(default=True)
+    
+    # Максимальный приоритет запросов клиента в планировщике Gemini/YOLO
+    lane = models.CharField(max_length=20, default='standard', choices=[
+        ('interactive', 'Interactive'),
+        ('standard', 'Standard'),
+        ('batch', 'Batch'),
+    ])
+    
+    # Token bucket: средняя скорость (0 - без ограничения) и допустимый всплеск запросов
+    rate_per_minute = models.PositiveIntegerField(default=60)
+    burst = models.PositiveIntegerField(default=20)
+    # Одновременных запросов
+    max_concurrent = models.PositiveIntegerField(default=4)
+    # Анализов в сутки (UTC), 0 - без ограничения
+    daily_quota = models.PositiveIntegerField(default=1000)
+    
+    # Адрес webhook по умолчанию для запросов с этим ключом
+    webhook_url = models.URLField(max_length=500, blank=True)
+    # Секрет подписи webhook этого клиента (HMAC нужен сам секрет, поэтому хранится открыто;
+    # показывается один раз при создании или смене)
+    webhook_secret = models.CharField(max_length=64, blank=True, editable=False)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['name']
+        verbose_name = 'API Key'
+        verbose_name_plural = 'API Keys'
+    
+    def __str__(self):
+        return f"{self.name} ({self.prefix}...)"
+    
+    @staticmethod
+    def hash_key(raw_key):
+        """SHA-256 ключа; сам ключ в базе не хранится"""
+        return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+    
+    def set_new_key(self):
+        """Генерирует новый ключ и возвращает его (показывается один раз)"""
+        raw_key = f"cak_{secrets.token_urlsafe(32)}"
+        self.prefix = raw_key[:12]
+        self.key_hash = self.hash_key(raw_key)
+        return raw_key
+    
+    def set_new_webhook_secret(self):
+        """Генерирует новый секрет подписи webhook и возвращает его (показывается один раз)"""
+        self.webhook_secret = f"whsec_{secrets.token_urlsafe(32)}"
+        return self.webhook_secret
+
+
+class InspectionSession(models.Model):
+    """
+    Осмотр одного автомобиля по нескольким фотографиям (снимки - CarAnalysis.photos)
+    
+    Сводка по всем ракурсам (см. inspections.py) вычисляется при завершении
+    анализа и хранится в записи: чтение сессии не разбирает JSON снимков.
+    """
+    
+    # Идентификатор автомобиля у клиента (госномер, VIN, номер в автопарке)
+    vehicle_id = models.CharField(max_length=100, blank=True, db_index=True)
+    status = models.CharField(max_length=20, default='processing', choices=[
+        ('processing', 'Processing'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    ])
+    created_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    # Сводка по ракурсам
+    photo_count = models.PositiveIntegerField(default=0)
+    failed_photos = models.PositiveIntegerField(default=0)
+    integrity_label = models.CharField(max_length=20, blank=True)
+    integrity_confidence = models.FloatField(default=0.0)
+    cleanliness_label = models.CharField(max_length=20, blank=True)
+    cleanliness_confidence = models.FloatField(default=0.0)
+    damage_count = models.PositiveIntegerField(default=0)
+    # Повреждения, объединенные по элементам кузова: ракурсы, источники (gemini/yolo), уверенность
+    damages = models.JSONField(default=list, blank=True)
+    processing_time = models.FloatField(null=True, blank=True)
+    
+    api_key = models.ForeignKey(ApiKey, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='inspection_sessions')
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Inspection Session'
+        verbose_name_plural = 'Inspection Sessions'
+    
+    def __str__(self):
+        vehicle = self.vehicle_id or 'vehicle'
+        return f"Inspection {self.id} - {vehicle} ({self.photo_count} photos, {self.status})"
+    
+    def as_api_result(self, photo_ids=None):
+        """Сводка сессии в формате API (для /api/inspections/<id>/)"""
+        result = {
+            'session_id': self.id,
+            'vehicle_id': self.vehicle_id,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(),
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'processing_time': self.processing_time,
+            'photo_count': self.photo_count,
+            'failed_photos': self.failed_photos,
+            'integrity': {
+                'label': self.integrity_label or None,
+                'confidence': self.integrity_confidence,
+            },
+            'cleanliness': {
+                'label': self.cleanliness_label or None,
+                'confidence': self.cleanliness_confidence,
+            },
+            'damage_count': self.damage_count,
+            'damages': self.damages,
+        }
+        if photo_ids is not None:
+            result['photo_ids'] = list(photo_ids)
+        return result
 
 
 class CarAnalysis(models.Model):
@@ -38,25 +166,218 @@ class CarAnalysis(models.Model):
     yolo_detections = models.JSONField(default=list)  # Список обнаруженных объектов
     yolo_confidence = models.FloatField(null=True, blank=True)
     
+    # Число повреждений Gemini и детекций YOLO: копии длины JSON-полей для списка
+    # в админке и шаблонов, пересчитываются при save (см. damage_counts)
+    gemini_damage_count = models.PositiveIntegerField(default=0, db_index=True)
+    yolo_detection_count = models.PositiveIntegerField(default=0, db_index=True)
+    
+    # Сопоставление Gemini и YOLO (см. fusion.py): объединенные повреждения и согласие моделей
+    # от 0 до 1; None - одна из моделей не дала результата
+    fused_damages = models.JSONField(default=list, blank=True)
+    agreement_score = models.FloatField(null=True, blank=True, db_index=True)
+    
     # Общие поля
     processing_time = models.FloatField(null=True, blank=True)  # Время обработки в секундах
     
+    # Статус: partial - ответ отдан по дедлайну без Gemini, результат допишется в фоне
+    status = models.CharField(max_length=20, default='complete', choices=[
+        ('complete', 'Complete'),
+        ('partial', 'Partial'),
+        ('failed', 'Failed'),
+    ])
+    
+    # Адрес для webhook-уведомления о завершении анализа
+    callback_url = models.URLField(max_length=500, blank=True)
+    
+    # Версии моделей, давших результат (см. CarAnalysisService.get_model_versions);
+    # по ним команда reanalyze находит записи, устаревшие после обновления модели
+    gemini_model_version = models.CharField(max_length=64, blank=True, db_index=True)
+    yolo_model_version = models.CharField(max_length=64, blank=True, db_index=True)
+    
+    # Трасса запроса: участки и их длительность (см. tracing.py)
+    trace_id = models.CharField(max_length=64, blank=True, db_index=True)
+    trace = models.JSONField(default=dict, blank=True)
+    
+    # Клиент, отправивший запрос через API
+    api_key = models.ForeignKey(ApiKey, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='analyses')
+    
+    # Сессия осмотра, если снимок - один из ракурсов автомобиля
+    session = models.ForeignKey(InspectionSession, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='photos')
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Car Analysis'
         verbose_name_plural = 'Car Analyses'
+        # Под сортировку и date_hierarchy списка в админке и фильтры list_filter
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['gemini_integrity_label', 'created_at']),
+            models.Index(fields=['gemini_cleanliness_label', 'created_at']),
+            models.Index(fields=['gemini_uncertain', 'created_at']),
+        ]
     
     def __str__(self):
         return f"Analysis {self.id} - {self.gemini_integrity_label} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
     
-    @property
-    def gemini_damage_count(self):
-        """Количество обнаруженных повреждений"""
-        if self.gemini_damage_details and 'parts' in self.gemini_damage_details:
-            return len(self.gemini_damage_details['parts'])
-        return 0
-    
-    @property
-    def yolo_detection_count(self):
-        """Количество обнаруженных объектов YOLO"""
-        return len(self.yolo_detections) if self.yolo_detections else 0
+    @staticmethod
+    def damage_counts(gemini_damage_details, yolo_detections):
+        """Число повреждений Gemini и детекций YOLO по JSON-полям анализа"""
+        gemini_count = 0
+        if isinstance(gemini_damage_details, dict):
+            gemini_count = len(gemini_damage_details.get('parts') or [])
+        return gemini_count, len(yolo_detections or [])
+    
+    def save(self, *args, **kwargs):
+        self.gemini_damage_count, self.yolo_detection_count = self.damage_counts(
+            self.gemini_damage_details, self.yolo_detections
+        )
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields)
+            if 'gemini_damage_details' in update_fields:
+                update_fields.add('gemini_damage_count')
+            if 'yolo_detections' in update_fields:
+                update_fields.add('yolo_detection_count')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+    
+    def as_api_result(self):
+        """Результат анализа в формате API (для /api/analysis/<id>/ и webhook)"""
+        partial = self.status == 'partial'
+        gemini = None
+        if not partial:
+            gemini = {
+                'integrity': {
+                    'label': self.gemini_integrity_label,
+                    'confidence': self.gemini_integrity_confidence,
+                },
+                'cleanliness': {
+                    'label': self.gemini_cleanliness_label,
+                    'confidence': self.gemini_cleanliness_confidence,
+                },
+                'damage_details': self.gemini_damage_details,
+                'environment': self.gemini_environment,
+                'uncertain': self.gemini_uncertain,
+                'notes': self.gemini_notes,
+            }
+        
+        return {
+            'analysis_id': self.id,
+            'status': self.status,
+            'partial': partial,
+            'created_at': self.created_at.isoformat(),
+            'processing_time': self.processing_time,
+            'trace_id': self.trace_id,
+            'model_versions': {
+                'gemini': self.gemini_model_version,
+                'yolo': self.yolo_model_version,
+            },
+            'results': {
+                'gemini': gemini,
+                'yolo': {
+                    'detections': self.yolo_detections,
+                    'average_confidence': self.yolo_confidence,
+                },
+                'fusion': None if self.agreement_score is None else {
+                    'agreement': self.agreement_score,
+                    'trusted': self.agreement_score >= settings.FUSION_TRUST_AGREEMENT,
+                    'damages': self.fused_damages,
+                },
+            },
+        }
+
+
+class DamageItem(models.Model):
+    """
+    Повреждение, найденное Gemini или YOLO на снимке (строка на каждое повреждение)
+
+    Копия gemini_damage_details.parts и yolo_detections анализа в виде
+    индексированных колонок: выборки вида «вмятины переднего бампера с
+    уверенностью выше 0.8 за неделю» идут по индексу, без разбора JSON.
+    Записывается при сохранении анализа (см. damage_items.py).
+    """
+
+    analysis = models.ForeignKey(CarAnalysis, on_delete=models.CASCADE, related_name='damage_items')
+    # Дата анализа (копия CarAnalysis.created_at, чтобы фильтр по дате не требовал JOIN)
+    created_at = models.DateTimeField()
+    source = models.CharField(max_length=10, choices=[
+        ('gemini', 'Gemini'),
+        ('yolo', 'YOLO'),
+    ])
+    # Элемент кузова: у Gemini со стороной (door_left_front), у YOLO - группа (door)
+    part = models.CharField(max_length=50)
+    # Группа элемента без стороны (damage_taxonomy.part_group) - общая для обеих моделей
+    part_group = models.CharField(max_length=50)
+    damage_type = models.CharField(max_length=30)
+    # Класс YOLO (doorouter-dent); у Gemini пусто
+    label = models.CharField(max_length=50, blank=True)
+    confidence = models.FloatField()
+    # Рамка в нормализованных координатах 0-1 (null, если модель ее не дала)
+    x1 = models.FloatField(null=True, blank=True)
+    y1 = models.FloatField(null=True, blank=True)
+    x2 = models.FloatField(null=True, blank=True)
+    y2 = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at', 'id']
+        indexes = [
+            models.Index(fields=['part_group', 'damage_type', 'created_at']),
+            models.Index(fields=['part', 'damage_type', 'created_at']),
+            models.Index(fields=['source', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.source}: {self.part} {self.damage_type} ({self.confidence:.2f})"
+
+
+class WebhookDelivery(models.Model):
+    """Исходящее webhook-уведомление (outbox), доставляется фоновым воркером"""
+    
+    analysis = models.ForeignKey(CarAnalysis, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='webhook_deliveries')
+    # Клиент, чьим секретом подписывается запрос (None - общий WEBHOOK_SECRET)
+    api_key = models.ForeignKey(ApiKey, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='webhook_deliveries')
+    url = models.URLField(max_length=500)
+    event = models.CharField(max_length=50, default='analysis.completed')
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, default='pending', choices=[
+        ('pending', 'Pending'),
+        ('delivered', 'Delivered'),
+    ])
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+    
+    def __str__(self):
+        return f"Webhook {self.id} {self.event} -> {self.url} ({self.status})"
+
+
+class WebhookDeadLetter(models.Model):
+    """Webhook, не доставленный после всех попыток"""
+    
+    analysis = models.ForeignKey(CarAnalysis, on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='webhook_dead_letters')
+    api_key = models.ForeignKey(ApiKey, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='webhook_dead_letters')
+    url = models.URLField(max_length=500)
+    event = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    failed_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-failed_at']
+    
+    def __str__(self):
+        return f"Dead webhook {self.id} {self.event} -> {self.url}"
@@ -1,10 +1,14 @@
 # car_detector/models_ai/yolo_detector.py
+import logging
 import os
 import math
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Union
 from PIL import Image
 import numpy as np
 
+from ..tracing import span
+
 try:
     from ultralytics import YOLO
     YOLO_AVAILABLE = True
@@ -12,12 +16,18 @@ except ImportError:
     YOLO_AVAILABLE = False
     print("Warning: ultralytics not available. YOLO detection will be disabled.")
 
+logger = logging.getLogger(__name__)
+
 
 class YOLODetector:
     """YOLO детектор для обнаружения повреждений автомобилей"""
     
     def __init__(self, weights_path: str = None):
         self.model = None
+        self.weights_path = weights_path
+        self.load_time = None
+        self.warmup_time = None
+        self.warmed_up = False
         self.class_labels = [
             'Bodypanel-Dent', 'Front-Windscreen-Damage', 'Headlight-Damage', 
             'Rear-windscreen-Damage', 'RunningBoard-Dent', 'Sidemirror-Damage', 
@@ -28,20 +38,22 @@ class YOLODetector:
         
         if YOLO_AVAILABLE and weights_path and os.path.exists(weights_path):
             try:
+                start_time = time.time()
                 self.model = YOLO(weights_path)
-                print(f"YOLO model loaded from {weights_path}")
+                self.load_time = time.time() - start_time
+                logger.info("YOLO model loaded from %s", weights_path)
             except Exception as e:
-                print(f"Error loading YOLO model: {e}")
+                logger.exception("Error loading YOLO model: %s", e)
                 self.model = None
         else:
-            print("YOLO model not available")
+            logger.warning("YOLO model not available")
     
-    def detect(self, image: Image.Image, confidence_threshold: float = 0.3) -> List[Dict[str, Any]]:
+    def detect(self, image: Union[Image.Image, np.ndarray], confidence_threshold: float = 0.3) -> List[Dict[str, Any]]:
         """
         Обнаруживает повреждения на изображении
         
         Args:
-            image: PIL Image объект
+            image: PIL Image объект или numpy массив (H, W, C)
             confidence_threshold: Минимальный порог уверенности
             
         Returns:
@@ -52,56 +64,121 @@ class YOLODetector:
         
         try:
             # Конвертируем PIL в numpy array для YOLO
-            img_array = np.array(image)
+            img_array = np.asarray(image)
             
             # Выполняем детекцию
-            results = self.model(img_array)
+            with span('yolo_predict'):
+                results = self.model(img_array)
             
             detections = []
-            
-            # Обрабатываем результаты
-            for r in results:
-                boxes = r.boxes
-                if boxes is not None:
-                    for box in boxes:
-                        # Координаты bounding box
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                        
-                        # Уверенность и класс
-                        conf = float(box.conf[0].cpu().numpy())
-                        cls = int(box.cls[0].cpu().numpy())
-                        
-                        if conf >= confidence_threshold:
-                            # Нормализуем координаты (0-1)
-                            img_width, img_height = image.size
-                            normalized_bbox = [
-                                x1 / img_width,
-                                y1 / img_height,
-                                x2 / img_width,
-                                y2 / img_height
-                            ]
-                            
-                            detection = {
-                                'class': self.class_labels[cls] if cls < len(self.class_labels) else f'class_{cls}',
-                                'confidence': conf,
-                                'bbox': normalized_bbox,
-                                'bbox_pixels': [x1, y1, x2, y2],
-                                'area': (x2 - x1) * (y2 - y1)
-                            }
-                            detections.append(detection)
+            with span('yolo_postprocess'):
+                for r in results:
+                    detections.extend(self._parse_result(r, img_array.shape, confidence_threshold))
             
             return detections
             
         except Exception as e:
-            print(f"Error during YOLO detection: {e}")
+            logger.exception("Error during YOLO detection: %s", e)
             return []
     
+    def detect_batch(self, images: List[Union[Image.Image, np.ndarray]],
+                     confidence_threshold: float = 0.3) -> List[List[Dict[str, Any]]]:
+        """
+        Обнаруживает повреждения на нескольких изображениях за один прогон модели
+        
+        Args:
+            images: Список PIL Image объектов или numpy массивов (H, W, C)
+            confidence_threshold: Минимальный порог уверенности
+            
+        Returns:
+            Список детекций для каждого изображения (в том же порядке)
+        """
+        if not self.model or not images:
+            return [[] for _ in images]
+        
+        try:
+            arrays = [np.asarray(image) for image in images]
+            results = self.model(arrays)
+            return [
+                self._parse_result(r, array.shape, confidence_threshold)
+                for r, array in zip(results, arrays)
+            ]
+        except Exception as e:
+            logger.exception("Error during YOLO batch detection: %s", e)
+            return [[] for _ in images]
+    
+    def _parse_result(self, result, image_shape, confidence_threshold: float) -> List[Dict[str, Any]]:
+        """Преобразует результат ultralytics для одного изображения в список детекций"""
+        img_height, img_width = image_shape[:2]
+        detections = []
+        
+        boxes = result.boxes
+        if boxes is None:
+            return detections
+        
+        for box in boxes:
+            # Координаты bounding box
+            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+            x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
+            
+            # Уверенность и класс
+            conf = float(box.conf[0].cpu().numpy())
+            cls = int(box.cls[0].cpu().numpy())
+            
+            if conf >= confidence_threshold:
+                # Нормализуем координаты (0-1)
+                normalized_bbox = [
+                    x1 / img_width,
+                    y1 / img_height,
+                    x2 / img_width,
+                    y2 / img_height
+                ]
+                
+                detection = {
+                    'class': self.class_labels[cls] if cls < len(self.class_labels) else f'class_{cls}',
+                    'confidence': conf,
+                    'bbox': normalized_bbox,
+                    'bbox_pixels': [x1, y1, x2, y2],
+                    'area': (x2 - x1) * (y2 - y1)
+                }
+                detections.append(detection)
+        
+        return detections
+    
+    def warmup(self, image_size: int = 640, runs: int = 1) -> float:
+        """
+        Прогревает модель холостым прогоном на пустом изображении
+        
+        Первый вызов модели инициализирует ядра PyTorch и буферы ultralytics,
+        поэтому его лучше выполнить до поступления реальных запросов.
+        
+        Args:
+            image_size: Сторона квадратного изображения для прогрева
+            runs: Количество холостых прогонов
+            
+        Returns:
+            Время прогрева в секундах (0.0, если модель не загружена)
+        """
+        if not self.model:
+            return 0.0
+        
+        blank = np.zeros((image_size, image_size, 3), dtype=np.uint8)
+        start_time = time.time()
+        for _ in range(max(runs, 1)):
+            self.model(blank, verbose=False)
+        self.warmup_time = time.time() - start_time
+        self.warmed_up = True
+        return self.warmup_time
+    
     def get_model_info(self) -> Dict[str, Any]:
         """Возвращает информацию о модели"""
         return {
             'available': self.model is not None,
             'yolo_available': YOLO_AVAILABLE,
             'class_count': len(self.class_labels),
-            'classes': self.class_labels
+            'classes': self.class_labels,
+            'weights_path': self.weights_path,
+            'load_time': self.load_time,
+            'warmed_up': self.warmed_up,
+            'warmup_time': self.warmup_time,
         }
@@ -0,0 +1,98 @@
+# car_detector/pagination.py
+"""
+Постраничный вывод анализов по ключу (created_at, id)
+
+Страница выбирается условием «строго раньше (или позже) последней показанной
+записи» по индексу (created_at, id), а не OFFSET: время выборки и память не
+зависят от номера страницы и размера таблицы. Курсор - created_at в
+микросекундах от эпохи и id через точку (1718000000000000.42); его подделка
+безопасна: некорректный курсор дает первую страницу.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+from django.db.models import Q, QuerySet
+
+# Поля, которые показывают карточки анализа (главная и список анализов)
+CARD_FIELDS = (
+    'id', 'image', 'created_at',
+    'gemini_integrity_label', 'gemini_integrity_confidence', 'gemini_cleanliness_label',
+    'gemini_damage_count', 'yolo_detection_count', 'processing_time',
+)
+
+
+def encode_cursor(obj) -> str:
+    """Курсор записи: created_at (мкс от эпохи) и id"""
+    created = obj.created_at - datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    micros = (created.days * 86400 + created.seconds) * 1_000_000 + created.microseconds
+    return f"{micros}.{obj.id}"
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """(created_at, id) из курсора или None, если курсор пуст или некорректен"""
+    if not cursor:
+        return None
+    try:
+        micros, pk = (int(part) for part in cursor.split('.', 1))
+        created_at = datetime.fromtimestamp(micros // 1_000_000, tz=dt_timezone.utc).replace(
+            microsecond=micros % 1_000_000
+        )
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    return created_at, pk
+
+
+class KeysetPage:
+    """Страница записей (новые первыми) и курсоры соседних страниц"""
+
+    def __init__(self, items: List, has_next: bool, has_previous: bool):
+        self.items = items
+        self.has_next = has_next and bool(items)
+        self.has_previous = has_previous and bool(items)
+        self.next_cursor = encode_cursor(items[-1]) if self.has_next else None
+        self.previous_cursor = encode_cursor(items[0]) if self.has_previous else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_other_pages(self) -> bool:
+        return self.has_next or self.has_previous
+
+
+def keyset_page(queryset: QuerySet, page_size: int, before: Optional[str] = None,
+                after: Optional[str] = None) -> KeysetPage:
+    """
+    Страница queryset в порядке (-created_at, -id)
+
+    Args:
+        queryset: Записи с полями created_at и id
+        page_size: Записей на странице
+        before: Курсор - записи старше него (следующая страница)
+        after: Курсор - записи новее него (предыдущая страница); before важнее
+
+    Returns:
+        KeysetPage; без курсоров - первая страница (самые новые записи)
+    """
+    before_key = decode_cursor(before)
+    after_key = decode_cursor(after) if before_key is None else None
+
+    if after_key is not None:
+        created_at, pk = after_key
+        # Ближайшие более новые записи: выборка по возрастанию, затем разворот
+        rows = list(queryset.filter(
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        ).order_by('created_at', 'id')[:page_size + 1])
+        has_previous = len(rows) > page_size
+        items = rows[:page_size][::-1]
+        return KeysetPage(items, has_next=True, has_previous=has_previous)
+
+    if before_key is not None:
+        created_at, pk = before_key
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    rows = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+    return KeysetPage(rows[:page_size], has_next=len(rows) > page_size, has_previous=before_key is not None)
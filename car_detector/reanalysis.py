@@ -0,0 +1,203 @@
+# car_detector/reanalysis.py
+"""
+Повторный анализ сохраненных записей после обновления модели
+
+Запись устарела по стадии, если ее gemini_model_version / yolo_model_version
+отличается от текущей версии (CarAnalysisService.get_model_versions):
+после замены best.pt меняется хеш весов, после правки промпта - версия
+промпта. Перезапускаются только устаревшие стадии; остальные поля записи
+не читаются и не перезаписываются.
+
+Записи читаются курсором (aiterator, на PostgreSQL - серверный курсор)
+в порядке id, обрабатываются порциями, результаты порции сохраняются
+bulk_update. Скорость ограничена (записей в секунду), стадии идут через
+полосу batch планировщика, поэтому обработка может идти параллельно с
+production-трафиком. Строки DamageItem и сводки сессий осмотра с
+обновленными снимками пересчитываются. Обновленная запись получает текущую версию и при
+повторном запуске пропускается, так что прерванный запуск продолжается
+той же командой.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from django.db.models import Q, QuerySet
+
+from .admission import LANE_BATCH
+from .damage_items import asave_damage_items
+from .inspections import arefresh_sessions
+from .logging_utils import log_event
+from .models import CarAnalysis
+from .services import car_analysis_service
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('gemini', 'yolo')
+
+# Поля, которые перезаписывает каждая стадия
+STAGE_FIELDS = {
+    'gemini': [
+        'gemini_integrity_label', 'gemini_integrity_confidence',
+        'gemini_cleanliness_label', 'gemini_cleanliness_confidence',
+        'gemini_damage_details', 'gemini_environment',
+        'gemini_uncertain', 'gemini_notes', 'gemini_model_version',
+        'gemini_damage_count', 'status',
+    ],
+    'yolo': ['yolo_detections', 'yolo_confidence', 'yolo_model_version', 'yolo_detection_count'],
+}
+FUSION_FIELDS = ['fused_damages', 'agreement_score']
+
+
+def stale_queryset(queryset: QuerySet, stages: Sequence[str], versions: Dict[str, str]) -> QuerySet:
+    """Записи, у которых хотя бы одна из стадий посчитана не текущей версией модели"""
+    condition = Q()
+    for stage in stages:
+        condition |= ~Q(**{f'{stage}_model_version': versions[stage]})
+    return queryset.filter(condition)
+
+
+class RateLimiter:
+    """Равномерный темп: не больше rate запусков в секунду (0 - без ограничения)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(self._next, now) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def _reanalyze_row(row: CarAnalysis, stages: List[str], versions: Dict[str, str]) -> List[str]:
+    """Перезапускает стадии для записи; возвращает измененные поля (пусто - ничего не обновлено)"""
+    try:
+        image_path = row.image.path
+    except (ValueError, NotImplementedError):
+        return []
+    if not os.path.exists(image_path):
+        return []
+
+    calls = {
+        'gemini': car_analysis_service.analyze_gemini_async,
+        'yolo': car_analysis_service.analyze_yolo_async,
+    }
+    outcomes = await asyncio.gather(
+        *(calls[stage](image_path, LANE_BATCH) for stage in stages), return_exceptions=True
+    )
+
+    fields = []
+    for stage, result in zip(stages, outcomes):
+        if isinstance(result, Exception) or 'error' in result:
+            # Неудачный повтор не затирает прежний результат
+            log_event(logger, 'reanalysis.stage_failed', level=logging.WARNING, analysis_id=row.id,
+                      stage=stage, error=str(result if isinstance(result, Exception) else result['error']))
+            continue
+        formatted = car_analysis_service.format_results_for_django({stage: result})
+        for field in STAGE_FIELDS[stage]:
+            if field == 'status':
+                setattr(row, field, car_analysis_service.analysis_status(result))
+            else:
+                setattr(row, field, formatted[field])
+        fields.extend(STAGE_FIELDS[stage])
+    
+    if fields:
+        # Сопоставление моделей по обновленному и сохраненному результатам
+        # (пустая версия - стадия не дала результата)
+        fusion = car_analysis_service.fuse_results(
+            {'damage_details': row.gemini_damage_details} if row.gemini_model_version else None,
+            {'detections': row.yolo_detections} if row.yolo_model_version else None,
+        )
+        if fusion is not None:
+            row.fused_damages = fusion['damages']
+            row.agreement_score = fusion['agreement']
+            fields.extend(FUSION_FIELDS)
+    return fields
+
+
+async def reanalyze(queryset: QuerySet, stages: Sequence[str] = STAGES, force: bool = False,
+                    rate: float = 2.0, concurrency: int = 4, chunk_size: int = 100,
+                    after_id: int = 0, limit: int = 0,
+                    progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Повторный анализ записей queryset
+
+    Args:
+        queryset: Записи-кандидаты
+        stages: Стадии для перезапуска (gemini, yolo)
+        force: Перезапускать стадии и для записей с текущей версией
+        rate: Записей в секунду (0 - без ограничения)
+        concurrency: Записей в обработке одновременно
+        chunk_size: Записей в порции курсора и в одном bulk_update
+        after_id: Начать с записей с id больше указанного
+        limit: Обработать не больше N записей (0 - все)
+        progress: Вызывается после каждой порции со статистикой
+
+    Returns:
+        Статистика: обработано, обновлено, пропущено, последний id
+    """
+    versions = car_analysis_service.get_model_versions()
+    stages = [stage for stage in STAGES if stage in stages]
+    if not force:
+        queryset = stale_queryset(queryset, stages, versions)
+    queryset = queryset.filter(id__gt=after_id).order_by('id').only(
+        'id', 'image', 'gemini_model_version', 'yolo_model_version', 'session_id',
+        'gemini_damage_details', 'yolo_detections', 'status', 'created_at'
+    )
+
+    stats = {'processed': 0, 'updated': 0, 'skipped': 0, 'last_id': after_id,
+             'versions': versions, 'started': time.monotonic()}
+    limiter = RateLimiter(rate)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def process(row: CarAnalysis):
+        async with slots:
+            await limiter.wait()
+            row_stages = stages if force else [
+                stage for stage in stages if getattr(row, f'{stage}_model_version') != versions[stage]
+            ]
+            return row, await _reanalyze_row(row, row_stages, versions)
+
+    async def run_chunk(chunk: List[CarAnalysis]):
+        results = await asyncio.gather(*(process(row) for row in chunk))
+        # Одна bulk_update на набор полей: не перезаписываем поля стадий, которые не запускались
+        groups: Dict[tuple, List[CarAnalysis]] = {}
+        for row, fields in results:
+            if fields:
+                groups.setdefault(tuple(fields), []).append(row)
+            else:
+                stats['skipped'] += 1
+        for fields, rows in groups.items():
+            await CarAnalysis.objects.abulk_update(rows, list(fields))
+            await asave_damage_items(rows, replace=True)
+            stats['updated'] += len(rows)
+        # Сводки сессий осмотра, в которые входят обновленные снимки
+        await arefresh_sessions(row.session_id for row, fields in results if fields)
+        stats['processed'] += len(chunk)
+        stats['last_id'] = chunk[-1].id
+        if progress:
+            progress(stats)
+
+    chunk = []
+    async for row in queryset.aiterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size or (limit and stats['processed'] + len(chunk) >= limit):
+            await run_chunk(chunk)
+            chunk = []
+            if limit and stats['processed'] >= limit:
+                break
+    if chunk:
+        await run_chunk(chunk)
+
+    log_event(logger, 'reanalysis.finished', processed=stats['processed'], updated=stats['updated'],
+              skipped=stats['skipped'], last_id=stats['last_id'],
+              duration_ms=round((time.monotonic() - stats['started']) * 1000, 1))
+    return stats
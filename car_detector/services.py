@@ -2,14 +2,42 @@
 import os
 import time
 import json
-from typing import Dict, List, Any
+import hashlib
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Any, Optional, Tuple
 from PIL import Image
 import io
+import numpy as np
+from django.conf import settings
 from django.core.files.base import ContentFile
 
 # Импорты интегрированных моделей
 from .models_ai import YOLODetector, GeminiAnalyzer
+from .gemini_cassette import GeminiCassette
 from .image_utils import create_comparison_image
+from .inference_pool import InferencePool
+from .inference_client import RemoteInferenceClient, InferenceUnavailable
+from .async_utils import run_blocking, run_on_background_loop, submit_background, submit_detached
+from .admission import admission_controller, AdmissionRejected, LANE_STANDARD
+from .models import CarAnalysis
+from .webhooks import aenqueue_analysis_webhook
+from .damage_items import asave_damage_items
+from .metrics import observe_stage
+from .fusion import fuse_damages
+from .logging_utils import log_event
+from .tracing import current_trace, record_span, use_trace
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_jpeg(frame: np.ndarray, quality: int = 90) -> bytes:
+    """Кодирует кадр RGB в JPEG для отправки на сервер инференса"""
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
 
 
 class CarAnalysisService:
@@ -17,8 +45,22 @@ class CarAnalysisService:
     
     def __init__(self):
         # Инициализируем модели
-        self.gemini_analyzer = GeminiAnalyzer()
+        cassette = None
+        if settings.GEMINI_CASSETTE_MODE:
+            cassette = GeminiCassette(
+                settings.GEMINI_CASSETTE_DIR, settings.GEMINI_CASSETTE_MODE,
+                latency_scale=settings.GEMINI_CASSETTE_LATENCY,
+            )
+        self.gemini_analyzer = GeminiAnalyzer(
+            api_endpoint=settings.GEMINI_API_ENDPOINT or None, cassette=cassette
+        )
         self.yolo_detector = None
+        self.inference_pool = None
+        self.remote_inference = None
+        self.weights_path = None
+        self._local_detector_lock = threading.Lock()
+        self._model_versions = None
+        self.warmed_up = False
         self._init_yolo()
     
     def _init_yolo(self):
@@ -27,23 +69,135 @@ class CarAnalysisService:
             # Ищем веса модели
             base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
             weights_path = os.path.join(base_dir, "CarDentDetector", "Weights", "best.pt")
+            self.weights_path = weights_path
             
-            if os.path.exists(weights_path):
+            if settings.YOLO_INFERENCE_ENDPOINTS:
+                # Инференс на выделенных серверах; локальная модель загружается только при отказе
+                self.remote_inference = RemoteInferenceClient(
+                    settings.YOLO_INFERENCE_ENDPOINTS,
+                    timeout=settings.YOLO_INFERENCE_TIMEOUT,
+                )
+                logger.info("YOLO remote inference configured: %s", ', '.join(settings.YOLO_INFERENCE_ENDPOINTS))
+            elif os.path.exists(weights_path) and settings.YOLO_INFERENCE_WORKERS > 0:
+                # Модель живет в процессах пула, веб-процесс ее не загружает
+                self.inference_pool = InferencePool(
+                    weights_path,
+                    workers=settings.YOLO_INFERENCE_WORKERS,
+                    torch_threads=settings.YOLO_INFERENCE_TORCH_THREADS,
+                    timeout=settings.YOLO_INFERENCE_TIMEOUT,
+                )
+                logger.info("YOLO inference pool configured with %s workers", settings.YOLO_INFERENCE_WORKERS)
+            elif os.path.exists(weights_path):
                 self.yolo_detector = YOLODetector(weights_path)
-                print("YOLO detector initialized successfully")
+                logger.info("YOLO detector initialized successfully")
             else:
-                print(f"YOLO weights not found at {weights_path}")
+                logger.warning("YOLO weights not found at %s", weights_path)
                 self.yolo_detector = YOLODetector()  # Создаем без весов
         except Exception as e:
-            print(f"Error initializing YOLO detector: {e}")
+            logger.exception("Error initializing YOLO detector: %s", e)
             self.yolo_detector = YOLODetector()  # Создаем без весов
     
-    def analyze_image(self, image_path: str) -> Dict[str, Any]:
+    @property
+    def yolo_available(self) -> bool:
+        """Доступен ли инференс YOLO (в процессе, через пул или на удаленном сервере)"""
+        if self.inference_pool or self.remote_inference:
+            return True
+        return bool(self.yolo_detector and self.yolo_detector.model)
+    
+    def warmup(self, start_pool: bool = True) -> Dict[str, Any]:
+        """
+        Прогревает модели до начала обработки запросов
+        
+        Вызывается один раз в мастер-процессе перед fork (см. gunicorn.conf.py),
+        чтобы воркеры получили уже загруженные и прогретые веса.
+        
+        Args:
+            start_pool: Запускать ли пул инференса в текущем процессе
+                (в мастере gunicorn пул не нужен: он принадлежит воркерам)
+            
+        Returns:
+            Состояние моделей после прогрева
+        """
+        if self.yolo_detector:
+            self.yolo_detector.warmup(settings.YOLO_WARMUP_IMAGE_SIZE)
+        if self.inference_pool and start_pool:
+            self.inference_pool.start()
+        # Хеш весов считается заранее, а не в первом запросе
+        self.get_model_versions()
+        self.warmed_up = True
+        return self.get_health()
+    
+    def get_health(self) -> Dict[str, Any]:
+        """
+        Возвращает состояние загрузки моделей для readiness/liveness проверок
+        
+        Returns:
+            Словарь с признаком готовности и информацией о моделях
+        """
+        yolo_info = self.yolo_detector.get_model_info() if self.yolo_detector else {}
+        yolo_loaded = yolo_info.get('available', False)
+        pool_stats = None
+        
+        if self.inference_pool and self.inference_pool.started:
+            pool_stats = self.inference_pool.get_stats()
+            yolo_loaded = any(worker['model_loaded'] for worker in pool_stats)
+            yolo_info = {
+                'warmed_up': all(worker['ready'] for worker in pool_stats),
+                'warmup_time': max((worker['warmup_time'] or 0.0) for worker in pool_stats),
+            }
+        
+        remote_stats = None
+        if self.remote_inference:
+            remote_stats = self.remote_inference.get_stats()
+            yolo_loaded = yolo_loaded or any(endpoint['available'] for endpoint in remote_stats)
+        
+        ready = self.warmed_up and (yolo_loaded or not settings.YOLO_REQUIRED)
+        
+        return {
+            'ready': ready,
+            'pid': os.getpid(),
+            'yolo': {
+                'loaded': yolo_loaded,
+                'load_time': yolo_info.get('load_time'),
+                'warmed_up': yolo_info.get('warmed_up', False),
+                'warmup_time': yolo_info.get('warmup_time'),
+                'inference_pool': pool_stats,
+                'remote_inference': remote_stats,
+            },
+            'gemini': {
+                'available': self.gemini_analyzer.available,
+            },
+            'model_versions': self.get_model_versions(),
+        }
+    
+    def get_model_versions(self) -> Dict[str, str]:
+        """
+        Текущие версии моделей для записей CarAnalysis
+        
+        YOLO - YOLO_MODEL_VERSION или первые 12 знаков SHA-256 файла весов,
+        Gemini - имя модели и версия промпта.
+        """
+        if self._model_versions is None:
+            yolo_version = settings.YOLO_MODEL_VERSION
+            if not yolo_version and self.weights_path and os.path.exists(self.weights_path):
+                digest = hashlib.sha256()
+                with open(self.weights_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(chunk)
+                yolo_version = digest.hexdigest()[:12]
+            self._model_versions = {
+                'gemini': self.gemini_analyzer.model_version,
+                'yolo': yolo_version,
+            }
+        return self._model_versions
+    
+    def analyze_image(self, image_path: str, priority: str = LANE_STANDARD) -> Dict[str, Any]:
         """
         Анализирует изображение автомобиля с помощью обеих моделей
         
         Args:
             image_path: Путь к изображению
+            priority: Полоса планировщика (interactive, standard, batch)
             
         Returns:
             Словарь с результатами анализа
@@ -58,34 +212,281 @@ class CarAnalysisService:
         
         # Анализ с помощью Gemini
         try:
-            print("Running Gemini analysis...")
-            gemini_results = self.gemini_analyzer.analyze(image_path)
+            queued_at = time.perf_counter()
+            with admission_controller.stage('gemini', priority):
+                record_span('gemini_queue', queued_at)
+                gemini_results = self.gemini_analyzer.analyze(image_path)
             results['gemini'] = gemini_results
-            print("Gemini analysis completed")
+            log_event(logger, 'analysis.stage', level=logging.DEBUG, stage='gemini',
+                      duration_ms=round((time.perf_counter() - queued_at) * 1000, 1))
+        except AdmissionRejected:
+            raise
         except Exception as e:
             error_msg = f"Gemini analysis failed: {str(e)}"
-            print(error_msg)
+            log_event(logger, 'analysis.stage_failed', error_msg, level=logging.WARNING, stage='gemini')
             results['errors'].append(error_msg)
         
         # Анализ с помощью YOLO
         try:
-            if self.yolo_detector:
-                print("Running YOLO analysis...")
-                yolo_results = self._run_yolo_analysis(image_path)
+            if self.yolo_detector or self.inference_pool or self.remote_inference:
+                queued_at = time.perf_counter()
+                with admission_controller.stage('yolo', priority):
+                    record_span('yolo_queue', queued_at)
+                    yolo_results = self._run_yolo_analysis(image_path)
                 results['yolo'] = yolo_results
-                print("YOLO analysis completed")
+                log_event(logger, 'analysis.stage', level=logging.DEBUG, stage='yolo',
+                          duration_ms=round((time.perf_counter() - queued_at) * 1000, 1))
             else:
                 results['errors'].append("YOLO detector not available")
+        except AdmissionRejected:
+            raise
         except Exception as e:
             error_msg = f"YOLO analysis failed: {str(e)}"
-            print(error_msg)
+            log_event(logger, 'analysis.stage_failed', error_msg, level=logging.WARNING, stage='yolo')
             results['errors'].append(error_msg)
         
+        results['fusion'] = self.fuse_results(results['gemini'], results['yolo'])
+        
         # Вычисляем время обработки
         results['processing_time'] = time.time() - start_time
         
         return results
     
+    async def analyze_image_async(self, image_path: str, priority: str = LANE_STANDARD) -> Dict[str, Any]:
+        """
+        Асинхронная версия analyze_image для async-представлений
+        
+        Gemini ожидается через асинхронный клиент, YOLO выполняется в пуле потоков,
+        обе модели работают параллельно.
+        
+        Args:
+            image_path: Путь к изображению
+            priority: Полоса планировщика (interactive, standard, batch)
+            
+        Returns:
+            Словарь с результатами анализа (формат как у analyze_image)
+        """
+        start_time = time.time()
+        results = {
+            'gemini': None,
+            'yolo': None,
+            'processing_time': 0,
+            'errors': []
+        }
+        
+        gemini_call = self.analyze_gemini_async(image_path, priority)
+        if self.yolo_detector or self.inference_pool or self.remote_inference:
+            yolo_call = self.analyze_yolo_async(image_path, priority)
+        else:
+            yolo_call = None
+            results['errors'].append("YOLO detector not available")
+        
+        gemini_results, yolo_results = await asyncio.gather(
+            gemini_call, yolo_call or asyncio.sleep(0), return_exceptions=True
+        )
+        
+        # Перегрузка стадии отдается клиенту как 429/503, а не как частичный результат
+        for outcome in (gemini_results, yolo_results):
+            if isinstance(outcome, AdmissionRejected):
+                raise outcome
+        
+        if isinstance(gemini_results, Exception):
+            results['errors'].append(f"Gemini analysis failed: {str(gemini_results)}")
+        else:
+            results['gemini'] = gemini_results
+        
+        if isinstance(yolo_results, Exception):
+            results['errors'].append(f"YOLO analysis failed: {str(yolo_results)}")
+        elif yolo_call is not None:
+            results['yolo'] = yolo_results
+        
+        results['fusion'] = self.fuse_results(results['gemini'], results['yolo'])
+        results['processing_time'] = time.time() - start_time
+        
+        return results
+    
+    async def analyze_image_with_deadline(self, image_path: str, budget: Optional[float],
+                                          priority: str = LANE_STANDARD) -> Tuple[Dict[str, Any], Optional[Future]]:
+        """
+        Анализ с бюджетом задержки
+        
+        Gemini запускается на фоновом цикле и не отменяется по дедлайну: если он
+        не успел, возвращается результат YOLO и Future незавершенного вызова Gemini,
+        который нужно передать в complete_in_background.
+        
+        Args:
+            image_path: Путь к изображению
+            budget: Бюджет задержки в секундах (None - ждать Gemini без ограничения)
+            priority: Полоса планировщика (interactive, standard, batch)
+            
+        Returns:
+            Результаты анализа (gemini = None, если не успел) и Future ожидающего Gemini
+        """
+        start_time = time.time()
+        results = {
+            'gemini': None,
+            'yolo': None,
+            'processing_time': 0,
+            'errors': []
+        }
+        
+        gemini_future = submit_background(self.analyze_gemini_async(image_path, priority))
+        
+        try:
+            if self.yolo_detector or self.inference_pool or self.remote_inference:
+                results['yolo'] = await self.analyze_yolo_async(image_path, priority)
+            else:
+                results['errors'].append("YOLO detector not available")
+        except AdmissionRejected:
+            gemini_future.cancel()
+            raise
+        except Exception as e:
+            results['errors'].append(f"YOLO analysis failed: {str(e)}")
+        
+        timeout = None if budget is None else max(budget - (time.time() - start_time), 0)
+        pending = None
+        try:
+            # shield: по дедлайну отменяется только ожидание, сам вызов Gemini продолжается
+            results['gemini'] = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(gemini_future)), timeout
+            )
+        except asyncio.TimeoutError:
+            pending = gemini_future
+            log_event(logger, 'analysis.deadline_exceeded', stage='gemini',
+                      duration_ms=round((time.time() - start_time) * 1000, 1))
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            results['errors'].append(f"Gemini analysis failed: {str(e)}")
+        
+        results['fusion'] = self.fuse_results(results['gemini'], results['yolo'])
+        results['processing_time'] = time.time() - start_time
+        
+        return results, pending
+    
+    def complete_in_background(self, analysis_id: Optional[int], pending: Future,
+                               image_path: str, start_time: float) -> Future:
+        """
+        Дописывает результат Gemini в запись CarAnalysis после частичного ответа
+        
+        Временный файл изображения удаляется после завершения Gemini.
+        Если запись не была создана (analysis_id = None), выполняется только очистка.
+        Трасса запроса дописывается в запись вместе с результатом.
+        """
+        return submit_detached(
+            self._complete_analysis(analysis_id, pending, image_path, start_time, current_trace())
+        )
+    
+    async def _complete_analysis(self, analysis_id: Optional[int], pending: Future,
+                                 image_path: str, start_time: float, trace=None):
+        try:
+            try:
+                gemini_results = await asyncio.wrap_future(pending)
+            except Exception as e:
+                error_msg = f"Gemini analysis failed: {str(e)}"
+                log_event(logger, 'analysis.stage_failed', error_msg, level=logging.WARNING,
+                          analysis_id=analysis_id, stage='gemini')
+                gemini_results = {'error': error_msg, 'notes': error_msg}
+            
+            if analysis_id is None:
+                return
+            
+            fields = {
+                key: value
+                for key, value in self.format_results_for_django({'gemini': gemini_results}).items()
+                if key.startswith('gemini_')
+            }
+            fields['status'] = self.analysis_status(gemini_results)
+            fields['processing_time'] = time.time() - start_time
+            # Сопоставление с уже сохраненным результатом YOLO (версия пуста, если YOLO не отработал)
+            yolo_detections, yolo_version = await CarAnalysis.objects.filter(id=analysis_id).values_list(
+                'yolo_detections', 'yolo_model_version'
+            ).aget()
+            fusion = self.fuse_results(gemini_results, {'detections': yolo_detections} if yolo_version else None)
+            if fusion is not None:
+                fields['fused_damages'] = fusion['damages']
+                fields['agreement_score'] = fusion['agreement']
+            with use_trace(trace), observe_stage('db_save'):
+                if trace is not None:
+                    fields['trace'] = trace.as_dict()
+                await CarAnalysis.objects.filter(id=analysis_id).aupdate(**fields)
+                analysis = await CarAnalysis.objects.aget(id=analysis_id)
+                await asave_damage_items([analysis], replace=True)
+            log_event(logger, 'analysis.completed_background', analysis_id=analysis_id,
+                      status=fields['status'], duration_ms=round(fields['processing_time'] * 1000, 1))
+            
+            await aenqueue_analysis_webhook(analysis)
+        except Exception as e:
+            logger.exception("Failed to complete analysis %s: %s", analysis_id, e,
+                             extra={'event': 'analysis.background_failed', 'analysis_id': analysis_id})
+        finally:
+            if os.path.exists(image_path):
+                await run_blocking(os.unlink, image_path)
+    
+    def fuse_results(self, gemini_results: Optional[Dict[str, Any]],
+                     yolo_results: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Сопоставление повреждений Gemini и детекций YOLO одного снимка (см. fusion.py)
+        
+        Returns:
+            agreement - согласие моделей от 0 до 1, trusted - согласие не ниже
+            FUSION_TRUST_AGREEMENT (результату можно доверять без дополнительных
+            проверок), damages - объединенный список повреждений; None, если
+            одна из моделей не дала результата
+        """
+        if not gemini_results or 'error' in gemini_results or not yolo_results or 'error' in yolo_results:
+            return None
+        with observe_stage('fusion'):
+            damages, agreement = fuse_damages(
+                (gemini_results.get('damage_details') or {}).get('parts') or [],
+                yolo_results.get('detections') or [],
+            )
+        return {
+            'agreement': agreement,
+            'trusted': agreement >= settings.FUSION_TRUST_AGREEMENT,
+            'damages': damages,
+        }
+    
+    @staticmethod
+    def analysis_status(gemini_results: Optional[Dict[str, Any]]) -> str:
+        """Статус записи CarAnalysis по результату Gemini"""
+        if not gemini_results or 'error' in gemini_results:
+            return 'failed'
+        return 'complete'
+    
+    async def analyze_gemini_async(self, image_path: str, priority: str = LANE_STANDARD) -> Dict[str, Any]:
+        """
+        Асинхронный анализ только с помощью Gemini
+        
+        Args:
+            image_path: Путь к изображению
+            priority: Полоса планировщика (interactive, standard, batch)
+            
+        Returns:
+            Результаты Gemini анализа
+        """
+        queued_at = time.perf_counter()
+        async with admission_controller.stage('gemini', priority):
+            record_span('gemini_queue', queued_at)
+            return await run_on_background_loop(self.gemini_analyzer.analyze_async(image_path))
+    
+    async def analyze_yolo_async(self, image_path: str, priority: str = LANE_STANDARD) -> Dict[str, Any]:
+        """
+        Асинхронный анализ только с помощью YOLO: _run_yolo_analysis в пуле потоков
+        с учетом лимита стадии YOLO
+        
+        Args:
+            image_path: Путь к изображению
+            priority: Полоса планировщика (interactive, standard, batch)
+            
+        Returns:
+            Результаты YOLO анализа
+        """
+        queued_at = time.perf_counter()
+        async with admission_controller.stage('yolo', priority):
+            record_span('yolo_queue', queued_at)
+            return await run_blocking(self._run_yolo_analysis, image_path)
+    
     def create_processed_image(self, image_path: str, gemini_results: Dict, yolo_results: Dict) -> str:
         """
         Создает обработанное изображение с наложенными повреждениями
@@ -103,25 +504,20 @@ class CarAnalysisService:
             gemini_damages = []
             if 'damage_details' in gemini_results and 'parts' in gemini_results['damage_details']:
                 gemini_damages = gemini_results['damage_details']['parts']
-                print(f"Найдено {len(gemini_damages)} повреждений Gemini")
-                for i, damage in enumerate(gemini_damages):
-                    print(f"  Повреждение {i+1}: {damage.get('part', 'unknown')} - {damage.get('type', 'unknown')}")
-                    if 'bbox' in damage:
-                        print(f"    Координаты: {damage['bbox']}")
-                    else:
-                        print(f"    Координаты: НЕТ!")
+                if logger.isEnabledFor(logging.DEBUG):
+                    for i, damage in enumerate(gemini_damages):
+                        log_event(logger, 'analysis.detection', level=logging.DEBUG, source='gemini', index=i,
+                                  part=damage.get('part', 'unknown'), label=damage.get('type', 'unknown'),
+                                  bbox=damage.get('bbox'))
             
             # Извлекаем детекции из результатов YOLO
             yolo_detections = []
             if 'detections' in yolo_results:
                 yolo_detections = yolo_results['detections']
-                print(f"Найдено {len(yolo_detections)} детекций YOLO")
-                for i, detection in enumerate(yolo_detections):
-                    print(f"  Детекция {i+1}: {detection.get('class', 'unknown')}")
-                    if 'bbox' in detection:
-                        print(f"    Координаты: {detection['bbox']}")
-                    else:
-                        print(f"    Координаты: НЕТ!")
+                if logger.isEnabledFor(logging.DEBUG):
+                    for i, detection in enumerate(yolo_detections):
+                        log_event(logger, 'analysis.detection', level=logging.DEBUG, source='yolo', index=i,
+                                  label=detection.get('class', 'unknown'), bbox=detection.get('bbox'))
             
             # Создаем временный файл для обработанного изображения
             temp_dir = os.path.dirname(image_path)
@@ -129,14 +525,15 @@ class CarAnalysisService:
             temp_path = os.path.join(temp_dir, temp_filename)
             
             # Создаем обработанное изображение
-            processed_path = create_comparison_image(
-                image_path, gemini_damages, yolo_detections, temp_path
-            )
+            with observe_stage('overlay_render'):
+                processed_path = create_comparison_image(
+                    image_path, gemini_damages, yolo_detections, temp_path
+                )
             
             return processed_path
             
         except Exception as e:
-            print(f"Ошибка при создании обработанного изображения: {e}")
+            logger.exception("Ошибка при создании обработанного изображения: %s", e)
             return image_path
     
     def _run_yolo_analysis(self, image_path: str) -> Dict[str, Any]:
@@ -151,7 +548,7 @@ class CarAnalysisService:
         """
         try:
             # Проверяем, инициализирован ли детектор
-            if not self.yolo_detector or not self.yolo_detector.model:
+            if not self.yolo_available:
                 return {
                     'detections': [],
                     'total_detections': 0,
@@ -161,10 +558,15 @@ class CarAnalysisService:
                 }
             
             # Загружаем изображение
-            image = Image.open(image_path)
+            with observe_stage('decode'):
+                image = Image.open(image_path)
+                if not self.remote_inference:
+                    # Декодируем заранее, чтобы декодирование не попадало во время инференса
+                    image.load()
             
             # Запускаем детекцию
-            detections = self.yolo_detector.detect(image)
+            with observe_stage('yolo_inference'):
+                detections = self._detect(image_path, image)
             
             # Форматируем результаты
             yolo_results = {
@@ -201,6 +603,74 @@ class CarAnalysisService:
                 'error': f"YOLO analysis error: {str(e)}"
             }
     
+    def _detect(self, image_path: str, image: Image.Image) -> List[Dict[str, Any]]:
+        """
+        Запускает детекцию на удаленном сервере, в пуле процессов или в текущем процессе
+        
+        Args:
+            image_path: Путь к изображению (на удаленный сервер отправляются исходные байты)
+            image: Открытое изображение для локального инференса
+            
+        Returns:
+            Список детекций в формате YOLODetector.detect
+        """
+        if self.remote_inference:
+            try:
+                with open(image_path, 'rb') as f:
+                    return self.remote_inference.detect_bytes(f.read())
+            except InferenceUnavailable as e:
+                if not settings.YOLO_INFERENCE_FALLBACK:
+                    raise
+                logger.warning("Remote inference unavailable, falling back to local: %s", e)
+                return self._get_local_detector().detect(image)
+        
+        if self.inference_pool:
+            return self.inference_pool.detect(image)
+        return self.yolo_detector.detect(image)
+    
+    def detect_frames(self, frames: List[np.ndarray]) -> List[List[Dict[str, Any]]]:
+        """
+        Детекция YOLO на нескольких кадрах (ключевые кадры видео)
+
+        Удаленный сервер получает кадры одним запросом /detect-batch, пул процессов -
+        все кадры сразу (параллельно на воркерах), локальная модель - один прогон detect_batch.
+
+        Args:
+            frames: Кадры RGB (H, W, C)
+
+        Returns:
+            Список детекций для каждого кадра (в том же порядке)
+        """
+        if not frames or not self.yolo_available:
+            return [[] for _ in frames]
+
+        if self.remote_inference:
+            try:
+                return self.remote_inference.detect_batch_bytes([_encode_jpeg(frame) for frame in frames])
+            except InferenceUnavailable as e:
+                if not settings.YOLO_INFERENCE_FALLBACK:
+                    raise
+                logger.warning("Remote inference unavailable, falling back to local: %s", e)
+                return self._get_local_detector().detect_batch(frames)
+
+        if self.inference_pool:
+            futures = [self.inference_pool.submit(frame) for frame in frames]
+            try:
+                return [future.result(timeout=self.inference_pool.timeout) for future in futures]
+            except FutureTimeoutError:
+                # Неполученные ответы снимаем, чтобы не держать записи и сегменты shared memory
+                for future in futures:
+                    self.inference_pool.abandon(future)
+                raise
+        return self.yolo_detector.detect_batch(frames)
+
+    def _get_local_detector(self) -> YOLODetector:
+        """Лениво загружает локальную модель для работы без серверов инференса"""
+        with self._local_detector_lock:
+            if self.yolo_detector is None:
+                self.yolo_detector = YOLODetector(self.weights_path)
+            return self.yolo_detector
+    
     def format_results_for_django(self, analysis_results: Dict[str, Any]) -> Dict[str, Any]:
         """
         Форматирует результаты анализа для сохранения в Django модели
@@ -223,6 +693,8 @@ class CarAnalysisService:
             'gemini_notes': '',
             'yolo_detections': [],
             'yolo_confidence': 0.0,
+            'fused_damages': [],
+            'agreement_score': None,
         }
         
         # Обрабатываем результаты Gemini
@@ -238,6 +710,8 @@ class CarAnalysisService:
                 'gemini_environment': gemini.get('environment', {}),
                 'gemini_uncertain': gemini.get('uncertain', False),
                 'gemini_notes': gemini.get('notes', ''),
+                # Неудачный анализ версией не помечается: reanalyze повторит его
+                'gemini_model_version': '' if 'error' in gemini else self.get_model_versions()['gemini'],
             })
         
         # Обрабатываем результаты YOLO
@@ -247,8 +721,25 @@ class CarAnalysisService:
             formatted_data.update({
                 'yolo_detections': yolo.get('detections', []),
                 'yolo_confidence': yolo.get('average_confidence', 0.0),
+                'yolo_model_version': '' if 'error' in yolo else self.get_model_versions()['yolo'],
             })
         
+        # Сопоставление моделей (если в результатах есть обе)
+        if 'fusion' in analysis_results:
+            fusion = analysis_results['fusion']
+        else:
+            fusion = self.fuse_results(analysis_results.get('gemini'), analysis_results.get('yolo'))
+        if fusion is not None:
+            formatted_data.update({
+                'fused_damages': fusion['damages'],
+                'agreement_score': fusion['agreement'],
+            })
+        
+        # Счетчики для списков (bulk_create и aupdate не вызывают save)
+        formatted_data['gemini_damage_count'], formatted_data['yolo_detection_count'] = CarAnalysis.damage_counts(
+            formatted_data['gemini_damage_details'], formatted_data['yolo_detections']
+        )
+        
         # Добавляем время обработки
         formatted_data['processing_time'] = analysis_results.get('processing_time', 0.0)
         
@@ -1,3 +1,2083 @@
-from django.test import TestCase
+import asyncio
+import http.server
+import importlib
+import io
+import json
+import logging
+import os
+import pstats
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta, timezone as dt_timezone
+from multiprocessing import shared_memory
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+import cv2
+import numpy as np
+from PIL import Image
+import requests
+
+from benchmarks import microbench
+from car_detector import api_keys, fusion, metrics, traffic_capture
+from car_detector.admission import AdmissionRejected, PriorityScheduler, WeightedSemaphore
+from car_detector.api_keys import _acquire, _release, api_key_required
+from car_detector.async_utils import run_blocking
+from car_detector.counters import MemoryCounterStore
+from car_detector.damage_items import damage_item_rows, save_damage_items
+from car_detector.gemini_cassette import CassetteMiss, CassetteRecordedError, GeminiCassette
+from car_detector.inference_client import InferenceRequestError, RemoteInferenceClient
+from car_detector.inference_pool import InferencePool, _WorkerState
+from car_detector.inference_server import InferenceBackend, InferenceHTTPServer, pack_frames
+from car_detector.idempotency import IdempotencyConflict, SingleFlight, idempotent
+from car_detector.inspections import acomplete_session, merge_damages, summarize_photos
+from car_detector.logging_utils import EventSampler, QueueingHandler, log_event
+from car_detector.management.commands.analyze_dir import Command as AnalyzeDirCommand
+from car_detector.models import (
+    ApiKey, CarAnalysis, DamageItem, InspectionSession, WebhookDeadLetter, WebhookDelivery,
+)
+from car_detector.models_ai import GeminiAnalyzer
+from car_detector.services import car_analysis_service
+from car_detector.pagination import decode_cursor, encode_cursor, keyset_page
+from car_detector.reanalysis import reanalyze
+from car_detector.tracing import Trace, current_trace, traced, use_trace
+from car_detector.video_inspection import (
+    DamageTracker, estimate_shift, iter_keyframes, merge_gemini_results, pick_gemini_keyframes,
+)
+from car_detector.webhooks import WebhookDispatcher, validate_webhook_url, verify_signature
+
+
+@unittest.skipIf(os.environ.get('PERF_TESTS', '1') == '0', 'PERF_TESTS=0')
+class PerformanceRegressionTests(SimpleTestCase):
+    """
+    Горячие функции не медленнее базовых значений benchmarks/baselines.json больше чем на допуск
+
+    Допуск - PERF_TOLERANCE (по умолчанию 0.5); случай, превысивший его, замеряется
+    повторно, чтобы разовая посторонняя нагрузка не роняла тест. После осознанного изменения
+    производительности базовые значения обновляются командой
+    python benchmarks/microbench.py --update-baseline
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.baseline = microbench.load_baseline()
+        if cls.baseline is None:
+            raise unittest.SkipTest('benchmarks/baselines.json not found')
+
+    def assert_no_regression(self, prefix):
+        results = microbench.run_cases(prefix)
+        measured = 0
+        for row in microbench.compare(results, self.baseline):
+            if row['ratio'] is None:
+                continue
+            measured += 1
+            if row['regressed']:
+                row = microbench.compare(microbench.run_cases(row['name']), self.baseline)[0]
+            with self.subTest(case=row['name']):
+                self.assertFalse(
+                    row['regressed'],
+                    f"{row['name']}: {row['seconds'] * 1000:.3f} ms, "
+                    f"{row['ratio']:.2f}x baseline (tolerance {microbench.DEFAULT_TOLERANCE:.0%})",
+                )
+        if not measured:
+            self.skipTest(f'no available cases with baselines for {prefix}')
+
+    def test_yolo_detect(self):
+        self.assert_no_regression('yolo_detect')
+
+    def test_load_as_jpeg_bytes(self):
+        self.assert_no_regression('load_as_jpeg_bytes')
+
+    def test_parse_response(self):
+        self.assert_no_regression('parse_response')
+
+    def test_format_results_for_django(self):
+        self.assert_no_regression('format_results_for_django')
+
+    def test_fuse_results(self):
+        self.assert_no_regression('fuse_results')
+
+    def test_create_comparison_image(self):
+        self.assert_no_regression('create_comparison_image')
+
+    def test_video_frame_scoring(self):
+        self.assert_no_regression('video_frame_scoring')
+
+    def test_damage_tracker(self):
+        self.assert_no_regression('damage_tracker')
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=False)
+class WebhookUrlTests(SimpleTestCase):
+    """Адреса webhook во внутренней сети отклоняются (SSRF)"""
+
+    def test_rejects_internal_addresses(self):
+        for url in [
+            'http://127.0.0.1/hook', 'http://localhost:8000/hook', 'http://10.1.2.3/hook',
+            'http://192.168.0.10/hook', 'http://169.254.169.254/latest/meta-data/',
+            'http://100.64.0.1/hook', 'http://0.0.0.0/hook', 'http://[::1]/hook',
+            'http://[fd00::1]/hook', 'http://[::ffff:127.0.0.1]/hook', 'http://224.0.0.1/hook',
+        ]:
+            with self.subTest(url=url), self.assertRaises(ValidationError):
+                validate_webhook_url(url)
+
+    def test_accepts_public_address(self):
+        validate_webhook_url('https://93.184.216.34/hook')
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=True)
+    def test_private_hosts_allowed_for_development(self):
+        validate_webhook_url('http://127.0.0.1:9000/hook')
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=True, WEBHOOK_IN_PROCESS=False, WEBHOOK_SECRET='shared-secret',
+                   WEBHOOK_RETRY_BASE=2, WEBHOOK_RETRY_MAX=3600, WEBHOOK_MAX_ATTEMPTS=3)
+class WebhookDispatcherTests(TestCase):
+    """Доставка webhook: подпись, пакеты, повторы, dead letter и захват записей"""
+
+    def setUp(self):
+        self.dispatcher = WebhookDispatcher()
+        self.client_key = self.make_key('client')
+
+    def make_key(self, name):
+        api_key = ApiKey(name=name)
+        api_key.set_new_key()
+        api_key.set_new_webhook_secret()
+        api_key.save()
+        return api_key
+
+    def enqueue(self, url='http://hooks.test/a', api_key=None, number=1, **fields):
+        return WebhookDelivery.objects.create(
+            url=url, api_key=api_key, payload={'event': 'analysis.completed', 'number': number},
+            next_attempt_at=timezone.now() - timedelta(seconds=1), **fields,
+        )
+
+    def post(self, status=200):
+        response = mock.Mock(status_code=status)
+        return mock.patch('requests.Session.post', return_value=response)
+
+    @staticmethod
+    def sent(post, index=0):
+        args, kwargs = post.call_args_list[index]
+        headers = kwargs['headers']
+        return args[0], kwargs['data'], headers['X-Webhook-Timestamp'], headers['X-Webhook-Signature']
+
+    def test_batch_is_signed_with_client_secret(self):
+        first = self.enqueue(api_key=self.client_key, number=1)
+        second = self.enqueue(api_key=self.client_key, number=2)
+        with self.post() as post:
+            self.dispatcher.process_due()
+
+        self.assertEqual(post.call_count, 1)
+        url, body, timestamp, signature = self.sent(post)
+        self.assertEqual(url, 'http://hooks.test/a')
+        self.assertEqual([event['number'] for event in json.loads(body)['events']], [1, 2])
+        self.assertFalse(post.call_args.kwargs['allow_redirects'])
+        self.assertTrue(verify_signature(body, timestamp, signature, self.client_key.webhook_secret))
+        self.assertFalse(verify_signature(body, timestamp, signature, 'shared-secret'))
+        self.assertFalse(verify_signature(body + b' ', timestamp, signature, self.client_key.webhook_secret))
+        for delivery in (first, second):
+            delivery.refresh_from_db()
+            self.assertEqual((delivery.status, delivery.attempts), ('delivered', 1))
+        self.assertEqual(self.dispatcher.get_stats()['delivered'], 2)
+
+    def test_batches_are_grouped_by_url_and_client(self):
+        other_key = self.make_key('other')
+        self.enqueue(api_key=self.client_key, number=1)
+        self.enqueue(api_key=other_key, number=2)
+        self.enqueue(url='http://hooks.test/b', api_key=self.client_key, number=3)
+        self.enqueue(api_key=None, number=4)
+        self.enqueue(api_key=self.client_key, number=5)
+        with self.post() as post:
+            self.dispatcher.process_due()
+
+        secrets_by_number = {
+            1: self.client_key.webhook_secret, 5: self.client_key.webhook_secret,
+            2: other_key.webhook_secret, 3: self.client_key.webhook_secret, 4: 'shared-secret',
+        }
+        batches = []
+        for index in range(post.call_count):
+            url, body, timestamp, signature = self.sent(post, index)
+            numbers = sorted(event['number'] for event in json.loads(body)['events'])
+            secret = secrets_by_number[numbers[0]]
+            self.assertTrue(verify_signature(body, timestamp, signature, secret))
+            batches.append((url, numbers))
+        self.assertCountEqual(batches, [
+            ('http://hooks.test/a', [1, 5]), ('http://hooks.test/a', [2]),
+            ('http://hooks.test/b', [3]), ('http://hooks.test/a', [4]),
+        ])
+        self.assertFalse(WebhookDelivery.objects.filter(status='pending').exists())
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        delivery = self.enqueue(api_key=self.client_key)
+        for attempt in (1, 2):
+            with self.post(500):
+                before = timezone.now()
+                self.dispatcher.process_due()
+            delivery.refresh_from_db()
+            self.assertEqual((delivery.status, delivery.attempts, delivery.last_error), ('pending', attempt, 'HTTP 500'))
+            # Задержка WEBHOOK_RETRY_BASE * 2^(попытка-1) с джиттером +-20%
+            delay = (delivery.next_attempt_at - before).total_seconds()
+            self.assertGreaterEqual(delay, 2 * 2 ** (attempt - 1) * 0.8 - 0.1)
+            self.assertLessEqual(delay, 2 * 2 ** (attempt - 1) * 1.2 + 0.1)
+            WebhookDelivery.objects.filter(id=delivery.id).update(next_attempt_at=timezone.now())
+        self.assertEqual(self.dispatcher.get_stats()['retried'], 2)
+
+    def test_retry_counts_attempts_in_database(self):
+        delivery = self.enqueue(api_key=self.client_key)
+        claimed = self.dispatcher._claim_due()[1]
+        # Счетчик изменился после захвата (например, попытка другого процесса)
+        WebhookDelivery.objects.filter(id=delivery.id).update(attempts=1)
+        self.dispatcher._schedule_retry(claimed[0], 'HTTP 502')
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.attempts, 2)
+
+    def test_last_attempt_moves_to_dead_letter(self):
+        delivery = self.enqueue(api_key=self.client_key, attempts=2)
+        with self.post(503), self.assertLogs('car_detector.webhooks', 'WARNING') as logs:
+            self.dispatcher.process_due()
+        self.assertIn('moved to dead letter after 3 attempts', logs.output[0])
+
+        self.assertFalse(WebhookDelivery.objects.filter(id=delivery.id).exists())
+        dead_letter = WebhookDeadLetter.objects.get()
+        self.assertEqual((dead_letter.attempts, dead_letter.last_error), (3, 'HTTP 503'))
+        self.assertEqual((dead_letter.api_key_id, dead_letter.payload), (self.client_key.id, delivery.payload))
+        self.assertEqual(self.dispatcher.get_stats()['dead'], 1)
+
+    @override_settings(WEBHOOK_SECRET='')
+    def test_delivery_without_secret_is_not_sent(self):
+        self.enqueue(api_key=None)
+        with self.post() as post, self.assertLogs('car_detector.webhooks', 'WARNING'):
+            self.dispatcher.process_due()
+        post.assert_not_called()
+        self.assertEqual(WebhookDeadLetter.objects.get().last_error, 'webhook signing secret is not configured')
+
+    def test_claim_is_exclusive(self):
+        self.enqueue(api_key=self.client_key, number=1)
+        self.enqueue(api_key=self.client_key, number=2)
+        lease_until, claimed = self.dispatcher._claim_due()
+        self.assertEqual(len(claimed), 2)
+        self.assertGreater(lease_until, timezone.now())
+        # Второй воркер не видит захваченных записей, пока действует аренда
+        self.assertIsNone(WebhookDispatcher()._claim_due())
+        with self.post() as post:
+            WebhookDispatcher().process_due()
+        post.assert_not_called()
+
+    def test_batch_is_not_sent_after_lease_expires(self):
+        delivery = self.enqueue(api_key=self.client_key)
+        _, claimed = self.dispatcher._claim_due()
+        with self.post() as post, self.assertLogs('car_detector.webhooks', 'WARNING'):
+            self.dispatcher._deliver_batch(delivery.url, claimed, timezone.now())
+        post.assert_not_called()
+        delivery.refresh_from_db()
+        self.assertEqual((delivery.status, delivery.attempts), ('pending', 0))
+
+
+class WeightedSemaphoreTests(SimpleTestCase):
+    """Взвешенный допуск: емкость, очередь FIFO, отмена ожидания, 429 и 503"""
+
+    def semaphore(self, capacity=10, max_waiters=4, max_wait=5.0):
+        return WeightedSemaphore('test', capacity=capacity, max_waiters=max_waiters, max_wait=max_wait)
+
+    def test_weighted_acquire_and_release(self):
+        async def scenario():
+            semaphore = self.semaphore()
+            await semaphore.acquire_async(6)
+            large = asyncio.ensure_future(semaphore.acquire_async(5))
+            await asyncio.sleep(0)
+            # Очередь FIFO: легкий запрос не обходит ожидающий тяжелый
+            small = asyncio.ensure_future(semaphore.acquire_async(1))
+            await asyncio.sleep(0)
+            self.assertFalse(large.done() or small.done())
+            self.assertEqual(semaphore.snapshot()['waiting'], 2)
+
+            semaphore.release(6)
+            self.assertEqual(await large, 5)
+            self.assertEqual(await small, 1)
+            self.assertEqual((semaphore.in_use, semaphore.holders), (6, 2))
+            semaphore.release(5)
+            semaphore.release(1)
+            self.assertEqual((semaphore.in_use, semaphore.holders), (0, 0))
+
+        asyncio.run(scenario())
+
+    def test_weight_above_capacity_is_clamped(self):
+        semaphore = self.semaphore()
+        self.assertEqual(semaphore.acquire(25, timeout=0.1), 10)
+        self.assertEqual(semaphore.in_use, 10)
+
+    def test_cancelled_waiter_leaves_queue(self):
+        async def scenario():
+            semaphore = self.semaphore()
+            await semaphore.acquire_async(8)
+            waiter = asyncio.ensure_future(semaphore.acquire_async(5))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual((semaphore.in_use, semaphore.holders, semaphore.snapshot()['waiting']), (8, 1, 0))
+            self.assertEqual(semaphore.rejected, 1)
+
+        asyncio.run(scenario())
+
+    def test_cancellation_after_grant_releases_weight(self):
+        async def scenario():
+            semaphore = self.semaphore()
+            await semaphore.acquire_async(8)
+            waiter = asyncio.ensure_future(semaphore.acquire_async(5))
+            await asyncio.sleep(0)
+            # Задача отменена, а разрешение выдано раньше, чем она успела выйти из очереди
+            waiter.cancel()
+            semaphore.release(8)
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual((semaphore.in_use, semaphore.holders), (0, 0))
+
+        asyncio.run(scenario())
+
+    def test_full_queue_is_rejected_with_429(self):
+        semaphore = self.semaphore(max_waiters=1)
+        semaphore.acquire(10)
+        waiter = threading.Thread(target=lambda: semaphore.acquire(1, timeout=5))
+        waiter.start()
+        try:
+            while semaphore.snapshot()['waiting'] < 1:
+                waiter.join(0.01)
+            with self.assertRaises(AdmissionRejected) as rejected:
+                semaphore.acquire(1)
+            self.assertEqual(rejected.exception.status, 429)
+            self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        finally:
+            semaphore.release(10)
+            waiter.join()
+        self.assertEqual((semaphore.in_use, semaphore.rejected), (1, 1))
+
+    def test_wait_timeout_is_rejected_with_503(self):
+        semaphore = self.semaphore(max_wait=0.05)
+        semaphore.acquire(10)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            semaphore.acquire(1)
+        self.assertEqual(rejected.exception.status, 503)
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        self.assertEqual(semaphore.snapshot()['waiting'], 0)
+
+        async def scenario():
+            with self.assertRaises(AdmissionRejected) as rejected:
+                await semaphore.acquire_async(1, timeout=0.05)
+            self.assertEqual(rejected.exception.status, 503)
+
+        asyncio.run(scenario())
+        self.assertEqual((semaphore.in_use, semaphore.rejected), (10, 2))
+
+
+class PrioritySchedulerTests(SimpleTestCase):
+    """Полосы планировщика: WFQ, резерв interactive, защита от голодания"""
+
+    def scheduler(self, capacity=1, reserved=0, starvation=60.0, max_queue=20, max_wait=5.0):
+        lanes = {
+            lane: {'weight': weight, 'max_queue': max_queue, 'max_wait': max_wait}
+            for lane, weight in (('interactive', 4), ('standard', 2), ('batch', 1))
+        }
+        return PriorityScheduler('test', capacity, lanes, reserved_interactive=reserved,
+                                 starvation_timeout=starvation)
+
+    @staticmethod
+    async def enqueue(scheduler, lane):
+        task = asyncio.ensure_future(scheduler.acquire_async(1, lane))
+        await asyncio.sleep(0)
+        return lane, task
+
+    async def grant_order(self, scheduler, waiters, holder_lane):
+        """Освобождает слоты по одному и возвращает полосы в порядке выдачи"""
+        order = []
+        release_lane = holder_lane
+        for _ in waiters:
+            scheduler.release(1, lane=release_lane)
+            # Несколько итераций цикла: пробуждение идет через call_soon_threadsafe
+            for _ in range(5):
+                await asyncio.sleep(0)
+            granted = [(lane, task) for lane, task in waiters if task.done() and task not in order]
+            self.assertEqual(len(granted), 1)
+            release_lane, task = granted[0]
+            order.append(task)
+        scheduler.release(1, lane=release_lane)
+        return [next(lane for lane, task in waiters if task is granted) for granted in order]
+
+    def test_interactive_overtakes_batch(self):
+        async def scenario():
+            scheduler = self.scheduler()
+            await scheduler.acquire_async(1, 'batch')
+            waiters = [await self.enqueue(scheduler, lane) for lane in ('batch', 'batch', 'interactive')]
+            order = await self.grant_order(scheduler, waiters, 'batch')
+            self.assertEqual(order, ['interactive', 'batch', 'batch'])
+            self.assertEqual(scheduler.in_use, 0)
+
+        asyncio.run(scenario())
+
+    def test_slots_are_shared_by_weight(self):
+        async def scenario():
+            scheduler = self.scheduler()
+            await scheduler.acquire_async(1, 'standard')
+            waiters = [await self.enqueue(scheduler, 'batch') for _ in range(5)]
+            waiters += [await self.enqueue(scheduler, 'interactive') for _ in range(5)]
+            order = await self.grant_order(scheduler, waiters, 'standard')
+            # Вес 4:1 - batch получает слот после серии interactive, а не после всей очереди
+            self.assertEqual(order[:5].count('interactive'), 4)
+            self.assertEqual(sorted(order), ['batch'] * 5 + ['interactive'] * 5)
+
+        asyncio.run(scenario())
+
+    def test_reserved_slots_are_interactive_only(self):
+        async def scenario():
+            scheduler = self.scheduler(capacity=2, reserved=1)
+            await scheduler.acquire_async(1, 'batch')
+            _, batch = await self.enqueue(scheduler, 'batch')
+            self.assertFalse(batch.done())
+            self.assertEqual(await scheduler.acquire_async(1, 'interactive'), 1)
+            self.assertEqual(scheduler.in_use, 2)
+            scheduler.release(1, lane='interactive')
+            scheduler.release(1, lane='batch')
+            await batch
+            scheduler.release(1, lane='batch')
+
+        asyncio.run(scenario())
+
+    def test_starving_batch_waiter_is_promoted(self):
+        async def scenario():
+            scheduler = self.scheduler(starvation=0.05)
+            await scheduler.acquire_async(1, 'interactive')
+            waiters = [await self.enqueue(scheduler, 'batch')]
+            await asyncio.sleep(0.06)
+            waiters += [await self.enqueue(scheduler, 'interactive') for _ in range(3)]
+            order = await self.grant_order(scheduler, waiters, 'interactive')
+            self.assertEqual(order, ['batch', 'interactive', 'interactive', 'interactive'])
+            self.assertEqual(scheduler.snapshot()['lanes']['batch']['promoted'], 1)
+
+        asyncio.run(scenario())
+
+    def test_lane_queue_full_is_429_and_wait_timeout_is_503(self):
+        async def scenario():
+            scheduler = self.scheduler(max_queue=1, max_wait=0.05)
+            await scheduler.acquire_async(1, 'standard')
+            _, batch = await self.enqueue(scheduler, 'batch')
+            with self.assertRaises(AdmissionRejected) as rejected:
+                await scheduler.acquire_async(1, 'batch')
+            self.assertEqual(rejected.exception.status, 429)
+            self.assertIn('batch', str(rejected.exception))
+            with self.assertRaises(AdmissionRejected) as rejected:
+                await batch
+            self.assertEqual(rejected.exception.status, 503)
+            lanes = scheduler.snapshot()['lanes']
+            self.assertEqual((lanes['batch']['waiting'], scheduler.in_use), (0, 1))
+
+        asyncio.run(scenario())
+
+
+def _image_upload(name='car.png', color=(200, 30, 30), size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+GEMINI_RESULT = {
+    'integrity': {'label': 'damaged', 'confidence': 0.9},
+    'cleanliness': {'label': 'clean', 'confidence': 0.8},
+    'damage_details': {'parts': [{'part': 'hood', 'type': 'dent', 'confidence': 0.8, 'bbox': [0.1, 0.1, 0.5, 0.5]}]},
+    'environment': {},
+    'uncertain': False,
+    'notes': '',
+}
+
+YOLO_RESULT = {
+    'detections': [{'class': 'bonnet-dent', 'confidence': 0.7, 'bbox': [0.1, 0.1, 0.5, 0.5]}],
+    'average_confidence': 0.7,
+}
+
+
+@override_settings(API_KEYS_REQUIRED=False, WEBHOOK_ALLOW_PRIVATE_HOSTS=True, WEBHOOK_IN_PROCESS=False,
+                   WEBHOOK_SECRET='shared-secret')
+class PartialResultTests(TransactionTestCase):
+    """Бюджет задержки: частичный ответ YOLO и дописывание Gemini в фоне"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.gemini_paths = []
+        self.gemini_delay = 0.0
+
+        async def analyze_gemini_async(image_path, priority):
+            self.gemini_paths.append(image_path)
+            await asyncio.sleep(self.gemini_delay)
+            return GEMINI_RESULT
+
+        async def analyze_yolo_async(image_path, priority):
+            return YOLO_RESULT
+
+        for name, value in (('analyze_gemini_async', analyze_gemini_async),
+                            ('analyze_yolo_async', analyze_yolo_async),
+                            ('yolo_detector', mock.Mock()),
+                            ('_model_versions', {'gemini': 'gemini-test', 'yolo': 'yolo-test'})):
+            patcher = mock.patch.object(car_analysis_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def analyze(self, budget_ms):
+        return self.client.post(
+            reverse('api_analyze'),
+            {'image': _image_upload(), 'callback_url': 'http://hooks.test/done'},
+            HTTP_X_LATENCY_BUDGET=str(budget_ms),
+        )
+
+    def wait_for(self, condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('condition was not met in time')
+            time.sleep(0.02)
+
+    def test_deadline_returns_partial_yolo_result_and_completes_in_background(self):
+        self.gemini_delay = 0.3
+        response = self.analyze(budget_ms=20)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['partial'])
+        self.assertEqual(data['status'], 'partial')
+        self.assertIsNone(data['results']['gemini'])
+        self.assertEqual(data['results']['yolo'], YOLO_RESULT)
+        analysis = CarAnalysis.objects.get(id=data['analysis_id'])
+        self.assertEqual((analysis.status, analysis.yolo_detection_count), ('partial', 1))
+        # Частичный результат не уведомляет клиента; файл нужен фоновому Gemini
+        self.assertFalse(WebhookDelivery.objects.exists())
+        temp_path, = self.gemini_paths
+        self.assertTrue(os.path.exists(temp_path))
+
+        self.wait_for(lambda: WebhookDelivery.objects.exists())
+        analysis.refresh_from_db()
+        self.assertEqual(analysis.status, 'complete')
+        self.assertEqual((analysis.gemini_integrity_label, analysis.gemini_damage_count), ('damaged', 1))
+        self.assertIsNotNone(analysis.agreement_score)
+        self.assertEqual(analysis.damage_items.filter(source='gemini').count(), 1)
+        delivery = WebhookDelivery.objects.get()
+        self.assertEqual((delivery.url, delivery.analysis_id), ('http://hooks.test/done', analysis.id))
+        self.assertEqual(delivery.payload['status'], 'complete')
+        self.wait_for(lambda: not os.path.exists(temp_path))
+
+    def test_result_within_budget_is_complete(self):
+        response = self.analyze(budget_ms=5000)
+
+        data = response.json()
+        self.assertFalse(data['partial'])
+        self.assertEqual(data['status'], 'complete')
+        self.assertEqual(data['results']['gemini'], GEMINI_RESULT)
+        self.assertEqual(WebhookDelivery.objects.get().analysis_id, data['analysis_id'])
+        temp_path, = self.gemini_paths
+        self.assertFalse(os.path.exists(temp_path))
+
+
+class AnalyzeDirResumeTests(TransactionTestCase):
+    """analyze_dir: повторный запуск после сбоя не создает записи и копии файлов второй раз"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.photos = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.addCleanup(shutil.rmtree, self.photos)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        for index in range(3):
+            Image.new('RGB', (16, 16), (index * 60, 0, 0)).save(os.path.join(self.photos, f'car{index}.jpg'))
+        self.checkpoint = os.path.join(self.photos, 'run.checkpoint')
+
+        self.analyzed = []
+
+        async def analyze_gemini_async(image_path, priority):
+            self.analyzed.append(image_path)
+            return GEMINI_RESULT
+
+        async def analyze_yolo_async(image_path, priority):
+            return YOLO_RESULT
+
+        for name, value in (('analyze_gemini_async', analyze_gemini_async),
+                            ('analyze_yolo_async', analyze_yolo_async),
+                            ('_model_versions', {'gemini': 'gemini-test', 'yolo': 'yolo-test'})):
+            patcher = mock.patch.object(car_analysis_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_command(self):
+        call_command('analyze_dir', self.photos, checkpoint=self.checkpoint, yolo_workers=0,
+                     batch_size=10, stdout=io.StringIO())
+
+    def stored_images(self):
+        return sorted(os.listdir(os.path.join(self.media_root, 'car_images')))
+
+    def test_crash_after_insert_does_not_duplicate_rows(self):
+        with mock.patch.object(AnalyzeDirCommand, '_write_batch', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                self.run_command()
+        self.assertEqual(CarAnalysis.objects.count(), 3)
+        self.assertEqual(len(self.analyzed), 3)
+
+        self.run_command()
+        self.assertEqual(CarAnalysis.objects.count(), 3)
+        self.assertEqual(DamageItem.objects.filter(source='gemini').count(), 3)
+        self.assertEqual(len(self.analyzed), 3)
+        self.assertEqual(len(self.stored_images()), 3)
+
+        # Контрольная точка отмечает все фотографии: третий запуск ничего не делает
+        self.run_command()
+        self.assertEqual((CarAnalysis.objects.count(), len(self.analyzed)), (3, 3))
+
+    def test_crash_before_insert_redoes_batch_without_orphan_copies(self):
+        with mock.patch.object(CarAnalysis.objects, 'abulk_create', side_effect=RuntimeError('crash')):
+            with self.assertRaises(RuntimeError):
+                self.run_command()
+        self.assertEqual(CarAnalysis.objects.count(), 0)
+        self.assertEqual(len(self.stored_images()), 3)
+
+        self.run_command()
+        self.assertEqual(len(self.analyzed), 6)
+        self.assertEqual(CarAnalysis.objects.count(), 3)
+        self.assertEqual(
+            sorted(os.path.basename(name) for name in CarAnalysis.objects.values_list('image', flat=True)),
+            self.stored_images(),
+        )
+
+
+class IdempotencyTests(SimpleTestCase):
+    """Idempotency-Key и single-flight декоратора idempotent"""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.calls = []
+
+        @idempotent
+        async def view(request):
+            self.calls.append(request)
+            number = len(self.calls)
+            await asyncio.sleep(0.05)
+            return JsonResponse({'call': number})
+
+        self.view = view
+
+    def post(self, photos, data=None, **headers):
+        files = [SimpleUploadedFile(f'{i}.jpg', content, 'image/jpeg') for i, content in enumerate(photos)]
+        request = self.factory.post('/api/inspections/', {'image': files, **(data or {})}, headers=headers)
+        request.api_key = None
+        return request
+
+    async def test_identical_requests_share_one_call(self):
+        first, second = await asyncio.gather(self.view(self.post([b'car'])), self.view(self.post([b'car'])))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+    async def test_same_image_with_different_parameters_is_not_merged(self):
+        for variant in [
+            {'data': {'callback_url': 'https://a.example/hook'}},
+            {'data': {'callback_url': 'https://b.example/hook'}},
+            {'X-Callback-Url': 'https://c.example/hook'},
+            {'X-Latency-Budget': '500'},
+            {'X-Priority': 'batch'},
+            {'data': {'vehicle_id': 'VIN1'}},
+            {'data': {'gemini': 'false'}},
+        ]:
+            self.calls.clear()
+            data = variant.pop('data', None)
+            await asyncio.gather(self.view(self.post([b'car'])), self.view(self.post([b'car'], data, **variant)))
+            with self.subTest(variant=data or variant):
+                self.assertEqual(len(self.calls), 2)
+
+    async def test_key_replays_stored_response(self):
+        first = await self.view(self.post([b'car'], **{'Idempotency-Key': 'k1'}))
+        replay = await self.view(self.post([b'car'], **{'Idempotency-Key': 'k1'}))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(replay.content, first.content)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+    async def test_key_reused_with_different_parameters_conflicts(self):
+        await self.view(self.post([b'car'], {'callback_url': 'https://a.example/hook'}, **{'Idempotency-Key': 'k2'}))
+        response = await self.view(self.post([b'car'], {'callback_url': 'https://b.example/hook'},
+                                             **{'Idempotency-Key': 'k2'}))
+        self.assertEqual(response.status_code, 422)
+        response = await self.view(self.post([b'car'], **{'Idempotency-Key': 'k2', 'X-Latency-Budget': '100'}))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(self.calls), 1)
+
+    async def test_multi_photo_requests_are_not_merged_by_last_photo(self):
+        first, second = await asyncio.gather(
+            self.view(self.post([b'front', b'left', b'shared'])),
+            self.view(self.post([b'rear', b'right', b'shared'])),
+        )
+        self.assertEqual(len(self.calls), 2)
+        self.assertNotEqual(json.loads(first.content), json.loads(second.content))
+        self.assertFalse(second.has_header('Idempotent-Replayed'))
+
+    async def test_key_reused_with_different_photo_set_conflicts(self):
+        await self.view(self.post([b'front', b'shared'], **{'Idempotency-Key': 'session-1'}))
+        response = await self.view(self.post([b'rear', b'shared'], **{'Idempotency-Key': 'session-1'}))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(self.calls), 1)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Объединение вызовов SingleFlight и отмена"""
+
+    async def test_cancelled_waiter_does_not_cancel_original(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 'done'
+
+        original = asyncio.ensure_future(flight.do('k', 'f', work))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do('k', 'f', work))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        self.assertEqual(await original, ('done', False))
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(flight.get_stats(), {'in_flight': 0, 'executed': 1, 'coalesced': 1})
+
+    async def test_cancelled_original_fails_waiters_and_releases_key(self):
+        flight = SingleFlight()
+
+        async def hang():
+            await asyncio.sleep(3600)
+
+        original = asyncio.ensure_future(flight.do('k', 'f', hang))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do('k', 'f', hang))
+        await asyncio.sleep(0)
+        original.cancel()
+        with self.assertRaises(RuntimeError):
+            await waiter
+        with self.assertRaises(asyncio.CancelledError):
+            await original
+        self.assertEqual(flight.get_stats()['in_flight'], 0)
+
+        async def quick():
+            return 'again'
+
+        self.assertEqual(await flight.do('k', 'f', quick), ('again', False))
+
+    async def test_conflicting_fingerprint_raises(self):
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+
+        original = asyncio.ensure_future(flight.do('k', 'f1', work))
+        await asyncio.sleep(0)
+        with self.assertRaises(IdempotencyConflict):
+            await flight.do('k', 'f2', work)
+        release.set()
+        await original
+
+
+class RateLimitTests(SimpleTestCase):
+    """Token bucket ключа: rate_per_minute = 0 - без ограничения скорости"""
+
+    def test_zero_rate_is_unlimited(self):
+        store = MemoryCounterStore()
+        self.assertEqual(store.take_token('bucket', rate=0, burst=1), 0.0)
+        self.assertEqual(store.take_token('bucket', rate=0, burst=1), 0.0)
+
+    def test_key_with_zero_rate_is_admitted(self):
+        api_key = ApiKey(id=10**6, name='unlimited', rate_per_minute=0, burst=0, max_concurrent=100, daily_quota=0)
+        for _ in range(5):
+            quota_reserved = _acquire(api_key, counts_as_analysis=True)
+            _release(api_key, quota_reserved, 200)
+
+
+class ReplayQuotaTests(SimpleTestCase):
+    """Повтор по Idempotency-Key и объединенный дубликат не расходуют квоту"""
+
+    def setUp(self):
+        cache.clear()
+        self.api_key = ApiKey(id=10**6 + 1, name='client', rate_per_minute=0, max_concurrent=10, daily_quota=5)
+        for target, attribute, value in ((api_keys, 'counter_store', MemoryCounterStore()),
+                                         (api_keys, '_lookup_key', lambda raw_key: self.api_key)):
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.calls = 0
+
+        @api_key_required()
+        @idempotent
+        async def view(request):
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return JsonResponse({'success': True})
+
+        self.view = view
+
+    def post(self, **headers):
+        request = RequestFactory().post(
+            '/api/analyze/', {'image': SimpleUploadedFile('car.jpg', b'car', 'image/jpeg')},
+            headers={'X-API-Key': 'cak_test', **headers},
+        )
+        return self.view(request)
+
+    def usage(self):
+        usage = api_keys.get_usage(self.api_key)
+        return usage['quota_remaining'], usage['history'][0]['analyses']
+
+    async def test_replayed_response_is_not_charged(self):
+        first = await self.post(**{'Idempotency-Key': 'retry-1'})
+        replay = await self.post(**{'Idempotency-Key': 'retry-1'})
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.usage(), (4, 1))
+
+    async def test_coalesced_duplicate_is_not_charged(self):
+        await asyncio.gather(self.post(), self.post())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.usage(), (4, 1))
+
+
+class ApiKeyCacheTests(TestCase):
+    """Кеш ключей в процессе ограничен и не хранит промахи"""
+
+    def setUp(self):
+        api_keys._key_cache.clear()
+        self.addCleanup(api_keys._key_cache.clear)
+
+    def create_key(self, name):
+        api_key = ApiKey(name=name)
+        raw_key = api_key.set_new_key()
+        api_key.save()
+        return raw_key
+
+    def test_unknown_keys_are_not_cached(self):
+        for i in range(50):
+            self.assertIsNone(api_keys._lookup_key(f'cak_random_{i}'))
+        self.assertEqual(len(api_keys._key_cache), 0)
+
+    def test_cache_is_bounded(self):
+        raw_keys = [self.create_key(f'client-{i}') for i in range(5)]
+        with mock.patch.object(api_keys, 'KEY_CACHE_SIZE', 3):
+            for raw_key in raw_keys:
+                self.assertIsNotNone(api_keys._lookup_key(raw_key))
+            self.assertEqual(len(api_keys._key_cache), 3)
+            self.assertIn(ApiKey.hash_key(raw_keys[-1]), api_keys._key_cache)
+            self.assertNotIn(ApiKey.hash_key(raw_keys[0]), api_keys._key_cache)
+
+
+class InferenceClientTests(SimpleTestCase):
+    """Исключение узлов инференса: только при недоступности, не при ошибке запроса"""
+
+    def start_server(self, status):
+        calls = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                calls.append(self.path)
+                body = json.dumps({'detections': []} if status == 200 else {'error': 'failed'}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_port}', calls
+
+    def test_client_error_is_raised_without_failover(self):
+        bad_request_url, bad_request_calls = self.start_server(400)
+        healthy_url, healthy_calls = self.start_server(200)
+        client = RemoteInferenceClient([bad_request_url, healthy_url], timeout=5)
+        with self.assertRaises(InferenceRequestError):
+            client.detect_bytes(b'not an image')
+        self.assertEqual(len(bad_request_calls), 1)
+        self.assertEqual(healthy_calls, [])
+        self.assertTrue(all(stats['available'] for stats in client.get_stats()))
+
+    def test_server_error_fails_over_and_marks_node_down(self):
+        failing_url, _ = self.start_server(500)
+        healthy_url, healthy_calls = self.start_server(200)
+        client = RemoteInferenceClient([failing_url, healthy_url], timeout=5)
+        self.assertEqual(client.detect_bytes(b'image'), [])
+        self.assertEqual(len(healthy_calls), 1)
+        availability = {stats['url']: stats['available'] for stats in client.get_stats()}
+        self.assertEqual(availability, {failing_url: False, healthy_url: True})
+
+
+def _hung_pool(timeout=0.05):
+    """Пул с воркером, который "жив", но не отвечает: задачи остаются в его очереди"""
+    pool = InferencePool('weights.pt', workers=1, timeout=timeout)
+    state = _WorkerState(0)
+    state.process = mock.Mock(is_alive=mock.Mock(return_value=True))
+    state.request_queue = queue.Queue()
+    pool._workers = [state]
+    pool._owner_pid = os.getpid()
+    return pool, state
+
+
+class InferencePoolTimeoutTests(SimpleTestCase):
+    """Таймаут инференса в пуле освобождает задачу и сегмент shared memory"""
+
+    def hung_pool(self):
+        return _hung_pool()
+
+    def assert_released(self, pool, state, shm_name):
+        self.assertEqual(pool._pending, {})
+        self.assertEqual(state.in_flight, 0)
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shm_name)
+
+    def test_detect_timeout_releases_pending_and_segment(self):
+        pool, state = self.hung_pool()
+        with self.assertRaises(FutureTimeoutError):
+            pool.detect(np.zeros((4, 4, 3), dtype=np.uint8))
+        _, shm_name, *_ = state.request_queue.get_nowait()
+        self.assert_released(pool, state, shm_name)
+
+    def test_abandoned_future_fails_and_late_answer_is_ignored(self):
+        pool, state = self.hung_pool()
+        future = pool.submit(np.zeros((2, 2), dtype=np.uint8))
+        request_id, shm_name, *_ = state.request_queue.get_nowait()
+        pool.abandon(future)
+        self.assert_released(pool, state, shm_name)
+        with self.assertRaises(FutureTimeoutError):
+            future.result(timeout=0)
+        self.assertNotIn(request_id, pool._pending)
+        # Повторный вызов (например, для уже завершенных задач кадров) ничего не делает
+        pool.abandon(future)
+        self.assertEqual(state.in_flight, 0)
+
+
+class GeminiAsyncTests(SimpleTestCase):
+    """Блокирующие шаги analyze_async идут через run_blocking с контекстом запроса"""
+
+    def test_decode_runs_in_shared_executor_with_trace(self):
+        analyzer = GeminiAnalyzer()
+        analyzer.available = True
+        seen = {}
+
+        def load_as_jpeg_bytes(image_path):
+            seen['trace'] = current_trace()
+            seen['thread'] = threading.current_thread().name
+            return b'jpeg'
+
+        async def generate_text_async(image_bytes):
+            return '{}'
+
+        trace = Trace()
+        with mock.patch.object(analyzer, 'load_as_jpeg_bytes', load_as_jpeg_bytes), \
+                mock.patch.object(analyzer, '_generate_text_async', generate_text_async), \
+                mock.patch.object(analyzer, '_parse_response', return_value={'uncertain': False}):
+            with use_trace(trace):
+                result = asyncio.run(analyzer.analyze_async('photo.jpg'))
+
+        self.assertEqual(result, {'uncertain': False})
+        self.assertIs(seen['trace'], trace)
+        self.assertTrue(seen['thread'].startswith('car-analysis'))
+        self.assertIn('decode', trace.totals())
+
+
+class InferenceServerTests(SimpleTestCase):
+    """Сервер инференса: 503 при зависшем пуле, 413 для слишком большого тела"""
+
+    def start_server(self, backend, max_body=1024 * 1024):
+        server = InferenceHTTPServer(('127.0.0.1', 0), backend, max_body=max_body)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    def image_bytes(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, format='PNG')
+        return buffer.getvalue()
+
+    def test_hung_pool_returns_503_and_releases_tasks(self):
+        backend = InferenceBackend('missing.pt')
+        backend.pool, state = _hung_pool()
+        url = self.start_server(backend)
+
+        response = requests.post(f'{url}/detect-batch', data=pack_frames([self.image_bytes()] * 2), timeout=5)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(backend.pool._pending, {})
+        self.assertEqual(state.in_flight, 0)
+        health = backend.get_health()
+        self.assertEqual((health['in_flight'], health['errors']), (0, 1))
+
+    def test_oversized_body_is_rejected_with_413(self):
+        backend = InferenceBackend('missing.pt')
+        backend.detect_many = mock.Mock()
+        url = self.start_server(backend, max_body=1024)
+
+        response = requests.post(f'{url}/detect', data=b'x' * 4096, timeout=5)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.headers.get('Connection'), 'close')
+        backend.detect_many.assert_not_called()
+        response = requests.post(f'{url}/detect', data=b'x', headers={'Content-Length': 'abc'}, timeout=5)
+        self.assertEqual(response.status_code, 400)
+
+
+def _blocking_section():
+    return sum(range(1000))
+
+
+def _concurrent_request_work():
+    return sum(range(1000))
+
+
+class ProfilingTests(SimpleTestCase):
+    """Профиль async-запроса содержит его блокирующие участки, но не работу других запросов"""
+
+    def test_async_view_profiles_only_run_blocking_sections(self):
+        @traced
+        async def view(request):
+            await run_blocking(_blocking_section)
+            await asyncio.sleep(0.02)
+            return JsonResponse({})
+
+        async def other_request():
+            for _ in range(5):
+                _concurrent_request_work()
+                await asyncio.sleep(0.005)
+
+        async def scenario():
+            response, _ = await asyncio.gather(view(RequestFactory().get('/api/analyze/')), other_request())
+            return response
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            with override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_DIR=profile_dir):
+                response = asyncio.run(scenario())
+            profile_file, = os.listdir(profile_dir)
+            self.assertIn(response['X-Trace-Id'], profile_file)
+            functions = {name for _, _, name in pstats.Stats(os.path.join(profile_dir, profile_file)).stats}
+
+        self.assertIn('_blocking_section', functions)
+        self.assertNotIn('_concurrent_request_work', functions)
+
+
+def _gemini_part(part, damage_type, confidence=0.8, bbox=None):
+    return {'part': part, 'type': damage_type, 'confidence': confidence, 'bbox': bbox}
+
+
+def _yolo_detection(class_name, confidence=0.5, bbox=None):
+    return {'class': class_name, 'confidence': confidence, 'bbox': bbox}
+
+
+class FusionTests(SimpleTestCase):
+    """Сопоставление повреждений Gemini и детекций YOLO (fusion.py)"""
+
+    BOX = [0.1, 0.1, 0.4, 0.4]
+
+    def test_same_part_and_type_with_same_box(self):
+        damages, agreement = fusion.fuse_damages(
+            [_gemini_part('door_left_front', 'dent', 0.8, self.BOX)],
+            [_yolo_detection('doorouter-dent', 0.5, self.BOX)],
+        )
+        self.assertEqual(len(damages), 1)
+        self.assertEqual(damages[0]['sources'], ['gemini', 'yolo'])
+        self.assertEqual(damages[0]['iou'], 1.0)
+        # noisy-OR: 1 - (1 - 0.8) * (1 - 0.5)
+        self.assertEqual(damages[0]['confidence'], 0.9)
+        self.assertEqual(agreement, 1.0)
+
+    def test_group_only_match_has_partial_agreement(self):
+        # Headlight-Damage -> (headlight, broken_glass): группа совпала, тип нет
+        damages, agreement = fusion.fuse_damages(
+            [_gemini_part('headlight_left', 'crack', 0.8, self.BOX)],
+            [_yolo_detection('Headlight-Damage', 0.5, self.BOX)],
+        )
+        self.assertEqual(len(damages), 1)
+        self.assertEqual(agreement, 0.75)
+
+    def test_yolo_dent_does_not_match_other_damage_type(self):
+        damages, agreement = fusion.fuse_damages(
+            [_gemini_part('door_left_front', 'scratch', 0.8, self.BOX)],
+            [_yolo_detection('doorouter-dent', 0.5, self.BOX)],
+        )
+        self.assertEqual(sorted(item['sources'][0] for item in damages), ['gemini', 'yolo'])
+        self.assertEqual(agreement, 0.0)
+
+    def test_different_groups_do_not_match(self):
+        damages, _ = fusion.fuse_damages(
+            [_gemini_part('hood', 'dent', 0.8, self.BOX)],
+            [_yolo_detection('roof-dent', 0.5, self.BOX)],
+        )
+        self.assertEqual(len(damages), 2)
+
+    def test_bodypanel_dent_matches_any_body_panel(self):
+        damages, _ = fusion.fuse_damages(
+            [_gemini_part('fender_right', 'dent', 0.8, self.BOX)],
+            [_yolo_detection('Bodypanel-Dent', 0.5, self.BOX)],
+        )
+        self.assertEqual([item['sources'] for item in damages], [['gemini', 'yolo']])
+
+    def test_iou_gate(self):
+        gemini = [_gemini_part('hood', 'dent', 0.8, [0.0, 0.0, 0.1, 0.1])]
+        # Порог FUSION_MIN_IOU = 0.05; площади рамок 0.01
+        cases = [
+            ([0.5, 0.5, 0.6, 0.6], 2),        # IoU 0
+            ([0.05, 0.09, 0.15, 0.19], 2),    # пересечение 0.05 x 0.01, IoU ~0.026
+            ([0.05, 0.08, 0.15, 0.18], 1),    # пересечение 0.05 x 0.02, IoU ~0.053
+        ]
+        for bbox, expected in cases:
+            damages, _ = fusion.fuse_damages(gemini, [_yolo_detection('bonnet-dent', 0.5, bbox)])
+            with self.subTest(bbox=bbox):
+                self.assertEqual(len(damages), expected)
+
+    def test_gemini_part_without_bbox_matches_by_meaning(self):
+        damages, agreement = fusion.fuse_damages(
+            [_gemini_part('trunk', 'dent', 0.6)],
+            [_yolo_detection('boot-dent', 0.5, self.BOX)],
+        )
+        self.assertEqual(len(damages), 1)
+        self.assertEqual(damages[0]['bbox'], self.BOX)
+        self.assertEqual(damages[0]['iou'], 0.0)
+        # Геометрия не оценивается, смысл совпал полностью
+        self.assertEqual(agreement, 0.5)
+
+    def test_empty_results_agree(self):
+        self.assertEqual(fusion.fuse_damages([], []), ([], 1.0))
+        damages, agreement = fusion.fuse_damages([], [_yolo_detection('roof-dent', 0.5, self.BOX)])
+        self.assertEqual((len(damages), agreement), (1, 0.0))
+
+    def fuse_three_doors(self):
+        boxes = [[0.0, 0.0, 0.2, 0.2], [0.3, 0.0, 0.5, 0.2], [0.6, 0.0, 0.8, 0.2]]
+        gemini = [_gemini_part(f'door_{i}', 'dent', 0.8, box) for i, box in enumerate(boxes)]
+        # Детекции в обратном порядке и со сдвигом; уверенность 0.51..0.53 различает их в результате
+        yolo = [
+            _yolo_detection('doorouter-dent', 0.51 + i / 100, [box[0] + 0.02, box[1], box[2] + 0.02, box[3]])
+            for i, box in reversed(list(enumerate(boxes)))
+        ]
+        damages, _ = fusion.fuse_damages(gemini, yolo)
+        return {item['part']: item['yolo_confidence'] for item in damages}
+
+    def test_greedy_matching_pairs(self):
+        with mock.patch.object(fusion, 'linear_sum_assignment', None):
+            pairs = self.fuse_three_doors()
+        self.assertEqual(pairs, {'door_0': 0.51, 'door_1': 0.52, 'door_2': 0.53})
+
+    @unittest.skipIf(fusion.linear_sum_assignment is None, 'scipy not installed')
+    def test_hungarian_and_greedy_give_same_pairs(self):
+        hungarian = self.fuse_three_doors()
+        with mock.patch.object(fusion, 'linear_sum_assignment', None):
+            greedy = self.fuse_three_doors()
+        self.assertEqual(hungarian, greedy)
+
+    def test_fuse_results_trusted_threshold(self):
+        from car_detector.services import car_analysis_service
+
+        gemini = {'damage_details': {'parts': [_gemini_part('trunk', 'dent', 0.6)]}}
+        yolo = {'detections': [_yolo_detection('boot-dent', 0.5, self.BOX)]}
+        with self.settings(FUSION_TRUST_AGREEMENT=0.7):
+            result = car_analysis_service.fuse_results(gemini, yolo)
+            self.assertEqual(result['agreement'], 0.5)
+            self.assertFalse(result['trusted'])
+        with self.settings(FUSION_TRUST_AGREEMENT=0.5):
+            self.assertTrue(car_analysis_service.fuse_results(gemini, yolo)['trusted'])
+        self.assertIsNone(car_analysis_service.fuse_results(gemini, {'error': 'YOLO failed'}))
+        self.assertIsNone(car_analysis_service.fuse_results(None, yolo))
+
+
+class KeysetPaginationTests(TestCase):
+    """Постраничный вывод по курсору (created_at, id)"""
+
+    START = datetime(2026, 1, 1, 12, 0, 0, 123456, tzinfo=dt_timezone.utc)
+
+    def create_analyses(self, count, per_timestamp=1):
+        rows = [
+            CarAnalysis(
+                image='car_images/car.jpg', created_at=self.START + timedelta(seconds=i // per_timestamp),
+                gemini_integrity_label='undamaged', gemini_integrity_confidence=0.9,
+                gemini_cleanliness_label='clean', gemini_cleanliness_confidence=0.9,
+            )
+            for i in range(count)
+        ]
+        CarAnalysis.objects.bulk_create(rows)
+        return list(CarAnalysis.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def walk_forward(self, page_size):
+        pages = [keyset_page(CarAnalysis.objects.all(), page_size)]
+        while pages[-1].has_next:
+            pages.append(keyset_page(CarAnalysis.objects.all(), page_size, before=pages[-1].next_cursor))
+        return pages
+
+    def test_cursor_round_trip(self):
+        analysis = CarAnalysis(id=42, created_at=self.START)
+        self.assertEqual(decode_cursor(encode_cursor(analysis)), (self.START, 42))
+
+    def test_forged_cursor_gives_first_page(self):
+        expected = self.create_analyses(5)[:2]
+        for cursor in ['', 'garbage', '1.2.3', 'abc.1', '1718000000000000', '99999999999999999999999.1',
+                       '-5.x', '1718000000000000.']:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(decode_cursor(cursor))
+                page = keyset_page(CarAnalysis.objects.all(), 2, before=cursor, after=cursor)
+                self.assertEqual([item.id for item in page], expected)
+                self.assertFalse(page.has_previous)
+
+    def test_ties_on_created_at_are_neither_skipped_nor_repeated(self):
+        # По 4 записи на одну отметку времени, страница из 3: границы страниц внутри группы
+        expected = self.create_analyses(10, per_timestamp=4)
+        pages = self.walk_forward(3)
+        self.assertEqual([item.id for page in pages for item in page], expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+
+    def test_paging_back_from_last_page(self):
+        self.create_analyses(7, per_timestamp=2)
+        forward = self.walk_forward(3)
+        self.assertFalse(forward[-1].has_next)
+        back = [forward[-1]]
+        while back[-1].has_previous:
+            back.append(keyset_page(CarAnalysis.objects.all(), 3, after=back[-1].previous_cursor))
+        self.assertEqual([[item.id for item in page] for page in reversed(back)],
+                         [[item.id for item in page] for page in forward])
+        self.assertTrue(all(page.has_next for page in back[1:]))
+
+    def test_empty_table_and_page_past_the_end(self):
+        page = keyset_page(CarAnalysis.objects.all(), 3)
+        self.assertEqual((len(page), page.has_next, page.has_previous, page.has_other_pages), (0, False, False, False))
+        oldest = CarAnalysis.objects.get(id=self.create_analyses(2)[-1])
+        page = keyset_page(CarAnalysis.objects.all(), 3, before=encode_cursor(oldest))
+        self.assertEqual(len(page), 0)
+        self.assertIsNone(page.next_cursor)
+        self.assertIsNone(page.previous_cursor)
+
+
+def _write_walkaround_video(path, seconds=4, fps=10, blurred_seconds=(2,)):
+    """
+    Синтетический обход: камера сдвигается на 8 пикселей в секунду, резкий только
+    кадр 4 каждой секунды, секунды blurred_seconds размыты целиком
+    """
+    texture = (np.random.default_rng(0).random((30, 40, 3)) * 255).astype(np.uint8)
+    scene = cv2.resize(texture, (160, 120), interpolation=cv2.INTER_NEAREST)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (160, 120))
+    for index in range(seconds * fps):
+        second = index // fps
+        frame = np.roll(scene, 8 * second, axis=1)
+        if index % fps != 4 or second in blurred_seconds:
+            frame = cv2.GaussianBlur(frame, (15, 15), 5)
+        writer.write(frame)
+    writer.release()
+
+
+def _video_keyframe(detections=(), sharpness=100.0):
+    return {'detections': [_yolo_detection(name, confidence) for name, confidence in detections],
+            'sharpness': sharpness}
+
+
+def _gemini_frame(label='damaged', cleanliness='clean', parts=(), notes='', uncertain=False):
+    return {
+        'integrity': {'label': label, 'confidence': 0.9},
+        'cleanliness': {'label': cleanliness, 'confidence': 0.8},
+        'damage_details': {'overall_confidence': 0.7, 'parts': list(parts)},
+        'environment': {'lighting': 'day'},
+        'uncertain': uncertain,
+        'notes': notes,
+    }
+
+
+@override_settings(API_KEYS_REQUIRED=False)
+class VideoInspectionTests(TransactionTestCase):
+    """Видео-обход: ключевые кадры, трекинг повреждений, выбор кадров для Gemini и API"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.video_path = os.path.join(directory.name, 'walkaround.avi')
+        _write_walkaround_video(self.video_path)
+
+    def test_keyframes_skip_blurred_window_and_pick_sharpest_frame(self):
+        info = {}
+        keyframes = list(iter_keyframes(self.video_path, info, sample_fps=5, interval=1.0,
+                                        min_sharpness=1.0, max_keyframes=100, max_duration=100))
+
+        # Секунда 2 размыта целиком и отбрасывается на фоне резких кадров соседних окон
+        self.assertEqual([keyframe['frame_index'] for keyframe in keyframes], [4, 14, 34])
+        self.assertEqual(keyframes[0]['novelty'], 1.0)
+        self.assertTrue(all(keyframe['novelty'] > 0.02 for keyframe in keyframes))
+        self.assertEqual(keyframes[0]['frame'].shape, (120, 160, 3))
+        self.assertEqual((info['fps'], info['frames'], info['sampled_frames']), (10.0, 40, 20))
+        self.assertEqual((info['duration_s'], info['truncated']), (4.0, False))
+
+    def test_keyframe_limit_stops_decoding(self):
+        info = {}
+        keyframes = list(iter_keyframes(self.video_path, info, sample_fps=5, interval=1.0,
+                                        min_sharpness=1.0, max_keyframes=1, max_duration=100))
+        self.assertEqual([keyframe['frame_index'] for keyframe in keyframes], [4])
+        self.assertTrue(info['truncated'])
+        self.assertLess(info['frames'], 40)
+
+    def test_estimate_shift_follows_camera(self):
+        info = {}
+        gray = next(iter_keyframes(self.video_path, info, 5, 1.0, 1.0, 100, 100))['gray']
+        height, width = gray.shape
+        shifted = np.roll(gray, (height // 20, width // 10), axis=(0, 1))
+
+        dx, dy = estimate_shift(gray, shifted)
+        self.assertAlmostEqual(dx, 0.1, places=2)
+        self.assertAlmostEqual(dy, 0.05, places=2)
+        self.assertEqual(estimate_shift(None, gray), (0.0, 0.0))
+        self.assertEqual(estimate_shift(gray[:-1], gray), (0.0, 0.0))
+
+    def test_tracker_matches_by_iou_within_class(self):
+        tracker = DamageTracker()
+        tracker.update(0, 0.0, [_yolo_detection('dent', 0.5, [0.1, 0.1, 0.3, 0.3]),
+                                _yolo_detection('scratch', 0.4, [0.5, 0.5, 0.7, 0.7])])
+        # Та же вмятина чуть сдвинута; царапина на месте вмятины - другой класс, новый трек
+        tracker.update(1, 1.0, [_yolo_detection('dent', 0.8, [0.12, 0.1, 0.32, 0.3]),
+                                _yolo_detection('scratch', 0.6, [0.1, 0.1, 0.3, 0.3])])
+
+        damages = tracker.damages()
+        self.assertEqual([(damage['class'], damage['hits']) for damage in damages],
+                         [('dent', 2), ('scratch', 1), ('scratch', 1)])
+        dent = damages[0]
+        self.assertEqual((dent['confidence'], dent['best_keyframe'], dent['bbox']), (0.8, 1, [0.12, 0.1, 0.32, 0.3]))
+        self.assertEqual((dent['first_seen_s'], dent['last_seen_s']), (0.0, 1.0))
+        self.assertNotIn('_box', dent)
+        self.assertEqual([damage['class'] for damage in tracker.damages(min_hits=2)], ['dent'])
+
+    def test_tracker_applies_camera_shift(self):
+        box = [0.1, 0.1, 0.3, 0.3]
+        moved = [0.4, 0.1, 0.6, 0.3]
+        without_shift = DamageTracker()
+        without_shift.update(0, 0.0, [_yolo_detection('dent', 0.5, box)])
+        without_shift.update(1, 1.0, [_yolo_detection('dent', 0.5, moved)])
+        self.assertEqual(len(without_shift.tracks), 2)
+
+        with_shift = DamageTracker()
+        with_shift.update(0, 0.0, [_yolo_detection('dent', 0.5, box)])
+        with_shift.update(1, 1.0, [_yolo_detection('dent', 0.5, moved)], shift=(0.3, 0.0))
+        self.assertEqual([track['hits'] for track in with_shift.tracks], [2])
+
+    def test_tracker_gap_handling(self):
+        box = [0.2, 0.2, 0.4, 0.4]
+        tracker = DamageTracker(max_gap=1)
+        tracker.update(0, 0.0, [_yolo_detection('dent', 0.5, box)])
+        tracker.update(1, 0.5, [])
+        # Пропуск одного ключевого кадра допустим
+        tracker.update(2, 1.0, [_yolo_detection('dent', 0.5, box)])
+        self.assertEqual([track['hits'] for track in tracker.tracks], [2])
+        # Пропуск двух кадров - трек закрыт, та же рамка начинает новый
+        tracker.update(5, 2.5, [_yolo_detection('dent', 0.5, box)])
+        self.assertEqual([(track['track_id'], track['hits']) for track in tracker.tracks], [(1, 2), (2, 1)])
+
+    def test_pick_gemini_keyframes_one_per_segment(self):
+        keyframes = [
+            _video_keyframe(sharpness=50), _video_keyframe([('dent', 0.7)], sharpness=10),
+            _video_keyframe(sharpness=20), _video_keyframe(sharpness=90),
+            _video_keyframe([('scratch', 0.5)], sharpness=5), _video_keyframe(sharpness=30),
+        ]
+        # Отрезки [0, 1], [2, 3], [4, 5]: находки YOLO важнее резкости
+        self.assertEqual(pick_gemini_keyframes(keyframes, 3), [1, 3, 4])
+        self.assertEqual(pick_gemini_keyframes(keyframes[:2], 3), [0, 1])
+        self.assertEqual(pick_gemini_keyframes(keyframes, 0), [])
+        self.assertEqual(pick_gemini_keyframes([], 3), [])
+
+    def test_merge_gemini_results(self):
+        merged = merge_gemini_results([
+            (0, _gemini_frame('undamaged', 'dirty', notes='front')),
+            (2, _gemini_frame('damaged', 'clean', [_gemini_part('door', 'dent', 0.6)], notes='side')),
+            (3, {'error': 'timeout'}),
+            (5, _gemini_frame('damaged', 'dirty', [_gemini_part('door', 'dent', 0.9),
+                                                   _gemini_part('bumper', 'scratch', 0.5)],
+                              notes='side', uncertain=True)),
+            (6, _gemini_frame('undamaged', 'clean')),
+        ])
+
+        self.assertEqual(merged['integrity'], {'label': 'damaged', 'confidence': 0.9})
+        # Голоса 2:2 - побеждает более грязная оценка
+        self.assertEqual(merged['cleanliness']['label'], 'dirty')
+        parts = merged['damage_details']['parts']
+        self.assertEqual([(part['part'], part['type'], part['confidence'], part['keyframes']) for part in parts],
+                         [('door', 'dent', 0.9, [2, 5]), ('bumper', 'scratch', 0.5, [5])])
+        self.assertEqual(merged['notes'], 'front; side')
+        self.assertTrue(merged['uncertain'])
+        self.assertIsNone(merge_gemini_results([(0, {'error': 'timeout'}), (1, None)]))
+
+    def inspect(self, upload, **data):
+        return self.client.post(reverse('api_video_inspect'), {'video': upload, 'gemini': 'false', **data})
+
+    def test_endpoint_tracks_damage_across_keyframes(self):
+        def detect_frames(frames):
+            return [[_yolo_detection('dent', 0.4 + 0.1 * i, [0.2, 0.2, 0.6, 0.6])] for i in range(len(frames))]
+
+        with open(self.video_path, 'rb') as f:
+            upload = SimpleUploadedFile('walkaround.avi', f.read(), content_type='video/x-msvideo')
+        with mock.patch.object(car_analysis_service, 'detect_frames', side_effect=detect_frames):
+            response = self.inspect(upload)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['car_status'], data['damage_count'], data['damage_by_class']),
+                         ('damaged', 1, {'dent': 1}))
+        self.assertEqual(data['damages'][0]['hits'], 3)
+        self.assertEqual([keyframe['frame_index'] for keyframe in data['keyframes']], [4, 14, 34])
+        self.assertIsNone(data['gemini'])
+
+    def test_endpoint_rejects_bad_uploads(self):
+        response = self.inspect(SimpleUploadedFile('walkaround.gif', b'GIF89a', content_type='image/gif'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('.gif', response.json()['error'])
+
+        with override_settings(VIDEO_MAX_UPLOAD_MB=1):
+            response = self.inspect(SimpleUploadedFile('walkaround.mp4', b'\0' * (1024 * 1024 + 1),
+                                                       content_type='video/mp4'))
+        self.assertEqual(response.status_code, 413)
+
+        response = self.inspect(SimpleUploadedFile('walkaround.mp4', b'not a video' * 100, content_type='video/mp4'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['status'], 'error')
+
+
+def _session_photo(photo_id, parts=(), detections=(), status='complete', integrity=('damaged', 0.8),
+                   cleanliness=('clean', 0.8)):
+    return CarAnalysis(
+        id=photo_id, status=status,
+        gemini_integrity_label=integrity[0], gemini_integrity_confidence=integrity[1],
+        gemini_cleanliness_label=cleanliness[0], gemini_cleanliness_confidence=cleanliness[1],
+        gemini_damage_details={'parts': list(parts)}, yolo_detections=list(detections),
+    )
+
+
+@override_settings(API_KEYS_REQUIRED=False)
+class InspectionSessionTests(TransactionTestCase):
+    """Осмотр по нескольким ракурсам: сведение повреждений и POST /api/inspections/"""
+
+    def test_gemini_damages_merge_across_views_by_part_and_type(self):
+        damages = merge_damages([
+            _session_photo(1, [_gemini_part('door_left_front', 'dent', 0.6, [0.1, 0.1, 0.2, 0.2]),
+                               _gemini_part('hood', 'scratch', 0.5)]),
+            _session_photo(2, [_gemini_part('door_left_front', 'dent', 0.9, [0.3, 0.3, 0.4, 0.4])]),
+            _session_photo(3, [_gemini_part('door_left_front', 'scratch', 0.7)]),
+            # Ответ Gemini неудачного снимка не учитывается
+            _session_photo(4, [_gemini_part('roof', 'dent', 0.9)], status='failed'),
+        ])
+
+        self.assertEqual(
+            [(item['part'], item['type'], item['photos'], item['views'], item['best_photo'], item['confidence'])
+             for item in damages],
+            [('door_left_front', 'dent', [1, 2], 2, 2, 0.9),
+             ('door_left_front', 'scratch', [3], 1, 3, 0.7),
+             ('hood', 'scratch', [1], 1, 1, 0.5)],
+        )
+        self.assertEqual(damages[0]['bbox'], [0.3, 0.3, 0.4, 0.4])
+        self.assertEqual(damages[0]['part_group'], 'door')
+
+    def test_yolo_confirms_gemini_damage_preferring_same_photo(self):
+        damages = merge_damages([
+            _session_photo(1, [_gemini_part('door_left_front', 'dent', 0.9)]),
+            _session_photo(2, [_gemini_part('door_right_rear', 'dent', 0.5)],
+                           [_yolo_detection('doorouter-dent', 0.6)]),
+            # Ракурс без находок Gemini: YOLO подтверждает самое уверенное повреждение группы
+            _session_photo(3, [], [_yolo_detection('doorouter-dent', 0.4)]),
+        ])
+
+        by_part = {item['part']: item for item in damages}
+        self.assertEqual(set(by_part), {'door_left_front', 'door_right_rear'})
+        self.assertEqual(by_part['door_right_rear']['sources'], ['gemini', 'yolo'])
+        self.assertEqual(by_part['door_right_rear']['photos'], [2])
+        self.assertEqual(by_part['door_left_front']['sources'], ['gemini', 'yolo'])
+        self.assertEqual(by_part['door_left_front']['photos'], [1, 3])
+        # Уверенность подтвержденного повреждения остается уверенностью Gemini
+        self.assertEqual(by_part['door_left_front']['confidence'], 0.9)
+        self.assertEqual(by_part['door_left_front']['yolo_classes'], ['doorouter-dent'])
+
+    def test_unconfirmed_yolo_detections_become_group_damages(self):
+        damages = merge_damages([
+            _session_photo(1, [_gemini_part('hood', 'scratch', 0.5)],
+                           [_yolo_detection('Headlight-Damage', 0.4, [0.1, 0.1, 0.2, 0.2]),
+                            _yolo_detection('bonnet-dent', 0.7)]),
+            _session_photo(2, [], [_yolo_detection('Headlight-Damage', 0.8, [0.5, 0.5, 0.6, 0.6])]),
+        ])
+
+        by_key = {(item['part'], item['type']): item for item in damages}
+        headlight = by_key[('headlight', 'broken_glass')]
+        self.assertEqual((headlight['sources'], headlight['photos'], headlight['best_photo']), (['yolo'], [1, 2], 2))
+        self.assertEqual((headlight['confidence'], headlight['bbox']), (0.8, [0.5, 0.5, 0.6, 0.6]))
+        # Вмятина капота не подтверждает царапину Gemini - отдельное повреждение группы
+        self.assertEqual(by_key[('hood', 'dent')]['sources'], ['yolo'])
+        self.assertEqual(by_key[('hood', 'scratch')]['sources'], ['gemini'])
+        self.assertEqual(damages[0], headlight)
+
+    def test_summary_votes_and_failed_photos(self):
+        summary = summarize_photos([
+            _session_photo(1, integrity=('undamaged', 0.7), cleanliness=('clean', 0.9)),
+            _session_photo(2, [_gemini_part('hood', 'dent', 0.8)], integrity=('damaged', 0.85),
+                           cleanliness=('dirty', 0.6)),
+            _session_photo(3, status='failed', integrity=('damaged', 0.99), cleanliness=('dirty', 0.99)),
+        ])
+
+        self.assertEqual((summary['status'], summary['photo_count'], summary['failed_photos']), ('complete', 3, 1))
+        self.assertEqual((summary['integrity_label'], summary['integrity_confidence']), ('damaged', 0.85))
+        # Голоса 1:1 - побеждает более грязная оценка
+        self.assertEqual((summary['cleanliness_label'], summary['cleanliness_confidence']), ('dirty', 0.6))
+        self.assertEqual(summary['damage_count'], 1)
+
+    def test_create_session_from_repeated_image_fields(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        gemini = {**GEMINI_RESULT, 'damage_details': {'parts': [_gemini_part('door_left_front', 'dent', 0.8)]}}
+        yolo = {'detections': [_yolo_detection('doorouter-dent', 0.7)], 'average_confidence': 0.7}
+
+        async def analyze_gemini_async(image_path, priority):
+            return gemini
+
+        async def analyze_yolo_async(image_path, priority):
+            return yolo
+
+        with override_settings(MEDIA_ROOT=media_root.name), \
+                mock.patch.object(car_analysis_service, 'analyze_gemini_async', analyze_gemini_async), \
+                mock.patch.object(car_analysis_service, 'analyze_yolo_async', analyze_yolo_async), \
+                mock.patch.object(car_analysis_service, 'yolo_detector', mock.Mock()):
+            response = self.client.post(reverse('api_inspection_create'), {
+                'image': [_image_upload('front.png'), _image_upload('side.png'), _image_upload('rear.jpg')],
+                'vehicle_id': 'A123BC',
+            })
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        session = InspectionSession.objects.get(id=data['session_id'])
+        photos = list(CarAnalysis.objects.filter(session=session).order_by('id'))
+        self.assertEqual(data['photo_ids'], [photo.id for photo in photos])
+        self.assertEqual((session.vehicle_id, session.photo_count, data['photo_count']), ('A123BC', 3, 3))
+        damage, = data['damages']
+        self.assertEqual((damage['part'], damage['views'], damage['sources']), ('door_left_front', 3, ['gemini', 'yolo']))
+        self.assertEqual(DamageItem.objects.filter(analysis__session=session).count(), 6)
+
+        result = self.client.get(data['result_url']).json()
+        self.assertEqual((result['damage_count'], result['damages']), (1, data['damages']))
+
+    def test_too_many_photos_rejected(self):
+        with override_settings(INSPECTION_MAX_PHOTOS=2):
+            response = self.client.post(reverse('api_inspection_create'),
+                                        {'image': [_image_upload() for _ in range(3)]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(InspectionSession.objects.exists())
+
+
+OLD_GEMINI_DETAILS = {'parts': [_gemini_part('hood', 'scratch', 0.4)]}
+OLD_YOLO_DETECTIONS = [_yolo_detection('Headlight-Damage', 0.3)]
+
+
+class ReanalysisTests(TransactionTestCase):
+    """Повторный анализ записей, посчитанных прежними версиями моделей"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media = override_settings(MEDIA_ROOT=media_root.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        os.makedirs(os.path.join(media_root.name, 'car_images'))
+
+        self.calls = []
+        self.gemini_result = {**GEMINI_RESULT, 'damage_details': {
+            'parts': [_gemini_part('door_left_front', 'dent', 0.9), _gemini_part('bumper_front', 'scratch', 0.6)]
+        }}
+        self.yolo_result = {'detections': [_yolo_detection('doorouter-dent', 0.7)], 'average_confidence': 0.7}
+
+        async def analyze_gemini_async(image_path, priority):
+            self.calls.append(('gemini', os.path.basename(image_path)))
+            return self.gemini_result
+
+        async def analyze_yolo_async(image_path, priority):
+            self.calls.append(('yolo', os.path.basename(image_path)))
+            return self.yolo_result
+
+        for name, value in (('analyze_gemini_async', analyze_gemini_async),
+                            ('analyze_yolo_async', analyze_yolo_async),
+                            ('_model_versions', {'gemini': 'gemini-v2', 'yolo': 'yolo-v2'})):
+            patcher = mock.patch.object(car_analysis_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create(self, name, gemini_version='gemini-v1', yolo_version='yolo-v1', session=None):
+        with open(os.path.join(settings.MEDIA_ROOT, 'car_images', name), 'wb') as f:
+            f.write(b'image')
+        analysis = CarAnalysis.objects.create(
+            image=f'car_images/{name}', session=session,
+            gemini_integrity_label='damaged', gemini_integrity_confidence=0.5,
+            gemini_cleanliness_label='dirty', gemini_cleanliness_confidence=0.5,
+            gemini_damage_details=OLD_GEMINI_DETAILS, yolo_detections=OLD_YOLO_DETECTIONS,
+            gemini_model_version=gemini_version, yolo_model_version=yolo_version,
+        )
+        save_damage_items([analysis])
+        return analysis
+
+    def reanalyze(self, **kwargs):
+        return asyncio.run(reanalyze(CarAnalysis.objects.all(), rate=0, **kwargs))
+
+    def test_only_stale_stages_are_rerun_and_overwritten(self):
+        gemini_stale = self.create('a.png', yolo_version='yolo-v2')
+        current = self.create('b.png', gemini_version='gemini-v2', yolo_version='yolo-v2')
+        yolo_stale = self.create('c.png', gemini_version='gemini-v2')
+
+        stats = self.reanalyze()
+
+        self.assertEqual(sorted(self.calls), [('gemini', 'a.png'), ('yolo', 'c.png')])
+        self.assertEqual((stats['processed'], stats['updated'], stats['skipped']), (2, 2, 0))
+        gemini_stale.refresh_from_db()
+        self.assertEqual(gemini_stale.gemini_damage_details, self.gemini_result['damage_details'])
+        self.assertEqual((gemini_stale.gemini_model_version, gemini_stale.gemini_damage_count), ('gemini-v2', 2))
+        self.assertEqual(gemini_stale.yolo_detections, OLD_YOLO_DETECTIONS)
+        yolo_stale.refresh_from_db()
+        self.assertEqual(yolo_stale.gemini_damage_details, OLD_GEMINI_DETAILS)
+        self.assertEqual((yolo_stale.yolo_detections, yolo_stale.yolo_model_version),
+                         (self.yolo_result['detections'], 'yolo-v2'))
+        current.refresh_from_db()
+        self.assertEqual((current.gemini_damage_details, current.yolo_detections),
+                         (OLD_GEMINI_DETAILS, OLD_YOLO_DETECTIONS))
+
+    def test_failed_stage_keeps_previous_result(self):
+        self.gemini_result = {'error': 'quota exceeded'}
+        both_stale = self.create('a.png')
+        gemini_stale = self.create('b.png', yolo_version='yolo-v2')
+
+        with self.assertLogs('car_detector.reanalysis', 'WARNING') as logs:
+            stats = self.reanalyze()
+
+        self.assertEqual(len([line for line in logs.output if 'reanalysis.stage_failed' in line]), 2)
+        self.assertEqual((stats['updated'], stats['skipped']), (1, 1))
+        both_stale.refresh_from_db()
+        self.assertEqual((both_stale.gemini_damage_details, both_stale.gemini_model_version, both_stale.status),
+                         (OLD_GEMINI_DETAILS, 'gemini-v1', 'complete'))
+        self.assertEqual(both_stale.yolo_model_version, 'yolo-v2')
+        gemini_stale.refresh_from_db()
+        self.assertEqual((gemini_stale.gemini_damage_details, gemini_stale.gemini_model_version),
+                         (OLD_GEMINI_DETAILS, 'gemini-v1'))
+        # Неудачная стадия осталась устаревшей и будет повторена следующим запуском
+        self.calls.clear()
+        self.gemini_result = GEMINI_RESULT
+        self.assertEqual(self.reanalyze()['updated'], 2)
+        self.assertEqual(sorted(self.calls), [('gemini', 'a.png'), ('gemini', 'b.png')])
+
+    def test_resume_with_after_id_and_limit(self):
+        ids = [self.create(f'{i}.png').id for i in range(5)]
+
+        first = self.reanalyze(limit=2, chunk_size=10)
+        self.assertEqual((first['processed'], first['last_id']), (2, ids[1]))
+        self.calls.clear()
+        second = self.reanalyze(after_id=first['last_id'], chunk_size=2)
+        self.assertEqual((second['processed'], second['last_id']), (3, ids[4]))
+        self.assertEqual(sorted(name for stage, name in self.calls if stage == 'gemini'), ['2.png', '3.png', '4.png'])
+        # Все записи получили текущие версии: повторный запуск ничего не делает
+        self.calls.clear()
+        self.assertEqual(self.reanalyze()['processed'], 0)
+        self.assertEqual(self.calls, [])
+
+    def test_damage_items_and_session_summary_refreshed(self):
+        session = InspectionSession.objects.create(vehicle_id='A123BC')
+        photos = [self.create('front.png', session=session), self.create('side.png', session=session)]
+        asyncio.run(acomplete_session(session, photos))
+        session.refresh_from_db()
+        self.assertEqual([damage['part'] for damage in session.damages], ['hood', 'headlight'])
+
+        self.reanalyze()
+
+        items = DamageItem.objects.filter(analysis=photos[0]).order_by('source', '-confidence')
+        self.assertEqual([(item.source, item.part, item.damage_type) for item in items],
+                         [('gemini', 'door_left_front', 'dent'), ('gemini', 'bumper_front', 'scratch'),
+                          ('yolo', 'door', 'dent')])
+        self.assertEqual(DamageItem.objects.filter(part='hood').count(), 0)
+        session.refresh_from_db()
+        self.assertEqual([(damage['part'], damage['views']) for damage in session.damages],
+                         [('door_left_front', 2), ('bumper_front', 2)])
+        self.assertEqual((session.damage_count, session.cleanliness_label), (2, 'clean'))
+
+
+class GeminiCassetteTests(SimpleTestCase):
+    """Запись ответов Gemini на диск и воспроизведение без обращения к API"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_record_then_replay(self):
+        recorder = GeminiCassette(self.directory, 'record')
+        generate = mock.Mock(return_value='{"integrity": "damaged"}')
+        self.assertEqual(recorder.call('gemini-test', 'prompt v1', b'image', generate), '{"integrity": "damaged"}')
+        key = GeminiCassette.make_key('gemini-test', 'prompt v1', b'image')
+        self.assertTrue(os.path.exists(os.path.join(self.directory, key[:2], f'{key}.json.gz')))
+
+        # Новый экземпляр читает запись с диска; Gemini не вызывается
+        player = GeminiCassette(self.directory, 'replay', latency_scale=0)
+        self.assertEqual(player.call('gemini-test', 'prompt v1', b'image', generate), '{"integrity": "damaged"}')
+        generate.assert_called_once()
+        # Другой промпт или изображение - другой ключ
+        with self.assertRaises(CassetteMiss):
+            player.call('gemini-test', 'prompt v2', b'image', generate)
+        with self.assertRaises(CassetteMiss):
+            player.call('gemini-test', 'prompt v1', b'other image', generate)
+        self.assertEqual((recorder.get_stats()['recorded'], player.get_stats()['hits'], player.get_stats()['misses']),
+                         (1, 1, 2))
+
+    def test_recorded_error_is_replayed(self):
+        recorder = GeminiCassette(self.directory, 'record')
+        with self.assertRaises(RuntimeError):
+            recorder.call('gemini-test', 'prompt', b'image', mock.Mock(side_effect=RuntimeError('quota exceeded')))
+
+        player = GeminiCassette(self.directory, 'replay', latency_scale=0)
+        with self.assertRaisesRegex(CassetteRecordedError, 'RuntimeError: quota exceeded'):
+            player.call('gemini-test', 'prompt', b'image', mock.Mock())
+
+    def test_async_record_then_replay(self):
+        calls = []
+
+        async def generate():
+            calls.append(1)
+            return 'async answer'
+
+        async def scenario():
+            recorder = GeminiCassette(self.directory, 'record')
+            self.assertEqual(await recorder.acall('gemini-test', 'prompt', b'image', generate), 'async answer')
+            player = GeminiCassette(self.directory, 'replay', latency_scale=0)
+            # Первое чтение - с диска в пуле потоков, второе - из памяти
+            for _ in range(2):
+                self.assertEqual(await player.acall('gemini-test', 'prompt', b'image', generate), 'async answer')
+            with self.assertRaises(CassetteMiss):
+                await player.acall('gemini-test', 'prompt', b'other image', generate)
+            return player.get_stats()
+
+        stats = asyncio.run(scenario())
+        self.assertEqual((len(calls), stats['hits'], stats['misses']), (1, 2, 1))
+
+    def test_module_imports_without_django(self):
+        # Кассету использует скрипт gemini_car_state.py без настроек Django
+        code = "import sys, car_detector.gemini_cassette; sys.exit('django' in sys.modules)"
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, env={
+            key: value for key, value in os.environ.items() if key != 'DJANGO_SETTINGS_MODULE'
+        })
+        self.assertEqual(result.returncode, 0)
+
+
+@override_settings(TRAFFIC_CAPTURE_RATE=1.0, TRAFFIC_CAPTURE_PAYLOADS=True)
+class TrafficCaptureTests(SimpleTestCase):
+    """Запись запросов в архив трафика и их воспроизведение (benchmarks/replay_traffic.py)"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive = traffic_capture.CaptureArchive(directory.name, segment_bytes=1024 * 1024,
+                                                      segment_seconds=3600, max_segments=5)
+        self.addCleanup(self.archive.stop)
+        patcher = mock.patch.object(traffic_capture, '_archive', self.archive)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Скрипты benchmarks импортируют соседние модули как верхнеуровневые
+        with mock.patch.object(sys, 'path', [os.path.join(settings.BASE_DIR, 'benchmarks'), *sys.path]):
+            self.replay = importlib.import_module('replay_traffic')
+
+    def test_repeated_file_field_is_captured_and_replayed_in_full(self):
+        @traffic_capture.captured
+        async def api_inspection_create(request):
+            return JsonResponse({'photos': len(request.FILES.getlist('image'))})
+
+        uploads = [_image_upload('front.png', color=(255, 0, 0)), _image_upload('rear.png', color=(0, 0, 255))]
+        contents = [upload.read() for upload in uploads]
+        for upload in uploads:
+            upload.seek(0)
+        request = RequestFactory().post('/app2/api/inspections/', {'image': uploads, 'vehicle_id': 'A123BC'})
+        response = asyncio.run(api_inspection_create(request))
+        self.assertEqual(json.loads(response.content), {'photos': 2})
+        self.archive.stop()
+
+        record, = self.replay.load_archive([self.archive.directory])
+        self.assertEqual([(item['field'], item['name']) for item in record['files']],
+                         [('image', 'front.png'), ('image', 'rear.png')])
+        self.assertEqual(record['form'], {'vehicle_id': 'A123BC'})
+        replayer = self.replay.TrafficReplayer('http://app.test', None, speed=1, timeout=5, max_concurrency=1)
+        self.assertEqual(replayer._files(record), [
+            ('image', ('front.png', contents[0], 'image/png')),
+            ('image', ('rear.png', contents[1], 'image/png')),
+        ])
+
+
+class HealthCheckTests(SimpleTestCase):
+    """Liveness- и readiness-пробы"""
+
+    def setUp(self):
+        for name, value in (('warmed_up', False), ('yolo_detector', None), ('inference_pool', None),
+                            ('remote_inference', None),
+                            ('_model_versions', {'gemini': 'gemini-test', 'yolo': 'yolo-test'})):
+            patcher = mock.patch.object(car_analysis_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_live_answers_without_models(self):
+        response = self.client.get(reverse('health_live'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'alive', 'pid': os.getpid()})
+        self.assertEqual(self.client.post(reverse('health_live')).status_code, 405)
+
+    def test_ready_after_warmup(self):
+        response = self.client.get(reverse('health_ready'))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['ready'])
+
+        car_analysis_service.warmed_up = True
+        with override_settings(YOLO_REQUIRED=False):
+            response = self.client.get(reverse('health_ready'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['ready'])
+        self.assertFalse(data['yolo']['loaded'])
+        self.assertEqual(data['model_versions'], {'gemini': 'gemini-test', 'yolo': 'yolo-test'})
+
+    @override_settings(YOLO_REQUIRED=True)
+    def test_ready_requires_yolo_when_configured(self):
+        car_analysis_service.warmed_up = True
+        self.assertEqual(self.client.get(reverse('health_ready')).status_code, 503)
+
+        car_analysis_service.yolo_detector = mock.Mock(**{'get_model_info.return_value': {
+            'available': True, 'load_time': 1.5, 'warmed_up': True, 'warmup_time': 0.2,
+        }})
+        response = self.client.get(reverse('health_ready'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['yolo']['load_time'], 1.5)
+
+
+def _metric_samples(content):
+    from prometheus_client.parser import text_string_to_metric_families
+
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(content.decode())
+        for sample in family.samples
+    }
+
+
+@unittest.skipUnless(metrics.PROMETHEUS_AVAILABLE, 'prometheus_client is not installed')
+class MetricsTests(SimpleTestCase):
+    """Экспорт метрик /metrics/ в одном процессе и в режиме PROMETHEUS_MULTIPROC_DIR"""
+
+    REQUESTS = ('car_analysis_requests_total', (('endpoint', 'api_load'), ('status', '200')))
+    IN_FLIGHT = ('car_analysis_in_flight', (('endpoint', 'api_load'),))
+
+    @override_settings(API_KEYS_REQUIRED=False)
+    def test_endpoint_exposes_request_counters(self):
+        before = _metric_samples(self.client.get(reverse('metrics')).content).get(self.REQUESTS, 0.0)
+        self.assertEqual(self.client.get(reverse('api_load')).status_code, 200)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        samples = _metric_samples(response.content)
+        self.assertEqual(samples[self.REQUESTS], before + 1)
+        self.assertEqual(samples[self.IN_FLIGHT], 0.0)
+        self.assertIn(('car_analysis_request_seconds_count', (('endpoint', 'api_load'),)), samples)
+
+    def test_multiprocess_mode_merges_workers(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        worker = ("import os; from car_detector.metrics import in_flight, requests_total; "
+                  "requests_total.labels('api_load', '200').inc(); in_flight.labels('api_load').inc(); "
+                  "print(os.getpid())")
+        env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory.name}
+        pids = [
+            int(subprocess.run([sys.executable, '-c', worker], cwd=settings.BASE_DIR, env=env,
+                               capture_output=True, text=True, check=True).stdout)
+            for _ in range(2)
+        ]
+
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory.name}):
+            samples = _metric_samples(metrics.render_metrics()[0])
+            self.assertEqual((samples[self.REQUESTS], samples[self.IN_FLIGHT]), (2.0, 2.0))
+            # Завершившийся воркер перестает учитываться в live-метриках, счетчики сохраняются
+            metrics.mark_process_dead(pids[0])
+            samples = _metric_samples(metrics.render_metrics()[0])
+        self.assertEqual((samples[self.REQUESTS], samples[self.IN_FLIGHT]), (2.0, 1.0))
+
+
+class StructuredLoggingTests(SimpleTestCase):
+    """Выборка событий и неблокирующий вывод логов"""
+
+    def record(self, event=None, level=logging.INFO):
+        record = logging.LogRecord('car_detector.test', level, __file__, 1, 'message', (), None)
+        if event is not None:
+            record.event = event
+        return record
+
+    def test_sampler_keeps_share_of_event(self):
+        sampler = EventSampler({'overlay.box': 0.0, 'analysis.detection': 0.25})
+        self.assertFalse(sampler.filter(self.record('overlay.box')))
+        # Предупреждения, события без доли и записи без события не отбрасываются
+        self.assertTrue(sampler.filter(self.record('overlay.box', logging.WARNING)))
+        self.assertTrue(sampler.filter(self.record('stage.finished')))
+        self.assertTrue(sampler.filter(self.record()))
+        with mock.patch('random.random', side_effect=[0.1, 0.3]):
+            self.assertEqual([sampler.filter(self.record('analysis.detection')) for _ in range(2)], [True, False])
+
+    def logger(self, handler):
+        logger = logging.getLogger(f'car_detector.tests.{self._testMethodName}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(handler.stop)
+        return logger
+
+    def test_handler_writes_json_events_from_background_thread(self):
+        output = io.StringIO()
+        with mock.patch('sys.stdout', output):
+            handler = QueueingHandler('json')
+        logger = self.logger(handler)
+
+        log_event(logger, 'analysis.finished', analysis_id=7, duration_ms=12.5)
+        handler.stop()
+
+        event = json.loads(output.getvalue())
+        self.assertEqual((event['event'], event['message'], event['level']),
+                         ('analysis.finished', 'analysis.finished', 'INFO'))
+        self.assertEqual((event['analysis_id'], event['duration_ms']), (7, 12.5))
+
+    def test_full_queue_drops_records_without_blocking(self):
+        handler = QueueingHandler('json', maxsize=2)
+        logger = self.logger(handler)
+        started, release, emitted = threading.Event(), threading.Event(), []
+
+        def emit(record):
+            started.set()
+            release.wait(5)
+            emitted.append(record.getMessage())
+
+        handler._target.emit = emit
+        logger.info('first')
+        self.assertTrue(started.wait(5))
+        # Поток вывода занят первой записью: две записи встают в очередь, остальные отбрасываются
+        start = time.perf_counter()
+        for number in range(4):
+            logger.info('queued %d', number)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(handler.dropped, 2)
+
+        release.set()
+        deadline = time.monotonic() + 5
+        while len(emitted) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(emitted, ['first', 'queued 0', 'queued 1'])
+
+
+def _stored_analysis(parts=(), detections=(), status='complete'):
+    return CarAnalysis.objects.create(
+        image='car_images/car.jpg', status=status,
+        gemini_integrity_label='damaged', gemini_integrity_confidence=0.9,
+        gemini_cleanliness_label='clean', gemini_cleanliness_confidence=0.9,
+        gemini_damage_details={'parts': list(parts)}, yolo_detections=list(detections),
+    )
+
+
+class DamageItemTests(TestCase):
+    """Строки DamageItem по JSON-результатам анализа"""
+
+    def test_rows_from_gemini_and_yolo(self):
+        analysis = _stored_analysis(
+            [_gemini_part('door_left_front', 'dent', 0.8, [0.1, 0.2, 0.3, 0.4]),
+             _gemini_part('hood', None, 0.5, ['x', 0, 0, 0]), {'type': 'dent'}],
+            [_yolo_detection('doorouter-dent', 0.6, [0.1, 0.2, 0.3, 0.4]), _yolo_detection('mystery', 0.2)],
+        )
+
+        rows = [(row['source'], row['part'], row['part_group'], row['damage_type'], row['label'], row['x1'])
+                for row in damage_item_rows(analysis)]
+        # Элемент без названия пропускается, некорректная рамка - без координат
+        self.assertEqual(rows, [
+            ('gemini', 'door_left_front', 'door', 'dent', '', 0.1),
+            ('gemini', 'hood', 'hood', 'other', '', None),
+            ('yolo', 'door', 'door', 'dent', 'doorouter-dent', 0.1),
+            ('yolo', 'mystery', 'mystery', 'other', 'mystery', None),
+        ])
+        # У partial/failed в gemini_damage_details нет ответа модели
+        analysis.status = 'partial'
+        self.assertEqual([row['source'] for row in damage_item_rows(analysis)], ['yolo', 'yolo'])
+
+    def test_save_replaces_only_given_analyses(self):
+        first = _stored_analysis([_gemini_part('hood', 'dent')])
+        second = _stored_analysis([_gemini_part('roof', 'scratch')], [_yolo_detection('roof-dent')])
+        self.assertEqual(save_damage_items([first, second]), 3)
+
+        first.gemini_damage_details = {'parts': [_gemini_part('trunk', 'crack'), _gemini_part('roof', 'dent')]}
+        first.save()
+        self.assertEqual(save_damage_items([first], replace=True), 2)
+
+        self.assertEqual(sorted(DamageItem.objects.filter(analysis=first).values_list('part', flat=True)),
+                         ['roof', 'trunk'])
+        self.assertEqual(DamageItem.objects.filter(analysis=second).count(), 2)
+        # Без replace строки добавляются к прежним
+        save_damage_items([second])
+        self.assertEqual(DamageItem.objects.filter(analysis=second).count(), 4)
+
+
+class DamageCountTests(TestCase):
+    """Счетчики gemini_damage_count / yolo_detection_count совпадают с сохраненными JSON-полями"""
+
+    def stored_counts(self, analysis):
+        return CarAnalysis.objects.values_list('gemini_damage_count', 'yolo_detection_count').get(id=analysis.id)
+
+    def test_save_recounts_including_update_fields(self):
+        analysis = _stored_analysis([_gemini_part('hood', 'dent')], [_yolo_detection('bonnet-dent')] * 3)
+        self.assertEqual(self.stored_counts(analysis), (1, 3))
+
+        analysis.gemini_damage_details = {'parts': [_gemini_part('hood', 'dent'), _gemini_part('roof', 'dent')]}
+        analysis.save(update_fields=['gemini_damage_details'])
+        self.assertEqual(self.stored_counts(analysis), (2, 3))
+        analysis.yolo_detections = []
+        analysis.save(update_fields=['yolo_detections'])
+        self.assertEqual(self.stored_counts(analysis), (2, 0))
+
+        # Ответ Gemini без списка parts (ошибка разбора) - ноль повреждений
+        analysis.gemini_damage_details = ['unexpected']
+        analysis.save()
+        self.assertEqual(self.stored_counts(analysis), (0, 0))
+
+    def test_formatted_results_carry_counts_for_bulk_create(self):
+        formatted = car_analysis_service.format_results_for_django({
+            'gemini': GEMINI_RESULT,
+            'yolo': {'detections': [_yolo_detection('bonnet-dent'), _yolo_detection('roof-dent')]},
+        })
+        # bulk_create не вызывает save: счетчики приходят из format_results_for_django
+        analysis, = CarAnalysis.objects.bulk_create([CarAnalysis(image='car_images/car.jpg', **formatted)])
+        self.assertEqual(self.stored_counts(analysis), (1, 2))
+
+    def test_backfill_migration_recounts_existing_rows(self):
+        backfill = importlib.import_module('car_detector.migrations.0013_backfill_damage_counts')
+        analyses = [_stored_analysis([_gemini_part('hood', 'dent')] * i, [_yolo_detection('roof-dent')]) for i in range(3)]
+        CarAnalysis.objects.update(gemini_damage_count=0, yolo_detection_count=0)
+
+        backfill.backfill_damage_counts(django_apps, None)
+
+        self.assertEqual([self.stored_counts(analysis) for analysis in analyses], [(0, 1), (1, 1), (2, 1)])
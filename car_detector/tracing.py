@@ -0,0 +1,268 @@
+# car_detector/tracing.py
+"""
+Трассировка запросов анализа
+
+Каждый запрос анализа получает trace id (из заголовка X-Trace-Id или новый)
+и собирает длительности участков (span) через CarAnalysisService,
+GeminiAnalyzer, YOLODetector и image_utils. Текущая трасса хранится в
+contextvar, поэтому span из пула потоков (run_blocking копирует контекст)
+и с фонового цикла попадают в трассу своего запроса.
+
+Ответ получает заголовки X-Trace-Id и Server-Timing, трасса сохраняется в
+CarAnalysis.trace. При PROFILE_SAMPLE_RATE = N каждый N-й запрос
+профилируется cProfile, профиль пишется в PROFILE_DIR. Для sync-представлений
+профилируется поток запроса целиком; для async - только блокирующие участки,
+выполненные через run_blocking (event loop обслуживает и другие запросы, и его
+профиль смешал бы их работу):
+
+    python -m pstats profiles/20250101-120000_<trace_id>.prof
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from .logging_utils import log_event
+
+
+TRACE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+logger = logging.getLogger(__name__)
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('car_analysis_trace', default=None)
+
+
+class Trace:
+    """Трасса одного запроса: trace id и список участков"""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        # Заполняется после создания CarAnalysis, попадает в события лога
+        self.analysis_id: Optional[int] = None
+        self.started_at = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        # Профили блокирующих участков (список создается, если запрос async-представления профилируется)
+        self.profiles: Optional[List[cProfile.Profile]] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float):
+        """Добавляет участок (start - значение time.perf_counter() в начале участка)"""
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'start_ms': round((start - self.started_at) * 1000, 2),
+                'duration_ms': round(duration * 1000, 2),
+                'thread': threading.current_thread().name,
+            })
+
+    def add_profile(self, profiler: cProfile.Profile):
+        with self._lock:
+            if self.profiles is not None:
+                self.profiles.append(profiler)
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started_at) * 1000, 2)
+
+    def totals(self) -> 'OrderedDict[str, float]':
+        """Суммарная длительность по имени участка в порядке первого появления"""
+        totals = OrderedDict()
+        with self._lock:
+            for span in self.spans:
+                totals[span['name']] = totals.get(span['name'], 0.0) + span['duration_ms']
+        return totals
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing"""
+        metrics = [f"{name};dur={duration:.1f}" for name, duration in self.totals().items()]
+        metrics.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ', '.join(metrics)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Трасса для сохранения в CarAnalysis.trace"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start_ms'])
+        return {
+            'trace_id': self.trace_id,
+            'total_ms': self.elapsed_ms(),
+            'spans': spans,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]):
+    """Делает трассу текущей (например, в фоновой задаче, запущенной без контекста запроса)"""
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    """Участок трассы; без текущей трассы ничего не делает"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start)
+
+
+def record_span(name: str, start: float):
+    """Записывает участок, начавшийся в start (time.perf_counter()) и закончившийся сейчас"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, time.perf_counter() - start)
+
+
+class TraceContextFilter(logging.Filter):
+    """Добавляет trace_id и analysis_id текущей трассы в записи лога (settings.LOGGING)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = _current_trace.get()
+        if trace is not None:
+            if not hasattr(record, 'trace_id'):
+                record.trace_id = trace.trace_id
+            if trace.analysis_id is not None and not hasattr(record, 'analysis_id'):
+                record.analysis_id = trace.analysis_id
+        return True
+
+
+def _request_trace_id(request) -> Optional[str]:
+    trace_id = request.headers.get('X-Trace-Id')
+    if trace_id and TRACE_ID_PATTERN.match(trace_id):
+        return trace_id
+    return None
+
+
+_request_counter = itertools.count(1)
+# cProfile нельзя включить дважды в одном потоке; профилируем не более одного запроса одновременно
+_profile_lock = threading.Lock()
+
+
+def _should_profile() -> bool:
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and next(_request_counter) % rate == 0
+
+
+def _save_profile(profile, trace: Trace, scope: str):
+    """Сохраняет профиль (cProfile.Profile или pstats.Stats); scope - что в него вошло"""
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    filename = f"{time.strftime('%Y%m%d-%H%M%S')}_{trace.trace_id}.prof"
+    path = os.path.join(settings.PROFILE_DIR, filename)
+    profile.dump_stats(path)
+    log_event(logger, 'profile.saved', f"Profile saved ({scope}): {path}", path=path, scope=scope)
+
+
+def profiled_call(func, *args, **kwargs):
+    """
+    Выполняет блокирующую функцию под cProfile, если текущий запрос профилируется
+
+    Вызывается run_blocking в потоке пула: у каждого участка свой профилировщик,
+    traced объединяет их в профиль запроса.
+    """
+    trace = _current_trace.get()
+    if trace is None or trace.profiles is None:
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # В этом потоке уже работает другой профилировщик
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        trace.add_profile(profiler)
+
+
+@contextmanager
+def _maybe_profile(trace: Trace):
+    """cProfile потока запроса для каждого PROFILE_SAMPLE_RATE-го запроса (sync-представления)"""
+    if not _should_profile() or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+        _save_profile(profiler, trace, 'request thread')
+    finally:
+        _profile_lock.release()
+
+
+@contextmanager
+def _maybe_profile_blocking(trace: Trace):
+    """
+    Профиль блокирующих участков для каждого PROFILE_SAMPLE_RATE-го запроса (async-представления)
+
+    Сам event loop не профилируется: пока представление ждет, цикл выполняет
+    корутины других запросов.
+    """
+    if not _should_profile():
+        yield
+        return
+    trace.profiles = []
+    try:
+        yield
+    finally:
+        with trace._lock:
+            profiles, trace.profiles = trace.profiles, None
+        if profiles:
+            _save_profile(pstats.Stats(*profiles), trace, 'run_blocking sections')
+
+
+def _finish_response(request, response, trace: Trace):
+    log_event(
+        logger, 'request.finished',
+        trace_id=trace.trace_id, analysis_id=trace.analysis_id, path=request.path, status=response.status_code,
+        duration_ms=trace.elapsed_ms(), stages=dict(trace.totals()),
+    )
+    response['X-Trace-Id'] = trace.trace_id
+    response['Server-Timing'] = trace.server_timing()
+    return response
+
+
+def traced(view):
+    """Декоратор представления анализа (sync или async): трасса, Server-Timing, профилирование"""
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            trace = Trace(_request_trace_id(request))
+            with use_trace(trace), _maybe_profile_blocking(trace):
+                response = await view(request, *args, **kwargs)
+            return _finish_response(request, response, trace)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        trace = Trace(_request_trace_id(request))
+        with use_trace(trace), _maybe_profile(trace):
+            response = view(request, *args, **kwargs)
+        return _finish_response(request, response, trace)
+    return wrapper
@@ -0,0 +1,266 @@
+# car_detector/traffic_capture.py
+"""
+Запись production-трафика API для воспроизведения (benchmarks/replay_traffic.py)
+
+Декоратор captured отбирает долю запросов (TRAFFIC_CAPTURE_RATE) и сохраняет
+для каждого: время поступления, endpoint, путь, статус, длительность,
+размер и SHA-256 загруженных файлов, поля формы и заголовки, влияющие на
+обработку. С TRAFFIC_CAPTURE_PAYLOADS сохраняются и сами файлы.
+
+Архив - каталог TRAFFIC_CAPTURE_DIR с сегментами <время>-<pid>/:
+    requests.jsonl        - одна JSON-строка на запрос;
+    payloads/<sha256>     - файлы запросов (одинаковые - один раз на сегмент).
+Сегмент закрывается по размеру (TRAFFIC_CAPTURE_SEGMENT_MB) или возрасту
+(TRAFFIC_CAPTURE_SEGMENT_SECONDS); хранятся последние
+TRAFFIC_CAPTURE_MAX_SEGMENTS сегментов всех процессов.
+
+Запрос только кладет запись в ограниченную очередь, на диск пишет фоновый
+поток; при переполнении очереди запись отбрасывается.
+"""
+import atexit
+import functools
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+
+from .async_utils import run_blocking
+from .logging_utils import log_event
+from .metrics import traffic_captured
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'requests.jsonl'
+PAYLOADS_DIR = 'payloads'
+
+# Заголовки, меняющие обработку запроса; ключи клиентов не сохраняются
+CAPTURED_HEADERS = ('X-Priority', 'X-Latency-Budget', 'X-Callback-Url')
+
+
+class CaptureArchive:
+    """
+    Вращаемый архив записанных запросов
+
+    Args:
+        directory: Каталог архива
+        segment_bytes: Размер сегмента, после которого открывается новый
+        segment_seconds: Возраст сегмента, после которого открывается новый
+        max_segments: Сколько последних сегментов хранить
+        maxsize: Размер очереди записи
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, segment_seconds: float,
+                 max_segments: int, maxsize: int = 100):
+        self.directory = str(directory)
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self.maxsize = maxsize
+        self.queue = queue.Queue(maxsize)
+        self._thread = None
+        self._owner_pid = None
+        self._start_lock = threading.Lock()
+        self._segment = None
+        self._segment_started = 0.0
+        self._segment_size = 0
+        self._segment_payloads = set()
+        self.written = 0
+        self.dropped = 0
+        atexit.register(self.stop)
+
+    def _ensure_writer(self):
+        # Поток записи не переживает fork (gunicorn preload_app): в новом процессе запускаем свой
+        if self._owner_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._owner_pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self._segment = None
+            self._thread = threading.Thread(target=self._run, name='traffic-capture', daemon=True)
+            self._thread.start()
+            self._owner_pid = os.getpid()
+
+    def submit(self, record: Dict[str, Any], payloads: Dict[str, bytes]) -> bool:
+        """Ставит запись в очередь; False - очередь переполнена, запись отброшена"""
+        self._ensure_writer()
+        try:
+            self.queue.put_nowait((record, payloads))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self._write(*item)
+                self.written += 1
+            except Exception as e:
+                log_event(logger, 'capture.write_failed', f"Traffic capture write failed: {e}",
+                          level=logging.WARNING, error=str(e))
+
+    def _open_segment(self):
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S.%f')}-{os.getpid()}"
+        self._segment = os.path.join(self.directory, name)
+        os.makedirs(os.path.join(self._segment, PAYLOADS_DIR), exist_ok=True)
+        self._segment_started = time.monotonic()
+        self._segment_size = 0
+        self._segment_payloads = set()
+        self._prune()
+
+    def _prune(self):
+        """Удаляет самые старые сегменты сверх max_segments (имена начинаются со времени)"""
+        segments = sorted(
+            entry.name for entry in os.scandir(self.directory)
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, INDEX_NAME))
+        )
+        current = os.path.basename(self._segment)
+        # Текущий сегмент еще пуст и в список не попал - место под него оставляем
+        for name in segments[:max(len(segments) - self.max_segments + 1, 0)]:
+            if name != current:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _write(self, record: Dict[str, Any], payloads: Dict[str, bytes]):
+        if (self._segment is None or self._segment_size >= self.segment_bytes
+                or time.monotonic() - self._segment_started >= self.segment_seconds):
+            self._open_segment()
+        # Файлы пишутся раньше строки индекса: индекс не ссылается на недописанные файлы
+        for sha, content in payloads.items():
+            if sha in self._segment_payloads:
+                continue
+            with open(os.path.join(self._segment, PAYLOADS_DIR, sha), 'wb') as f:
+                f.write(content)
+            self._segment_payloads.add(sha)
+            self._segment_size += len(content)
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with open(os.path.join(self._segment, INDEX_NAME), 'a', encoding='utf-8') as f:
+            f.write(line)
+        self._segment_size += len(line)
+
+    def stop(self, timeout: float = 5.0):
+        """Дописывает очередь и останавливает поток (при завершении процесса)"""
+        if self._thread is not None and self._owner_pid == os.getpid():
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            self._thread.join(timeout)
+            self._thread = None
+            self._owner_pid = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'directory': self.directory,
+            'segment': self._segment,
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+        }
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> CaptureArchive:
+    """Архив процесса (создается при первом записанном запросе)"""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                _archive = CaptureArchive(
+                    settings.TRAFFIC_CAPTURE_DIR,
+                    segment_bytes=settings.TRAFFIC_CAPTURE_SEGMENT_MB * 1024 * 1024,
+                    segment_seconds=settings.TRAFFIC_CAPTURE_SEGMENT_SECONDS,
+                    max_segments=settings.TRAFFIC_CAPTURE_MAX_SEGMENTS,
+                    maxsize=settings.TRAFFIC_CAPTURE_QUEUE_SIZE,
+                )
+    return _archive
+
+
+def _read_files(request, with_payloads: bool) -> Tuple[List[Dict[str, Any]], Dict[str, bytes]]:
+    """
+    Описание загруженных файлов и их содержимое (указатели возвращаются в начало)
+
+    Повторяющееся поле (несколько image в /api/inspections/) дает по записи на каждый файл.
+    """
+    files, payloads = [], {}
+    for field, uploads in request.FILES.lists():
+        for uploaded in uploads:
+            uploaded.seek(0)
+            content = b''.join(uploaded.chunks())
+            uploaded.seek(0)
+            sha = hashlib.sha256(content).hexdigest()
+            files.append({
+                'field': field,
+                'name': uploaded.name,
+                'content_type': uploaded.content_type,
+                'size': len(content),
+                'sha256': sha,
+            })
+            if with_payloads:
+                payloads[sha] = content
+    return files, payloads
+
+
+def captured(view):
+    """
+    Декоратор async-представления API: запись доли запросов в архив трафика
+
+    Ставится снаружи api_key_required, чтобы в архив попадали и отклоненные запросы.
+    """
+    endpoint = view.__name__
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        rate = settings.TRAFFIC_CAPTURE_RATE
+        if rate <= 0 or random.random() >= rate:
+            return await view(request, *args, **kwargs)
+
+        arrived = time.time()
+        start_time = time.perf_counter()
+        files, payloads = [], {}
+        if request.method == 'POST':
+            # Файл читаем до представления: после сохранения в хранилище он может быть перемещен
+            files, payloads = await run_blocking(_read_files, request, settings.TRAFFIC_CAPTURE_PAYLOADS)
+
+        status = 500
+        try:
+            response = await view(request, *args, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            idempotency_key = request.headers.get('Idempotency-Key')
+            record = {
+                'ts': round(arrived, 6),
+                'endpoint': endpoint,
+                'method': request.method,
+                'path': request.path,
+                'query': request.META.get('QUERY_STRING', ''),
+                'status': status,
+                'duration_ms': round((time.perf_counter() - start_time) * 1000, 1),
+                'files': files,
+                'form': {key: value for key, value in request.POST.items()} if request.method == 'POST' else {},
+                'headers': {name: request.headers[name] for name in CAPTURED_HEADERS if name in request.headers},
+                # Сам ключ не сохраняем, но повторы с одним ключом должны воспроизводиться как повторы
+                'idempotency_key': (hashlib.sha256(idempotency_key.encode()).hexdigest()[:16]
+                                    if idempotency_key else None),
+                'pid': os.getpid(),
+            }
+            queued = get_archive().submit(record, payloads)
+            traffic_captured.labels('queued' if queued else 'dropped').inc()
+
+    return wrapper
@@ -8,6 +8,15 @@ urlpatterns = [
     path('analysis/<int:analysis_id>/', views.analysis_detail, name='analysis_detail'),
     path('analyses/', views.analysis_list, name='analysis_list'),
     path('api/analyze/', views.api_analyze, name='api_analyze'),
+    path('api/analysis/<int:analysis_id>/', views.api_analysis_result, name='api_analysis_result'),
     path('api/gemini-analyze/', views.api_gemini_analyze, name='api_gemini_analyze'),
     path('api/simple-status/', views.api_simple_status, name='api_simple_status'),
+    path('api/inspections/', views.api_inspection_create, name='api_inspection_create'),
+    path('api/inspections/<int:session_id>/', views.api_inspection_result, name='api_inspection_result'),
+    path('api/video-inspect/', views.api_video_inspect, name='api_video_inspect'),
+    path('api/load/', views.api_load, name='api_load'),
+    path('api/usage/', views.api_usage, name='api_usage'),
+    path('health/live/', views.health_live, name='health_live'),
+    path('health/ready/', views.health_ready, name='health_ready'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
@@ -0,0 +1,571 @@
+# car_detector/video_inspection.py
+"""
+Анализ видео-обхода автомобиля
+
+Водитель снимает короткое видео вокруг машины вместо отдельных фотографий.
+Конвейер:
+    1. Декодирование: кадры оцениваются с частотой VIDEO_SAMPLE_FPS, остальные
+       только пропускаются (grab без преобразования в массив).
+    2. Ключевые кадры: резкость (дисперсия лапласиана уменьшенного серого
+       кадра) со штрафом за движение камеры; в каждом окне
+       VIDEO_KEYFRAME_INTERVAL секунд берется лучший кадр, если он не размыт
+       (VIDEO_MIN_SHARPNESS) и сцена изменилась после предыдущего ключевого.
+    3. YOLO на ключевых кадрах пачками (CarAnalysisService.detect_frames),
+       пока декодируются следующие кадры.
+    4. Трекинг: детекции одного класса на соседних ключевых кадрах
+       связываются по IoU с поправкой на сдвиг камеры (фазовая корреляция),
+       поэтому вмятина, видимая на нескольких кадрах, считается один раз.
+    5. Gemini - только на VIDEO_GEMINI_KEYFRAMES ключевых кадрах, равномерно
+       по времени обхода, с наибольшим числом находок YOLO; ответы
+       объединяются в одну оценку автомобиля.
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from .admission import admission_controller, LANE_STANDARD
+from .async_utils import run_blocking
+from .damage_taxonomy import CLEANLINESS_ORDER
+from .fusion import iou_matrix
+from .logging_utils import log_event
+from .metrics import observe_stage
+from .services import car_analysis_service
+from .tracing import record_span
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.avi', '.mkv', '.webm')
+
+# Ширина серого кадра для оценки резкости и сдвига
+ANALYSIS_WIDTH = 320
+# Миниатюра для оценки движения и новизны
+THUMB_SIZE = (64, 36)
+# Ключевой кадр, почти не отличающийся от предыдущего, отбрасывается (средняя разница 0..1)
+MIN_NOVELTY = 0.02
+# Штраф за движение камеры при выборе кадра в окне
+MOTION_PENALTY = 10.0
+# Ключевой кадр должен быть не менее чем вдвое слабее самого резкого кадра последних секунд:
+# абсолютный порог зависит от сцены, а смазанный участок видно на фоне соседних
+RELATIVE_SHARPNESS = 0.5
+RECENT_SECONDS = 3.0
+# Кадры для YOLO и Gemini уменьшаются до этой стороны (YOLO все равно работает в 640)
+MAX_FRAME_SIDE = 1280
+INFERENCE_BATCH = 8
+
+TRACK_IOU = 0.3
+# Сколько ключевых кадров подряд трек может не находиться (перекрытие, блик)
+TRACK_MAX_GAP = 2
+
+
+class VideoError(Exception):
+    """Видео не открывается или не содержит кадров"""
+
+
+def _analysis_images(frame: np.ndarray) -> Tuple[np.ndarray, float, np.ndarray]:
+    """Серый кадр ANALYSIS_WIDTH, его резкость и миниатюра 0..1"""
+    height, width = frame.shape[:2]
+    # Прореживание срезом до ~2x целевой ширины почти бесплатно; INTER_AREA по полному 4K-кадру - нет
+    step = max(width // (2 * ANALYSIS_WIDTH), 1)
+    small = cv2.resize(frame[::step, ::step], (ANALYSIS_WIDTH, max(round(height * ANALYSIS_WIDTH / width), 1)),
+                       interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    thumb = cv2.resize(gray, THUMB_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+    return gray, sharpness, thumb
+
+
+def _to_rgb(frame: np.ndarray) -> np.ndarray:
+    """Кадр BGR декодера -> RGB не больше MAX_FRAME_SIDE (как изображения PIL в анализе фото)"""
+    height, width = frame.shape[:2]
+    scale = MAX_FRAME_SIDE / max(height, width)
+    if scale < 1:
+        frame = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def iter_keyframes(path: str, info: Dict[str, Any], sample_fps: float, interval: float,
+                   min_sharpness: float, max_keyframes: int, max_duration: float):
+    """
+    Ключевые кадры видео по мере декодирования
+
+    Args:
+        path: Путь к видео
+        info: Заполняется сведениями о видео (fps, размер, длительность, число кадров)
+        sample_fps: Кадров в секунду для оценки
+        interval: Окно выбора ключевого кадра, секунды
+        min_sharpness: Минимальная резкость ключевого кадра
+        max_keyframes: Предел ключевых кадров (дальше видео не читается)
+        max_duration: Предел длительности, секунды (дальше видео не читается)
+
+    Yields:
+        Словари: frame_index, time_s, sharpness, motion, novelty, frame (RGB), gray
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise VideoError("Cannot open video")
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        if not fps or fps > 240:
+            fps = 30.0
+        step = max(round(fps / sample_fps), 1) if sample_fps > 0 else 1
+        info.update({
+            'fps': round(fps, 2),
+            'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'total_frames': int(capture.get(cv2.CAP_PROP_FRAME_COUNT)),
+            'frames': 0,
+            'sampled_frames': 0,
+            'duration_s': 0.0,
+            'truncated': False,
+        })
+
+        best = None
+        window_end = interval
+        previous_thumb = None
+        last_key_thumb = None
+        last_key_time = None
+        emitted = 0
+        recent = deque(maxlen=max(round(RECENT_SECONDS * fps / step), 1))
+
+        def flush(candidate):
+            # Размытый, слишком близкий или повторяющий предыдущий ключевой кадр не нужен
+            nonlocal last_key_thumb, last_key_time, emitted
+            if candidate is None:
+                return None
+            if candidate['sharpness'] < max(min_sharpness, RELATIVE_SHARPNESS * max(recent)):
+                return None
+            if last_key_time is not None and candidate['time_s'] - last_key_time < interval / 2:
+                return None
+            novelty = 1.0 if last_key_thumb is None else float(np.mean(np.abs(candidate['thumb'] - last_key_thumb)))
+            if novelty < MIN_NOVELTY:
+                return None
+            last_key_thumb = candidate.pop('thumb')
+            last_key_time = candidate['time_s']
+            emitted += 1
+            candidate['novelty'] = round(novelty, 4)
+            candidate['frame'] = _to_rgb(candidate['frame'])
+            return candidate
+
+        index = -1
+        while True:
+            index += 1
+            time_s = index / fps
+            if time_s >= max_duration or emitted >= max_keyframes:
+                info['truncated'] = capture.grab()
+                break
+            if index % step:
+                # Пропускаемый кадр: без копирования в массив и преобразования цвета
+                if not capture.grab():
+                    break
+                info['frames'] += 1
+                continue
+            ok, frame = capture.read()
+            if not ok:
+                break
+            info['frames'] += 1
+            info['sampled_frames'] += 1
+
+            if time_s >= window_end:
+                keyframe = flush(best)
+                if keyframe is not None:
+                    yield keyframe
+                best = None
+                window_end = (time_s // interval + 1) * interval
+
+            gray, sharpness, thumb = _analysis_images(frame)
+            recent.append(sharpness)
+            motion = 0.0 if previous_thumb is None else float(np.mean(np.abs(thumb - previous_thumb)))
+            previous_thumb = thumb
+            score = sharpness / (1.0 + MOTION_PENALTY * motion)
+            if best is None or score > best['score']:
+                best = {
+                    'frame_index': index, 'time_s': round(time_s, 3), 'score': score,
+                    'sharpness': round(sharpness, 1), 'motion': round(motion, 4),
+                    'frame': frame, 'gray': gray, 'thumb': thumb,
+                }
+
+        keyframe = flush(best)
+        if keyframe is not None and emitted <= max_keyframes:
+            yield keyframe
+        info['duration_s'] = round(info['frames'] / fps, 3)
+    finally:
+        capture.release()
+
+
+def estimate_shift(previous: Optional[np.ndarray], current: np.ndarray) -> Tuple[float, float]:
+    """
+    Сдвиг содержимого кадра current относительно previous в долях ширины и высоты
+
+    Фазовая корреляция серых кадров; при ненадежной оценке - нулевой сдвиг.
+    """
+    if previous is None or previous.shape != current.shape:
+        return 0.0, 0.0
+    window = cv2.createHanningWindow(current.shape[::-1], cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(previous.astype(np.float32), current.astype(np.float32), window)
+    if response < 0.05:
+        return 0.0, 0.0
+    height, width = current.shape
+    return dx / width, dy / height
+
+
+class DamageTracker:
+    """
+    Объединение детекций YOLO ключевых кадров в треки повреждений
+
+    Args:
+        iou_threshold: Минимальный IoU детекции с предсказанной рамкой трека
+        max_gap: Сколько ключевых кадров подряд трек может не находиться
+    """
+
+    def __init__(self, iou_threshold: float = TRACK_IOU, max_gap: int = TRACK_MAX_GAP):
+        self.iou_threshold = iou_threshold
+        self.max_gap = max_gap
+        self.tracks: List[Dict[str, Any]] = []
+
+    def update(self, keyframe: int, time_s: float, detections: List[Dict[str, Any]],
+               shift: Tuple[float, float] = (0.0, 0.0)):
+        """
+        Добавляет детекции ключевого кадра
+
+        Args:
+            keyframe: Номер ключевого кадра (по возрастанию)
+            time_s: Время кадра в видео
+            detections: Детекции в формате YOLODetector.detect (нормализованные bbox)
+            shift: Сдвиг содержимого относительно предыдущего ключевого кадра (estimate_shift)
+        """
+        active = [track for track in self.tracks if keyframe - track['last_keyframe'] <= self.max_gap + 1]
+        # Рамки треков переносим вслед за камерой
+        offset = np.array([shift[0], shift[1], shift[0], shift[1]])
+        for track in active:
+            track['_box'] = track['_box'] + offset
+
+        unmatched = set(range(len(detections)))
+        if detections and active:
+            boxes = np.array([detection['bbox'] for detection in detections], dtype=np.float64)
+            iou = iou_matrix(boxes, np.array([track['_box'] for track in active]))
+            same_class = (np.array([detection['class'] for detection in detections])[:, None]
+                          == np.array([track['class'] for track in active])[None, :])
+            iou[~same_class] = 0.0
+            # Жадное сопоставление по убыванию IoU
+            used_tracks = set()
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                i, j = divmod(int(flat), len(active))
+                if iou[i, j] < self.iou_threshold:
+                    break
+                if i not in unmatched or j in used_tracks:
+                    continue
+                unmatched.discard(i)
+                used_tracks.add(j)
+                self._extend(active[j], detections[i], keyframe, time_s)
+
+        for i in sorted(unmatched):
+            detection = detections[i]
+            self.tracks.append({
+                'track_id': len(self.tracks) + 1,
+                'class': detection['class'],
+                'confidence': detection['confidence'],
+                'hits': 1,
+                'first_seen_s': time_s,
+                'last_seen_s': time_s,
+                'best_keyframe': keyframe,
+                'bbox': detection['bbox'],
+                'last_keyframe': keyframe,
+                '_box': np.array(detection['bbox'], dtype=np.float64),
+            })
+
+    @staticmethod
+    def _extend(track: Dict[str, Any], detection: Dict[str, Any], keyframe: int, time_s: float):
+        track['hits'] += 1
+        track['last_seen_s'] = time_s
+        track['last_keyframe'] = keyframe
+        track['_box'] = np.array(detection['bbox'], dtype=np.float64)
+        if detection['confidence'] > track['confidence']:
+            track['confidence'] = detection['confidence']
+            track['best_keyframe'] = keyframe
+            track['bbox'] = detection['bbox']
+
+    def damages(self, min_hits: int = 1) -> List[Dict[str, Any]]:
+        """Треки, найденные не менее чем на min_hits ключевых кадрах, по убыванию уверенности"""
+        damages = [
+            {key: value for key, value in track.items() if key not in ('_box', 'last_keyframe')}
+            for track in self.tracks if track['hits'] >= min_hits
+        ]
+        return sorted(damages, key=lambda track: track['confidence'], reverse=True)
+
+
+def pick_gemini_keyframes(keyframes: List[Dict[str, Any]], count: int) -> List[int]:
+    """
+    Номера ключевых кадров для Gemini: по одному из count равных отрезков обхода,
+    в отрезке - кадр с наибольшими находками YOLO, затем самый резкий
+    """
+    if count <= 0 or not keyframes:
+        return []
+    if len(keyframes) <= count:
+        return list(range(len(keyframes)))
+    max_sharpness = max(keyframe['sharpness'] for keyframe in keyframes) or 1.0
+    chosen = []
+    for segment in np.array_split(np.arange(len(keyframes)), count):
+        chosen.append(int(max(segment, key=lambda i: (
+            sum(detection['confidence'] for detection in keyframes[i]['detections'])
+            + keyframes[i]['sharpness'] / max_sharpness
+        ))))
+    return chosen
+
+
+def merge_gemini_results(results: List[Tuple[int, Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Одна оценка автомобиля по ответам Gemini на несколько ключевых кадров
+
+    Поврежден, если поврежден хотя бы на одном кадре; чистота - самая частая оценка
+    (при равенстве - более грязная); повреждения одной части и типа объединяются.
+
+    Args:
+        results: Пары (номер ключевого кадра, результат GeminiAnalyzer.analyze)
+
+    Returns:
+        Результат в формате GeminiAnalyzer.analyze или None, если успешных ответов нет
+    """
+    results = [(keyframe, result) for keyframe, result in results if result and 'error' not in result]
+    if not results:
+        return None
+
+    integrity = [result.get('integrity') or {} for _, result in results]
+    damaged = [item.get('confidence', 0.0) for item in integrity if item.get('label') == 'damaged']
+    if damaged:
+        merged_integrity = {'label': 'damaged', 'confidence': max(damaged)}
+    else:
+        merged_integrity = {'label': 'undamaged',
+                            'confidence': min(item.get('confidence', 0.0) for item in integrity)}
+
+    cleanliness = [result.get('cleanliness') or {} for _, result in results]
+    votes = Counter(item.get('label') for item in cleanliness if item.get('label'))
+    merged_cleanliness = {'label': None, 'confidence': 0.0}
+    if votes:
+        label = max(votes, key=lambda name: (
+            votes[name], CLEANLINESS_ORDER.index(name) if name in CLEANLINESS_ORDER else -1
+        ))
+        scores = [item.get('confidence', 0.0) for item in cleanliness if item.get('label') == label]
+        merged_cleanliness = {'label': label, 'confidence': sum(scores) / len(scores)}
+
+    parts: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    overall = 0.0
+    for keyframe, result in results:
+        details = result.get('damage_details') or {}
+        overall = max(overall, details.get('overall_confidence') or 0.0)
+        for part in details.get('parts') or []:
+            key = (part.get('part'), part.get('type'))
+            known = parts.get(key)
+            if known is None:
+                parts[key] = {**part, 'keyframes': [keyframe]}
+                continue
+            known['keyframes'].append(keyframe)
+            if (part.get('confidence') or 0.0) > (known.get('confidence') or 0.0):
+                parts[key] = {**part, 'keyframes': known['keyframes']}
+
+    notes = []
+    for _, result in results:
+        if result.get('notes') and result['notes'] not in notes:
+            notes.append(result['notes'])
+
+    return {
+        'integrity': merged_integrity,
+        'cleanliness': merged_cleanliness,
+        'damage_details': {
+            'overall_confidence': overall,
+            'parts': sorted(parts.values(), key=lambda part: part.get('confidence') or 0.0, reverse=True),
+        },
+        'environment': results[0][1].get('environment'),
+        'uncertain': any(result.get('uncertain') for _, result in results),
+        'notes': '; '.join(notes),
+    }
+
+
+class VideoInspector:
+    """
+    Анализ видео-обхода: ключевые кадры, YOLO с трекингом и Gemini на нескольких кадрах
+
+    Параметры по умолчанию берутся из настроек VIDEO_*.
+    """
+
+    def __init__(self, sample_fps: Optional[float] = None, keyframe_interval: Optional[float] = None,
+                 min_sharpness: Optional[float] = None, max_keyframes: Optional[int] = None,
+                 gemini_keyframes: Optional[int] = None, max_duration: Optional[float] = None,
+                 min_hits: int = 1):
+        self.sample_fps = settings.VIDEO_SAMPLE_FPS if sample_fps is None else sample_fps
+        self.keyframe_interval = settings.VIDEO_KEYFRAME_INTERVAL if keyframe_interval is None else keyframe_interval
+        self.min_sharpness = settings.VIDEO_MIN_SHARPNESS if min_sharpness is None else min_sharpness
+        self.max_keyframes = settings.VIDEO_MAX_KEYFRAMES if max_keyframes is None else max_keyframes
+        self.gemini_keyframes = settings.VIDEO_GEMINI_KEYFRAMES if gemini_keyframes is None else gemini_keyframes
+        self.max_duration = settings.VIDEO_MAX_DURATION if max_duration is None else max_duration
+        self.min_hits = min_hits
+
+    def scan(self, path: str) -> Dict[str, Any]:
+        """
+        Блокирующая часть: декодирование, ключевые кадры, YOLO и трекинг
+
+        YOLO для очередной пачки ключевых кадров выполняется в отдельном потоке,
+        пока декодируются следующие кадры.
+
+        Returns:
+            video (сведения о видео), keyframes (с детекциями и JPEG), tracker
+        """
+        info: Dict[str, Any] = {}
+        keyframes: List[Dict[str, Any]] = []
+        tracker = DamageTracker()
+        state = {'previous_gray': None}
+
+        def finish(batch, future):
+            for keyframe, detections in zip(batch, future.result()):
+                number = len(keyframes)
+                shift = estimate_shift(state['previous_gray'], keyframe['gray'])
+                state['previous_gray'] = keyframe.pop('gray')
+                tracker.update(number, keyframe['time_s'], detections, shift)
+                ok, jpeg = cv2.imencode('.jpg', cv2.cvtColor(keyframe.pop('frame'), cv2.COLOR_RGB2BGR),
+                                        [cv2.IMWRITE_JPEG_QUALITY, 90])
+                keyframe['jpeg'] = jpeg.tobytes() if ok else None
+                keyframe['detections'] = detections
+                keyframe.pop('score', None)
+                keyframes.append(keyframe)
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='video-yolo') as executor:
+            pending = None
+            batch = []
+            frames = iter_keyframes(path, info, self.sample_fps, self.keyframe_interval,
+                                    self.min_sharpness, self.max_keyframes, self.max_duration)
+            for keyframe in frames:
+                batch.append(keyframe)
+                if len(batch) < INFERENCE_BATCH:
+                    continue
+                if pending is not None:
+                    finish(*pending)
+                pending = (batch, executor.submit(car_analysis_service.detect_frames,
+                                                  [item['frame'] for item in batch]))
+                batch = []
+            if pending is not None:
+                finish(*pending)
+            if batch:
+                finish(batch, executor.submit(car_analysis_service.detect_frames,
+                                              [item['frame'] for item in batch]))
+
+        if not info.get('frames'):
+            raise VideoError('Video contains no decodable frames')
+        return {'video': info, 'keyframes': keyframes, 'tracker': tracker}
+
+    async def inspect(self, path: str, priority: str = LANE_STANDARD, use_gemini: bool = True,
+                      keyframes_dir: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Полный анализ видео-обхода
+
+        Args:
+            path: Путь к видео
+            priority: Полоса планировщика (interactive, standard, batch)
+            use_gemini: Отправлять ли ключевые кадры в Gemini
+            keyframes_dir: Каталог для сохранения ключевых кадров (JPEG)
+
+        Returns:
+            Сводка повреждений автомобиля по всему видео
+        """
+        start_time = time.perf_counter()
+        errors = []
+
+        # Декодирование и YOLO занимают CPU - как одна задача стадии YOLO
+        async with admission_controller.stage('yolo', priority):
+            record_span('yolo_queue', start_time)
+            with observe_stage('video_scan'):
+                scan = await run_blocking(self.scan, path)
+        scan_time = time.perf_counter() - start_time
+        keyframes = scan['keyframes']
+
+        chosen = pick_gemini_keyframes(keyframes, self.gemini_keyframes) if use_gemini else []
+        gemini = None
+        if chosen:
+            gemini_results = await self._analyze_gemini(keyframes, chosen, priority)
+            for number, result in gemini_results:
+                if 'error' in result:
+                    errors.append(f"Gemini keyframe {number}: {result['error']}")
+            gemini = merge_gemini_results(gemini_results)
+
+        if keyframes_dir:
+            await run_blocking(self._save_keyframes, keyframes, keyframes_dir)
+
+        damages = scan['tracker'].damages(self.min_hits)
+        processing_time = time.perf_counter() - start_time
+        video = scan['video']
+        damaged = bool(damages) or bool(gemini and gemini['integrity']['label'] == 'damaged')
+        summary = {
+            'car_status': 'damaged' if damaged else 'good',
+            'damage_count': len(damages),
+            'damage_by_class': dict(Counter(damage['class'] for damage in damages)),
+            'damages': damages,
+            'gemini': gemini,
+            'video': video,
+            'keyframes': [
+                {
+                    'keyframe': number,
+                    'frame_index': keyframe['frame_index'],
+                    'time_s': keyframe['time_s'],
+                    'sharpness': keyframe['sharpness'],
+                    'motion': keyframe['motion'],
+                    'novelty': keyframe['novelty'],
+                    'detections': len(keyframe['detections']),
+                    'gemini': number in chosen,
+                }
+                for number, keyframe in enumerate(keyframes)
+            ],
+            'errors': errors,
+            'scan_time': round(scan_time, 2),
+            'processing_time': round(processing_time, 2),
+            'realtime_factor': round(video['duration_s'] / processing_time, 1) if processing_time else None,
+        }
+        log_event(logger, 'video.inspected', duration_s=video['duration_s'], frames=video['frames'],
+                  keyframes=len(keyframes), gemini_keyframes=len(chosen), damages=len(damages),
+                  duration_ms=round(processing_time * 1000, 1))
+        return summary
+
+    async def _analyze_gemini(self, keyframes: List[Dict[str, Any]], chosen: List[int],
+                              priority: str) -> List[Tuple[int, Dict[str, Any]]]:
+        paths = await run_blocking(self._write_temp_keyframes, [keyframes[number]['jpeg'] for number in chosen])
+        try:
+            outcomes = await asyncio.gather(
+                *(car_analysis_service.analyze_gemini_async(path, priority) for path in paths),
+                return_exceptions=True,
+            )
+        finally:
+            await run_blocking(self._remove_files, paths)
+        return [
+            (number, {'error': str(outcome)} if isinstance(outcome, Exception) else outcome)
+            for number, outcome in zip(chosen, outcomes)
+        ]
+
+    @staticmethod
+    def _write_temp_keyframes(images: List[Optional[bytes]]) -> List[str]:
+        paths = []
+        for image in images:
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
+                temp_file.write(image or b'')
+                paths.append(temp_file.name)
+        return paths
+
+    @staticmethod
+    def _remove_files(paths: List[str]):
+        for path in paths:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    @staticmethod
+    def _save_keyframes(keyframes: List[Dict[str, Any]], directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for number, keyframe in enumerate(keyframes):
+            if keyframe['jpeg']:
+                name = f"keyframe_{number:03d}_{keyframe['time_s']:07.2f}s.jpg"
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(keyframe['jpeg'])
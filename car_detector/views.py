@@ -1,30 +1,55 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
+import asyncio
 import json
+import logging
 import os
 import tempfile
+import time
+from typing import Optional
 
-from .models import CarAnalysis
+from .models import CarAnalysis, InspectionSession
+from .inspections import acomplete_session
+from .damage_items import asave_damage_items, save_damage_items
+from .pagination import CARD_FIELDS, keyset_page
 from .services import car_analysis_service
+from .async_utils import run_blocking
+from .idempotency import idempotent
+from .api_keys import api_key_required, get_usage
+from .metrics import observe_stage, render_metrics, track_request
+from .tracing import current_trace, traced
+from .traffic_capture import captured
+from .webhooks import aenqueue_analysis_webhook, signing_secret, validate_webhook_url
+from .video_inspection import VideoError, VideoInspector, VIDEO_EXTENSIONS
+from .admission import (
+    admission_controller, AdmissionRejected, normalize_lane, LANE_INTERACTIVE, LANE_STANDARD
+)
 from .translations import (
     translate_car_part, translate_damage_type, translate_integrity,
     translate_cleanliness, translate_weather, translate_lighting
 )
 
+logger = logging.getLogger(__name__)
+
 
 def home(request):
     """Главная страница с формой загрузки изображения"""
-    recent_analyses = CarAnalysis.objects.all()[:5]
+    recent_analyses = CarAnalysis.objects.only(*CARD_FIELDS).order_by('-created_at', '-id')[:5]
     return render(request, 'car_detector/home.html', {
         'recent_analyses': recent_analyses
     })
 
 
+@traced
 def upload_and_analyze(request):
     """Обработка загрузки и анализа изображения"""
     if request.method == 'POST':
@@ -42,31 +67,39 @@ def upload_and_analyze(request):
         
         try:
             # Сохраняем изображение во временный файл
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                for chunk in image_file.chunks():
-                    temp_file.write(chunk)
-                temp_path = temp_file.name
+            with observe_stage('upload_read'):
+                temp_path = _save_upload_to_temp(image_file)
             
-            # Анализируем изображение
-            analysis_results = car_analysis_service.analyze_image(temp_path)
+            # Анализируем изображение (с учетом бюджета мегапикселей)
+            megapixels = admission_controller.image_megapixels(temp_path)
+            try:
+                with admission_controller.admit(megapixels):
+                    analysis_results = car_analysis_service.analyze_image(temp_path)
+            except AdmissionRejected as e:
+                os.unlink(temp_path)
+                messages.error(request, f'Сервис перегружен, повторите попытку через {e.retry_after} с')
+                return redirect('dual_analysis')
             
             # Создаем запись в базе данных
             car_analysis = CarAnalysis()
             
             # Сбрасываем указатель файла в начало
             image_file.seek(0)
-            car_analysis.image.save(
-                image_file.name,
-                ContentFile(image_file.read()),
-                save=False
-            )
+            with observe_stage('storage_write'):
+                car_analysis.image.save(
+                    image_file.name,
+                    ContentFile(image_file.read()),
+                    save=False
+                )
             
             # Заполняем данные из результатов анализа
             formatted_data = car_analysis_service.format_results_for_django(analysis_results)
             for key, value in formatted_data.items():
                 setattr(car_analysis, key, value)
             
-            car_analysis.save()
+            with observe_stage('db_save'):
+                car_analysis.save()
+                save_damage_items([car_analysis])
             
             # Создаем обработанное изображение с наложенными повреждениями
             try:
@@ -78,7 +111,7 @@ def upload_and_analyze(request):
                 
                 # Сохраняем обработанное изображение
                 if processed_path != temp_path and os.path.exists(processed_path):
-                    with open(processed_path, 'rb') as processed_file:
+                    with open(processed_path, 'rb') as processed_file, observe_stage('storage_write'):
                         car_analysis.processed_image.save(
                             f"processed_{image_file.name}",
                             ContentFile(processed_file.read()),
@@ -88,11 +121,19 @@ def upload_and_analyze(request):
                     os.unlink(processed_path)
                     
             except Exception as e:
-                print(f"Ошибка при создании обработанного изображения: {e}")
+                logger.exception("Ошибка при создании обработанного изображения: %s", e)
             
             # Удаляем временный файл
             os.unlink(temp_path)
             
+            # Сохраняем трассу запроса вместе с анализом
+            trace = current_trace()
+            if trace is not None:
+                trace.analysis_id = car_analysis.id
+                car_analysis.trace_id = trace.trace_id
+                car_analysis.trace = trace.as_dict()
+                car_analysis.save(update_fields=['trace_id', 'trace'])
+            
             messages.success(request, 'Анализ завершен успешно!')
             return redirect('analysis_detail', analysis_id=car_analysis.id)
             
@@ -131,40 +172,213 @@ def analysis_detail(request, analysis_id):
 
 
 def analysis_list(request):
-    """Список всех анализов"""
-    analyses = CarAnalysis.objects.all()
+    """Список всех анализов (постранично, по курсору before/after)"""
+    analyses = keyset_page(
+        CarAnalysis.objects.only(*CARD_FIELDS),
+        settings.ANALYSIS_LIST_PAGE_SIZE,
+        before=request.GET.get('before'),
+        after=request.GET.get('after'),
+    )
     return render(request, 'car_detector/analysis_list.html', {
         'analyses': analyses
     })
 
 
+@require_http_methods(["GET"])
+def health_live(request):
+    """Liveness-проба: процесс жив и обрабатывает запросы"""
+    return JsonResponse({'status': 'alive', 'pid': os.getpid()})
+
+
+@require_http_methods(["GET"])
+def metrics(request):
+    """Метрики в формате Prometheus"""
+    content, content_type = render_metrics()
+    return HttpResponse(content, content_type=content_type)
+
+
+@require_http_methods(["GET"])
+def health_ready(request):
+    """Readiness-проба: модели загружены и прогреты"""
+    health = car_analysis_service.get_health()
+    return JsonResponse(health, status=200 if health['ready'] else 503)
+
+
+def _save_upload_to_temp(image_file, suffix: str = '.jpg') -> str:
+    """Сохраняет загруженный файл во временный файл и возвращает путь к нему"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        for chunk in image_file.chunks():
+            temp_file.write(chunk)
+        return temp_file.name
+
+
+def _remove_temp_file(temp_path: str):
+    """Удаляет временный файл, если он существует"""
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+
+
+def _request_priority(request, default: str = LANE_STANDARD) -> str:
+    """Полоса планировщика из заголовка X-Priority (можно только понизить приоритет)"""
+    api_key = getattr(request, 'api_key', None)
+    if api_key is not None:
+        # Приоритет клиента не выше указанного в его ключе
+        default = normalize_lane(api_key.lane, default)
+    return normalize_lane(request.headers.get('X-Priority'), default)
+
+
+def _rejected_response(error: AdmissionRejected) -> JsonResponse:
+    """Ответ 429/503 с Retry-After, когда запрос не допущен из-за перегрузки"""
+    response = JsonResponse({
+        'status': 'error',
+        'error': str(error),
+        'retry_after': error.retry_after,
+    }, status=error.status)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+@require_http_methods(["GET"])
+@track_request
+@captured
+@api_key_required(counts_as_analysis=False)
+async def api_load(request):
+    """Текущая нагрузка процесса для автомасштабирования"""
+    return JsonResponse(admission_controller.get_load())
+
+
+@require_http_methods(["GET"])
+@track_request
+@captured
+@api_key_required(counts_as_analysis=False)
+async def api_usage(request):
+    """Лимиты и использование текущего API-ключа (?days=N - история за N дней)"""
+    if request.api_key is None:
+        return JsonResponse({'error': 'API key required'}, status=401)
+    try:
+        days = int(request.GET.get('days', '1'))
+    except ValueError:
+        days = 1
+    return JsonResponse(await run_blocking(get_usage, request.api_key, days))
+
+
+def _latency_budget(request) -> Optional[float]:
+    """Бюджет задержки в секундах из заголовка X-Latency-Budget (мс) или настроек; None - без дедлайна"""
+    budget_ms = settings.ANALYSIS_LATENCY_BUDGET_MS
+    header = request.headers.get('X-Latency-Budget')
+    if header:
+        try:
+            budget_ms = float(header)
+        except ValueError:
+            pass
+    return budget_ms / 1000 if budget_ms > 0 else None
+
+
+def _callback_url(request) -> str:
+    """
+    Адрес webhook из поля callback_url, заголовка X-Callback-Url или API-ключа
+    
+    Разрешает имя хоста (блокирующий вызов). ValidationError, если адрес некорректен,
+    не разрешается или ведет во внутреннюю сеть.
+    """
+    url = request.POST.get('callback_url') or request.headers.get('X-Callback-Url') or ''
+    if not url and getattr(request, 'api_key', None) is not None:
+        url = request.api_key.webhook_url
+    if url:
+        URLValidator(schemes=['http', 'https'])(url)
+        try:
+            validate_webhook_url(url)
+        except (OSError, UnicodeError):
+            raise ValidationError('Webhook host does not resolve')
+        if not signing_secret(getattr(request, 'api_key', None)):
+            raise ValidationError('Webhook signing secret is not configured')
+    return url
+
+
+def _attach_image(car_analysis: CarAnalysis, image_file):
+    """Сохраняет загруженное изображение в хранилище и привязывает к записи"""
+    image_file.seek(0)
+    car_analysis.image.save(image_file.name, ContentFile(image_file.read()), save=False)
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def api_analyze(request):
+@track_request
+@captured
+@traced
+@api_key_required()
+@idempotent
+async def api_analyze(request):
     """API endpoint для анализа изображения"""
     try:
         if 'image' not in request.FILES:
             return JsonResponse({'error': 'No image provided'}, status=400)
         
         image_file = request.FILES['image']
+        try:
+            callback_url = await run_blocking(_callback_url, request)
+        except ValidationError as e:
+            return JsonResponse({'error': f'Invalid callback_url: {e.messages[0]}'}, status=400)
         
-        # Сохраняем во временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            for chunk in image_file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
-        
-        # Анализируем
-        analysis_results = car_analysis_service.analyze_image(temp_path)
+        megapixels = await run_blocking(admission_controller.image_megapixels, image_file)
         
-        # Удаляем временный файл
-        os.unlink(temp_path)
+        async with admission_controller.admit(megapixels):
+            # Сохраняем во временный файл
+            with observe_stage('upload_read'):
+                temp_path = await run_blocking(_save_upload_to_temp, image_file)
+            start_time = time.time()
+            pending = None
+            car_analysis = None
+            
+            # Анализируем: если Gemini не уложился в бюджет, отвечаем результатом YOLO
+            try:
+                analysis_results, pending = await car_analysis_service.analyze_image_with_deadline(
+                    temp_path, _latency_budget(request), _request_priority(request)
+                )
+                
+                car_analysis = CarAnalysis(
+                    status='partial' if pending else car_analysis_service.analysis_status(
+                        analysis_results['gemini']
+                    ),
+                    callback_url=callback_url,
+                    api_key=request.api_key,
+                    trace_id=current_trace().trace_id,
+                    **car_analysis_service.format_results_for_django(analysis_results)
+                )
+                with observe_stage('storage_write'):
+                    await run_blocking(_attach_image, car_analysis, image_file)
+                with observe_stage('db_save'):
+                    car_analysis.trace = current_trace().as_dict()
+                    await car_analysis.asave()
+                    await asave_damage_items([car_analysis])
+                current_trace().analysis_id = car_analysis.id
+                
+                # Частичный результат уведомит фоновое завершение
+                try:
+                    await aenqueue_analysis_webhook(car_analysis)
+                except Exception as e:
+                    logger.exception("Failed to enqueue webhook for analysis %s: %s", car_analysis.id, e)
+            finally:
+                if pending is None:
+                    # Удаляем временный файл
+                    await run_blocking(_remove_temp_file, temp_path)
+                else:
+                    # Gemini дописывает результат в запись и удаляет файл сам
+                    car_analysis_service.complete_in_background(
+                        car_analysis.id if car_analysis else None, pending, temp_path, start_time
+                    )
         
         return JsonResponse({
             'success': True,
+            'analysis_id': car_analysis.id,
+            'status': car_analysis.status,
+            'partial': pending is not None,
+            'result_url': reverse('api_analysis_result', args=[car_analysis.id]),
             'results': analysis_results
         })
         
+    except AdmissionRejected as e:
+        return _rejected_response(e)
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -172,9 +386,32 @@ def api_analyze(request):
         }, status=500)
 
 
+@require_http_methods(["GET"])
+@track_request
+@captured
+@api_key_required(counts_as_analysis=False)
+async def api_analysis_result(request, analysis_id):
+    """API endpoint для получения сохраненного результата (в т.ч. дописанного в фоне)"""
+    analyses = CarAnalysis.objects.all()
+    if request.api_key is not None:
+        # Клиент видит только свои анализы
+        analyses = analyses.filter(api_key=request.api_key)
+    try:
+        analysis = await analyses.aget(id=analysis_id)
+    except CarAnalysis.DoesNotExist:
+        return JsonResponse({'error': 'Analysis not found'}, status=404)
+    
+    return JsonResponse({'success': True, **analysis.as_api_result()})
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def api_gemini_analyze(request):
+@track_request
+@captured
+@traced
+@api_key_required()
+@idempotent
+async def api_gemini_analyze(request):
     """API endpoint для анализа изображения только с помощью Gemini"""
     try:
         if 'image' not in request.FILES:
@@ -188,18 +425,20 @@ def api_gemini_analyze(request):
         if file_extension not in allowed_extensions:
             return JsonResponse({'error': f'File must be an image. Got extension: {file_extension}'}, status=400)
         
+        megapixels = await run_blocking(admission_controller.image_megapixels, image_file)
+        
         # Сохраняем изображение во временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            for chunk in image_file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
+        with observe_stage('upload_read'):
+            temp_path = await run_blocking(_save_upload_to_temp, image_file)
         
         # Анализируем изображение только с помощью Gemini
         try:
-            import time
             start_time = time.time()
             
-            gemini_results = car_analysis_service.gemini_analyzer.analyze(temp_path)
+            async with admission_controller.admit(megapixels):
+                gemini_results = await car_analysis_service.analyze_gemini_async(
+                    temp_path, _request_priority(request)
+                )
             processing_time = time.time() - start_time
             
             # Форматируем ответ
@@ -212,6 +451,8 @@ def api_gemini_analyze(request):
             
             return JsonResponse(response_data)
             
+        except AdmissionRejected as e:
+            return _rejected_response(e)
         except Exception as e:
             return JsonResponse({
                 'status': 'error',
@@ -220,8 +461,7 @@ def api_gemini_analyze(request):
         
         finally:
             # Удаляем временный файл
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+            await run_blocking(_remove_temp_file, temp_path)
         
     except Exception as e:
         error_text = f"""🚗 АНАЛИЗ АВТОМОБИЛЯ
@@ -245,7 +485,12 @@ def api_gemini_analyze(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def api_simple_status(request):
+@track_request
+@captured
+@traced
+@api_key_required()
+@idempotent
+async def api_simple_status(request):
     """API endpoint для получения простого статуса автомобиля"""
     try:
         if 'image' not in request.FILES:
@@ -259,18 +504,21 @@ def api_simple_status(request):
         if file_extension not in allowed_extensions:
             return JsonResponse({'error': f'File must be an image. Got extension: {file_extension}'}, status=400)
         
+        megapixels = await run_blocking(admission_controller.image_megapixels, image_file)
+        
         # Сохраняем изображение во временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            for chunk in image_file.chunks():
-                temp_file.write(chunk)
-            temp_path = temp_file.name
+        with observe_stage('upload_read'):
+            temp_path = await run_blocking(_save_upload_to_temp, image_file)
         
         # Анализируем изображение только с помощью Gemini
         try:
-            import time
             start_time = time.time()
             
-            gemini_results = car_analysis_service.gemini_analyzer.analyze(temp_path)
+            # Водитель ждет ответа у машины - интерактивная полоса
+            async with admission_controller.admit(megapixels):
+                gemini_results = await car_analysis_service.analyze_gemini_async(
+                    temp_path, _request_priority(request, LANE_INTERACTIVE)
+                )
             processing_time = time.time() - start_time
             
             # Проверяем, есть ли ошибка в результатах Gemini
@@ -455,6 +703,8 @@ def api_simple_status(request):
             
             return JsonResponse(response_data)
             
+        except AdmissionRejected as e:
+            return _rejected_response(e)
         except Exception as e:
             error_text = f"""🚗 АНАЛИЗ АВТОМОБИЛЯ
 
@@ -478,8 +728,7 @@ def api_simple_status(request):
         
         finally:
             # Удаляем временный файл
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+            await run_blocking(_remove_temp_file, temp_path)
         
     except Exception as e:
         error_text = f"""🚗 АНАЛИЗ АВТОМОБИЛЯ
@@ -499,3 +748,134 @@ def api_simple_status(request):
             'processing_time': 0.0,
             'error': str(e)
         }, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@track_request
+@captured
+@traced
+@api_key_required()
+@idempotent
+async def api_video_inspect(request):
+    """API endpoint для анализа видео-обхода автомобиля: сводка повреждений по всему видео"""
+    if 'video' not in request.FILES:
+        return JsonResponse({'error': 'No video provided'}, status=400)
+    
+    video_file = request.FILES['video']
+    file_extension = os.path.splitext(video_file.name)[1].lower()
+    if file_extension not in VIDEO_EXTENSIONS:
+        return JsonResponse({'error': f'File must be a video. Got extension: {file_extension}'}, status=400)
+    if video_file.size > settings.VIDEO_MAX_UPLOAD_MB * 1024 * 1024:
+        return JsonResponse({'error': f'Video is larger than {settings.VIDEO_MAX_UPLOAD_MB} MB'}, status=413)
+    
+    use_gemini = request.POST.get('gemini', 'true').lower() not in ('0', 'false', 'no')
+    
+    with observe_stage('upload_read'):
+        temp_path = await run_blocking(_save_upload_to_temp, video_file, file_extension)
+    try:
+        summary = await VideoInspector().inspect(temp_path, _request_priority(request), use_gemini)
+    except AdmissionRejected as e:
+        return _rejected_response(e)
+    except VideoError as e:
+        return JsonResponse({'status': 'error', 'error': str(e)}, status=400)
+    except Exception as e:
+        logger.exception("Video inspection failed: %s", e)
+        return JsonResponse({'status': 'error', 'error': f'Video inspection failed: {str(e)}'}, status=500)
+    finally:
+        await run_blocking(_remove_temp_file, temp_path)
+    
+    return JsonResponse({'status': 'success', **summary})
+
+
+async def _analyze_session_photo(request, image_file, priority: str) -> CarAnalysis:
+    """Анализ одного ракурса сессии осмотра; запись CarAnalysis возвращается несохраненной"""
+    megapixels = await run_blocking(admission_controller.image_megapixels, image_file)
+    async with admission_controller.admit(megapixels):
+        with observe_stage('upload_read'):
+            temp_path = await run_blocking(_save_upload_to_temp, image_file)
+        try:
+            analysis_results = await car_analysis_service.analyze_image_async(temp_path, priority)
+        finally:
+            await run_blocking(_remove_temp_file, temp_path)
+    
+    car_analysis = CarAnalysis(
+        status=car_analysis_service.analysis_status(analysis_results['gemini']),
+        api_key=request.api_key,
+        trace_id=current_trace().trace_id,
+        **car_analysis_service.format_results_for_django(analysis_results)
+    )
+    with observe_stage('storage_write'):
+        await run_blocking(_attach_image, car_analysis, image_file)
+    return car_analysis
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@track_request
+@captured
+@traced
+@api_key_required()
+@idempotent
+async def api_inspection_create(request):
+    """API endpoint для осмотра автомобиля по нескольким фотографиям (поле image повторяется)"""
+    image_files = request.FILES.getlist('image')
+    if not image_files:
+        return JsonResponse({'error': 'No image provided'}, status=400)
+    if len(image_files) > settings.INSPECTION_MAX_PHOTOS:
+        return JsonResponse(
+            {'error': f'Too many photos: {len(image_files)} (max {settings.INSPECTION_MAX_PHOTOS})'}, status=400
+        )
+    allowed_extensions = ['.jpg', '.jpeg', '.png', '.webp']
+    for image_file in image_files:
+        file_extension = os.path.splitext(image_file.name)[1].lower()
+        if file_extension not in allowed_extensions:
+            return JsonResponse({'error': f'File must be an image. Got extension: {file_extension}'}, status=400)
+    
+    start_time = time.time()
+    priority = _request_priority(request)
+    try:
+        # Ракурсы анализируются параллельно, каждый проходит допуск и лимиты стадий отдельно
+        photos = await asyncio.gather(
+            *(_analyze_session_photo(request, image_file, priority) for image_file in image_files)
+        )
+    except AdmissionRejected as e:
+        return _rejected_response(e)
+    except Exception as e:
+        logger.exception("Inspection analysis failed: %s", e)
+        return JsonResponse({'status': 'error', 'error': f'Inspection failed: {str(e)}'}, status=500)
+    
+    with observe_stage('db_save'):
+        session = InspectionSession(vehicle_id=request.POST.get('vehicle_id', '')[:100], api_key=request.api_key)
+        await session.asave()
+        trace = current_trace().as_dict()
+        for photo in photos:
+            photo.session = session
+            photo.trace = trace
+        photos = await CarAnalysis.objects.abulk_create(photos)
+        await asave_damage_items(photos)
+        await acomplete_session(session, photos, time.time() - start_time)
+    
+    return JsonResponse({
+        'success': True,
+        'result_url': reverse('api_inspection_result', args=[session.id]),
+        **session.as_api_result(photo_ids=[photo.id for photo in photos]),
+    })
+
+
+@require_http_methods(["GET"])
+@track_request
+@captured
+@api_key_required(counts_as_analysis=False)
+async def api_inspection_result(request, session_id):
+    """API endpoint для сводки сессии осмотра (сохраненная сводка, без разбора снимков)"""
+    sessions = InspectionSession.objects.all()
+    if request.api_key is not None:
+        # Клиент видит только свои сессии
+        sessions = sessions.filter(api_key=request.api_key)
+    try:
+        session = await sessions.aget(id=session_id)
+    except InspectionSession.DoesNotExist:
+        return JsonResponse({'error': 'Inspection not found'}, status=404)
+    
+    return JsonResponse({'success': True, **session.as_api_result()})
@@ -0,0 +1,349 @@
+# car_detector/webhooks.py
+"""
+Доставка webhook-уведомлений о завершенных анализах
+
+Путь анализа только добавляет запись WebhookDelivery (outbox) и будит
+воркер; HTTP-запросы выполняет фоновый поток WebhookDispatcher:
+
+- события на один адрес объединяются в пакет: {"events": [...]};
+- тело подписывается HMAC-SHA256 секретом клиента (ApiKey.webhook_secret;
+  для запросов без ключа - WEBHOOK_SECRET, без него доставка не выполняется):
+      X-Webhook-Timestamp: <unix time>
+      X-Webhook-Signature: sha256=<hex(hmac(secret, "<timestamp>.<body>"))>
+- при ошибке попытка повторяется с экспоненциальной задержкой,
+  после WEBHOOK_MAX_ATTEMPTS попыток запись переносится в WebhookDeadLetter;
+- адрес, который разрешается во внутреннюю сеть (loopback, RFC1918, link-local,
+  метаданные облака), отклоняется при приеме запроса и повторно перед каждой
+  отправкой; перенаправления не выполняются.
+
+Записи захватываются условным UPDATE на время одной отправки (аренда
+2 * WEBHOOK_TIMEOUT): воркер захватывает и отправляет по одному пакету и не
+начинает отправку, если аренда истекает, поэтому воркеры нескольких процессов
+(или отдельный процесс run_webhook_worker) не доставляют одно событие дважды.
+"""
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .logging_utils import log_event
+from .models import CarAnalysis, WebhookDeadLetter, WebhookDelivery
+
+logger = logging.getLogger(__name__)
+
+
+def sign_payload(body: bytes, timestamp: str, secret: str) -> str:
+    """Подпись тела запроса для заголовка X-Webhook-Signature"""
+    message = timestamp.encode('utf-8') + b'.' + body
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body: bytes, timestamp: str, signature: str, secret: str) -> bool:
+    """Проверка подписи на стороне получателя"""
+    return hmac.compare_digest(sign_payload(body, timestamp, secret), signature)
+
+
+def _forbidden_address(address: str) -> bool:
+    """Адрес не из публичного интернета (частный, loopback, link-local, зарезервированный, multicast)"""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return not ip.is_global or ip.is_multicast
+
+
+def validate_webhook_url(url: str):
+    """
+    Проверяет, что все адреса хоста webhook публичные
+    
+    Raises:
+        ValidationError: Хост не указан или разрешается во внутреннюю сеть
+        socket.gaierror: Имя хоста не разрешается (может быть временной ошибкой DNS)
+    """
+    parts = urlsplit(url)
+    if not parts.hostname:
+        raise ValidationError('Webhook URL has no host')
+    if settings.WEBHOOK_ALLOW_PRIVATE_HOSTS:
+        return
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    if any(_forbidden_address(address) for address in addresses):
+        raise ValidationError(f'Webhook host {parts.hostname} resolves to a non-public address')
+
+
+def signing_secret(api_key) -> str:
+    """Секрет подписи webhook клиента; пустая строка - подписать нечем и отправлять нельзя"""
+    if api_key is not None:
+        return api_key.webhook_secret
+    return settings.WEBHOOK_SECRET
+
+
+def _delivery_for(analysis: CarAnalysis) -> WebhookDelivery:
+    return WebhookDelivery(
+        analysis=analysis,
+        api_key_id=analysis.api_key_id,
+        url=analysis.callback_url,
+        event='analysis.completed',
+        payload={'event': 'analysis.completed', **analysis.as_api_result()},
+    )
+
+
+def enqueue_analysis_webhook(analysis: CarAnalysis) -> Optional[WebhookDelivery]:
+    """Ставит уведомление о завершении анализа в очередь (если задан callback_url)"""
+    if not analysis.callback_url or analysis.status == 'partial':
+        return None
+    delivery = _delivery_for(analysis)
+    delivery.save()
+    webhook_dispatcher.wake()
+    return delivery
+
+
+async def aenqueue_analysis_webhook(analysis: CarAnalysis) -> Optional[WebhookDelivery]:
+    """Асинхронная версия enqueue_analysis_webhook"""
+    if not analysis.callback_url or analysis.status == 'partial':
+        return None
+    delivery = _delivery_for(analysis)
+    await delivery.asave()
+    webhook_dispatcher.wake()
+    return delivery
+
+
+class WebhookDispatcher:
+    """Фоновый воркер доставки webhook"""
+
+    # Максимальная пауза между проверками очереди, секунды
+    IDLE_POLL_INTERVAL = 30.0
+
+    def __init__(self):
+        self._thread = None
+        self._owner_pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._session = requests.Session()
+        self._stats_lock = threading.Lock()
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+
+    def start(self):
+        """Запускает поток доставки в текущем процессе (идемпотентно)"""
+        with self._lock:
+            if self._owner_pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._owner_pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self.run_forever, name='webhook-dispatcher', daemon=True
+            )
+            self._thread.start()
+
+    def wake(self):
+        """Сообщает воркеру о новых записях; без блокировки вызывающего кода"""
+        if settings.WEBHOOK_IN_PROCESS:
+            self.start()
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def run_forever(self):
+        """Цикл доставки: обрабатывает готовые записи и спит до следующей"""
+        while not self._stop.is_set():
+            try:
+                delay = self.process_due()
+            except Exception as e:
+                logger.exception("Webhook dispatcher error: %s", e)
+                delay = settings.WEBHOOK_RETRY_BASE
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def process_due(self) -> float:
+        """
+        Доставляет все записи, время попытки которых наступило
+
+        Returns:
+            Секунды до следующей запланированной попытки
+        """
+        close_old_connections()
+        while True:
+            claim = self._claim_due()
+            if claim is None:
+                break
+            lease_until, deliveries = claim
+            if deliveries:
+                self._deliver_batch(deliveries[0].url, deliveries, lease_until)
+
+        next_attempt = WebhookDelivery.objects.filter(status='pending').aggregate(
+            next_attempt=Min('next_attempt_at')
+        )['next_attempt']
+        if next_attempt is None:
+            return self.IDLE_POLL_INTERVAL
+        return min(max((next_attempt - timezone.now()).total_seconds(), 0.0), self.IDLE_POLL_INTERVAL)
+
+    def _claim_due(self) -> Optional[Tuple[datetime, List[WebhookDelivery]]]:
+        """
+        Захватывает один пакет готовых записей, сдвигая время попытки на срок аренды
+
+        Пакет - события одного клиента на один адрес (подписываются его секретом);
+        аренда рассчитана на одну отправку, поэтому пакеты захватываются по одному.
+
+        Returns:
+            (конец аренды, захваченные записи) или None, если готовых записей нет;
+            список пуст, если пакет успел захватить другой воркер
+        """
+        now = timezone.now()
+        due = WebhookDelivery.objects.filter(status='pending', next_attempt_at__lte=now)
+        first = due.order_by('next_attempt_at').values('url', 'api_key_id').first()
+        if first is None:
+            return None
+
+        lease_until = now + timedelta(seconds=settings.WEBHOOK_TIMEOUT * 2)
+        batch = due.filter(url=first['url'], api_key_id=first['api_key_id']).select_related(
+            'api_key'
+        ).order_by('next_attempt_at')[:settings.WEBHOOK_BATCH_SIZE]
+
+        claimed = []
+        for delivery in batch:
+            updated = WebhookDelivery.objects.filter(
+                id=delivery.id, status='pending', next_attempt_at=delivery.next_attempt_at
+            ).update(next_attempt_at=lease_until)
+            if updated:
+                claimed.append(delivery)
+        return lease_until, claimed
+
+    def _deliver_batch(self, url: str, deliveries: List[WebhookDelivery], lease_until: datetime):
+        """Отправляет пакет событий на один адрес и фиксирует результат"""
+        secret = signing_secret(deliveries[0].api_key)
+        if not secret:
+            # Без секрета получатель не может проверить подпись: не отправляем, повтор не поможет
+            for delivery in deliveries:
+                self._schedule_retry(delivery, 'webhook signing secret is not configured', give_up=True)
+            return
+        
+        try:
+            validate_webhook_url(url)
+        except ValidationError as e:
+            # Адрес мог начать разрешаться во внутреннюю сеть после приема запроса
+            for delivery in deliveries:
+                self._schedule_retry(delivery, e.messages[0], give_up=True)
+            return
+        except (OSError, UnicodeError) as e:
+            for delivery in deliveries:
+                self._schedule_retry(delivery, f'DNS resolution failed: {e}')
+            return
+        
+        if timezone.now() + timedelta(seconds=settings.WEBHOOK_TIMEOUT) > lease_until:
+            # До конца аренды отправка может не успеть (например, долго разрешался DNS): после ее
+            # истечения записи захватит другой воркер, и событие ушло бы дважды. Попытка не считается
+            log_event(
+                logger, 'webhook.lease_expired',
+                f"Webhook batch to {url} skipped: claim lease expires before the request could finish",
+                level=logging.WARNING, url=url, events=len(deliveries),
+            )
+            return
+
+        body = json.dumps(
+            {'events': [delivery.payload for delivery in deliveries]}, cls=DjangoJSONEncoder
+        ).encode('utf-8')
+        timestamp = str(int(time.time()))
+        headers = {
+            'Content-Type': 'application/json',
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Signature': sign_payload(body, timestamp, secret),
+        }
+
+        error = ''
+        try:
+            # Без перенаправлений: иначе ответ 307 увел бы запрос на непроверенный адрес
+            response = self._session.post(url, data=body, headers=headers, timeout=settings.WEBHOOK_TIMEOUT,
+                                          allow_redirects=False)
+            if not 200 <= response.status_code < 300:
+                error = f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            error = str(e)
+
+        ids = [delivery.id for delivery in deliveries]
+        if not error:
+            WebhookDelivery.objects.filter(id__in=ids).update(
+                status='delivered', delivered_at=timezone.now(), attempts=F('attempts') + 1, last_error=''
+            )
+            with self._stats_lock:
+                self.delivered += len(deliveries)
+            return
+
+        for delivery in deliveries:
+            self._schedule_retry(delivery, error)
+
+    def _schedule_retry(self, delivery: WebhookDelivery, error: str, give_up: bool = False):
+        """Повтор с экспоненциальной задержкой или перенос в dead-letter (сразу, если give_up)"""
+        with transaction.atomic():
+            # Счетчик попыток увеличивается в базе, а не от значения, прочитанного при захвате
+            record = WebhookDelivery.objects.filter(id=delivery.id)
+            record.update(attempts=F('attempts') + 1, last_error=error)
+            attempts = record.values_list('attempts', flat=True).first()
+            if attempts is None:
+                # Запись уже удалена (например, вместе с ключом клиента)
+                return
+            dead = give_up or attempts >= settings.WEBHOOK_MAX_ATTEMPTS
+            if dead:
+                WebhookDeadLetter.objects.create(
+                    analysis_id=delivery.analysis_id,
+                    api_key_id=delivery.api_key_id,
+                    url=delivery.url,
+                    event=delivery.event,
+                    payload=delivery.payload,
+                    attempts=attempts,
+                    last_error=error,
+                    created_at=delivery.created_at,
+                )
+                record.delete()
+            else:
+                # Экспоненциальная задержка с джиттером, чтобы повторы не приходили волной
+                delay = min(settings.WEBHOOK_RETRY_BASE * (2 ** (attempts - 1)), settings.WEBHOOK_RETRY_MAX)
+                delay *= random.uniform(0.8, 1.2)
+                record.update(next_attempt_at=timezone.now() + timedelta(seconds=delay))
+
+        if dead:
+            log_event(
+                logger, 'webhook.dead_letter',
+                f"Webhook {delivery.event} to {delivery.url} moved to dead letter after {attempts} attempts: {error}",
+                level=logging.WARNING, analysis_id=delivery.analysis_id, url=delivery.url,
+                attempts=attempts, error=error,
+            )
+            with self._stats_lock:
+                self.dead += 1
+            return
+
+        with self._stats_lock:
+            self.retried += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счетчики воркера текущего процесса"""
+        with self._stats_lock:
+            return {
+                'running': bool(self._thread and self._thread.is_alive() and self._owner_pid == os.getpid()),
+                'delivered': self.delivered,
+                'retried': self.retried,
+                'dead': self.dead,
+            }
+
+
+webhook_dispatcher = WebhookDispatcher()
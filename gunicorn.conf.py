@@ -0,0 +1,96 @@
+# gunicorn.conf.py
+"""
+Конфигурация gunicorn для продакшн-запуска
+
+Модели загружаются и прогреваются один раз в мастер-процессе (preload_app),
+после чего воркеры получают веса YOLO через fork в режиме copy-on-write.
+
+Запуск:
+    gunicorn -c gunicorn.conf.py
+"""
+import gc
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+# По умолчанию ASGI: async API-представления держат сотни запросов к Gemini
+# в одном процессе. GUNICORN_WORKER_CLASS=sync возвращает WSGI-режим.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+if worker_class in ('sync', 'gthread'):
+    wsgi_app = 'car_analysis_project.wsgi:application'
+else:
+    wsgi_app = 'car_analysis_project.asgi:application'
+
+# Загружаем приложение в мастере, чтобы модели были общими для всех воркеров
+preload_app = True
+
+# Количество потоков PyTorch в каждом воркере
+torch_threads = int(os.environ.get('YOLO_TORCH_THREADS', '1'))
+
+# Короткий прогон в каждом воркере после fork (инициализация пула потоков)
+worker_warmup = os.environ.get('YOLO_WORKER_WARMUP', 'True').lower() in ('1', 'true', 'yes')
+
+# Метрики Prometheus нескольких воркеров: каталог очищается при старте мастера
+prometheus_multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if prometheus_multiproc_dir:
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+    for name in os.listdir(prometheus_multiproc_dir):
+        if name.endswith('.db'):
+            os.remove(os.path.join(prometheus_multiproc_dir, name))
+
+
+def _set_torch_threads(count):
+    """Устанавливает число потоков PyTorch, если torch установлен"""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(count)
+
+
+def when_ready(server):
+    """Загружает и прогревает модели в мастере до запуска воркеров"""
+    # Пул потоков OpenMP, созданный до fork, не работает в дочерних процессах,
+    # поэтому в мастере прогреваем модель в один поток
+    _set_torch_threads(1)
+
+    from car_detector.services import car_analysis_service
+    # Пул инференса (YOLO_INFERENCE_WORKERS > 0) запускается в каждом воркере отдельно
+    health = car_analysis_service.warmup(start_pool=False)
+    server.log.info("Models loaded in master: %s", health['yolo'])
+
+    # Переносим всё, что создано при загрузке, в постоянное поколение GC:
+    # сборщик мусора в воркерах не будет трогать эти страницы и ломать copy-on-write
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Настраивает воркер сразу после fork"""
+    _set_torch_threads(torch_threads)
+
+
+def post_worker_init(worker):
+    """Прогревает модель (или запускает пул инференса) и доставку webhook в воркере до приема запросов"""
+    from car_detector.services import car_analysis_service
+
+    if car_analysis_service.inference_pool:
+        car_analysis_service.inference_pool.start()
+    elif worker_warmup and car_analysis_service.yolo_detector:
+        car_analysis_service.yolo_detector.warmup(image_size=320)
+
+    # Доставка webhook, оставшихся в очереди после перезапуска
+    from django.conf import settings
+    from car_detector.webhooks import webhook_dispatcher
+
+    if settings.WEBHOOK_IN_PROCESS:
+        webhook_dispatcher.start()
+
+
+def child_exit(server, worker):
+    """Убирает live-метрики завершившегося воркера (режим PROMETHEUS_MULTIPROC_DIR)"""
+    from car_detector.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)